@@ -0,0 +1,224 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2011-2014 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Batched, transactional writes to the monitoring database
+#
+# Rather than issuing one INSERT (built by string concatenation) or
+# DELETE per row, each committing on its own, the populator queues the
+# changes of a group of tables and commits them together:
+#
+#    writer.delete_all('ops_slice_user')
+#    writer.execute('delete from ops_slice where ts < %s', [ts])
+#    writer.insert('ops_slice', [schema, slice_id, ...])
+#    ...
+#    writer.commit()
+#
+# commit runs the queued statements in the order queued, followed by
+# the queued rows of each table as multi-row parameterized INSERTs,
+# in a single transaction.  Readers of the database thus never see a
+# table group half rewritten.
+
+import time
+
+
+class BatchWriter:
+    """
+        Queues writes to a database (a DB-API connection) and commits
+        them in one transaction.
+
+        paramstyle is the placeholder style of the database module 
+        ('format' for psycopg2, 'qmark' for sqlite3).  Statements given
+        to execute use '%s' placeholders, which are translated.
+        At most max_parameters values are bound to a single INSERT.
+    """
+    def __init__(self, connection, paramstyle='format', max_parameters=900):
+        self._connection = connection
+        self._placeholder = '%s'
+        if paramstyle == 'qmark': self._placeholder = '?'
+        self._max_parameters = max_parameters
+        self._statements = [] # (sql, parameters) in order queued
+        self._rows_by_table = {}
+        self._tables = [] # Tables with queued rows, in order queued
+
+        self._metrics = {'commits' : 0, 'rows' : 0, 'statements' : 0,
+                         'last_commit_rows' : 0, 'last_commit_time' : None}
+
+    def insert(self, table, row):
+        """
+            Queue a row (list of column values, None for NULL) to insert
+        """
+        if table not in self._rows_by_table:
+            self._rows_by_table[table] = []
+            self._tables.append(table)
+        self._rows_by_table[table].append(row)
+
+    def execute(self, sql, parameters=[]):
+        """
+            Queue a statement with '%s' placeholders for the parameters
+        """
+        self._statements.append((sql, parameters))
+
+    def delete_all(self, table):
+        self.execute("delete from %s" % table)
+
+    def delete_where_in(self, table, column, values):
+        """
+            Queue the deletion of the rows whose column has one of the
+            given values
+        """
+        values = list(values)
+        if len(values) == 0: return
+        for start in range(0, len(values), self._max_parameters):
+            chunk = values[start:start + self._max_parameters]
+            self.execute("delete from %s where %s in (%s)" % \
+                             (table, column, 
+                              ", ".join(['%s'] * len(chunk))),
+                         chunk)
+
+    def purge_old_tsdata(self, table, ts):
+        """
+            Queue the deletion of rows with a timestamp before ts
+        """
+        self.execute("delete from %s where ts < %%s" % table, [ts])
+
+    def query(self, sql, parameters=[]):
+        """
+            Run a select with '%s' placeholders for the parameters now
+            (not queued) and return its rows
+        """
+        cursor = self._connection.cursor()
+        try:
+            cursor.execute(self._translate(sql), parameters)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def getMetrics(self):
+        return dict(self._metrics)
+
+    def commit(self):
+        """
+            Run all queued statements and inserts in one transaction.
+            On failure the transaction is rolled back, the queue 
+            discarded and the exception raised.
+        """
+        statements = self._statements
+        rows_by_table = self._rows_by_table
+        tables = self._tables
+        self._statements = []
+        self._rows_by_table = {}
+        self._tables = []
+
+        start_time = time.time()
+        num_rows = 0
+        num_statements = 0
+        cursor = self._connection.cursor()
+        try:
+            for sql, parameters in statements:
+                cursor.execute(self._translate(sql), parameters)
+                num_statements = num_statements + 1
+            for table in tables:
+                rows = rows_by_table[table]
+                width = len(rows[0])
+                rows_per_statement = max(1, self._max_parameters / width)
+                for start in range(0, len(rows), rows_per_statement):
+                    chunk = rows[start:start + rows_per_statement]
+                    cursor.execute(self._insertSQL(table, width, len(chunk)),
+                                   [value for row in chunk for value in row])
+                    num_statements = num_statements + 1
+                num_rows = num_rows + len(rows)
+            self._connection.commit()
+        except Exception:
+            self._connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        self._metrics['commits'] = self._metrics['commits'] + 1
+        self._metrics['rows'] = self._metrics['rows'] + num_rows
+        self._metrics['statements'] = \
+            self._metrics['statements'] + num_statements
+        self._metrics['last_commit_rows'] = num_rows
+        self._metrics['last_commit_time'] = time.time() - start_time
+
+    def _insertSQL(self, table, width, num_rows):
+        row = "(" + ", ".join([self._placeholder] * width) + ")"
+        return "insert into %s values %s" % \
+            (table, ", ".join([row] * num_rows))
+
+    def _translate(self, sql):
+        if self._placeholder == '%s': return sql
+        return sql.replace('%s', self._placeholder)
+
+
+if __name__ == "__main__":
+    # Compare row-by-row inserts and deletes (each committed, as through
+    # table_manager) with batched writes against a SQLite stand-in
+    import os
+    import sqlite3
+    import tempfile
+
+    num_rows = 5000
+    handle, filename = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    connection = sqlite3.connect(filename)
+    connection.execute("create table ops_sliver (schema, id, selfRef, urn, " + \
+                           "uuid, ts, aggregate_urn, aggregate_href, " + \
+                           "slice_urn, slice_uuid, creator, created, " + \
+                           "expires, node_id, link_id)")
+    connection.commit()
+    rows = [['schema', 'sliver-%d' % i, 'href', 'urn:sliver-%d' % i, 
+             'uuid-%d' % i, 1000, 'urn:agg', 'href', 'urn:slice', 'uuid', 
+             "O'Brien", 0, -1, 'node', ''] for i in range(num_rows)]
+    try:
+        for cycle in range(2):
+            start = time.time()
+            ids = [row[0] for row in \
+                       connection.execute("select id from ops_sliver")]
+            for id in ids:
+                connection.execute("delete from ops_sliver where id = ?", 
+                                   [id])
+                connection.commit()
+            for row in rows:
+                connection.execute("insert into ops_sliver values (" + \
+                                       ", ".join(['?'] * len(row)) + ")", 
+                                   row)
+                connection.commit()
+            elapsed = time.time() - start
+        print "Row by row: %d rows in %.3f sec (%d rows/sec)" % \
+            (num_rows, elapsed, num_rows / elapsed)
+
+        writer = BatchWriter(connection, 'qmark')
+        for cycle in range(2):
+            start = time.time()
+            writer.delete_all('ops_sliver')
+            for row in rows:
+                writer.insert('ops_sliver', row)
+            writer.commit()
+            elapsed = time.time() - start
+        print "Batched: %d rows in %.3f sec (%d rows/sec)" % \
+            (num_rows, elapsed, num_rows / elapsed)
+        print writer.getMetrics()
+    finally:
+        connection.close()
+        os.unlink(filename)
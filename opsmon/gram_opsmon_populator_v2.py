@@ -24,12 +24,18 @@
 # Module to populate monitoring database with live statistics of
 # State of all the compute nodes on this rack
 
+import batch_writer
 import gram_slice_info
+import host_agent
 import json
 import os
 import psutil
+import psycopg2
+import retention
 import subprocess
+import switch_stats
 import sys
+import table_sync
 import tempfile
 import time
 
@@ -77,6 +83,22 @@ class OpsMonPopulator:
         self._prev_values = {}
         self._config = config
         self._table_manager = table_manager.TableManager('local', config_path, False)
+        # Changes of each cycle are written through the batch writer,
+        # committing each group of tables in one transaction
+        self._writer = batch_writer.BatchWriter(self._connect_database())
+        # Only the changes to the info tables are written each cycle
+        self._table_sync = table_sync.TableSync(self._writer)
+        self._add_info_tables()
+        # Raw samples are kept for the window, then rolled up into
+        # coarser averages if configured
+        self._retention = retention.Retention(self._writer,
+                                              self._window_duration_sec,
+                                              config.get('rollups', []))
+        for cmd in self._node_commands + self._interface_commands:
+            self._retention.addTable(cmd['table'])
+        for port in config.get('ports', {}).values():
+            for meas in port['measurements']:
+                self._retention.addTable(meas['table'])
         for cmd in self._node_commands:
             tablename = cmd['table']
             self._prev_values[tablename] = {}
@@ -97,20 +119,24 @@ class OpsMonPopulator:
         self._link_schema = "http://www.gpolab.bbn.com/monitoring/schema/20140501/link#"
         self._user_schema = "http://www.gpolab.bbn.com/monitoring/schema/20140501/user#"
 
-        # Change ' to " in any expressions (can't parse " in json)
-        for cmd in self._node_commands:
-            expr = cmd['expression']
-            expr_new = expr.replace("'", '\\"')
-            cmd['expression'] = expr_new
-
-        imports = ";".join("import %s" % mod for mod in self._modules)
-        measurements = ", ".join(c['expression'] for c in self._node_commands)
-        self._rsh_command = "python -c %s%s;print %s%s" % \
-            ('"', imports, measurements, '"')
-#        print "RSH =  %s" % self._rsh_command
-        self._interface_info_rsh_command = "python -c %s%s%s;print %s%s" % \
-            ('"', imports, ';import json', 'json.dumps(psutil.net_io_counters(pernic=True))', '"')
-#        print "IFACE RSH =  %s" % self._interface_info_rsh_command
+        # One persistent collector agent per host, polled concurrently
+        self._host_timeout_sec = int(config.get('host_timeout_sec', 10))
+        self._host_agents = {}
+        for host in self._hosts:
+            agent_command = ['rsh', host['address'], host_agent.AGENT_COMMAND]
+            self._host_agents[host['id']] = host_agent.HostAgent(agent_command)
+        self._host_request = {'modules' : self._modules,
+                              'expressions' : [c['expression'] \
+                                                   for c in self._node_commands],
+                              'net_io' : len(self._interface_commands) > 0}
+
+        # Port parsers are resolved once; each switch keeps one session
+        self._switch_stats = \
+            switch_stats.SwitchStats(config.get('ports', {}),
+                                     config.get('switches', {}),
+                                     int(config.get('switch_timeout_sec', 30)),
+                                     config.get('switch_capture'),
+                                     config.get('switch_replay'))
 
         self._external_vlans = self._compute_external_vlans()
         self._internal_vlans = \
@@ -201,25 +227,88 @@ class OpsMonPopulator:
     def get_internal_link_urn(self):
         return self._aggregate_urn+ "_INTERNAL"
 
+    # Register the info tables with the table sync: info tables are
+    # keyed by id, relation tables by their two ids.  Measurements of
+    # nodes and interfaces are deleted with them.
+    def _add_info_tables(self):
+        node_data_tables = ['ops_node_cpu_util', 
+                            'ops_node_disk_part_max_used',
+                            'ops_node_is_available', 'ops_node_mem_used_kb',
+                            'ops_node_num_vms_allocated', 'ops_node_swap_free']
+        interface_data_tables = ['ops_interface_rx_bps', 
+                                 'ops_interface_rx_dps',
+                                 'ops_interface_rx_eps', 
+                                 'ops_interface_rx_pps',
+                                 'ops_interface_tx_bps', 
+                                 'ops_interface_tx_dps',
+                                 'ops_interface_tx_eps', 
+                                 'ops_interface_tx_frequency',
+                                 'ops_interface_tx_power', 
+                                 'ops_interface_tx_pps',
+                                 'ops_interface_wmx_noc']
+        related = {'ops_node' : [(table, 'id') for table in node_data_tables],
+                   'ops_interface' : [(table, 'id') \
+                                          for table in interface_data_tables]}
+        # Index of the timestamp of each info table
+        ts_indices = {'ops_aggregate' : 4, 'ops_link' : 4, 'ops_node' : 4,
+                      'ops_interface' : 4, 'ops_interfacevlan' : 4, 
+                      'ops_authority' : 4, 'ops_user' : 4, 
+                      'ops_slice' : 5, 'ops_sliver' : 5}
+        for table, ts_index in ts_indices.items():
+            self._table_sync.addTable(table, ['id'], [1], ts_index,
+                                      related.get(table, []))
+        relation_tables = {'ops_aggregate_resource' : 'aggregate_id',
+                           'ops_node_interface' : 'node_id',
+                           'ops_link_interfacevlan' : 'link_id',
+                           'ops_slice_user' : 'slice_id',
+                           'ops_authority_slice' : 'authority_id',
+                           'ops_sliver_resource' : 'sliver_id',
+                           'ops_aggregate_sliver' : 'aggregate_id'}
+        for table, column in relation_tables.items():
+            self._table_sync.addTable(table, ['id', column], [0, 1])
+
+    # Connect to the monitoring database for batched writes
+    def _connect_database(self):
+        return psycopg2.connect(database=self._database_name,
+                                user=self._database_user, 
+                                password=self._database_pwd,
+                                host=self._config.get('database_host', 
+                                                      'localhost'))
+
     # Top-level loop: Generate data file, execute into database and sleep
+    # The updates of each group of tables are committed together
     def run(self):
         print "GRAM OPSMON process for %s" % self._aggregate_id
         while True:
+            start_time = time.time()
+            num_rows = 0
             self._latest_snapshot = gram_slice_info.find_latest_snapshot()
             self._objects_by_urn = gram_slice_info.parse_snapshot(self._latest_snapshot)
-            self.delete_static_entries()
+            for update_tables in [self.update_data_tables,
+                                  self.update_aggregate_tables]:
+                update_tables()
+                self._writer.commit()
+                num_rows = num_rows + \
+                    self._writer.getMetrics()['last_commit_rows']
+
+            # The info tables are computed in full and only the rows that
+            # changed since the last cycle written, in one transaction
             self.update_info_tables()
-            self.update_data_tables()
             self.update_slice_tables()
             self.update_sliver_tables()
-            self.update_aggregate_tables()
             self.update_interfacevlan_info()
             self.update_switch_info()
+            added, removed, changed = self._table_sync.sync()
+            self._writer.commit()
+            num_rows = num_rows + \
+                self._writer.getMetrics()['last_commit_rows']
 #            data_filename = self.generate_data_file()
 #            self.execute_data_file(data_filename)
 #            print "FILE = %s" % data_filename
 #            os.unlink(data_filename)
-            print "Updated OpsMon dynamic data for %s at %d" % (self._aggregate_id, int(time.time()))
+            print "Updated OpsMon dynamic data for %s at %d (%d rows in %.2f sec; info rows %d added, %d removed, %d changed)" % \
+                (self._aggregate_id, int(time.time()), num_rows, 
+                 time.time() - start_time, added, removed, changed)
             time.sleep(self._frequency_sec)
 
     # Update static H/W config information based on config plus information
@@ -234,13 +323,6 @@ class OpsMonPopulator:
     # Update aggregate info tables
     def update_aggregate_info(self):
         ts = str(int(time.time()*1000000))
-        purge_old_related_entries(self._table_manager, 
-                                  'ops_aggregate_sliver', 'aggregate_id',
-                                  'ops_aggregate', 'id', ts)
-        purge_old_related_entries(self._table_manager, 
-                                  'ops_sliver', 'aggregate_href',
-                                  'ops_aggregate', 'selfRef', ts)
-        self._table_manager.purge_old_tsdata('ops_aggregate', ts)
         meas_ref = self._measurement_href
         # New fields
         pop_version = 1.0
@@ -249,11 +331,10 @@ class OpsMonPopulator:
 
         agg = [self._agg_schema, self._aggregate_id, self._aggregate_href, 
                self._aggregate_urn, ts, meas_ref, pop_version, op_status, ip_poolsize]
-        info_insert(self._table_manager, 'ops_aggregate', agg)
+        self._table_sync.add('ops_aggregate', agg)
 
     def update_link_info(self):
         ts = str(int(time.time()*1000000))
-        self._table_manager.purge_old_tsdata('ops_link', ts)
 
         links = [link for link in self._objects_by_urn.values() \
                      if link['__type__'] == 'NetworkLink']
@@ -263,36 +344,14 @@ class OpsMonPopulator:
             link_id = self.get_link_id(link_urn)
             link_href = self.get_link_href(link_id)
             link_info = [self._link_schema, link_id, link_href, link_urn, ts]
-            info_insert(self._table_manager, 'ops_link', link_info)
+            self._table_sync.add('ops_link', link_info)
 
             agg_resource_info = [link_id, self._aggregate_id, link_href, link_urn]
-            info_insert(self._table_manager, 'ops_aggregate_resource', agg_resource_info)
+            self._table_sync.add('ops_aggregate_resource', agg_resource_info)
 
     # Update node info tables
     def update_node_info(self):
         ts = str(int(time.time()*1000000))
-        purge_old_related_entries(self._table_manager, 
-                                  'ops_node_cpu_util', 'id', 
-                                  'ops_node', 'id', ts)
-        purge_old_related_entries(self._table_manager, 
-                                  'ops_node_disk_part_max_used', 'id', 
-                                  'ops_node', 'id', ts)
-        purge_old_related_entries(self._table_manager, 
-                                  'ops_node_is_available', 'id', 
-                                  'ops_node', 'id', ts)
-        purge_old_related_entries(self._table_manager, 
-                                  'ops_node_mem_used_kb', 'id', 
-                                  'ops_node', 'id', ts)
-        purge_old_related_entries(self._table_manager, 
-                                  'ops_node_num_vms_allocated', 'id', 
-                                  'ops_node', 'id', ts)
-        purge_old_related_entries(self._table_manager, 
-                                  'ops_node_swap_free', 'id', 
-                                  'ops_node', 'id', ts)
-        purge_old_related_entries(self._table_manager, 
-                                  'ops_node_interface', 'node_id', 
-                                  'ops_node', 'id', ts)
-        self._table_manager.purge_old_tsdata('ops_node', ts)
         for node_id, nd in self._nodes.items():
             # New fields
             node_type = "NODE"
@@ -300,53 +359,13 @@ class OpsMonPopulator:
             node = [nd['schema'], nd['id'], nd['href'], nd['urn'], ts, 
                     node_type, nd['mem_total_kb'], virt_type]
             resource = [nd['id'], self._aggregate_id, nd['urn'], nd['href']]
-            info_insert(self._table_manager, "ops_node", node)
-            info_insert(self._table_manager, 'ops_aggregate_resource', resource)
+            self._table_sync.add('ops_node', node)
+            self._table_sync.add('ops_aggregate_resource', resource)
 
     # Update interface info tables
     def update_interface_info(self):
         ts = str(int(time.time()*1000000))
 
-        # Clear out old interface info:
-        purge_old_related_entries(self._table_manager, 
-                                  'ops_interface_rx_bps', 'id',
-                                  'ops_interface', 'id', ts)
-        purge_old_related_entries(self._table_manager,
-                                  'ops_interface_rx_dps', 'id',
-                                  'ops_interface', 'id', ts)
-        purge_old_related_entries(self._table_manager,
-                                  'ops_interface_rx_eps', 'id',
-                                  'ops_interface', 'id', ts)
-        purge_old_related_entries(self._table_manager,
-                                  'ops_interface_rx_pps', 'id',
-                                  'ops_interface', 'id', ts)
-        purge_old_related_entries(self._table_manager,
-                                  'ops_interface_tx_bps', 'id',
-                                  'ops_interface', 'id', ts)
-        purge_old_related_entries(self._table_manager,
-                                  'ops_interface_tx_dps', 'id',
-                                  'ops_interface', 'id', ts)
-        purge_old_related_entries(self._table_manager,
-                                  'ops_interface_tx_eps', 'id',
-                                  'ops_interface', 'id', ts)
-        purge_old_related_entries(self._table_manager,
-                                  'ops_interface_tx_frequency', 'id',
-                                  'ops_interface', 'id', ts)
-        purge_old_related_entries(self._table_manager,
-                                  'ops_interface_tx_power', 'id',
-                                  'ops_interface', 'id', ts)
-        purge_old_related_entries(self._table_manager,
-                                  'ops_interface_tx_pps', 'id',
-                                  'ops_interface', 'id', ts)
-        purge_old_related_entries(self._table_manager,
-                                  'ops_interface_wmx_noc', 'id',
-                                  'ops_interface', 'id', ts)
-        self._table_manager.purge_old_tsdata('ops_interface', ts)
-        # Clear out old sliver resource info
-        for node_urn, node_info in self._nodes.items():
-            node_id = self.get_node_id(node_info['id'])
-            self._table_manager.delete_stmt('ops_node_interface', node_id)
-
         # Insert into ops_node_interface
         for node_info in self._config['hosts']:
             node_urn = node_info['urn']
@@ -372,15 +391,14 @@ class OpsMonPopulator:
                                   iface_role, 
                                   iface_max_bps, iface_max_pps]
 
-                info_insert(self._table_manager, 'ops_interface', interface_info)
-                info_insert(self._table_manager, 'ops_node_interface', node_interface_info)
+                self._table_sync.add('ops_interface', interface_info)
+                self._table_sync.add('ops_node_interface', node_interface_info)
 
 
     # Update the ops_link_interface_vlan and ops_interfacevlan
     # tables to reflect current VLAN allocations
     def update_interfacevlan_info(self):
         ts = str(int(time.time()*1000000))
-        self._table_manager.purge_old_tsdata('ops_interfacevlan', ts)
 
         links = [link for link in self._objects_by_urn.values() \
                      if link['__type__'] == 'NetworkLink']
@@ -429,12 +447,12 @@ class OpsMonPopulator:
                               ifacevlan_href, ifacevlan_urn, ts, tag,
                               iface_urn, iface_href]
             
-            info_insert(self._table_manager, 'ops_interfacevlan', 
-                        ifacevlan_info)
+            self._table_sync.add('ops_interfacevlan', 
+                                 ifacevlan_info)
 
             link_ifacevlan_info = [ifacevlan_id, link_id, ifacevlan_urn, ifacevlan_href]
-            info_insert(self._table_manager, 'ops_link_interfacevlan',
-                        link_ifacevlan_info)
+            self._table_sync.add('ops_link_interfacevlan',
+                                 link_ifacevlan_info)
 
         # Add in stitching interface vlan info
         for link in links:
@@ -448,8 +466,8 @@ class OpsMonPopulator:
                 ifacevlan_href = self.get_interfacevlan_href(ifacevlan_id)
 
                 link_ifacevlan_info = [ifacevlan_id, link_id, ifacevlan_urn, ifacevlan_href]
-                info_insert(self._table_manager, 'ops_link_interfacevlan', 
-                            link_ifacevlan_info);
+                self._table_sync.add('ops_link_interfacevlan', 
+                                     link_ifacevlan_info);
                 
                 iface_urn = self.find_iface_urn_for_link_urn(ifacevlan_urn)
                 iface_id = self.get_interface_id(iface_urn, 'EGRESS')
@@ -457,8 +475,8 @@ class OpsMonPopulator:
                 ifacevlan_info = [self._interfacevlan_schema, ifacevlan_id,
                                   ifacevlan_href, ifacevlan_urn, ts, vlan_tag, 
                                   iface_urn, iface_href]
-                info_insert(self._table_manager, 'ops_interfacevlan',
-                            ifacevlan_info);
+                self._table_sync.add('ops_interfacevlan',
+                                     ifacevlan_info);
 
     # Return the interface port URN for the given stitching link URN
     def find_iface_urn_for_link_urn(self, link_urn):
@@ -495,7 +513,10 @@ class OpsMonPopulator:
                 switch_node_info = [self._node_schema, switch_id, switch_href,\
                                         switch_name, ts, 
                                     node_type, 0, virt_type] # 0 = mem_total_kb
-                info_insert(self._table_manager, 'ops_node', switch_node_info)
+                self._table_sync.add('ops_node', switch_node_info)
+
+            # Statistics of all configured ports, a batch per switch
+            port_stats = self._switch_stats.collect()
 
             # Enter an interface in the ops_interface for the egress_ports
             # As well as ops_node_interface
@@ -515,18 +536,9 @@ class OpsMonPopulator:
                 iface_max_bps = 0 
                 iface_max_pps = 0 
 
-                if iface_urn in self._config['ports']:
-                    stats_command = self._config['ports'][iface_urn]['command']
-                    parser_module = \
-                        self._config['ports'][iface_urn]['parser_module']
-                    parser = self._config['ports'][iface_urn]['parser']
+                if iface_urn in port_stats:
                     measurements = self._config['ports'][iface_urn]['measurements']
-                    iface_raw_stats = subprocess.check_output(stats_command)
-#                    print "IFACE_RAW_STATS = %s" % iface_raw_stats
-                    exec('import %s' % parser_module)
-                    parse_cmd = "%s(iface_raw_stats)" % parser
-                    iface_stats = eval(parse_cmd)
- #                   print "IFACE_STATS = %s" % iface_stats
+                    iface_stats = port_stats[iface_urn]
                     iface_max_bps = iface_stats['line_speed']
                     iface_address = iface_stats['mac_address']
 
@@ -538,10 +550,11 @@ class OpsMonPopulator:
                         if meas_change_rate:
                             value = self._compute_change_rate(value, 
                                                               meas_table,
-                                                              iface_id)
+                                                              iface_id,
+                                                              int(ts))
                             ts_data = [iface_id, ts, value]
-                            info_insert(self._table_manager, meas_table, 
-                                        ts_data)
+                            self._writer.insert(meas_table, 
+                                                ts_data)
                          
                 # Insert interface and node_interface entries for egress port
                 iface_info = [self._interface_schema, iface_id, iface_href,
@@ -550,10 +563,10 @@ class OpsMonPopulator:
 #                              iface_address, 
                               iface_role, 
                               iface_max_bps, iface_max_pps]
-                info_insert(self._table_manager, 'ops_interface', iface_info)
+                self._table_sync.add('ops_interface', iface_info)
                 node_iface_info = [iface_id, switch_id, iface_urn, iface_href]
-                info_insert(self._table_manager, 'ops_node_interface', 
-                            node_iface_info)
+                self._table_sync.add('ops_node_interface', 
+                                     node_iface_info)
 
 
 
@@ -562,13 +575,6 @@ class OpsMonPopulator:
     def update_slice_tables(self):
         ts = int(time.time()*1000000)
 
-        # Clear out old slice/user info
-        self.delete_all_entries_in_table('ops_slice_user')
-        self.delete_all_entries_in_table('ops_authority_slice')
-        self._table_manager.purge_old_tsdata('ops_slice', ts)
-        self._table_manager.purge_old_tsdata('ops_user', ts)
-        self._table_manager.purge_old_tsdata('ops_authority', ts)
-
         user_urns = []
         authority_urns = []
 
@@ -594,8 +600,8 @@ class OpsMonPopulator:
             
                 authority_info = [self._authority_schema, authority_id,
                                   authority_href, authority_urn, ts]
-                info_insert(self._table_manager, 'ops_authority', 
-                            authority_info)
+                self._table_sync.add('ops_authority', 
+                                     authority_info)
                 authority_urns.append(authority_urn)
 
             created = -1 # *** Can't get this
@@ -606,7 +612,7 @@ class OpsMonPopulator:
             slice_info = [self._slice_schema, slice_id, slice_href,
                           slice_urn, slice_uuid, ts, authority_urn, 
                           authority_href, created, expires]
-            info_insert(self._table_manager, 'ops_slice', slice_info)
+            self._table_sync.add('ops_slice', slice_info)
 
             # If user URN is present, link from slice to user
             if user_urn is not None:
@@ -615,12 +621,12 @@ class OpsMonPopulator:
                 user_href = self.get_user_href(user_id)
                 role = None # *** Don't know what this is or how to get it
                 slice_user_info = [user_id, slice_id, user_urn, role, user_href]
-                info_insert(self._table_manager, 'ops_slice_user', slice_user_info)
+                self._table_sync.add('ops_slice_user', slice_user_info)
 
             # Link from slice to authority
             auth_slice_info = [slice_id, authority_id, slice_urn, slice_href]
-            info_insert(self._table_manager, 'ops_authority_slice', 
-                        auth_slice_info)
+            self._table_sync.add('ops_authority_slice', 
+                                 auth_slice_info)
 
         # Fill in users table
         for user_urn in user_urns:
@@ -640,20 +646,13 @@ class OpsMonPopulator:
 
             user_info = [self._user_schema, user_id, user_href, user_urn, ts,
                          authority_urn, authority_href, full_name, email]
-            info_insert(self._table_manager, 'ops_user', user_info)
+            self._table_sync.add('ops_user', user_info)
 
 
     # update sliver tables based on most recent snapshot
     def update_sliver_tables(self):
         ts = int(time.time()*1000000)
 
-        # Clear out old sliver info:
-        self._table_manager.purge_old_tsdata('ops_sliver', ts)
-        # Clear out old sliver resource and aggregate sliver
-        self.delete_all_entries_in_table('ops_sliver_resource')
-        self.delete_all_entries_in_table('ops_aggregate_sliver')
-            
-
         # Insert into ops_sliver_resource table and ops_aggregate_sliver table
         for object_urn, object_attributes in self._objects_by_urn.items():
             if object_attributes['__type__'] not in ['NetworkInterface', 'VirtualMachine']: continue
@@ -688,16 +687,16 @@ class OpsMonPopulator:
                                ts, self._aggregate_urn, self._aggregate_href, \
                                slice_urn, slice_uuid, creator, \
                                created, expires, node_id, link_id]
-            info_insert(self._table_manager, 'ops_sliver', sliver_info)
+            self._table_sync.add('ops_sliver', sliver_info)
 
             # Insert into ops_sliver_resource table
             sliver_resource_info = [node_id, sliver_id, node_urn, node_href]
-            info_insert(self._table_manager, 'ops_sliver_resource', sliver_resource_info)
+            self._table_sync.add('ops_sliver_resource', sliver_resource_info)
 
             # Insert into ops_aggregate_sliver table
             sliver_aggregate_info = \
                 [sliver_id, self._aggregate_id, sliver_urn, sliver_href]
-            info_insert(self._table_manager, 'ops_aggregate_sliver', sliver_aggregate_info)
+            self._table_sync.add('ops_aggregate_sliver', sliver_aggregate_info)
 
     # Update aggregate measurement tables on most recent snapshot
     def update_aggregate_tables(self):
@@ -706,7 +705,7 @@ class OpsMonPopulator:
         num_vms_table = 'ops_aggregate_num_vms_allocated'
 
         # Clear out old node info
-        self._table_manager.purge_old_tsdata(num_vms_table, ts)
+        self._writer.purge_old_tsdata(num_vms_table, ts)
 
         # Count number of VM's in current snapshot
         num_vms = 0
@@ -716,7 +715,7 @@ class OpsMonPopulator:
         
         # Write a record to the ops_aggregate_num_vms_allocated table
         num_vms_info = [self._aggregate_id, ts, num_vms]
-        info_insert(self._table_manager, num_vms_table, num_vms_info)
+        self._writer.insert(num_vms_table, num_vms_info)
 
 
     # Update data tables 
@@ -726,24 +725,24 @@ class OpsMonPopulator:
     def update_data_tables(self):
 
         ts = int(time.time()*1000000)
-        window_threshold = ts - (self._window_duration_sec * 1000000)
 
-        # Delete old records from data tables
-        for command in self._node_commands + self._interface_commands:
-            tablename = command['table'] 
-            self._table_manager.purge_old_tsdata(tablename, window_threshold)
+        # Roll up or delete old records from data tables
+        self._retention.run(ts)
 
-        # For each host, grab the most recent data in a single command
+        # Grab the most recent data from all hosts at once, a single
+        # request to the agent of each host
+        replies = host_agent.collect_all(self._host_agents, 
+                                         self._host_request,
+                                         self._host_timeout_sec)
         for host in self._hosts:
 
             host_id = self.get_node_id(host['id'])
             node_urn = self._nodes[host_id]['urn']
-            host_address = host['address']
-            rsh_command = ["rsh", host_address, self._rsh_command]
-#            print "RSH = %s" % rsh_command
-            result = subprocess.check_output(rsh_command)
-#            print "RESULT (%s) = %s" % (host_id, result)
-            measurements = result.split(' ')
+            reply = replies[host['id']]
+            if reply is None:
+                print "No measurements from host %s" % host['address']
+                continue
+            measurements = reply['values']
             for i in range(len(measurements)):
                 command = self._node_commands[i]
                 tablename = command['table']
@@ -752,15 +751,13 @@ class OpsMonPopulator:
                 # For metrics that are change rates, keep track of previous value
                 # And compute rate of change (change in metric / change in time)
                 if change_rate:
-                    value = self._compute_change_rate(value, tablename, host_id)
+                    value = self._compute_change_rate(value, tablename, host_id,
+                                                      ts)
 
                 ts_data = [host_id, ts, value]
-                info_insert(self._table_manager,  tablename, ts_data)
+                self._writer.insert(tablename, ts_data)
 
-            interface_info_rsh_command = ['rsh', host_address, self._interface_info_rsh_command]
-            interface_info_string = subprocess.check_output(interface_info_rsh_command)
-            interface_info = json.loads(interface_info_string)
-#            print "II(%s) = %s" % (host_id , interface_info)
+            interface_info = reply.get('net_io', {})
             for interface_name, interface in host['interfaces'].items():
                 interface_id = self.get_interface_id(node_urn, interface_name)
                 for interface_command in self._interface_commands:
@@ -771,19 +768,27 @@ class OpsMonPopulator:
                     value = interface_info[interface_name][expression_index]
                     
                     if change_rate:
-                        value = self._compute_change_rate(value, tablename, interface_id)
+                        value = self._compute_change_rate(value, tablename, 
+                                                          interface_id, ts)
 
                     ts_data = [interface_id, ts, value]
-                    info_insert(self._table_manager, tablename, ts_data)
+                    self._writer.insert(tablename, ts_data)
 
-    def _compute_change_rate(self, value, tablename, identifier):
+    # Rate of change of a counter since its previous raw sample, over the
+    # time actually elapsed (a host may have missed cycles).
+    # The previous raw values are kept here, never read back from the
+    # tables, which hold rates and may have been rolled up.
+    def _compute_change_rate(self, value, tablename, identifier, ts):
         prev_value = value # For first time, make change rate zero
+        prev_ts = ts
         if tablename in self._prev_values and \
                 identifier in self._prev_values[tablename]:
-            prev_value = self._prev_values[tablename][identifier]
+            prev_value, prev_ts = self._prev_values[tablename][identifier]
         if tablename not in self._prev_values: self._prev_values[tablename] = {}
-        self._prev_values[tablename][identifier] = value
-        value = int(((value - prev_value) / float(self._frequency_sec)))
+        self._prev_values[tablename][identifier] = (value, ts)
+        # Counter was reset (e.g. host rebooted): start over
+        if value < prev_value or ts <= prev_ts: return 0
+        value = int(((value - prev_value) * 1000000 / float(ts - prev_ts)))
         return value
 
     def _compute_external_vlans(self):
@@ -796,16 +801,6 @@ class OpsMonPopulator:
                 external_vlans[port] = parseVLANs(vlans)
         return external_vlans
 
-    def delete_static_entries(self):
-        self.delete_all_entries_in_table('ops_aggregate_resource')
-        self.delete_all_entries_in_table('ops_link_interfacevlan')
-
-    # Delete all entries in a given table
-    def delete_all_entries_in_table(self, tablename):
-        ids = self._table_manager.get_all_ids_from_table(tablename)
-#        print "Deleting all entries in %s %s" % (tablename, ids)
-        for id in ids:
-            self._table_manager.delete_stmt(tablename, id)
 
 
 # Helper functions
@@ -814,25 +809,6 @@ class OpsMonPopulator:
 def flatten_urn(urn):
     return urn.replace(':', '_').replace('+', '_')
 
-# creates a values string from an ordered array of values
-def info_insert(table_manager, table_str, row_arr):
-    val_str = "('"
-        
-    for val in row_arr:
-        val_str += str(val) + "','" # join won't do this
-    val_str = val_str[:-2] + ")" # remove last 2 of 3 chars: ',' and add )
-
-#    print "INSERT: %s => %s" % (table_str, val_str)
-
-    table_manager.insert_stmt(table_str, val_str)
-
-def purge_old_related_entries(table_manager, related_table, related_index, 
-                              key_table, key_index, ts):
-    delete_related_entries = \
-        "delete from %s where %s in (select %s from %s where ts < %s)" % \
-        (related_table, related_index, key_index, key_table, ts)
-    table_manager.execute_sql(delete_related_entries)
-
 def main():
     if len(sys.argv) < 2:
         print "Usage: python gram_opsmon_populator config_filename"
@@ -1,25 +1,16 @@
-import glob
-import json
-import os
 import sys
 
+from gram.am.gram import snapshot_journal
+from gram.am.gram import snapshot_store
+
 def find_latest_snapshot():
     SNAPSHOT_DIRECTORY = '/etc/gram/snapshots/gram'
-    files = glob.glob(SNAPSHOT_DIRECTORY + "/" + "*.json")
-    latest_snapshot = None
-    latest_ctime = None
-    for file in files:
-        stat = os.stat(file)
-        ctime = stat.st_ctime
-        if latest_snapshot is None or latest_ctime < ctime:
-            latest_snapshot = file
-            latest_ctime = ctime
-    return latest_snapshot
+    return snapshot_store.find_latest_snapshot(SNAPSHOT_DIRECTORY)
 
 def parse_snapshot(snapshot_filename):
-    snapshot_data = None
-    with open(snapshot_filename, 'r') as snapshot_file:
-        snapshot_data = json.load(snapshot_file)
+    # Snapshots are either JSON or compressed containers, with the
+    # changes recorded in the journal kept next to them (if any)
+    snapshot_data = snapshot_journal.replay(snapshot_filename)
 #        print "DATA = %s" % snapshot_data
     objects_by_urn = {}
     objects_by_uid = {}
@@ -0,0 +1,216 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2011-2014 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Persistent metric collectors on the compute hosts
+#
+# Instead of starting a new remote interpreter (rsh host python -c ...)
+# for every measurement of every cycle, the populator starts one
+# collector agent per host
+#
+#    rsh <host> python -u -c "<AGENT_COMMAND>"
+#
+# sends it the agent source (AGENT_SOURCE, as the first line, JSON encoded)
+# and then keeps the connection open.  Each request is a JSON line
+#
+#    {"modules" : [<module>, ...], "expressions" : [<expression>, ...],
+#     "net_io" : <bool>}
+#
+# answered with a JSON line
+#
+#    {"values" : [<value of each expression>, ...],
+#     "net_io" : <psutil.net_io_counters(pernic=True)>}
+#
+# or {"error" : <message>}.  collect_all polls the agents of all hosts
+# concurrently: an agent that does not answer within the timeout is
+# stopped (and restarted on the next request) without holding up the
+# others.
+
+import json
+import os
+import select
+import subprocess
+import threading
+import time
+
+AGENT_SOURCE = """
+import json
+import sys
+modules = {}
+while True:
+    line = sys.stdin.readline()
+    if not line: break
+    request = json.loads(line)
+    reply = {}
+    try:
+        namespace = {}
+        for module in request['modules']:
+            if module not in modules: modules[module] = __import__(module)
+            namespace[module.split('.')[0]] = modules[module]
+        reply['values'] = [eval(expression, namespace) \\
+                               for expression in request['expressions']]
+        if request.get('net_io'):
+            import psutil
+            reply['net_io'] = psutil.net_io_counters(pernic=True)
+        data = json.dumps(reply)
+    except Exception, e:
+        data = json.dumps({'error' : str(e)})
+    sys.stdout.write(data + '\\n')
+    sys.stdout.flush()
+"""
+
+AGENT_COMMAND = \
+    'python -u -c "import sys,json;exec(json.loads(sys.stdin.readline()))"'
+
+
+class HostAgent:
+    """
+        Local end of the collector agent of one host, started by the 
+        given command (e.g. ['rsh', address, AGENT_COMMAND]).
+    """
+    def __init__(self, command):
+        self._command = command
+        self._process = None
+        self._buffer = ''
+        self._metrics = {'requests' : 0, 'timeouts' : 0, 'failures' : 0,
+                         'starts' : 0, 'last_latency' : None}
+
+    def getMetrics(self): return dict(self._metrics)
+
+    def collect(self, request, timeout):
+        """
+            Send the request to the agent (starting it if need be) and 
+            return its reply, or None if it did not reply within timeout
+            seconds or failed.
+        """
+        deadline = time.time() + timeout
+        self._metrics['requests'] = self._metrics['requests'] + 1
+        try:
+            if self._process is None: self._start()
+            self._process.stdin.write(json.dumps(request) + '\n')
+            self._process.stdin.flush()
+            line = self._readLine(deadline)
+        except (IOError, OSError, ValueError), e:
+            print "Metric collection failed on %s: %s" % (self._command, e)
+            self._metrics['failures'] = self._metrics['failures'] + 1
+            line = None
+        if line is None:
+            self.stop()
+            return None
+        self._metrics['last_latency'] = time.time() - (deadline - timeout)
+        reply = json.loads(line)
+        if 'error' in reply:
+            self._metrics['failures'] = self._metrics['failures'] + 1
+            print "Metric collection failed on %s: %s" % \
+                (self._command, reply['error'])
+            return None
+        return reply
+
+    def stop(self):
+        if self._process is None: return
+        try:
+            self._process.kill()
+            self._process.wait()
+        except OSError:
+            pass
+        self._process = None
+        self._buffer = ''
+
+    def _start(self):
+        self._process = subprocess.Popen(self._command, 
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE)
+        self._process.stdin.write(json.dumps(AGENT_SOURCE) + '\n')
+        self._process.stdin.flush()
+        self._metrics['starts'] = self._metrics['starts'] + 1
+
+    # Read a line of the reply, or return None at the deadline or
+    # if the agent exited
+    def _readLine(self, deadline):
+        fd = self._process.stdout.fileno()
+        while '\n' not in self._buffer:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self._metrics['timeouts'] = self._metrics['timeouts'] + 1
+                return None
+            readable, writable, errors = select.select([fd], [], [], remaining)
+            if not readable: continue
+            data = os.read(fd, 65536)
+            if not data:
+                self._metrics['failures'] = self._metrics['failures'] + 1
+                return None
+            self._buffer = self._buffer + data
+        line, self._buffer = self._buffer.split('\n', 1)
+        return line
+
+
+def collect_all(agents, request, timeout):
+    """
+        Send the request to all agents ({key : HostAgent}) concurrently
+        and return {key : reply or None}
+    """
+    replies = {}
+    def collect(key, agent):
+        replies[key] = agent.collect(request, timeout)
+    threads = [threading.Thread(target=collect, args=(key, agent)) \
+                   for key, agent in agents.items()]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return replies
+
+
+if __name__ == "__main__":
+    # Compare a fresh interpreter per host and cycle (as with rsh 
+    # python -c) with persistent agents polled concurrently, using
+    # local processes to stand in for the hosts
+    import sys
+
+    num_hosts = 10
+    request = {'modules' : ['os'], 'expressions' : ['os.getloadavg()[0]']}
+    command = "import os;print os.getloadavg()[0]"
+
+    for cycle in range(2):
+        start = time.time()
+        for host in range(num_hosts):
+            subprocess.check_output([sys.executable, '-c', command])
+        elapsed = time.time() - start
+    print "Fresh interpreters: %d hosts in %.3f sec" % (num_hosts, elapsed)
+
+    agent_command = ['sh', '-c', 
+                     AGENT_COMMAND.replace('python', sys.executable, 1)]
+    agents = dict((host, HostAgent(agent_command)) \
+                      for host in range(num_hosts))
+    for cycle in range(2):
+        start = time.time()
+        replies = collect_all(agents, request, 5)
+        elapsed = time.time() - start
+    print "Persistent agents: %d hosts in %.3f sec (%d replies)" % \
+        (num_hosts, elapsed, 
+         len([reply for reply in replies.values() if reply]))
+
+    # A host that does not answer in time doesn't hold up the others
+    agents['slow'] = HostAgent(['sh', '-c', 'sleep 10'])
+    start = time.time()
+    replies = collect_all(agents, request, 1)
+    print "With a stalled host: %.3f sec, reply from it: %s" % \
+        (time.time() - start, replies['slow'])
+    for agent in agents.values(): agent.stop()
@@ -0,0 +1,186 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2011-2014 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Retention and downsampling of the OpsMon time-series tables
+#
+# Raw samples are kept for window_duration_sec.  With "rollups" in the
+# OpsMon config, e.g.
+#
+#    "rollups" : [{"bucket_sec" : 60, "keep_sec" : 86400},
+#                 {"bucket_sec" : 900, "keep_sec" : 2592000}]
+#
+# older samples are not dropped but rolled into buckets: samples older
+# than the raw window are replaced by their per-minute averages, which
+# are kept for a day, and those older than a day by 15 minute averages,
+# kept for 30 days.  Only what is older than the last rollup is purged.
+#
+# Rolled-up rows stay in the same (id, ts, v) tables with ts the start
+# of their bucket, so readers of the tables are unchanged; queries over
+# long windows simply see fewer rows.
+#
+# Each rollup owns the range of timestamps between its cutoff (now less
+# the keep time of the finer level, rounded down to a bucket boundary)
+# and the cutoff of the next coarser rollup.  Each cycle only the part
+# of that range that crossed the cutoff since the last cycle is read:
+# one grouped select, one range delete and the inserts of the averages
+# per table and rollup.  Buckets that already hold a single aligned row
+# (e.g. after a restart, when the whole range is read once) are not
+# rewritten.
+#
+# Change rates are computed by the populator from the raw counters
+# before they are written, so the rollups average rates and never
+# difference rolled-up values.
+
+VALUE_COLUMN = 'v'
+
+
+class Retention:
+    """
+        Rolls up and purges the samples of the time-series tables added, 
+        writing through the given BatchWriter.  rollups is a list of
+        {'bucket_sec', 'keep_sec'} from finest to coarsest.
+    """
+    def __init__(self, writer, raw_keep_sec, rollups=[]):
+        self._writer = writer
+        self._levels = [] # (bucket usec, keep usec) from finest to coarsest
+        keep_sec = raw_keep_sec
+        bucket_sec = 1
+        for rollup in rollups:
+            if int(rollup['bucket_sec']) % bucket_sec != 0 or \
+                    int(rollup['keep_sec']) <= keep_sec:
+                raise ValueError("Rollup %s must have a coarser bucket " \
+                                     "and longer keep time than the last" % \
+                                     rollup)
+            bucket_sec = int(rollup['bucket_sec'])
+            keep_sec = int(rollup['keep_sec'])
+            self._levels.append((bucket_sec * 1000000, keep_sec * 1000000))
+        self._raw_keep = raw_keep_sec * 1000000
+        self._tables = []
+        self._watermarks = {} # (table, level) => end of range rolled up
+        self._metrics = {'rolled_rows' : 0, 'written_rows' : 0}
+
+    def addTable(self, table):
+        if table not in self._tables: self._tables.append(table)
+
+    def getMetrics(self):
+        return dict(self._metrics)
+
+    def run(self, ts):
+        """
+            Queue the rollups and purges due at time ts (usec)
+        """
+        cutoffs = self._cutoffs(ts)
+        if len(self._levels) > 0:
+            purge_threshold = ts - self._levels[-1][1]
+        else:
+            purge_threshold = ts - self._raw_keep
+        for table in self._tables:
+            self._writer.purge_old_tsdata(table, purge_threshold)
+            for level in range(len(self._levels)):
+                # Range [start, end) of this level
+                end = cutoffs[level]
+                start = self._watermarks.get((table, level), 0)
+                if level + 1 < len(self._levels):
+                    start = max(start, cutoffs[level + 1])
+                else:
+                    start = max(start, purge_threshold)
+                if start < end:
+                    self._rollup(table, self._levels[level][0], start, end)
+                self._watermarks[(table, level)] = end
+
+    # The end of the range of each level, aligned to its buckets
+    def _cutoffs(self, ts):
+        cutoffs = []
+        keep = self._raw_keep
+        for bucket, level_keep in self._levels:
+            cutoff = ts - keep
+            cutoffs.append(cutoff - cutoff % bucket)
+            keep = level_keep
+        return cutoffs
+
+    def _rollup(self, table, bucket, start, end):
+        bucket_expression = "(ts / %d) * %d" % (bucket, bucket)
+        rows = self._writer.query(("select id, %s, avg(%s), count(*), " + \
+                                       "min(ts) from %s " + \
+                                       "where ts >= %%s and ts < %%s " + \
+                                       "group by id, %s") % \
+                                      (bucket_expression, VALUE_COLUMN, 
+                                       table, bucket_expression),
+                                  [start, end])
+
+        # Only rewrite from the first bucket that is not rolled up yet
+        unrolled = [bucket_ts for id, bucket_ts, value, count, min_ts \
+                        in rows if count > 1 or min_ts != bucket_ts]
+        if len(unrolled) == 0: return
+        rewrite_start = min(unrolled)
+        self._writer.execute("delete from %s where ts >= %%s and ts < %%s" % \
+                                 table, [rewrite_start, end])
+        for id, bucket_ts, value, count, min_ts in rows:
+            if bucket_ts < rewrite_start: continue
+            self._writer.insert(table, [id, bucket_ts, float(value)])
+            self._metrics['rolled_rows'] = \
+                self._metrics['rolled_rows'] + count
+            self._metrics['written_rows'] = \
+                self._metrics['written_rows'] + 1
+
+
+if __name__ == "__main__":
+    # Simulate 3 days of 60 second samples of 10 nodes against a SQLite
+    # stand-in, comparing the table size with and without rollups
+    import batch_writer
+    import sqlite3
+    import time
+
+    num_ids = 10
+    frequency_sec = 60
+    num_cycles = 3 * 24 * 60
+    start_ts = 1400000000 * 1000000
+    rollups = [{'bucket_sec' : 600, 'keep_sec' : 86400},
+               {'bucket_sec' : 3600, 'keep_sec' : 30 * 86400}]
+
+    for label, levels in [('raw only', []), ('rollups', rollups)]:
+        connection = sqlite3.connect(':memory:')
+        connection.execute("create table ops_node_cpu_util (id, ts, v)")
+        connection.execute("create index ops_node_cpu_util_ts " + \
+                               "on ops_node_cpu_util (ts)")
+        writer = batch_writer.BatchWriter(connection, 'qmark')
+        # Keep raw data for the whole period unless rolling up
+        raw_keep_sec = 3600
+        if len(levels) == 0: raw_keep_sec = 30 * 86400
+        retention = Retention(writer, raw_keep_sec, levels)
+        retention.addTable('ops_node_cpu_util')
+        start = time.time()
+        for cycle in range(num_cycles):
+            ts = start_ts + cycle * frequency_sec * 1000000
+            retention.run(ts)
+            for id in range(num_ids):
+                writer.insert('ops_node_cpu_util', ['node-%d' % id, ts, 
+                                                    cycle % 100])
+            writer.commit()
+        elapsed = time.time() - start
+        num_rows = connection.execute("select count(*) " + \
+                                          "from ops_node_cpu_util").fetchone()[0]
+        average = connection.execute("select avg(v) " + \
+                                         "from ops_node_cpu_util").fetchone()[0]
+        print "%s: %d rows after %d cycles (average %.2f) in %.2f sec" % \
+            (label, num_rows, num_cycles, average, elapsed)
@@ -0,0 +1,297 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2011-2014 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Statistics of the switch ports of the stitching edge points
+#
+# The parser of each configured port (e.g.
+# "parse_interface_stats.parse_interface_stats") is resolved to a
+# callable once, when the ports are loaded.  Each switch listed under
+# "switches" in the OpsMon config
+#
+#    "switches" : {"force10" : {"address" : "10.10.8.200", "user" : "admin",
+#                               "password" : "admin", "prompt" : "FTOS>"}}
+#
+# gets one persistent CLI session (switch_session.expect) which is kept
+# open across cycles; each cycle the "show int" commands for all the
+# ports of the switch
+#
+#    "ports" : {<port urn> : {"switch" : "force10", "interface" : "te 0/2",
+#                             "parser" : ..., "measurements" : [...]}}
+#
+# are sent as a single batch and the output of the batch is split by
+# port in one pass.  Ports configured only with a "command" (e.g.
+# stats.expect) still run that command each cycle.
+#
+# The raw output of each batch can be appended to a capture file
+# (one JSON line {"switch", "commands", "output"} per batch), and a
+# capture file can be replayed in place of the switches, so that the
+# parsing can be exercised offline:
+#
+#    python switch_stats.py opsmon_config.json --replay force10_capture.json
+
+import json
+import os
+import select
+import subprocess
+import time
+
+SESSION_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'switch_session.expect')
+
+COMMAND_MARKER = 'COMMAND '
+END_MARKER = 'END'
+
+_parsers = {}
+
+def resolve_parser(parser, parser_module=None):
+    """
+        Return the callable named by the dotted parser name, importing
+        its module (parser_module if given) the first time it is needed.
+    """
+    if parser in _parsers: return _parsers[parser]
+    module_name, function_name = parser.rsplit('.', 1)
+    if parser_module is not None: module_name = parser_module
+    module = __import__(module_name)
+    for name in module_name.split('.')[1:]:
+        module = getattr(module, name)
+    _parsers[parser] = getattr(module, function_name)
+    return _parsers[parser]
+
+
+def interface_command(interface):
+    return "show int %s" % interface
+
+
+def split_output(output):
+    """
+        Split the output of a batch into {command : [lines]}, 
+        in a single pass over its lines.
+    """
+    sections = {}
+    lines = None
+    for line in output.split('\n'):
+        line = line.rstrip('\r')
+        if line.startswith(COMMAND_MARKER):
+            lines = []
+            sections[line[len(COMMAND_MARKER):]] = lines
+        elif line == END_MARKER:
+            lines = None
+        elif lines is not None:
+            lines.append(line)
+    return sections
+
+
+class SwitchSession:
+    """
+        Persistent CLI session with one switch, run by the given command
+        (e.g. ['expect', SESSION_SCRIPT, address, user, password, prompt])
+    """
+    def __init__(self, command):
+        self._command = command
+        self._process = None
+        self._buffer = ''
+
+    def run(self, commands, timeout):
+        """
+            Run the batch of commands on the switch (logging in if need 
+            be) and return the raw output of the batch, or None if it 
+            failed or did not complete within timeout seconds.
+        """
+        deadline = time.time() + timeout
+        try:
+            if self._process is None:
+                self._process = subprocess.Popen(self._command,
+                                                 stdin=subprocess.PIPE,
+                                                 stdout=subprocess.PIPE)
+                if self._readUntil('READY', deadline) is None:
+                    self.stop()
+                    return None
+            self._process.stdin.write(';'.join(commands) + '\n')
+            self._process.stdin.flush()
+            output = self._readUntil(END_MARKER, deadline)
+        except (IOError, OSError), e:
+            print "Switch session failed: %s" % e
+            output = None
+        if output is None:
+            self.stop()
+        return output
+
+    def stop(self):
+        if self._process is None: return
+        try:
+            self._process.kill()
+            self._process.wait()
+        except OSError:
+            pass
+        self._process = None
+        self._buffer = ''
+
+    # Read up to and including the given line, or return None at the
+    # deadline or if the session exited
+    def _readUntil(self, last_line, deadline):
+        fd = self._process.stdout.fileno()
+        while True:
+            lines = self._buffer.split('\n')
+            for i in range(len(lines) - 1):
+                if lines[i].rstrip('\r') == last_line:
+                    output = '\n'.join(lines[:i+1]) + '\n'
+                    self._buffer = '\n'.join(lines[i+1:])
+                    return output
+            remaining = deadline - time.time()
+            if remaining <= 0: return None
+            readable, writable, errors = select.select([fd], [], [], remaining)
+            if not readable: continue
+            data = os.read(fd, 65536)
+            if not data: return None
+            self._buffer = self._buffer + data
+
+
+class ReplaySession:
+    """
+        Stands in for the session with a switch, returning the batches 
+        captured from that switch in turn and None once they are used up
+        (starting over would make the counters go backwards)
+    """
+    def __init__(self, capture_filename, switch_name):
+        self._outputs = []
+        for line in open(capture_filename):
+            record = json.loads(line)
+            if record['switch'] == switch_name:
+                self._outputs.append(str(record['output']))
+        self._index = 0
+
+    def run(self, commands, timeout):
+        if self._index >= len(self._outputs): return None
+        output = self._outputs[self._index]
+        self._index = self._index + 1
+        return output
+
+    def stop(self): pass
+
+
+class SwitchStats:
+    """
+        Statistics of the configured switch ports
+    """
+    def __init__(self, ports, switches, timeout=30, capture_filename=None,
+                 replay_filename=None):
+        self._timeout = timeout
+        self._capture_filename = capture_filename
+        self._parsers = {}
+        self._commands = {} # port urn => command
+        self._ports_by_switch = {} # switch name => [port urn]
+        for port_urn, port in ports.items():
+            self._parsers[port_urn] = \
+                resolve_parser(port['parser'], port.get('parser_module'))
+            if 'interface' in port:
+                self._commands[port_urn] = \
+                    interface_command(port['interface'])
+                switch_name = port['switch']
+                if switch_name not in self._ports_by_switch:
+                    self._ports_by_switch[switch_name] = []
+                self._ports_by_switch[switch_name].append(port_urn)
+            else:
+                self._commands[port_urn] = port['command']
+
+        self._sessions = {}
+        for switch_name in self._ports_by_switch:
+            if replay_filename is not None:
+                session = ReplaySession(replay_filename, switch_name)
+            else:
+                switch = switches[switch_name]
+                session = SwitchSession(['expect', SESSION_SCRIPT,
+                                         switch['address'], switch['user'],
+                                         switch['password'],
+                                         switch.get('prompt', 'FTOS>')])
+            self._sessions[switch_name] = session
+
+    def collect(self):
+        """
+            Return {port urn : parsed statistics} for the ports whose
+            statistics could be read this cycle.
+        """
+        stats = {}
+        for switch_name, port_urns in self._ports_by_switch.items():
+            commands = []
+            for port_urn in port_urns:
+                if self._commands[port_urn] not in commands:
+                    commands.append(self._commands[port_urn])
+            output = self._sessions[switch_name].run(commands, self._timeout)
+            if output is None:
+                print "No statistics from switch %s" % switch_name
+                continue
+            if self._capture_filename is not None:
+                self._capture(switch_name, commands, output)
+            sections = split_output(output)
+            for port_urn in port_urns:
+                command = self._commands[port_urn]
+                if command in sections:
+                    stats[port_urn] = self._parsers[port_urn](sections[command])
+
+        # Ports read by their own command
+        for port_urn, command in self._commands.items():
+            if isinstance(command, basestring): continue
+            try:
+                raw_stats = subprocess.check_output(command)
+            except (subprocess.CalledProcessError, OSError), e:
+                print "No statistics for port %s: %s" % (port_urn, e)
+                continue
+            stats[port_urn] = self._parsers[port_urn](raw_stats)
+        return stats
+
+    def stop(self):
+        for session in self._sessions.values(): session.stop()
+
+    def _capture(self, switch_name, commands, output):
+        record = {'switch' : switch_name, 'commands' : commands,
+                  'output' : output}
+        with open(self._capture_filename, 'a') as capture_file:
+            capture_file.write(json.dumps(record) + '\n')
+
+
+if __name__ == "__main__":
+    import optparse
+    import sys
+
+    parser = optparse.OptionParser(usage="%prog [options] config_filename")
+    parser.add_option("--capture", help="Append switch output to file")
+    parser.add_option("--replay", help="Replay captured switch output")
+    parser.add_option("--cycles", type="int", default=2,
+                      help="Number of collection cycles")
+    options, args = parser.parse_args()
+    if len(args) < 1:
+        parser.print_help()
+        sys.exit(1)
+
+    config = json.loads(open(args[0]).read())
+    switch_stats = SwitchStats(config['ports'], config.get('switches', {}),
+                               capture_filename=options.capture,
+                               replay_filename=options.replay)
+    for cycle in range(options.cycles):
+        start = time.time()
+        stats = switch_stats.collect()
+        elapsed = time.time() - start
+        for port_urn in sorted(stats):
+            print "%s: %s" % (port_urn, stats[port_urn])
+        print "Cycle %d: %d ports in %.3f sec" % (cycle, len(stats), elapsed)
+    switch_stats.stop()
@@ -0,0 +1,180 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2011-2014 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Differential sync of the OpsMon info tables
+#
+# Each cycle the populator computes the rows the info tables (slices,
+# slivers, users, authorities, nodes, interfaces, VLANs and the 
+# relations between them) should hold from the newest snapshot and its
+# configuration.  Rather than deleting and reinserting every row, the
+# rows are compared (by key, ignoring their timestamp) with those 
+# written in the previous cycle, and only the rows added, removed or
+# changed are written.  The timestamp of a row is thus the time the
+# object it describes appeared or last changed.
+#
+# The first sync after startup rewrites the tables entirely, since
+# they may hold rows from before the restart.
+
+
+class TableSync:
+    """
+        Keeps the rows last written to a set of tables and queues only
+        the differences with the rows of the current cycle on a
+        batch_writer.BatchWriter.
+    """
+    def __init__(self, writer):
+        self._writer = writer
+        self._specs = {} # table => (key_columns, key_indices, ts_index, related)
+        self._tables = [] # Tables in order added
+        self._previous_rows = None # table => {key : row} as last written
+        self._current_rows = {}
+
+    def addTable(self, table, key_columns, key_indices, ts_index=None, 
+                 related=[]):
+        """
+            Register a table whose rows are identified by the values at
+            key_indices (of columns key_columns), with a timestamp at
+            ts_index (if any).  related is a list of (table, column) 
+            whose rows referring to the key (of a single column) of a
+            removed row are deleted with it.
+        """
+        self._specs[table] = (key_columns, key_indices, ts_index, related)
+        self._tables.append(table)
+        self._current_rows[table] = {}
+
+    def add(self, table, row):
+        """
+            Add a row the table should hold this cycle
+        """
+        key_indices = self._specs[table][1]
+        key = tuple([row[index] for index in key_indices])
+        self._current_rows[table][key] = row
+
+    def sync(self):
+        """
+            Queue the changes since the last sync and start a new cycle.
+            Returns the numbers of rows (added, removed, changed).
+        """
+        if self._previous_rows is None:
+            counts = self._rewrite()
+        else:
+            counts = self._diff()
+        self._previous_rows = self._current_rows
+        self._current_rows = dict((table, {}) for table in self._tables)
+        return counts
+
+    # Queue deletion of all rows and insertion of the current rows
+    def _rewrite(self):
+        num_added = 0
+        for table in self._tables:
+            key_columns, key_indices, ts_index, related = self._specs[table]
+            rows = self._current_rows[table]
+            keys = [key[0] for key in rows.keys()]
+            for related_table, related_column in related:
+                if len(keys) == 0:
+                    self._writer.delete_all(related_table)
+                else:
+                    self._writer.execute("delete from %s where %s not in (%s)"\
+                                             % (related_table, related_column, 
+                                                ", ".join(['%s'] * len(keys))),
+                                         keys)
+            self._writer.delete_all(table)
+            for row in rows.values():
+                self._writer.insert(table, row)
+            num_added = num_added + len(rows)
+        return num_added, 0, 0
+
+    # Queue deletion of removed rows, insertion of added rows and 
+    # replacement of changed rows.  Unchanged rows keep their timestamp.
+    def _diff(self):
+        num_added = 0
+        num_removed = 0
+        num_changed = 0
+        for table in self._tables:
+            key_columns, key_indices, ts_index, related = self._specs[table]
+            previous_rows = self._previous_rows[table]
+            current_rows = self._current_rows[table]
+
+            for key, row in previous_rows.items():
+                if key not in current_rows:
+                    self._deleteRow(table, key)
+                    for related_table, related_column in related:
+                        self._writer.delete_where_in(related_table, 
+                                                     related_column, [key[0]])
+                    num_removed = num_removed + 1
+
+            for key, row in current_rows.items():
+                if key not in previous_rows:
+                    self._writer.insert(table, row)
+                    num_added = num_added + 1
+                elif self._withoutTimestamp(row, ts_index) != \
+                        self._withoutTimestamp(previous_rows[key], ts_index):
+                    self._deleteRow(table, key)
+                    self._writer.insert(table, row)
+                    num_changed = num_changed + 1
+                else:
+                    current_rows[key] = previous_rows[key]
+        return num_added, num_removed, num_changed
+
+    def _deleteRow(self, table, key):
+        key_columns = self._specs[table][0]
+        condition = " and ".join(["%s = %%s" % column \
+                                      for column in key_columns])
+        self._writer.execute("delete from %s where %s" % (table, condition),
+                             list(key))
+
+    # Compare values as strings: rows are written as text
+    def _withoutTimestamp(self, row, ts_index):
+        return [str(row[index]) for index in range(len(row)) \
+                    if index != ts_index]
+
+
+if __name__ == "__main__":
+    # Compare the rows written per cycle on a quiet rack by rewriting
+    # the tables and by the differential sync, against a SQLite stand-in
+    import sqlite3
+    import time
+    import batch_writer
+
+    connection = sqlite3.connect(':memory:')
+    connection.execute("create table ops_sliver (id, urn, ts, expires)")
+    connection.execute("create table ops_sliver_cpu (id, ts, value)")
+    writer = batch_writer.BatchWriter(connection, 'qmark')
+    sync = TableSync(writer)
+    sync.addTable('ops_sliver', ['id'], [0], 2, [('ops_sliver_cpu', 'id')])
+
+    def cycle(num_slivers, expires):
+        ts = int(time.time() * 1000000)
+        for i in range(num_slivers):
+            sync.add('ops_sliver', ['sliver-%d' % i, 'urn:sliver-%d' % i, 
+                                    ts, expires.get(i, -1)])
+        statements = writer.getMetrics()['statements']
+        counts = sync.sync()
+        writer.commit()
+        return counts, writer.getMetrics()['statements'] - statements
+
+    print "First cycle (added, removed, changed), statements:", cycle(2000, {})
+    print "Quiet cycle:", cycle(2000, {})
+    print "Renewed one sliver:", cycle(2000, {7 : 12345})
+    print "Deleted one sliver:", cycle(1999, {7 : 12345})
+    print "Rows:", connection.execute("select count(*) from ops_sliver").fetchone()[0]
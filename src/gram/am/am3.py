@@ -27,7 +27,6 @@ Invoked from gcf-am.py
 The GENI AM API is defined in the AggregateManager class.
 """
 
-import base64
 import collections
 import datetime
 import dateutil.parser
@@ -38,7 +37,6 @@ import time
 import traceback
 import uuid
 import xml.dom.minidom as minidom
-import zlib
 import re
 
 import gcf.geni
@@ -51,7 +49,7 @@ from gcf.geni.am.am3 import *
 from gram import config
 from gram import constants
 from gram.gram_manager import GramManager
-from gram.rspec_handler import generateAdvertisement
+from gram.rspec_handler import AdvertisementCache
 import gram.open_stack_interface
 
 class GramReferenceAggregateManager(ReferenceAggregateManager):
@@ -111,16 +109,25 @@ class GramReferenceAggregateManager(ReferenceAggregateManager):
             return ret
 
         stitching_state = self._gram_manager.getStitchingState()
-        result = generateAdvertisement(self._gram_manager._aggregate_urn, \
-                                           stitching_state)
-        
-        if 'geni_compressed' in options and options['geni_compressed']:
-            try:
-                result = base64.b64encode(zlib.compress(result))
-            except Exception, exc:
-                self.logger.error("Error compressing and encoding resource list")
-                
-        return self.successResult(result)
+        compressed = 'geni_compressed' in options and options['geni_compressed']
+        try:
+            result, version = AdvertisementCache.get( \
+                self._gram_manager._aggregate_urn, stitching_state, compressed)
+        except Exception, exc:
+            if not compressed: raise
+            self.logger.error("Error compressing and encoding resource list")
+            result, version = AdvertisementCache.get( \
+                self._gram_manager._aggregate_urn, stitching_state)
+
+        # Conditional request: the client already has this version
+        if 'gram_if_none_match' in options and \
+                options['gram_if_none_match'] == version:
+            ret_val = self.successResult('')
+            ret_val['output'] = 'Advertisement not modified'
+        else:
+            ret_val = self.successResult(result)
+        ret_val['gram_advertisement_version'] = version
+        return ret_val
 
     # The list of credentials are options - some single cred
     # must give the caller required permissions.
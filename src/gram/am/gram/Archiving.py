@@ -25,12 +25,14 @@
 # to/from files using JSON
 
 import datetime
+import os
 import time
 import json
 import pdb
 from resources import Slice, VirtualMachine, NetworkLink, NetworkInterface
 import stitching
 import config
+import snapshot_container
 from open_stack_interface import _execCommand
 from manage_ssh_proxy import SSHProxyTable, _addNewProxy
 import re
@@ -125,7 +127,6 @@ class GramJSONEncoder(json.JSONEncoder):
                     "os_version":o.getOSVersion(),
                     "vm_flavor":o.getVMFlavor(),
                     "host":o.getHost(),
-                    "last_status_update" : o.getLastStatusUpdate(),
                     "port":o.getSSHProxyLoginPort()
                     }
         
@@ -199,9 +200,15 @@ class GramJSONEncoder(json.JSONEncoder):
 
 # THis should create a JSON structure which is a list
 # of the JSON encoding of all slices and then all slivers
+# If config.snapshot_format is 'container', the objects of each slice
+# are instead written as a separate record of a snapshot container
+# (see snapshot_container.py)
+# The state is written to a temporary file which is renamed to filename
+# once complete, so readers never see a partly written snapshot
 def write_state(filename, gram_manager, slices, stitching_handler):
     #print "WS.CALL " + str(slices) + " " + filename
-    file = open(filename, "w")
+    temp_filename = filename + ".tmp"
+    file = open(temp_filename, "wb")
     objects = []
     for slice in slices.values(): 
         objects.append(slice)
@@ -220,9 +227,27 @@ def write_state(filename, gram_manager, slices, stitching_handler):
     # Save the SSH address/proxy table
     objects.append({"SSH_PROXY": SSHProxyTable._get()})
 
-    data = GramJSONEncoder(stitching_handler).encode(objects)
+    encoder = GramJSONEncoder(stitching_handler)
+    if config.snapshot_format == 'container':
+        # Everything after the slices and slivers (manager state, proxies)
+        other_objects = [json_object for json_object in objects \
+                             if isinstance(json_object, dict)]
+        slice_records = []
+        for slice in slices.values():
+            slivers = slice.getAllSlivers().values()
+            slice_records.append((slice.getSliceURN(), slice.getTenantUUID(),
+                                  [sliver.getSliverURN() for sliver in slivers],
+                                  encoder.encode([slice] + slivers)))
+        data = snapshot_container.encode_snapshot(slice_records,
+                                       encoder.encode(other_objects),
+                                       config.snapshot_compression_level)
+    else:
+        data = encoder.encode(objects)
     file.write(data)
+    file.flush()
+    os.fsync(file.fileno())
     file.close();
+    os.rename(temp_filename, filename)
 
 # Decode JSON representation of list of slices and associated slivers
 # Comes as a list of slices and slivers
@@ -323,10 +348,6 @@ class GramJSONDecoder:
                 vm.setRequestRspec(json_object["request_rspec"])
                 vm.setManifestRspec(json_object["manifest_rspec"])
                 vm.setHost(json_object['host'])
-                last_status_update = None
-                if 'last_status_update' in json_object:
-                    last_status_update = json_object['last_status_update']
-                vm.setLastStatusUpdate(last_status_update)
                 
                 # network_interfaces
                 self._network_interfaces_by_virtual_machine_urn[sliver_urn]  = \
@@ -456,11 +477,12 @@ class GramJSONDecoder:
                 link.addEndpoint(network_interface)
 
 def read_state(filename, gram_manager, stitching_handler):
-    file = open(filename, "r")
-    data = file.read()
-    file.close()
-    json_data = json.loads(data)
+    json_data = snapshot_container.load_objects(filename)
+    return restore_objects(json_data, gram_manager, stitching_handler)
 
+# Restore slices from a list of JSON-encoded objects in the form
+# written by write_state
+def restore_objects(json_data, gram_manager, stitching_handler):
     # This should be a list of JSON-enocded objects
     # Need to turn this into a list of objects
     # Resolve links among them
@@ -478,8 +500,16 @@ def read_state(filename, gram_manager, stitching_handler):
 
     slices = dict()
     decoder = GramJSONDecoder(stitching_handler)
+    # Slivers refer to their slice so decode all slices first
+    # (snapshots built from a journal interleave slices and slivers)
     for json_object in json_data: 
-        decoder.decode(json_object)
+        if isinstance(json_object, dict) and \
+                json_object.get("__type__") == "Slice":
+            decoder.decode(json_object)
+    for json_object in json_data: 
+        if not isinstance(json_object, dict) or \
+                json_object.get("__type__") != "Slice":
+            decoder.decode(json_object)
     decoder.resolve()
 
     
@@ -0,0 +1,256 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Asynchronous tracking of VM boots.
+#
+# VMs are booted without waiting for them to become ACTIVE.  Each boot
+# is registered with the BootTracker, which returns a BootFuture.  A
+# single poller thread periodically lists the status of all servers in
+# one call and resolves the futures of the VMs that have become ACTIVE,
+# gone into ERROR or timed out.  Boots that stop being tracked (the VM
+# was deleted) are resolved as CANCELLED.  The callbacks of resolved futures run on
+# a small fixed pool of completion threads, so the number of threads
+# does not grow with the number of VMs being booted.
+
+import Queue
+import threading
+import time
+
+import config
+
+# Results of a boot
+ACTIVE = 'ACTIVE'
+ERROR = 'ERROR'
+TIMEOUT = 'TIMEOUT'
+CANCELLED = 'CANCELLED'
+
+
+class BootFuture:
+    """
+        The eventual result (ACTIVE, ERROR, TIMEOUT or CANCELLED) of
+        booting a VM.
+    """
+    def __init__(self, vm_uuid, deadline):
+        self._vm_uuid = vm_uuid
+        self._deadline = deadline
+        self._result = None
+        self._callbacks = []
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+
+    def getVMUUID(self): return self._vm_uuid
+
+    def getResult(self): return self._result
+
+    def isDone(self): return self._event.isSet()
+
+    def succeeded(self): return self._result == ACTIVE
+
+    def wait(self, timeout=None):
+        """
+            Wait for the boot to finish and its callbacks to have run.
+            Returns the result, or None if the wait timed out.
+        """
+        self._event.wait(timeout)
+        return self._result
+
+    def addCallback(self, callback):
+        """
+            Have callback(future) called when the boot finishes.  Callbacks
+            run in the order they were added.  If the boot has already 
+            finished the callback is called right away.
+        """
+        with self._lock:
+            if self._result is None:
+                self._callbacks.append(callback)
+                return
+        self._runCallback(callback)
+
+    def _resolve(self, result):
+        with self._lock:
+            self._result = result
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            self._runCallback(callback)
+        self._event.set()
+
+    def _runCallback(self, callback):
+        try:
+            callback(self)
+        except Exception, e:
+            config.logger.error("Boot callback for VM %s failed: %s" % \
+                                    (self._vm_uuid, e))
+
+
+class BootTracker:
+    """
+        Tracks the VMs being booted.  list_function() returns a 
+        {vm_uuid : nova status} dictionary for all servers; it is called
+        from the poller thread every poll_interval seconds while there
+        are boots pending.
+    """
+    def __init__(self, list_function, poll_interval, boot_timeout,
+                 num_completion_workers):
+        self._list_function = list_function
+        self._poll_interval = poll_interval
+        self._boot_timeout = boot_timeout
+        self._condition = threading.Condition()
+        self._pending = {} # vm_uuid => BootFuture
+        self._completions = Queue.Queue()
+        self._num_polls = 0
+        self._stopped = False
+        self._threads = []
+        self._startThread(self._poll)
+        for i in range(max(1, num_completion_workers)):
+            self._startThread(self._complete)
+
+    def track(self, vm_uuid):
+        """
+            Start tracking the boot of the VM with the given uuid.
+            Returns the BootFuture for the boot.
+        """
+        future = BootFuture(vm_uuid, time.time() + self._boot_timeout)
+        with self._condition:
+            self._pending[vm_uuid] = future
+            if len(self._pending) == 1:
+                self._condition.notify()
+        return future
+
+    def forget(self, vm_uuid):
+        """
+            Stop tracking the boot of a VM (e.g. because it has been
+            deleted).  Its future is resolved as CANCELLED.
+        """
+        with self._condition:
+            future = self._pending.pop(vm_uuid, None)
+        if future is not None:
+            self._completions.put((future, CANCELLED))
+
+    def getNumPending(self):
+        with self._condition:
+            return len(self._pending)
+
+    def getNumPolls(self): return self._num_polls
+
+    def _startThread(self, target):
+        worker = threading.Thread(target=target)
+        worker.setDaemon(True)
+        worker.start()
+        self._threads.append(worker)
+
+    def stop(self):
+        """
+            Stop the poller and completion threads.  Pending boots are
+            resolved as CANCELLED.
+        """
+        with self._condition:
+            self._stopped = True
+            pending = self._pending.values()
+            self._pending = {}
+            self._condition.notify()
+        for future in pending:
+            self._completions.put((future, CANCELLED))
+        for i in range(len(self._threads) - 1):
+            self._completions.put(None)
+        for worker in self._threads:
+            worker.join()
+
+    def _poll(self):
+        while True:
+            with self._condition:
+                while len(self._pending) == 0 and not self._stopped:
+                    self._condition.wait()
+                if not self._stopped:
+                    self._condition.wait(self._poll_interval)
+                if self._stopped: return
+
+            try:
+                statuses = self._list_function()
+            except Exception, e:
+                config.logger.error("Failed to list VM status: %s" % e)
+                statuses = {}
+            self._num_polls = self._num_polls + 1
+
+            now = time.time()
+            resolved = []
+            with self._condition:
+                for vm_uuid, future in self._pending.items():
+                    status = statuses.get(vm_uuid)
+                    if status == ACTIVE or status == ERROR:
+                        resolved.append((future, status))
+                    elif now > future._deadline:
+                        resolved.append((future, TIMEOUT))
+                for future, result in resolved:
+                    del self._pending[future.getVMUUID()]
+            for future, result in resolved:
+                if result != ACTIVE:
+                    config.logger.error("Boot of VM %s finished with %s" % \
+                                            (future.getVMUUID(), result))
+                self._completions.put((future, result))
+
+    def _complete(self):
+        while True:
+            completion = self._completions.get()
+            if completion is None: return
+            future, result = completion
+            future._resolve(result)
+
+
+if __name__ == "__main__":
+    import logging
+    import random
+    logging.basicConfig()
+    config.logger.setLevel(logging.CRITICAL)
+
+    # 100 VMs that become ACTIVE (or ERROR) after a random number of polls
+    num_vms = 100
+    boot_times = {}
+    for i in range(num_vms):
+        boot_times['vm-%d' % i] = time.time() + random.uniform(0.05, 0.5)
+    def list_statuses():
+        now = time.time()
+        statuses = {}
+        for vm_uuid, boot_time in boot_times.items():
+            if vm_uuid == 'vm-13' : statuses[vm_uuid] = ERROR
+            elif now < boot_time: statuses[vm_uuid] = 'BUILD'
+            else: statuses[vm_uuid] = ACTIVE
+        return statuses
+
+    tracker = BootTracker(list_statuses, 0.05, 5, 2)
+    done = []
+    start = time.time()
+    futures = [tracker.track(vm_uuid) for vm_uuid in boot_times.keys()]
+    for future in futures:
+        future.addCallback(lambda f: done.append(f.getResult()))
+    for future in futures:
+        future.wait()
+    print "%d VMs booted (%d failed) in %.2f sec with %d list calls and %d threads" % \
+        (len(done), done.count(ERROR), time.time() - start, 
+         tracker.getNumPolls(), threading.activeCount())
+
+    # A boot that is forgotten (the VM was deleted) is cancelled
+    future = tracker.track('deleted-vm')
+    tracker.forget('deleted-vm')
+    print "Forgotten boot: %s" % future.wait(5)
+    tracker.stop()
@@ -0,0 +1,251 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Detection of the end of VM boots from their console logs.
+#
+# Some images (those with a 'boot_complete_msg' in
+# config.disk_image_metadata) print a known message on the console when
+# they have finished booting.  The BootWatcher watches the console logs of
+# such VMs from a single background thread.  Each poll fetches only the
+# tail (the last tail_lines lines) of a log.  For each VM the watcher
+# remembers the end of the output it has already scanned: if that is not
+# in the tail, more output than the tail was added since and the tail is
+# fetched again, twice as long.  Only the output added since the last
+# poll is searched, so the message is found wherever it appears in the
+# log.  A VM is watched until the message is seen (the VM becomes ready)
+# or the timeout expires (the VM has failed).
+
+import threading
+import time
+
+import config
+import constants
+
+
+class WatchedVM:
+    def __init__(self, vm_object, boot_complete_msg, deadline):
+        self._vm_object = vm_object
+        self._boot_complete_msg = boot_complete_msg
+        self._deadline = deadline
+        self._scanned_end = None # End of the output already scanned
+
+
+class BootWatcher:
+    """
+        console_log_function(vm_uuid, length) returns the last length
+        lines of the console log of the VM (the whole log if it is 
+        shorter); it may raise an exception.
+    """
+    # Characters at the end of the scanned output that are looked for
+    # in the next tail (at least the length of the message)
+    SCANNED_END_LENGTH = 256
+
+    def __init__(self, console_log_function, poll_interval, timeout,
+                 tail_lines):
+        self._console_log_function = console_log_function
+        self._poll_interval = poll_interval
+        self._timeout = timeout
+        self._tail_lines = tail_lines
+        self._condition = threading.Condition()
+        self._watched = {} # vm_uuid => WatchedVM
+        self._stopped = False
+        self._num_fetches = 0
+        self._num_bytes_fetched = 0
+        self._num_bytes_scanned = 0
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def watch(self, vm_object, boot_complete_msg):
+        """
+            Start watching the console log of the VM for the message.
+            The VM is notready until the message is seen.
+        """
+        vm_uuid = vm_object.getUUID()
+        with self._condition:
+            if vm_uuid in self._watched: return
+            vm_object.setOperationalState(constants.notready)
+            self._watched[vm_uuid] = \
+                WatchedVM(vm_object, boot_complete_msg,
+                          time.time() + self._timeout)
+            self._condition.notify()
+
+    def unwatch(self, vm_uuid):
+        with self._condition:
+            if vm_uuid in self._watched:
+                del self._watched[vm_uuid]
+
+    def isWatching(self, vm_uuid):
+        with self._condition:
+            return vm_uuid in self._watched
+
+    def getMetrics(self):
+        with self._condition:
+            return {'watched' : len(self._watched),
+                    'fetches' : self._num_fetches,
+                    'bytes_fetched' : self._num_bytes_fetched,
+                    'bytes_scanned' : self._num_bytes_scanned}
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while len(self._watched) == 0 and not self._stopped:
+                    self._condition.wait()
+                if not self._stopped:
+                    self._condition.wait(self._poll_interval)
+                if self._stopped: return
+                watched = self._watched.items()
+
+            for vm_uuid, watched_vm in watched:
+                self._check(vm_uuid, watched_vm)
+
+    def _check(self, vm_uuid, watched_vm):
+        vm_object = watched_vm._vm_object
+        try:
+            found = self._scanNewOutput(vm_uuid, watched_vm)
+        except Exception, e:
+            config.logger.error("Failed to get console log %s: %s" % \
+                                    (vm_uuid, e))
+            found = False
+
+        with self._condition:
+            if self._watched.get(vm_uuid) is not watched_vm:
+                return # No longer watched
+            if found:
+                config.logger.info("VM %s finished booting" % \
+                                       vm_object.getName())
+                vm_object.setOperationalState(constants.ready)
+                del self._watched[vm_uuid]
+            elif time.time() > watched_vm._deadline:
+                config.logger.error("VM %s did not finish booting in %d sec" % \
+                                        (vm_object.getName(), self._timeout))
+                vm_object.setOperationalState(constants.failed)
+                del self._watched[vm_uuid]
+
+    # Fetch the tail of the console log holding the output added since
+    # the last poll and search that output for the message
+    def _scanNewOutput(self, vm_uuid, watched_vm):
+        msg = watched_vm._boot_complete_msg
+        length = self._tail_lines
+        while True:
+            log = self._console_log_function(vm_uuid, length)
+            with self._condition:
+                self._num_fetches = self._num_fetches + 1
+                self._num_bytes_fetched = self._num_bytes_fetched + len(log)
+            whole_log = len(log.splitlines()) < length
+            start = 0
+            if watched_vm._scanned_end:
+                position = log.find(watched_vm._scanned_end)
+                if position >= 0:
+                    # Rescan the end of the old output in case the 
+                    # message straddles the two polls
+                    start = max(0, position + \
+                                    len(watched_vm._scanned_end) - \
+                                    (len(msg) - 1))
+                elif not whole_log:
+                    # More new output than the tail holds
+                    length = length * 2
+                    continue
+                # Otherwise the log was truncated (e.g. the VM rebooted)
+            break
+
+        with self._condition:
+            self._num_bytes_scanned = self._num_bytes_scanned + \
+                len(log) - start
+        watched_vm._scanned_end = \
+            log[-max(BootWatcher.SCANNED_END_LENGTH, len(msg)):]
+        return log.find(msg, start) >= 0
+
+
+class FakeConsoleLogSource:
+    """
+        Console logs held in memory, for exercising the BootWatcher 
+        without nova.  Call as console_log_function.
+    """
+    def __init__(self):
+        self._logs = {}
+        self._lock = threading.Lock()
+        self._num_calls = 0
+
+    def append(self, vm_uuid, text):
+        with self._lock:
+            self._logs[vm_uuid] = self._logs.get(vm_uuid, '') + text
+
+    def reset(self, vm_uuid):
+        with self._lock:
+            self._logs[vm_uuid] = ''
+
+    def getNumCalls(self): return self._num_calls
+
+    def __call__(self, vm_uuid, length):
+        with self._lock:
+            self._num_calls = self._num_calls + 1
+            if vm_uuid not in self._logs:
+                raise Exception('No such VM %s' % vm_uuid)
+            return ''.join(self._logs[vm_uuid].splitlines(True)[-length:])
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig()
+    config.logger.setLevel(logging.CRITICAL)
+
+    class FakeVM:
+        def __init__(self, uuid): 
+            self._uuid = uuid
+            self._state = None
+        def getUUID(self): return self._uuid
+        def getName(self): return self._uuid
+        def setOperationalState(self, state): self._state = state
+
+    msg = 'cloud-init boot finished at'
+    source = FakeConsoleLogSource()
+    watcher = BootWatcher(source, 0.02, 1, 10)
+    vms = [FakeVM('vm-%d' % i) for i in range(20)]
+    for vm in vms:
+        source.append(vm.getUUID(), '')
+        watcher.watch(vm, msg)
+
+    # Each VM logs 50 lines; most print the message (split between
+    # two writes for some, followed by more output for all)
+    for line in range(50):
+        for i in range(len(vms)):
+            text = '[%5d.000] line %d of boot output\n' % (line, line)
+            if line == 40 and i != 7:
+                if i % 2: text = text + msg[:10]
+                else: text = text + msg + ' 12:00\n'
+            if line == 41 and i % 2: text = msg[10:] + ' 12:00\n' + text
+            source.append(vms[i].getUUID(), text)
+        time.sleep(0.005)
+    time.sleep(1.2)
+    states = [vm._state for vm in vms]
+    print "%d ready, %d failed after %d console-log calls; metrics = %s" % \
+        (states.count(constants.ready), states.count(constants.failed),
+         source.getNumCalls(), watcher.getMetrics())
+    watcher.stop()
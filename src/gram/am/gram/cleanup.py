@@ -28,6 +28,7 @@ import sys
 import time
 
 import config
+import cli_output
 import open_stack_interface
 import manage_ssh_proxy
 import optparse
@@ -60,7 +61,7 @@ for slice in slices:
     # Figure out the uuid of this tenant
     cmd_string = 'keystone tenant-list' 
     print cmd_string
-    output = open_stack_interface._execCommand(cmd_string)
+    output = open_stack_interface._execTableCommand(cmd_string)
     tenant_uuid = open_stack_interface._getUUIDByName(output, tenant_name)
     if tenant_uuid == None :
         # Tenant does not exist.  Exit!
@@ -70,7 +71,7 @@ for slice in slices:
     # Figure out the uuid of the tenant admin
     cmd_string = 'keystone user-list'
     print cmd_string
-    output = open_stack_interface._execCommand(cmd_string)
+    output = open_stack_interface._execTableCommand(cmd_string)
     tenant_admin_uuid = open_stack_interface._getUUIDByName(output,
                                                             tenant_admin)
     if tenant_admin_uuid == None :
@@ -88,29 +89,24 @@ for slice in slices:
     output = open_stack_interface._execCommand(cmd_string)
 
     # Delete the VMs
-    output_lines = output.split('\n')
-    for i in range(3, len(output_lines) - 2) :
-        columns = output_lines[i].split('|')
-        vm_uuid = columns[1]
+    for columns in cli_output.parseTable(output).getRows() :
+        vm_uuid = columns[0]
         cmd_string = 'nova delete %s' % vm_uuid
         print cmd_string
         open_stack_interface._execCommand(cmd_string)
 
         # Delete the SSH Proxy assoicated with the VM
-        cntrlNet = columns[4].split('=')
+        cntrlNet = columns[3].split('=')
         net_str_length = len(cntrlNet)
         if net_str_length >= 2 :
             control_nic_ipaddr = cntrlNet[net_str_length - 1].strip()
             manage_ssh_proxy._removeProxy(control_nic_ipaddr)
 
     # Find all ports of this tenant
-    ports_cmd_string = '%sport-list -- --tenant_id=%s' % \
+    ports_cmd_string = '%s port-list -- --tenant_id=%s' % \
         (config.network_type, tenant_uuid)
-    ports_output = open_stack_interface._execCommand(ports_cmd_string)
-    port_lines = ports_output.split('\n')
-    for i in range(3, len(port_lines)-2):
-        port_columns = port_lines[i].split('|')
-        port_id = port_columns[1].strip()
+    ports_output = open_stack_interface._execTableCommand(ports_cmd_string)
+    for port_id in ports_output.getColumn('id'):
         try:
             delete_port_cmd = '%s port-delete %s' % \
                 (config.network_type, port_id)
@@ -127,11 +123,8 @@ for slice in slices:
     cmd_string = '%s net-list -- --tenant_id %s' % \
         (config.network_type, tenant_uuid)
     print cmd_string
-    net_list_output = open_stack_interface._execCommand(cmd_string)
-    net_list_output_lines = net_list_output.split('\n')
-    for i in range(3, len(net_list_output_lines) - 2) :
-        columns = net_list_output_lines[i].split('|')
-        net_uuid = columns[1]
+    net_list_output = open_stack_interface._execTableCommand(cmd_string)
+    for net_uuid in net_list_output.getColumn('id') :
         cmd_string = '%s net-delete %s' % (config.network_type, net_uuid)
         print cmd_string
         open_stack_interface._execCommand(cmd_string)
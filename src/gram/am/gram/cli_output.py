@@ -0,0 +1,249 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Parsing of the output of the OpenStack command line clients.
+#
+# The CLIs print their results either as ASCII tables
+#
+#    +----+---------------------+
+#    | ID | Hypervisor hostname |
+#    +----+---------------------+
+#    | 3  | compute1            |
+#    +----+---------------------+
+#
+# or, for the clients built on cliff (quantum/neutron) when asked with
+# '-f json', as JSON.  Both are turned into a CLITable.
+#
+# The table tokenizer works in a single pass: the column boundaries are
+# taken once from the first border line and every row is sliced at those
+# positions, so cells containing '|' are not split.  Rows whose first
+# column is blank continue the cells of the previous row (multi-line cells).
+
+import json
+import re
+
+
+class CLITable:
+    """
+        Rows and columns of a CLI result.  The headers are the column
+        names; each row is a list of cell strings.
+    """
+    def __init__(self, headers, rows):
+        self._headers = headers
+        self._rows = rows
+        self._column_index = dict((headers[i], i) for i in range(len(headers)))
+
+    def getHeaders(self): return self._headers
+
+    def getRows(self): return self._rows
+
+    def __len__(self): return len(self._rows)
+
+    def hasColumn(self, header):
+        return header in self._column_index
+
+    def getColumn(self, header):
+        """
+            Return the list of values in the column with the given header,
+            or an empty list if there is no such column.
+        """
+        if header not in self._column_index: return []
+        index = self._column_index[header]
+        return [row[index] for row in self._rows]
+
+    def getColumns(self):
+        """
+            Return {header : list of column values} for all columns.
+        """
+        return dict((header, self.getColumn(header)) \
+                        for header in self._headers)
+
+    def getDicts(self):
+        """
+            Return the rows as a list of {header : value} dictionaries.
+        """
+        return [dict(zip(self._headers, row)) for row in self._rows]
+
+    def getValueByPropertyName(self, property_name):
+        """
+            For two column Property/Value (or Field/Value) tables
+            returned by show and create commands, return the value of
+            the given property.  Returns None if there is no such property.
+        """
+        for row in self._rows:
+            if len(row) > 1 and row[0] == property_name:
+                return row[1]
+        # Not a property name: match it as a word anywhere in a row,
+        # as the original line-based lookup did
+        pattern = re.compile(r'\b' + re.escape(property_name) + r'\b')
+        for row in self._rows:
+            if len(row) > 1 and pattern.search(' '.join(row)):
+                return row[1]
+        return None
+
+    def getUUIDByName(self, name):
+        """
+            For list tables whose first column holds the uuids of the
+            objects listed, return the uuid of the first row that names
+            the given object.  Returns None if there is no such row.
+        """
+        pattern = re.compile(r'\b' + re.escape(name) + r'\b')
+        for row in self._rows:
+            if len(row) > 0 and name in row[1:]:
+                return row[0]
+        for row in self._rows:
+            if len(row) > 0 and pattern.search(' '.join(row)):
+                return row[0]
+        return None
+
+
+def parseTable(output):
+    """
+        Parse an ASCII table into a CLITable.  Returns an empty table if
+        the output has no table in it.
+    """
+    # Column positions are in characters, not bytes
+    encoded = False
+    if isinstance(output, str):
+        try:
+            output = output.decode('utf-8')
+            encoded = True
+        except UnicodeDecodeError:
+            pass
+    lines = output.split('\n')
+
+    # Find the first border line and compute the column boundaries
+    # (the positions of the '+' characters) from it
+    border_index = None
+    for i in range(len(lines)):
+        if lines[i].startswith('+'):
+            border_index = i
+            break
+    if border_index is None:
+        return CLITable([], [])
+    border = lines[border_index].rstrip()
+    bounds = [pos for pos in range(len(border)) if border[pos] == '+']
+    spans = [(bounds[i] + 1, bounds[i+1]) for i in range(len(bounds) - 1)]
+
+    headers = None
+    rows = []
+    for line in lines[border_index + 1:]:
+        if not line.startswith('|'):
+            # Border line (or trailing text after the table)
+            continue
+        cells = [line[start:end].strip() for start, end in spans]
+        if encoded:
+            cells = [cell.encode('utf-8') for cell in cells]
+        if headers is None:
+            headers = cells
+        elif cells[0] == '' and len(rows) > 0:
+            # Continuation line of a multi-line cell
+            previous = rows[-1]
+            for i in range(len(cells)):
+                if cells[i] != '':
+                    if previous[i] != '':
+                        previous[i] = previous[i] + '\n' + cells[i]
+                    else:
+                        previous[i] = cells[i]
+        else:
+            rows.append(cells)
+
+    if headers is None:
+        return CLITable([], [])
+    return CLITable(headers, rows)
+
+
+def _valueToString(value):
+    if value is None: return ''
+    if isinstance(value, unicode): return value.encode('utf-8')
+    if isinstance(value, str): return value
+    if isinstance(value, bool): return str(value)
+    if isinstance(value, (int, long, float)): return str(value)
+    return json.dumps(value)
+
+
+def parseJSON(output):
+    """
+        Parse the '-f json' output of a cliff based client into a
+        CLITable.  List commands produce a list of row dictionaries.
+        Show/create commands produce either a dictionary or a list of
+        {'Field', 'Value'} dictionaries; those become two column
+        Field/Value tables.
+    """
+    data = json.loads(output)
+    if isinstance(data, dict):
+        rows = [[_valueToString(key), _valueToString(value)] \
+                    for key, value in data.items()]
+        return CLITable(['Field', 'Value'], rows)
+
+    if len(data) == 0:
+        return CLITable([], [])
+    headers = []
+    for item in data:
+        for key in item.keys():
+            key = _valueToString(key)
+            if key not in headers: headers.append(key)
+    if set(headers) == set(['Field', 'Value']):
+        headers = ['Field', 'Value']
+    rows = [[_valueToString(item.get(header)) for header in headers] \
+                for item in data]
+    return CLITable(headers, rows)
+
+
+def parseOutput(output):
+    """
+        Parse CLI output which is either JSON or an ASCII table.
+    """
+    stripped = output.lstrip()
+    if stripped.startswith('[') or stripped.startswith('{'):
+        return parseJSON(stripped)
+    return parseTable(output)
+
+
+if __name__ == "__main__":
+    import time
+
+    table = """+--------------------------------------+---------+------------+
+| id                                   | name    | fixed_ips  |
++--------------------------------------+---------+------------+
+| 1d2a6e7d-6a3f-4a1f-8c2a-8b9f8ab0c6d1 | foo|bar | 10.0.1.3   |
+|                                      |         | 10.0.2.3   |
+| 5e5a2b0c-0e43-4b16-b7e7-2b0a7e7d9c11 | baz     | 10.0.3.3   |
++--------------------------------------+---------+------------+
+"""
+    parsed = parseTable(table)
+    print "COLUMNS = %s" % parsed.getColumns()
+    print "UUID(baz) = %s" % parsed.getUUIDByName('baz')
+    print "JSON = %s" % \
+        parseOutput('[{"id": "abc", "name": "net1"}]').getColumns()
+
+    # Parse a large tenant list
+    rows = ["| %036d | %-11s | True    |" % (i, 'tenant-%d' % i) \
+                for i in range(5000)]
+    border = "+" + "-" * 38 + "+" + "-" * 13 + "+" + "-" * 9 + "+"
+    header = "| %-36s | %-11s | enabled |" % ('id', 'name')
+    big_table = "\n".join([border, header, border] + rows + [border, ""])
+    start = time.time()
+    parsed = parseTable(big_table)
+    ids = parsed.getColumn('id')
+    print "Parsed %d rows in %.3f sec" % (len(ids), time.time() - start)
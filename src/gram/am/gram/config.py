@@ -68,6 +68,7 @@ aggregate_id = " "
 
 allocation_expiration_minutes =  10      # allocations expire in 10 mins
 lease_expiration_minutes =  7 * 24 * 60  # resources can be leased for 7 days
+expiry_check_interval = 10 # Seconds between checks for expired leases (at most)
 
 # Aggregate Manager software related configuration
 logger = logging.getLogger('gcf.am3.gram')
@@ -77,6 +78,68 @@ gram_snapshot_directory = '/etc/gram/snapshots' # Directory of snapshots
 recover_from_snapshot = "" # Specific file from which to recover 
 recover_from_most_recent_snapshot = True # Should we restore from most recent
 snapshot_maintain_limit = 10 # Remove all snapshots earlier than this #
+snapshot_max_age_hours = 0 # Remove snapshots older than this (0 for no limit)
+snapshot_max_total_mb = 0 # Remove oldest snapshots beyond this total size (0 for no limit)
+snapshot_format = 'container' # 'container' (compressed, indexed by slice) or 'json'
+snapshot_compression_level = 6 # zlib level (1-9) of the records of container snapshots
+
+# Parameters regarding the journal of per-slice changes kept next to the
+# most recent snapshot (instead of writing a full snapshot on every change)
+snapshot_journal = True # Journal changes rather than write full snapshots
+snapshot_journal_compact_records = 500 # Write a new full snapshot after this many journal records
+snapshot_journal_fsync_interval = 1.0 # Seconds between fsyncs of the journal
+persist_in_background = True # Persist state from a writer thread, not the request threads
+persist_coalesce_window = 0.5 # Seconds to gather changes into one write
+persist_flush_timeout = 30.0 # Seconds to wait for pending writes on shutdown
+persist_retry_backoff = 1.0 # Seconds before retrying a failed write (doubled on each failure)
+persist_max_retry_backoff = 60.0 # Maximum seconds between retries of a failed write
+
+# Maximum number of OpenStack operations (network, port and VM creations)
+# run concurrently while provisioning a slice
+provisioning_max_workers = 10
+
+# Maximum number of OpenStack delete operations run concurrently while
+# deleting slivers and slices (across all slices being deleted)
+deletion_max_workers = 10
+deletion_retries = 2 # Times a failed OpenStack delete operation is retried
+deletion_retry_delay = 2.0 # Seconds before the first retry (doubled after each)
+
+# Startup reconciliation of the restored slices with OpenStack
+reconcile_in_background = True # Serve requests while reconciling (those changing unreconciled slices wait)
+reconcile_max_workers = 8 # Maximum number of OpenStack listings run concurrently while reconciling
+
+# Whether Provision returns as soon as nova has accepted the VM boot
+# requests (leaving the VMs configuring) rather than waiting for the boots
+async_vm_boot = True
+
+# VM boots are tracked by a single poller that lists the status of all
+# servers at this interval (seconds)
+vm_boot_poll_interval = 5
+
+# Seconds after which a VM that has not become ACTIVE is considered failed
+vm_boot_timeout = 1200
+
+# Number of threads that complete the set up of booted VMs
+# (floating IPs, SSH proxy)
+vm_boot_completion_workers = 4
+
+# Seconds for which the listing of the status of all VMs used by
+# Status and Describe is reused before nova is asked again
+server_status_cache_ttl = 2
+
+# VMs of images with a 'boot_complete_msg' (see disk_image_metadata) are
+# ready once the message is in their console log.  The logs of booting VMs
+# are read at this interval (seconds)...
+boot_watch_poll_interval = 5
+# ...until the message is seen or this many seconds have passed (failed)
+boot_watch_timeout = 1800
+# Lines at the end of a console log fetched per poll (more are fetched
+# if the log has grown by more since the last poll)
+boot_watch_tail_lines = 50
+
+# XML library used to read request RSpecs and write manifests:
+# 'etree' (faster, smaller) or 'minidom'.  Both produce the same manifests.
+rspec_backend = 'etree'
 
 # File where GRAM stores the subnet number for the last allocated sub-net
 # This is used in resources.py.  This file is temporary.  It should not be
@@ -104,6 +167,9 @@ vmoc_interface_port = 7001
 
 # Should GRAM automatically register slices with VMOC?
 vmoc_slice_autoregister = True # Set to False to disable GRAM/VMOC interface
+vmoc_retry_interval = 5 # Seconds between attempts to (re)connect to VMOC
+vmoc_max_batch_size = 100 # Maximum slice changes sent to VMOC in one message
+vmoc_max_unacked_batches = 8 # Messages sent to VMOC ahead of acknowledgements
 
 # Variables for VMOC/GRAM switch behavior/configuration
 vmoc_set_vlan_on_untagged_packet_out = False
@@ -189,6 +255,16 @@ os_no_cache = 1
 service_token = None
 service_endpoint = "http://localhost:35357/v2.0"
 
+# Backend used by open_stack_interface to issue OpenStack operations:
+#   'cli'  : fork the nova/neutron/keystone/glance command line clients
+#   'rest' : use the in-process REST client (open_stack_client) which
+#            caches keystone tokens and keeps connections to the services open
+openstack_api_backend = "cli"
+
+# Whether to ask the quantum/neutron clients for JSON output ('-f json')
+# rather than parsing their ASCII tables
+cli_structured_output = True
+
 # Installation configuration
 network_type = "quantum"
 openstack_type = "grizzly"
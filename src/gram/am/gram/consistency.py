@@ -26,6 +26,7 @@
 # check on open_stack consistency
 
 import config
+import cli_output
 import open_stack_interface as osi
 from compute_node_interface import compute_node_command, ComputeNodeInterfaceHandler
 
@@ -34,43 +35,23 @@ def check_openstack_consistency():
     tenants = {}
     command_string = "keystone tenant-list"
     output = osi._execCommand(command_string)
-    output_lines = output.split('\n')
-    for i in range(3, len(output_lines)-2):
-        line = output_lines[i]
-        parts = line.split('|')
-        tenant_id = parts[1].strip()
-        name = parts[2].strip()
+    for row in cli_output.parseTable(output).getRows():
+        tenant_id = row[0]
+        name = row[1]
         tenants[tenant_id] = name
 
     # Get all VM's
-    vms = []
     command_string = 'nova list --all-tenants'
     output = osi._execCommand(command_string)
-    output_lines = output.split('\n')
-    for i in range(3, len(output_lines)-2):
-        line = output_lines[i]
-        parts = line.split('|')
-        vms.append(parts[1].strip())
+    vms = cli_output.parseTable(output).getColumn('ID')
 
     # Get all ports
-    ports = []
     command_string = '%s port-list' % config.network_type
-    output = osi._execCommand(command_string)
-    output_lines = output.split('\n')
-    for i in range(3, len(output_lines)-2):
-        line = output_lines[i]
-        parts = line.split('|')
-        ports.append(parts[1].strip())
+    ports = osi._execTableCommand(command_string).getColumn('id')
 
     # Get all nets
-    nets = []
-    command_string = 'net-list' % config.network_type
-    output = osi._execCommand(command_string)
-    output_lines = output.split('\n')
-    for i in range(3, len(output_lines)-2):
-        line = output_lines[i]
-        parts = line.split('|')
-        nets.append(parts[1].strip())
+    command_string = '%s net-list' % config.network_type
+    nets = osi._execTableCommand(command_string).getColumn('id')
 
     print "Checking that all NOVA VM's have a valid tenant ID"
 
@@ -78,17 +59,11 @@ def check_openstack_consistency():
     for vm in vms:
         command_string = 'nova show %s' % vm
         output = osi._execCommand(command_string)
-        output_lines = output.split('\n')
         tenant_name = '***'
-        matching_tenant_id = None
-        for i in range(3, len(output_lines)-2):
-            line = output_lines[i]
-            parts = line.split('|')
-            if parts[1].strip() == 'tenant_id':
-                tenant_id = parts[2].strip()
-                if tenants.has_key(tenant_id):
-                    tenant_name = tenants[tenant_id]
-                    break
+        tenant_id = cli_output.parseTable(output).getValueByPropertyName( \
+            'tenant_id')
+        if tenants.has_key(tenant_id):
+            tenant_name = tenants[tenant_id]
         print "VM " + vm + " " + str(tenant_id) + " " + str(tenant_name)
 
 
@@ -96,18 +71,11 @@ def check_openstack_consistency():
     print "Checking that all network ports have a valid tenant ID"
     for port in ports:
         command_string = '%s port-show %s' % (config.network_type, port)
-        output = osi._execCommand(command_string)
-        output_lines = output.split('\n')
-        tenant_id = ''
-        for i in range(3, len(output_lines)-2):
-            line = output_lines[i]
-            parts = line.split('|')
-            if parts[1].strip() == 'tenant_id':
-                tenant_id = parts[2].strip()
-                tenant_name = '***'
-                if tenants.has_key(tenant_id): 
-                    tenant_name = tenants[tenant_id]
-                break
+        output = osi._execTableCommand(command_string)
+        tenant_id = output.getValueByPropertyName('tenant_id') or ''
+        tenant_name = '***'
+        if tenants.has_key(tenant_id): 
+            tenant_name = tenants[tenant_id]
         print "PORT " + port + " " + tenant_id + " " + str(tenant_name)
     
 
@@ -115,19 +83,12 @@ def check_openstack_consistency():
     print "Checking that all network nets have a valid tenant ID"
     for net in nets:
         command_string = '%s net-show %s' % (config.network_type, net)
-        output = osi._execCommand(command_string)
-        output_lines = output.split('\n')
-        tenant_id = ''
-        for i in range(3, len(output_lines)-2):
-            line = output_lines[i]
-            parts = line.split('|')
-            if parts[1].strip() == 'tenant_id':
-                tenant_id = parts[2].strip()
-                tenant_name = '***'
-                if tenants.has_key(tenant_id):
-                    tenant_name = tenants[tenant_id]
-                break
-        print "NET " + port + " " + tenant_id + " " + str(tenant_name)
+        output = osi._execTableCommand(command_string)
+        tenant_id = output.getValueByPropertyName('tenant_id') or ''
+        tenant_name = '***'
+        if tenants.has_key(tenant_id):
+            tenant_name = tenants[tenant_id]
+        print "NET " + net + " " + tenant_id + " " + str(tenant_name)
 
 # Check that all ports defined on br-int switches are
 # associated with quantum/neutron ports
@@ -0,0 +1,362 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+
+# Concurrent deletion of the OpenStack resources of slices.
+#
+# The OpenStack operations that tear down (part of) a slice make up a
+# teardown plan.  Each operation is a step that deletes one resource and
+# names the steps it depends on: ports are deleted before the networks
+# they are on, router interfaces before routers and networks, and so on.
+# The steps of any number of plans are run by a DeletionEngine on a
+# bounded pool of worker threads; a step starts as soon as the steps it
+# depends on have finished.
+#
+# Deletion is best effort.  A step whose failure may go away (a timeout,
+# a lost connection, a resource still in use) raises TransientError and
+# is retried after a delay (that doubles after each attempt); any other
+# failure is reported at once.  A resource that is not found has already
+# been deleted.  Either way the steps that depend on a failed step are
+# run anyway.  The outcome of each step is kept in its plan and logged
+# once the engine has run.
+
+import Queue
+import threading
+import time
+
+import config
+
+
+DELETED = 'deleted'
+FAILED = 'failed'
+
+# Kinds of failure of a delete operation
+TRANSIENT = 'transient'
+NOT_FOUND = 'not found'
+PERMANENT = 'permanent'
+
+# Error messages (lower case) of failures that may go away on retry and
+# of resources that do not exist
+_TRANSIENT_MESSAGES = ['timed out', 'timeout', 'connection refused',
+                       'connection reset', 'unable to establish connection',
+                       'service unavailable', 'in use', 'conflict']
+_NOT_FOUND_MESSAGES = ['not found', 'no server with a name or id']
+
+
+class TransientError(Exception):
+    """
+        Raised by a step action whose failure may go away on retry
+    """
+    pass
+
+
+def classifyError(message, status=None):
+    """
+        Return the kind of failure (TRANSIENT, NOT_FOUND or PERMANENT) 
+        of a delete operation given its error message and, for API calls
+        that got a response, its HTTP status.
+    """
+    if status == 404: return NOT_FOUND
+    if status is not None and \
+            (status in [408, 409, 429] or status >= 500): 
+        return TRANSIENT
+    message = message.lower()
+    for pattern in _NOT_FOUND_MESSAGES:
+        if pattern in message: return NOT_FOUND
+    for pattern in _TRANSIENT_MESSAGES:
+        if pattern in message: return TRANSIENT
+    return PERMANENT
+
+
+class DeletionStep:
+    """
+        An action returns None on success or an error message on failure.
+        It raises TransientError for failures that are worth retrying.
+    """
+    def __init__(self, name, resource, action, dependencies, retries):
+        self._name = name
+        self._resource = resource
+        self._action = action
+        self._dependencies = dependencies
+        self._retries = retries
+        self._attempts = 0
+        self._start_time = None
+        self._end_time = None
+        self._error = None
+
+    def getName(self): return self._name
+    def getResource(self): return self._resource
+    def getDependencies(self): return self._dependencies
+
+    def getOutcome(self):
+        if self._end_time is None: return None
+        if self._error: return FAILED
+        return DELETED
+
+    def run(self, retry_delay):
+        self._start_time = time.time()
+        while True:
+            self._attempts = self._attempts + 1
+            transient = False
+            try:
+                self._error = self._action()
+            except TransientError, e:
+                self._error = str(e)
+                transient = True
+            except Exception, e:
+                self._error = 'GRAM internal error: %s failed: %s' % \
+                    (self._name, e)
+            if not transient or self._attempts > self._retries: break
+            config.logger.info("Retrying delete of %s: %s" % \
+                                   (self._resource, self._error))
+            time.sleep(retry_delay * 2 ** (self._attempts - 1))
+        self._end_time = time.time()
+        return self._error
+
+
+class TeardownPlan:
+    """
+        The steps that delete the OpenStack resources of one slice
+    """
+    def __init__(self, slice_urn):
+        self._slice_urn = slice_urn
+        self._steps = {}
+        self._step_order = [] # Names in order added
+        self._start_time = None
+        self._end_time = None
+
+    def getSliceURN(self): return self._slice_urn
+
+    def addStep(self, name, resource, action, dependencies=[], retries=None):
+        """
+            Add a step deleting the named resource.  Dependencies on 
+            steps that are never added are considered satisfied.  retries 
+            defaults to config.deletion_retries.
+        """
+        if retries is None: retries = config.deletion_retries
+        self._steps[name] = DeletionStep(name, resource, action, 
+                                         dependencies, retries)
+        self._step_order.append(name)
+        return name
+
+    def hasStep(self, name): return name in self._steps
+
+    def getStep(self, name): return self._steps[name]
+
+    def getStepNames(self): return list(self._step_order)
+
+    def getOutcomes(self):
+        """
+            Return list of (resource, outcome, attempts, error) for the 
+            steps of the plan, in order added.  The outcome is DELETED or
+            FAILED, or None if the step has not been run.
+        """
+        outcomes = []
+        for name in self._step_order:
+            step = self._steps[name]
+            outcomes.append((step.getResource(), step.getOutcome(),
+                             step._attempts, step._error))
+        return outcomes
+
+    def getFailures(self):
+        """
+            Return the list of resources that could not be deleted
+        """
+        return [outcome[0] for outcome in self.getOutcomes() \
+                    if outcome[1] == FAILED]
+
+    def succeeded(self):
+        return len(self.getFailures()) == 0
+
+    def logOutcomes(self):
+        failures = 0
+        for resource, outcome, attempts, error in self.getOutcomes():
+            if outcome == FAILED:
+                failures = failures + 1
+                config.logger.error("Failed to delete %s of slice %s after %d attempts: %s" % \
+                                        (resource, self._slice_urn, attempts,
+                                         error))
+        duration = 0.0
+        if self._start_time is not None:
+            duration = self._end_time - self._start_time
+        config.logger.info("Deleted %d of %d resources of slice %s in %.2f sec"\
+                               % (len(self._steps) - failures, 
+                                  len(self._steps), self._slice_urn, duration))
+
+
+class DeletionEngine:
+
+    def __init__(self, max_workers, retry_delay=None):
+        self._max_workers = max(1, max_workers)
+        if retry_delay is None: retry_delay = config.deletion_retry_delay
+        self._retry_delay = retry_delay
+        self._plans = []
+
+    def addPlan(self, slice_urn):
+        """
+            Add and return a new plan tearing down (part of) a slice
+        """
+        plan = TeardownPlan(slice_urn)
+        self._plans.append(plan)
+        return plan
+
+    def getPlans(self): return self._plans
+
+    def run(self):
+        """
+            Run the steps of all plans.  Returns True if all steps
+            succeeded.
+        """
+        start_time = time.time()
+
+        # Steps are identified by (plan index, step name)
+        # Count unfinished dependencies of each step and find dependents
+        waiting_on = {}
+        dependents = {}
+        step_order = []
+        for index in range(len(self._plans)):
+            plan = self._plans[index]
+            plan._start_time = start_time
+            for name in plan.getStepNames():
+                step_id = (index, name)
+                step_order.append(step_id)
+                dependencies = [(index, dependency) \
+                                    for dependency in plan.getStep(name).getDependencies() \
+                                    if plan.hasStep(dependency)]
+                waiting_on[step_id] = len(dependencies)
+                for dependency in dependencies:
+                    dependents.setdefault(dependency, []).append(step_id)
+
+        # Steps remaining in each plan
+        remaining = [len(each_plan.getStepNames()) \
+                         for each_plan in self._plans]
+        for index in range(len(self._plans)):
+            if remaining[index] == 0:
+                self._plans[index]._end_time = time.time()
+
+        ready = Queue.Queue()
+        finished = Queue.Queue()
+        num_workers = min(self._max_workers, len(step_order))
+        workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._work, 
+                                      args=(ready, finished))
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+
+        num_running = 0
+        for step_id in step_order:
+            if waiting_on[step_id] == 0: 
+                ready.put(step_id)
+                num_running = num_running + 1
+
+        while num_running > 0:
+            step_id, step_error = finished.get()
+            num_running = num_running - 1
+            index = step_id[0]
+            remaining[index] = remaining[index] - 1
+            if remaining[index] == 0:
+                self._plans[index]._end_time = time.time()
+            # Run the dependents even if the step failed: the resources
+            # they delete should go regardless
+            for dependent in dependents.get(step_id, []):
+                waiting_on[dependent] = waiting_on[dependent] - 1
+                if waiting_on[dependent] == 0:
+                    ready.put(dependent)
+                    num_running = num_running + 1
+
+        for worker in workers:
+            ready.put(None)
+        for worker in workers:
+            worker.join()
+
+        success = True
+        for plan in self._plans:
+            plan.logOutcomes()
+            if not plan.succeeded(): success = False
+        config.logger.info("Deleted %d slices (%d resources) in %.2f sec" % \
+                               (len(self._plans), len(step_order), 
+                                time.time() - start_time))
+        return success
+
+    def _work(self, ready, finished):
+        while True:
+            step_id = ready.get()
+            if step_id is None: return
+            index, name = step_id
+            step = self._plans[index].getStep(name)
+            finished.put((step_id, step.run(self._retry_delay)))
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig()
+    config.logger.setLevel(logging.CRITICAL)
+    config.deletion_retries = 2
+
+    # Reap 20 slices of 4 VMs and 2 links: each delete takes 1 unit
+    UNIT = 0.02
+    def delay(units):
+        def action():
+            time.sleep(units * UNIT)
+        return action
+
+    def addSlicePlan(engine, i):
+        plan = engine.addPlan('slice-%d' % i)
+        vm_steps = []
+        for j in range(4):
+            port_step = plan.addStep('port-%d' % j, 'port %d' % j, delay(1))
+            vm_steps.append(plan.addStep('vm-%d' % j, 'VM %d' % j, 
+                                         delay(1), [port_step]))
+        interface_steps = []
+        for j in range(2):
+            interface_steps.append(plan.addStep('interface-%d' % j, 
+                                                'router interface %d' % j,
+                                                delay(1)))
+            plan.addStep('network-%d' % j, 'network %d' % j, delay(1), 
+                         vm_steps + ['interface-%d' % j])
+        plan.addStep('router', 'router', delay(1), interface_steps)
+        plan.addStep('tenant', 'tenant', delay(1), 
+                     plan.getStepNames())
+
+    for max_workers in [1, 10, 40]:
+        engine = DeletionEngine(max_workers, 0)
+        for i in range(20): addSlicePlan(engine, i)
+        start = time.time()
+        engine.run()
+        print "%2d workers: %.2f sec" % (max_workers, time.time() - start)
+
+    # A transient failure is retried, a permanent one reported at once
+    attempts = []
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 2: raise TransientError('Port in use')
+    engine = DeletionEngine(4, 0.01)
+    plan = engine.addPlan('slice')
+    plan.addStep('vm', 'VM node-1', flaky)
+    plan.addStep('network', 'network link-1', lambda: 'Permission denied', 
+                 ['vm'])
+    plan.addStep('tenant', 'tenant', delay(0), ['network'])
+    print "SUCCESS = %s" % engine.run()
+    for outcome in plan.getOutcomes(): print outcome
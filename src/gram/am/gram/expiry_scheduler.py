@@ -0,0 +1,269 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+
+# Scheduler of sliver expirations.
+#
+# The slivers whose leases are pending are kept in a min-heap of
+# (expiration, sliver_urn) entries.  A single worker thread sleeps until
+# the earliest expiration and then hands every sliver that has expired
+# by then to the expire function, one call per slice, so slivers of a
+# slice that expire together are deleted together.
+#
+# The worker sleeps at most check_interval seconds at a time (so a
+# sliver scheduled to expire sooner than the one it is waiting for is
+# expired at most that late).  It sleeps with time.sleep rather than a
+# timed Condition.wait, which on Python 2 polls every 50 msec.
+#
+# Rescheduling a sliver (on renew or provision) or unscheduling it (on
+# delete) does not search the heap: the current expiration of each
+# sliver is kept in a dictionary and heap entries that no longer match
+# it are discarded when they reach the top of the heap.
+
+import datetime
+import heapq
+import threading
+import time
+
+import config
+
+
+class ExpiryScheduler:
+    """
+        Calls expire_function(slice_urn, sliver_urns) when the
+        leases of the given slivers of a slice have ended.
+    """
+    def __init__(self, expire_function, check_interval):
+        self._expire_function = expire_function
+        self._check_interval = check_interval
+        self._condition = threading.Condition()
+        self._stopped = False
+
+        # Heap of (expiration, sliver_urn)
+        self._heap = []
+        # Current (expiration, slice_urn) of each scheduled sliver
+        self._entries = {}
+
+        # Metrics
+        self._num_expired = 0
+        self._num_batches = 0
+        self._num_failures = 0
+        self._last_expire_latency = 0.0
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def schedule(self, slice_object, slivers):
+        """
+            Schedule (or reschedule) the expiration of the given slivers 
+            of a slice at their current expiration times.  Slivers without
+            an expiration time expire immediately.
+        """
+        slice_urn = slice_object.getSliceURN()
+        with self._condition:
+            for sliver in slivers:
+                expiration = sliver.getExpiration()
+                if expiration is None: expiration = datetime.datetime.min
+                sliver_urn = sliver.getSliverURN()
+                if self._entries.get(sliver_urn) == (expiration, slice_urn):
+                    continue
+                self._entries[sliver_urn] = (expiration, slice_urn)
+                heapq.heappush(self._heap, (expiration, sliver_urn))
+            self._compact()
+            self._condition.notifyAll()
+
+    def unschedule(self, slivers):
+        """
+            Cancel the expiration of the given slivers
+        """
+        with self._condition:
+            for sliver in slivers:
+                self._entries.pop(sliver.getSliverURN(), None)
+            self._compact()
+
+    def stop(self):
+        """
+            Stop the worker thread.  Pending expirations are dropped.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notifyAll()
+        self._thread.join()
+
+    def getNextExpiration(self):
+        """
+            Return the earliest pending expiration time, or None
+        """
+        with self._condition:
+            self._discardStale()
+            if len(self._heap) == 0: return None
+            return self._heap[0][0]
+
+    def getMetrics(self):
+        """
+            Return dictionary of scheduler metrics: number of slivers (and
+            slices) pending expiry, the next expiration time, the number of
+            slivers expired, of expire calls (batches) and of failed calls
+            and the latency in seconds of the last batch
+        """
+        with self._condition:
+            self._discardStale()
+            next_expiration = None
+            if len(self._heap) > 0: next_expiration = self._heap[0][0]
+            slice_urns = set([entry[1] for entry in self._entries.values()])
+            return {'pending' : len(self._entries),
+                    'pending_slices' : len(slice_urns),
+                    'next_expiration' : next_expiration,
+                    'expired' : self._num_expired,
+                    'batches' : self._num_batches,
+                    'failures' : self._num_failures,
+                    'last_expire_latency' : self._last_expire_latency}
+
+    # Called with self._condition held
+    # Drop entries at the top of the heap that were rescheduled or 
+    # unscheduled
+    def _discardStale(self):
+        while len(self._heap) > 0:
+            expiration, sliver_urn = self._heap[0]
+            entry = self._entries.get(sliver_urn)
+            if entry is not None and entry[0] == expiration: break
+            heapq.heappop(self._heap)
+
+    # Called with self._condition held
+    # Rebuild the heap when most of its entries are stale
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(entry[0], sliver_urn) \
+                              for sliver_urn, entry in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    # Called with self._condition held
+    # Remove the slivers expired by now from the schedule and return 
+    # {slice_urn : list of sliver urns}
+    def _popExpired(self, now):
+        expired = {}
+        while True:
+            self._discardStale()
+            if len(self._heap) == 0 or self._heap[0][0] > now: break
+            expiration, sliver_urn = heapq.heappop(self._heap)
+            slice_urn = self._entries.pop(sliver_urn)[1]
+            if slice_urn not in expired: expired[slice_urn] = []
+            expired[slice_urn].append(sliver_urn)
+        return expired
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    self._discardStale()
+                    if len(self._heap) > 0: break
+                    self._condition.wait()
+                if self._stopped: return
+                delay = self._heap[0][0] - datetime.datetime.utcnow()
+            delay = delay.days * 86400 + delay.seconds + \
+                delay.microseconds / 1e6
+            if delay > 0:
+                time.sleep(min(delay, self._check_interval))
+                continue
+
+            with self._condition:
+                if self._stopped: return
+                expired = self._popExpired(datetime.datetime.utcnow())
+
+            for slice_urn, sliver_urns in expired.items():
+                config.logger.info("Expiring %d slivers of slice %s" % \
+                                       (len(sliver_urns), slice_urn))
+                start_time = time.time()
+                failed = False
+                try:
+                    self._expire_function(slice_urn, sliver_urns)
+                except Exception, e:
+                    config.logger.error("Failed to expire slivers of %s: %s" \
+                                            % (slice_urn, e))
+                    failed = True
+                latency = time.time() - start_time
+                with self._condition:
+                    self._num_expired = self._num_expired + len(sliver_urns)
+                    self._num_batches = self._num_batches + 1
+                    if failed: self._num_failures = self._num_failures + 1
+                    self._last_expire_latency = latency
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig()
+    config.logger.setLevel(logging.WARNING)
+
+    class FakeSliver:
+        def __init__(self, urn, expiration): 
+            self._urn = urn
+            self._expiration = expiration
+        def getSliverURN(self): return self._urn
+        def getExpiration(self): return self._expiration
+
+    class FakeSlice:
+        def __init__(self, urn): self._urn = urn
+        def getSliceURN(self): return self._urn
+
+    deleted = []
+    def expire(slice_urn, sliver_urns):
+        deleted.append((datetime.datetime.utcnow(), slice_urn, 
+                        sorted(sliver_urns)))
+
+    scheduler = ExpiryScheduler(expire, 0.05)
+    start = datetime.datetime.utcnow()
+    soon = start + datetime.timedelta(seconds=0.2)
+    later = start + datetime.timedelta(seconds=0.4)
+    slice_1 = FakeSlice('slice_1')
+    slice_2 = FakeSlice('slice_2')
+    scheduler.schedule(slice_1, [FakeSliver('vm_1', soon), 
+                                 FakeSliver('vm_2', soon),
+                                 FakeSliver('link_1', soon)])
+    scheduler.schedule(slice_2, [FakeSliver('vm_3', soon), 
+                                 FakeSliver('vm_4', later)])
+    # Renew one sliver and delete another
+    scheduler.schedule(slice_1, [FakeSliver('link_1', later)])
+    scheduler.unschedule([FakeSliver('vm_3', soon)])
+    print "METRICS = %s" % scheduler.getMetrics()
+    time.sleep(0.6)
+    for when, slice_urn, sliver_urns in deleted:
+        print "%.3f sec: %s %s" % \
+            ((when - start).microseconds / 1e6, slice_urn, sliver_urns)
+    print "METRICS = %s" % scheduler.getMetrics()
+    scheduler.stop()
+
+    # Schedule and reschedule many slivers
+    scheduler = ExpiryScheduler(expire, 0.05)
+    slivers = [FakeSliver('sliver_%d' % i, start + \
+                              datetime.timedelta(days=1, seconds=i)) \
+                   for i in range(100000)]
+    timer = time.time()
+    scheduler.schedule(slice_1, slivers)
+    for sliver in slivers[:10000]:
+        sliver._expiration = sliver._expiration + datetime.timedelta(days=1)
+        scheduler.schedule(slice_1, [sliver])
+    print "Scheduled %d slivers, rescheduled %d in %.3f sec" % \
+        (len(slivers), 10000, time.time() - timer)
+    print "PENDING = %d" % scheduler.getMetrics()['pending']
+    scheduler.stop()
@@ -34,12 +34,18 @@ import constants
 from gcf.sfa.trust.certificate import Certificate
 from resources import GramImageInfo, Slice, VirtualMachine, NetworkLink
 import rspec_handler
+from request_rspec import ParsedRequest
 import open_stack_interface
 import stitching
 import utils
 import vlan_pool
 import Archiving
-import threading
+import snapshot_journal
+import snapshot_store
+import persist_writer
+import slice_registry
+import expiry_scheduler
+import reconciliation
 import thread
 
 from vmoc.VMOCClientInterface import VMOCClientInterface
@@ -47,39 +53,55 @@ from vmoc.VMOCConfig import VMOCSliceConfiguration, VMOCVLANConfiguration
 
 class SliceURNtoSliceObject :
     """
-        Class maps slice URNs to slice objects
+        Class maps slice URNs to slice objects.  The slices are kept in
+        a SliceRegistry which also indexes them and their slivers.
     """
-    _slices = {}   # Slice objects at this aggregate, indexed by slice urn
-    _lock = threading.RLock()
+    _registry = slice_registry.SliceRegistry() # Slices at this aggregate
+
+    @staticmethod
+    def get_registry() :
+        return SliceURNtoSliceObject._registry
 
     @staticmethod
     def get_slice_object(slice_urn) :
         """
             Returns the Slice object that has the given slice_urn.
         """
-        with SliceURNtoSliceObject._lock :
-            if slice_urn in SliceURNtoSliceObject._slices :
-                return SliceURNtoSliceObject._slices[slice_urn]
-            else :
-                return None
+        return SliceURNtoSliceObject._registry.getSlice(slice_urn)
             
     @staticmethod
     def get_slice_objects() :
         """
             Returns a list of all Slice objects at this aggregate .
         """
-        with SliceURNtoSliceObject._lock :
-            return SliceURNtoSliceObject._slices.values()
+        return SliceURNtoSliceObject._registry.getSlices()
+
+    @staticmethod
+    def get_slice_objects_by_urn() :
+        """
+            Returns a {slice urn : Slice} dictionary of all slices at 
+            this aggregate.
+        """
+        return SliceURNtoSliceObject._registry.getSlicesByURN()
 
     @staticmethod
     def set_slice_object(slice_urn, slice_object) :
-        with SliceURNtoSliceObject._lock :
-            SliceURNtoSliceObject._slices[slice_urn] = slice_object
+        SliceURNtoSliceObject._registry.addSlice(slice_object)
+
+    @staticmethod
+    def set_slice_objects(slice_objects) :
+        """
+            Replace the slices at this aggregate with the given 
+            {slice urn : Slice} dictionary
+        """
+        registry = SliceURNtoSliceObject._registry
+        registry.clear()
+        for slice_object in slice_objects.values() :
+            registry.addSlice(slice_object)
 
     @staticmethod
     def remove_slice_object(slice_urn) :
-        with SliceURNtoSliceObject._lock :
-            del SliceURNtoSliceObject._slices[slice_urn]
+        SliceURNtoSliceObject._registry.removeSlice(slice_urn)
 
 
 class GramManager :
@@ -110,6 +132,15 @@ class GramManager :
         if config.gram_snapshot_directory:
             self._snapshot_directory = \
                 config.gram_snapshot_directory + "/" + getpass.getuser()
+        self._snapshot_store = None
+        self._journal = None
+
+        # Persist state from a background writer rather than in the
+        # request threads
+        self._persist_writer = None
+        if self._snapshot_directory and config.persist_in_background:
+            self._persist_writer = persist_writer.PersistWriter( \
+                self.write_state, config.persist_coalesce_window)
 
         # Set max allocation and lease times
         self._max_alloc_time = \
@@ -119,6 +150,12 @@ class GramManager :
 
         self._stitching = stitching.Stitching()
 
+        # Scheduler of sliver expirations: slices are scheduled once
+        # restored and reconciled
+        self._expiry_scheduler = \
+            expiry_scheduler.ExpiryScheduler(self.expire_slice_slivers,
+                                             config.expiry_check_interval)
+
         self._persistent_state = {"FOO" : "BAR"}
 
         # Client interface to VMOC - update VMOC on current
@@ -131,21 +168,62 @@ class GramManager :
         # Recover state from snapshot, if configured to do so
         self.restore_state()
 
-        # Reconcile restored state with state of OpenStack
-        # Are any resources no longer there? If so delete slices
-        self.reconcile_state()
-
-        # If any slices restored from snapshot, report to VMOC
-        with SliceURNtoSliceObject._lock:
-            for slice_name in SliceURNtoSliceObject._slices:
-                the_slice = SliceURNtoSliceObject._slices[slice_name]
-                self.registerSliceToVMOC(the_slice)
+        # Reconcile restored state with state of OpenStack (in the
+        # background if so configured).  Requests that change a restored
+        # slice wait until it has been reconciled.
+        restored_slices = SliceURNtoSliceObject.get_slice_objects()
+        self._reconciler = reconciliation.Reconciler( \
+            [the_slice.getSliceURN() for the_slice in restored_slices])
+        if config.reconcile_in_background:
+            thread.start_new_thread(self.finish_startup, (restored_slices,))
+        else:
+            self.finish_startup(restored_slices)
         
         # Remove extraneous snapshots
         self.prune_snapshots()
 
         thread.start_new_thread(self.periodic_cleanup,())
 
+    # Reconcile the restored slices with OpenStack, then report those 
+    # that remain to VMOC and schedule the expiration of their slivers
+    def finish_startup(self, restored_slices):
+        try:
+            # Are any resources no longer there? If so delete slices
+            self.reconcile_state(restored_slices)
+        except Exception, e:
+            config.logger.error("Failed to reconcile state with OpenStack: %s"\
+                                    % e)
+        self._reconciler.finish()
+
+        for the_slice in restored_slices:
+            if SliceURNtoSliceObject.get_slice_object( \
+                the_slice.getSliceURN()) is not the_slice:
+                continue
+            # If any slices restored from snapshot, report to VMOC
+            self.registerSliceToVMOC(the_slice)
+            # Delete slivers when their leases end
+            self._expiry_scheduler.schedule(the_slice, 
+                                            the_slice.getSlivers().values())
+
+    # Wait until startup reconciliation is done with the slice with 
+    # the given URN.  Returns an error result if reconciliation deleted 
+    # the given slice_object, None otherwise.
+    def wait_for_reconciliation(self, slice_urn, slice_object=None):
+        self._reconciler.waitForSlice(slice_urn)
+        if slice_object is None or \
+                SliceURNtoSliceObject.get_slice_object(slice_urn) is \
+                slice_object:
+            return None
+        code = {'geni_code': constants.UNKNOWN_SLICE}
+        return {'code': code, 'value': '', 
+                'output': 'Slice %s was deleted as inconsistent with OpenStack'\
+                    % slice_urn}
+
+    # Return the number of restored slices still to be reconciled with
+    # OpenStack, deleted as inconsistent and the reconciliation time
+    def get_reconciliation_metrics(self):
+        return self._reconciler.getMetrics()
+
     def getStitchingState(self) : return self._stitching
 
     # Maintain some persistent state on the gram manager that 
@@ -172,6 +250,7 @@ class GramManager :
             Returns an error string on failure.
         """
         config.logger.info('Allocate called for slice %r' % slice_urn)
+        self.wait_for_reconciliation(slice_urn)
 
         # Grab user urn out of slice credentail
         user_urn  = None
@@ -188,12 +267,16 @@ class GramManager :
 
         # Lock this slice so nobody else can mess with it during allocation
         with slice_object.getLock() :
-            # Parse the request rspec.  Get back any error message from parsing
+            # Parse the request rspec once: the parsed request is shared
+            # by the sliver, stitching and manifest code below
+            parsed_request = ParsedRequest(rspec)
+
+            # Get back any error message from parsing
             # the rspec and a list of slivers created while parsing
             # Also OF controller, if any
             err_output, err_code, slivers, controller_link_info = \
                 rspec_handler.parseRequestRspec(self._aggregate_urn,
-                                                slice_object, rspec, 
+                                                slice_object, parsed_request, 
                                                 self._stitching)
 
             if err_output != None :
@@ -253,7 +336,7 @@ class GramManager :
             for link_sliver_object in slice_object.getNetworkLinks():
                 success, error_string, error_code = \
                     self._stitching.allocate_external_vlan_tags(link_sliver_object, \
-                                                                    rspec, is_v2_allocation)
+                                                                    parsed_request, is_v2_allocation)
                 if not success:
                     self.cleanup_slivers(slivers, slice_object)
                     return {'code' : {'geni_code' : error_code}, 'value' : "",
@@ -280,7 +363,8 @@ class GramManager :
                                                              slivers, True, \
                                                              False,
                                                              agg_urn, \
-                                                             self._stitching)
+                                                             self._stitching,
+                                                             parsed_request)
             if error_code != constants.SUCCESS:
                 self.cleanup_slivers(slivers, slice_object)
                 return {'code' : {'geni_code' : error_code}, 'value' : "", 
@@ -295,8 +379,14 @@ class GramManager :
                 if not sliver.getUserURN():
                     sliver.setUserURN(user_urn)
 
+            # Expire the allocation if it isn't provisioned in time
+            self._expiry_scheduler.schedule(slice_object, slivers)
+
             # Persist aggregate state
-            self.persist_state()
+            self.persist_state(slice_object)
+
+            # Resources have been allocated: advertise anew
+            rspec_handler.AdvertisementCache.invalidate()
 
             # Create a sliver status list for the slivers allocated by this call
             sliver_status_list = \
@@ -317,6 +407,10 @@ class GramManager :
             Provision the slivers listed in sliver_objects, if they have
             not already been provisioned.
         """
+        error = self.wait_for_reconciliation(slice_object.getSliceURN(),
+                                             slice_object)
+        if error: return error
+
         if len(sliver_objects) == 0 :
             # No slivers specified: Return error message
             code = {'geni_code': constants.REQUEST_PARSE_FAILED}
@@ -358,16 +452,14 @@ class GramManager :
                          'geni_end_time' in options and options['geni_end_time'])
             for sliver in sliver_objects :
                 sliver.setExpiration(expiration)
+            self._expiry_scheduler.schedule(slice_object, sliver_objects)
 
             # Generate a manifest rpsec 
-            req_rspec = slice_object.getRequestRspec()
             manifest, error_string, error_code =  \
-                rspec_handler.generateManifestForSlivers(slice_object,
-                                                         sliver_objects,
-                                                         True,
-                                                         False,
-                                                         self._aggregate_urn,
-                                                         self._stitching)
+                rspec_handler.getManifestForSlivers(slice_object,
+                                                    sliver_objects,
+                                                    self._aggregate_urn,
+                                                    self._stitching)
 
             if error_code != constants.SUCCESS:
                 return {'code' : {'geni_code' : error_code}, 'value' : "", 
@@ -378,7 +470,7 @@ class GramManager :
                 utils.SliverList().getStatusOfSlivers(sliver_objects)
 
             # Persist new GramManager state
-            self.persist_state()
+            self.persist_state(slice_object)
 
             # Report the new slice to VMOC
             self.registerSliceToVMOC(slice_object)
@@ -427,14 +519,13 @@ class GramManager :
             sliver_status_list = \
                 utils.SliverList().getStatusOfSlivers(slivers)
 
-            # Generate the manifest to be returned
+            # Generate the manifest to be returned (or reuse it if
+            # the slivers haven't changed since the last call)
             manifest, error_string, error_code =  \
-                rspec_handler.generateManifestForSlivers(slice_object, 
-                                                         slivers, 
-                                                         False, 
-                                                         False,
-                                                         self._aggregate_urn,
-                                                         self._stitching)
+                rspec_handler.getManifestForSlivers(slice_object, 
+                                                    slivers, 
+                                                    self._aggregate_urn,
+                                                    self._stitching)
 
             if error_code != constants.SUCCESS:
                 return {'code' : {'geni_code' : error_code}, 'value' : "", 
@@ -462,6 +553,10 @@ class GramManager :
                 geni_restart (reboot if ready)
                 geni_stop (shutdown if ready)
         """
+        error = self.wait_for_reconciliation(slice_object.getSliceURN(),
+                                             slice_object)
+        if error: return error
+
         ret_str = ""
         if action == 'delete_snapshot':
             ret_code, ret_str = open_stack_interface._deleteImage(options)
@@ -514,68 +609,115 @@ class GramManager :
         """
         config.logger.info('Delete called for slice %r' % \
                                slice_object.getSliceURN())
+        error = self.wait_for_reconciliation(slice_object.getSliceURN(),
+                                             slice_object)
+        if error: return error
+        return self.delete_slices([(slice_object, sliver_objects)])[0]
 
-        # Lock this slice so nobody else can mess with it while we do the deletes
-        with slice_object.getLock() :
+    def delete_slices(self, deletions) :
+        """
+            Delete slivers of several slices.  deletions is a list of 
+            (slice_object, sliver_objects) pairs.  The OpenStack resources 
+            of all the slices are deleted concurrently.
+
+            Returns the list of delete results (as returned by delete)
+            in the order of deletions.
+        """
+        # Lock these slices so nobody else can mess with them while we do
+        # the deletes.  Slices are locked in order of URN so two
+        # concurrent calls can't deadlock.
+        slice_objects = [deletion[0] for deletion in deletions]
+        locks = [slice_object.getLock() for slice_object in \
+                     sorted(slice_objects, 
+                            key = lambda slice_object : \
+                                slice_object.getSliceURN())]
+        for lock in locks : lock.acquire()
+        try :
             # Delete any slivers that have been provisioned
             # First find the sliver_objects that have been provisioned.
             # Provisioned slivers need their OpenStack resources deleted.  
             # Other slivers just need their allocation and operational states
             # changed.
-            provisioned_slivers = []
-            for sliver in sliver_objects :
-                if sliver.getAllocationState() == constants.provisioned :
-                    provisioned_slivers.append(sliver)
-                else :
-                    # Sliver has not been provisioned.  Just change its
-                    # allocation and operational states
-                    sliver.setAllocationState(constants.unallocated)
-                    sliver.setOperationalState(constants.stopping)
-
-            # Delete provisioned slivers
-            success =  open_stack_interface.deleteSlivers(slice_object, 
-                                                          provisioned_slivers)
-
-            sliver_status_list = \
-                utils.SliverList().getStatusOfSlivers(sliver_objects)
-
-            # Remove deleted slivers from the slice
-            for sliver in sliver_objects :
-                slice_object.removeSliver(sliver)
-
-            ### THIS CODE SHOULD BE MOVED TO EXPIRE WHEN WE ACTUALLY EXPIRE
-            ### SLIVERS AND SLICES.  SLICES SHOULD BE DELETED ONLY WHEN THEY
-            ### EXPIRE.  FOR NOW WE DELETE THEM WHEN ALL THEIR SLIVERS ARE 
-            ### DELETED.
-            if len(slice_object.getSlivers()) == 0 :
-                open_stack_interface.expireSlice(slice_object)
-                # Update VMOC
-                self.registerSliceToVMOC(slice_object, False)
-                # Remove slice from GRAM
-                SliceURNtoSliceObject.remove_slice_object(slice_object.getSliceURN());
-
-            # Free all stitching VLAN allocations
-            for sliver in sliver_objects:
-                self._stitching.deleteAllocation(sliver.getSliverURN())
-
-            # Free all internal vlans back to pool
-            for sliver in sliver_objects:
-                if isinstance(sliver, NetworkLink):
-                    tag = sliver.getVLANTag()
-                    if self._internal_vlans.isAllocated(tag):
-                        self._internal_vlans.free(tag)
-
-            # Persist new GramManager state
-            self.persist_state()
+            teardowns = []
+            for slice_object, sliver_objects in deletions :
+                provisioned_slivers = []
+                for sliver in sliver_objects :
+                    if sliver.getAllocationState() == constants.provisioned :
+                        provisioned_slivers.append(sliver)
+                    else :
+                        # Sliver has not been provisioned.  Just change its
+                        # allocation and operational states
+                        sliver.setAllocationState(constants.unallocated)
+                        sliver.setOperationalState(constants.stopping)
+
+                ### THIS CODE SHOULD BE MOVED TO EXPIRE WHEN WE ACTUALLY EXPIRE
+                ### SLIVERS AND SLICES.  SLICES SHOULD BE DELETED ONLY WHEN THEY
+                ### EXPIRE.  FOR NOW WE DELETE THEM WHEN ALL THEIR SLIVERS ARE 
+                ### DELETED.
+                deleted_urns = set([sliver.getSliverURN() \
+                                        for sliver in sliver_objects])
+                remaining_urns = set(slice_object.getSlivers().keys()) - \
+                    deleted_urns
+                expire = len(remaining_urns) == 0
+                teardowns.append((slice_object, provisioned_slivers, expire))
+
+            # Delete provisioned slivers (and the tenants of slices
+            # left without slivers)
+            plans = open_stack_interface.teardownSlices(teardowns)
+
+            results = []
+            for i in range(len(deletions)) :
+                slice_object, sliver_objects = deletions[i]
+                results.append(self._finish_delete(slice_object, 
+                                                   sliver_objects, plans[i]))
+
+            # Resources have been freed: advertise anew
+            rspec_handler.AdvertisementCache.invalidate()
+            return results
+        finally :
+            for lock in locks : lock.release()
+
+    # Update the state of a slice once the OpenStack resources of the 
+    # given slivers have been deleted according to the teardown plan
+    # Returns the result struct of the delete
+    def _finish_delete(self, slice_object, sliver_objects, plan) :
+        sliver_status_list = \
+            utils.SliverList().getStatusOfSlivers(sliver_objects)
 
-            # Generate the return struct
-            code = {'geni_code': constants.SUCCESS}
-            if success :
-                return {'code': code, 'value': sliver_status_list,  'output': ''}
-            else :
-                return {'code':code, 
-                        'value':sliver_status_list,
-                        'output': 'Failed to delete one or more slivers'}
+        # Remove deleted slivers from the slice
+        for sliver in sliver_objects :
+            slice_object.removeSliver(sliver)
+        self._expiry_scheduler.unschedule(sliver_objects)
+
+        if len(slice_object.getSlivers()) == 0 :
+            # Update VMOC
+            self.registerSliceToVMOC(slice_object, False)
+            # Remove slice from GRAM
+            SliceURNtoSliceObject.remove_slice_object(slice_object.getSliceURN());
+
+        # Free all stitching VLAN allocations
+        for sliver in sliver_objects:
+            self._stitching.deleteAllocation(sliver.getSliverURN())
+
+        # Free all internal vlans back to pool
+        for sliver in sliver_objects:
+            if isinstance(sliver, NetworkLink):
+                tag = sliver.getVLANTag()
+                if self._internal_vlans.isAllocated(tag):
+                    self._internal_vlans.free(tag)
+
+        # Persist new GramManager state
+        self.persist_state(slice_object)
+
+        # Generate the return struct
+        code = {'geni_code': constants.SUCCESS}
+        if plan.succeeded() :
+            return {'code': code, 'value': sliver_status_list,  'output': ''}
+        else :
+            return {'code':code, 
+                    'value':sliver_status_list,
+                    'output': 'Failed to delete one or more slivers: %s' % \
+                        ', '.join(plan.getFailures())}
 
 
     def renew_slivers(self,slice_object, sliver_objects, creds, expiration_time, options):
@@ -587,6 +729,10 @@ class GramManager :
             expiration time, set sliver expiration times to the slice 
             credentials expiration time.
         """
+        error = self.wait_for_reconciliation(slice_object.getSliceURN(),
+                                             slice_object)
+        if error: return error
+
         expiration = utils.min_expire(creds, self._max_lease_time,
                                       expiration_time)
 
@@ -594,6 +740,7 @@ class GramManager :
         with slice_object.getLock() :
             for sliver in sliver_objects :
                 sliver.setExpiration(expiration)
+            self._expiry_scheduler.schedule(slice_object, sliver_objects)
 
             # Create a sliver status list for the slivers that were renewed
             sliver_status_list = \
@@ -638,30 +785,82 @@ class GramManager :
 
 
     # Persist state to file based on current timestamp
+    # If a slice is given, only the state of that slice has changed
+    # (or the slice has been deleted) and, when journaling, only that
+    # slice is written to the journal
+    def persist_state(self, slice_object=None):
+        if not self._snapshot_directory: return
+        if self._persist_writer:
+            self._persist_writer.markDirty(slice_object)
+        elif slice_object:
+            self.write_state([slice_object])
+        else:
+            self.write_state(None)
+
+    # Wait until all state changes have been persisted
+    # Returns False if a write failed or the timeout (seconds) expired first
+    def flush_state(self, timeout=None):
+        if not self._persist_writer: return True
+        return self._persist_writer.flush(timeout)
+
+    # Return metrics (queue depth, write latency) of background persistence
+    def get_persist_metrics(self):
+        if not self._persist_writer: return None
+        return self._persist_writer.getMetrics()
+
+    # Return hit/miss counters of the cache of VM status used by
+    # Status and Describe
+    def get_status_cache_metrics(self):
+        return open_stack_interface.getStatusCacheMetrics()
+
+    # Write the state of the given slices (or all slices if None) 
+    # to the snapshot journal or to a new snapshot file
     __persist_filename_format="%Y_%m_%d_%H_%M_%S"
     __recent_base_filename=None
     __base_filename_counter=0
-    def persist_state(self):
-        if not self._snapshot_directory: return
+    def write_state(self, slice_objects=None):
         start_time = time.time()
+        if self._journal:
+            if slice_objects is None:
+                slice_objects = SliceURNtoSliceObject.get_slice_objects()
+                self._journal.recordSlicesDeletedExcept( \
+                    [slice.getSliceURN() for slice in slice_objects], self)
+            for slice in slice_objects:
+                slice_urn = slice.getSliceURN()
+                with slice.getLock():
+                    if SliceURNtoSliceObject.get_slice_object(slice_urn):
+                        self._journal.recordSlice(slice, self)
+                    else:
+                        self._journal.recordSliceDeleted(slice_urn, self)
+            end_time = time.time()
+            config.logger.info("Journaled state of %d slices in %.3f sec" % \
+                                   (len(slice_objects), 
+                                    (end_time - start_time)))
+            return
+        filename = self.new_snapshot_filename()
+        Archiving.write_state(filename, self, 
+                              SliceURNtoSliceObject.get_slice_objects_by_urn(),
+                              self._stitching)
+        self._snapshot_store.addSnapshot(filename)
+        end_time = time.time()
+        config.logger.info("Persisting state to %s in %.2f sec" % \
+                               (filename, (end_time - start_time)))
+
+    # Return name of a new snapshot file based on current timestamp
+    def new_snapshot_filename(self):
         base_filename = \
-            time.strftime(GramManager.__persist_filename_format, time.localtime(start_time))
+            time.strftime(GramManager.__persist_filename_format, time.localtime(time.time()))
         counter = 0
         if base_filename==GramManager.__recent_base_filename:
             GramManager.__base_filename_counter = GramManager.__base_filename_counter + 1
             counter = GramManager.__base_filename_counter
         else:
             GramManager.__base_filename_counter=0
-#        print "BFN %s RBFN %s COUNTER %d GMBFNC %d" % (base_filename, GramManager.__recent_base_filename, GramManager.__base_filename_counter, counter)
         GramManager.__recent_base_filename = base_filename
-        filename = "%s/%s_%d.json" % (self._snapshot_directory, \
-                                         base_filename, counter)
-        GramManager.__recent_base_filename = base_filename
-        Archiving.write_state(filename, self, SliceURNtoSliceObject._slices,
-                               self._stitching)
-        end_time = time.time()
-        config.logger.info("Persisting state to %s in %.2f sec" % \
-                               (filename, (end_time - start_time)))
+        filename = "%s/%s_%d%s" % (self._snapshot_directory, \
+                                      base_filename, counter,
+                                      snapshot_journal.snapshot_suffix())
+        return filename
 
     # Update VMOC about state of given slice (register or unregister)
     # Register both the control network and all data networks
@@ -726,11 +925,8 @@ class GramManager :
             # And if so, return the slice and the sliver objects for these 
             # sliver urns
             sliver_urn = urns[0]
-            slice = None
-            for test_slice in SliceURNtoSliceObject.get_slice_objects() :
-                if test_slice.getSlivers().has_key(sliver_urn):
-                    slice = test_slice
-                    break
+            slice = SliceURNtoSliceObject.get_registry(). \
+                getSliceOfSliver(sliver_urn)
             if slice:
                 for sliver_urn  in urns:
                     if not slice.getSlivers().has_key(sliver_urn):
@@ -747,21 +943,47 @@ class GramManager :
         """
             Find and delete slivers that have expired.
         """
-        # We walk through the list of slices.  For each slice we make a 
-        # list of slivers that have expired.  If the slice has slivers that
-        # have expired, we use the self.delete method to delete these slivers
+        # Slivers are normally expired by the expiry scheduler when their 
+        # leases end.  This finds any expired slivers from the expiration
+        # index of the slice registry and deletes them, one delete per slice
+        now = datetime.datetime.utcnow()
+        registry = SliceURNtoSliceObject.get_registry()
+        expired = {}
+        for sliver in registry.getSliversExpiringBefore(now):
+            slice_object = registry.getSliceOfSliver(sliver.getSliverURN())
+            if slice_object is None: continue
+            slice_urn = slice_object.getSliceURN()
+            if slice_urn not in expired: expired[slice_urn] = []
+            expired[slice_urn].append(sliver.getSliverURN())
+        for slice_urn, sliver_urns in expired.items():
+            self.expire_slice_slivers(slice_urn, sliver_urns)
+
+    def expire_slice_slivers(self, slice_urn, sliver_urns):
+        """
+            Delete those of the given slivers of a slice that have
+            expired (they may have been renewed or deleted since they
+            were found to expire).
+        """
+        slice_object = SliceURNtoSliceObject.get_slice_object(slice_urn)
+        if slice_object is None: return
         now = datetime.datetime.utcnow()
-        for slice_object in SliceURNtoSliceObject.get_slice_objects():
-            # Lock this slice so nobody else can mess with it while we expire
-            # its slivers
-            with slice_object.getLock() :
-                slivers = slice_object.getSlivers()
-                expired_slivers = list()
-                for sliver in slivers.values():
-                    if not sliver.getExpiration() or sliver.getExpiration() < now:
-                        expired_slivers.append(sliver)
-                if len(expired_slivers) != 0 :
-                    self.delete(slice_object, expired_slivers, None)
+        # Lock this slice so nobody else can mess with it while we expire
+        # its slivers
+        with slice_object.getLock() :
+            slivers = slice_object.getSlivers()
+            expired_slivers = list()
+            for sliver_urn in sliver_urns:
+                if sliver_urn not in slivers: continue
+                sliver = slivers[sliver_urn]
+                if not sliver.getExpiration() or sliver.getExpiration() <= now:
+                    expired_slivers.append(sliver)
+            if len(expired_slivers) != 0 :
+                self.delete(slice_object, expired_slivers, None)
+
+    # Return the number of slivers (and slices) pending expiry and
+    # counts of slivers expired by the expiry scheduler
+    def get_expiry_metrics(self):
+        return self._expiry_scheduler.getMetrics()
 
 
     def list_flavors(self):
@@ -781,6 +1003,10 @@ class GramManager :
         if self._snapshot_directory is not None:
             if not os.path.exists(self._snapshot_directory):
                 os.makedirs(self._snapshot_directory)
+            self._snapshot_store = snapshot_store.SnapshotStore( \
+                self._snapshot_directory, config.snapshot_maintain_limit,
+                config.snapshot_max_age_hours * 3600,
+                config.snapshot_max_total_mb * 1024 * 1024)
             # Use the specified one (if any)
             # Otherwise, use the most recent (if indicated)
             # Otherwise, no state to restore
@@ -790,32 +1016,41 @@ class GramManager :
                     config.recover_from_snapshot != "": 
                 snapshot_file = config.recover_from_snapshot
             if not snapshot_file and config.recover_from_most_recent_snapshot:
-                files = self.get_snapshots()
-                if files and len(files) > 0:
-                    snapshot_file = files[len(files)-1]
+                snapshot_file = self._snapshot_store.getLatest()
                 config.logger.info("SNAPSHOT FILE : %s" % snapshot_file)
 #                print 'snapshot file: '
 #                print snapshot_file
+            json_data = []
             if snapshot_file is not None:
                 config.logger.info("Restoring state from snapshot : %s" \
                                        % snapshot_file)
-                SliceURNtoSliceObject._slices = \
-                    Archiving.read_state(snapshot_file, self, self._stitching)
+                json_data = snapshot_journal.replay(snapshot_file)
+                SliceURNtoSliceObject.set_slice_objects( \
+                    Archiving.restore_objects(json_data, self, self._stitching))
                 # Restore the state of the VLAN pools
                 # Go through all the network links and 
                 # if the vlan tag is in the internal pool, allocate it
 
-                for slice_urn, slice_obj in SliceURNtoSliceObject._slices.items():
+                for slice_obj in SliceURNtoSliceObject.get_slice_objects():
                     for network_link in slice_obj.getNetworkLinks():
                         vlan_tag = network_link.getVLANTag()
-                        if vlan_tag and vlan_tag in self._internal_vlans.getAllVLANs():
+                        if vlan_tag and self._internal_vlans.isInPool(vlan_tag):
 #                            config.logger.info("Restored internal VLAN %d" % vlan_tag)
                             self._internal_vlans.allocate(vlan_tag)
 
                 config.logger.info("Restored %d slices" % \
-                                       len(SliceURNtoSliceObject._slices))
-
-    # Clean up expired slices periodically
+                                       len(SliceURNtoSliceObject.get_registry()))
+
+            # Journal subsequent changes against a new snapshot 
+            # of the restored state
+            if config.snapshot_journal:
+                self._journal = snapshot_journal.SnapshotJournal( \
+                    self.new_snapshot_filename, self._stitching, 
+                    self._snapshot_store)
+                self._journal.start(json_data)
+
+    # Clean up expired keystone tokens and dangling security groups 
+    # periodically (slivers are expired by the expiry scheduler)
     def periodic_cleanup(self):
         token_table_user = 'keystone'
         token_table_database = 'keystone'
@@ -823,7 +1058,7 @@ class GramManager :
         while True:
             cmd = None
             try:
-                config.logger.info("Cleaning up expired slivers")
+                config.logger.info("Cleaning up expired keystone tokens")
                 cmd = "mysql -u%s -p%s -h%s %s -e 'DELETE FROM token WHERE NOT DATE_SUB(CURDATE(),INTERVAL %d DAY) <= expires'" % \
                     (token_table_user, config.mysql_password, 
                      config.control_host_addr, token_table_database, 
@@ -853,7 +1088,6 @@ class GramManager :
             except Exception, e:
                 print e
                 
-            self.expire_slivers()
             time.sleep(3000)
 
     # Allocate internal VLAN tags to all links for which the tag is not
@@ -868,32 +1102,31 @@ class GramManager :
         return True
 
 
-    # Remove old snapshots, keeping only last config.snapshot_maintain_limit
+    # Remove old snapshots, keeping only the last 
+    # config.snapshot_maintain_limit (and those within the age and
+    # total size limits).  Snapshots are also pruned as they are written.
     def prune_snapshots(self):
-        files = self.get_snapshots()
-        if files and len(files) > config.snapshot_maintain_limit:
-            files_to_remove = files[0:len(files)-config.snapshot_maintain_limit-1]
-            for file in files_to_remove:
-                os.unlink(file)
-
-    # Return list of files in config.gam_snapshot_directory  in time
-    # ascending order
+        if not self._snapshot_store: return
+        removed = self._snapshot_store.prune()
+        if len(removed) > 0:
+            config.logger.info("Removed %d old snapshots" % len(removed))
+
+    # Return list of snapshot files in config.gam_snapshot_directory  in time
+    # ascending order (not including their journals)
     def get_snapshots(self):
-        files = None
-        if self._snapshot_directory:
-            dir = self._snapshot_directory
-            files = [os.path.join(dir, s) for s in os.listdir(dir)
-                     if os.path.isfile(os.path.join(dir, s))]
-            files.sort(key = lambda s: os.path.getmtime(s))
-        return files
-
-    # Compute the UUIDs of OpenStack objects for all slices
+        if not self._snapshot_store: return None
+        return self._snapshot_store.getSnapshots()
+
+    # Compute the UUIDs of OpenStack objects for the given slices
+    # (or all slices if None)
     # Return dictionary of 'vm_uuids', 'net_uuids', 'router_uuids', 
     #    'subnet_uuids' indexed by tenant_uuid
-    def get_all_slice_info(self):
+    def get_all_slice_info(self, slice_objects=None):
         result = {}
 
-        for slice_urn, slice_object in SliceURNtoSliceObject._slices.items():
+        if slice_objects is None:
+            slice_objects = SliceURNtoSliceObject.get_slice_objects()
+        for slice_object in slice_objects:
             tenant_uuid = slice_object.getTenantUUID()
             result[tenant_uuid] = {}
 
@@ -927,11 +1160,16 @@ class GramManager :
     # Currently defined in OpenStack
     # If any resources in GRAM of a given slice no longer exist in OpenStack
     # Delete the slice
-    def reconcile_state(self):
-#        print "RECONCILING...."
+    # Only the given slices (or all slices if None) are reconciled: 
+    # slices created since startup are consistent
+    def reconcile_state(self, slice_objects=None):
+        if slice_objects is None:
+            slice_objects = SliceURNtoSliceObject.get_slice_objects()
+
+        # Index the resources of the tenants in OpenStack and in GRAM
         os_info = open_stack_interface.get_all_tenant_info()
 #        print "OS_INFO   = %s" % os_info
-        gram_info = self.get_all_slice_info()
+        gram_info = self.get_all_slice_info(slice_objects)
 #        print "GRAM_INFO = %s" % gram_info
 
         # Compare the two sets of tagged UUIDS
@@ -939,40 +1177,40 @@ class GramManager :
         # gram slice has some UUIDs that OS doesn't have or
         # OS slice has some UUIDS that GRAM doesn't have, delete slice
         # from GRAM and OS
-        tenants_to_delete = []
-        for tenant_id, tenant_data in gram_info.items():
-            # Is this a slice in GRAM but not in OpenStack
-            if not tenant_id in os_info:
-                tenants_to_delete.append(tenant_id)
-            else:
-                for key, gram_data in tenant_data.items():
-                    # Is this a slice with the same uuid type but not same
-                    # entries
-                    if key in os_info[tenant_id]:
-                        os_data = os_info[tenant_id][key]
-                        gram_data.sort()
-                        os_data.sort()
-                        if cmp(gram_data, os_data) != 0:
-                            tenants_to_delete.append(tenant_id)
-                            break
-                    else:
-                        # This is a slice with some key in GRAM not in OS
-                        tenants_to_delete.append(tenant_id)
-                        break
+        tenants_to_delete = \
+            reconciliation.findInconsistentTenants(gram_info, os_info)
+
+        # Slices of the other tenants are consistent: let requests for
+        # them proceed
+        tenants_to_delete = set(tenants_to_delete)
+        slices_to_delete = [slice_object for slice_object in slice_objects \
+                                if slice_object.getTenantUUID() in \
+                                tenants_to_delete]
+        urns_to_delete = set([slice_object.getSliceURN() \
+                                  for slice_object in slices_to_delete])
+        self._reconciler.release([slice_object.getSliceURN() \
+                                      for slice_object in slice_objects \
+                                      if slice_object.getSliceURN() not in \
+                                      urns_to_delete])
 
         if len(tenants_to_delete) > 0:
-            config.logger.info("OpenStack and GRAM-internal representations of these tenants are inconsistent: deleting from OpenStack and GRAM %s " % tenants_to_delete)
-            for slice_urn, slice_object in SliceURNtoSliceObject._slices.items():
-                tenant_uuid = slice_object.getTenantUUID()
-                if tenant_uuid in tenants_to_delete:
-                    slice_slivers = slice_object.getSlivers().values()
-                    config.logger.info("Deleting Slice URN = %s" % slice_urn)
-                    self.delete(slice_object, slice_slivers, {})
+            config.logger.info("OpenStack and GRAM-internal representations of these tenants are inconsistent: deleting from OpenStack and GRAM %s " % list(tenants_to_delete))
+            # Delete the slices of all these tenants concurrently
+            deletions = []
+            for slice_object in slices_to_delete:
+                slice_slivers = slice_object.getSlivers().values()
+                config.logger.info("Deleting Slice URN = %s" % \
+                                       slice_object.getSliceURN())
+                deletions.append((slice_object, slice_slivers))
+            self.delete_slices(deletions)
+            self._reconciler.release(urns_to_delete, True)
 
 
 
     def __del__(self) :
         config.logger.info('In destructor')
+        if not self.flush_state(config.persist_flush_timeout):
+            config.logger.error('Failed to persist state on shutdown')
         # open_stack_interface.cleanup(None, None)
 
     def errorResult(self, code, output, am_code=None):
@@ -32,6 +32,7 @@ from gcf.geni.util.tz_util import tzd
 from .gram_manager import *
 from .resources import *
 from .stitching import *
+from .request_rspec import asParsedRequest
 import datetime
 import dateutil.parser
 import xml.dom.minidom
@@ -50,9 +51,8 @@ class GRAM_Resource_Manager(Base_Resource_Manager):
             creds = [credential.Credential(string=c) for c in credentials]
             
             # Grab info about  current slivers
-            slices = SliceURNtoSliceObject._slices
-            for slice_urn in slices:
-                slice_obj = slices[slice_urn]
+            for slice_obj in SliceURNtoSliceObject.get_slice_objects():
+                slice_urn = slice_obj.getSliceURN()
                 slivers = slice_obj.getSlivers()
                 for sliver_urn, sliver_obj in slivers.items():
                     user_urn = sliver_obj.getUserURN() 
@@ -103,7 +103,7 @@ class GRAM_Resource_Manager(Base_Resource_Manager):
                              }
                     resource_info.append(entry)
 
-                self.processCapacity(resource_info, rspec, 'not_set_yet', slice_urn, user_urn, 
+                self.processCapacity(resource_info, rspec_raw, 'not_set_yet', slice_urn, user_urn, 
                                 start_time, end_time)
 
         elif method_name in [AM_Methods.RENEW_SLIVER_V2, AM_Methods.RENEW_V3]:
@@ -124,7 +124,8 @@ class GRAM_Resource_Manager(Base_Resource_Manager):
 
             if method_name == AM_Methods.RENEW_SLIVER_V2:
                 the_slice_urn = arguments['slice_urn']
-                the_slice = SliceURNtoSliceObject._slices[the_slice_urn]
+                the_slice = \
+                    SliceURNtoSliceObject.get_slice_object(the_slice_urn)
                 slivers = the_slice.getSlivers().values()
             else:
                 urns = arguments['urns']
@@ -142,12 +143,14 @@ class GRAM_Resource_Manager(Base_Resource_Manager):
     def processCapacity(self, resource_info, rspec, sliver_urn, slice_urn, 
                         user_urn, start_time, end_time):
         stitching = Stitching()
+        rspec = asParsedRequest(rspec)
+        backend = rspec.getBackend()
         error_string, error_code, details = stitching.parseRequestRSpec(rspec)
 #        print "S = %s C = %s D = %s" % (error_string, error_code, details)
         if error_code == 0 and details is not None:
             for link_id, hop in details['my_hops_by_path_id'].items():
-                for capacity in hop.getElementsByTagName('capacity'):
-                    capacity_value = int(capacity.childNodes[0].nodeValue)
+                for capacity in backend.findAll(hop, 'capacity'):
+                    capacity_value = int(backend.getText(capacity))
                     entry = { 'sliver_urn' : sliver_urn,
                               'slice_urn' : slice_urn,
                               'user_urn' : user_urn,
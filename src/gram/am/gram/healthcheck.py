@@ -314,10 +314,10 @@ def check_mgmt_ns(recreate=False):
                   cmd = ("%s net-create " + mgmt_net_name + " --provider:network_type vlan --provider:physical_network physnet2 --provider:segmentation_id " + mgmt_net_vlan + " --shared") % config.network_type
                   osi._execCommand(cmd)
                   cmd = ("%s subnet-create " + mgmt_net_name + " " + mgmt_net_cidr) % config.network_type
-                  output = osi._execCommand(cmd)
+                  output = osi._execTableCommand(cmd)
                   MGMT_SUBNET_ID = osi._getValueByPropertyName(output, 'id')
                   cmd = ("%s net-create public --router:external=True") % config.network_type
-                  output = osi._execCommand(cmd)
+                  output = osi._execTableCommand(cmd)
                   PUBLIC_NET_ID = osi._getValueByPropertyName(output, 'id') 
                   cmd = ("%s subnet-create --allocation_pool" + \
                         " start=" + public_subnet_start_ip + \
@@ -328,7 +328,7 @@ def check_mgmt_ns(recreate=False):
 
                   output = osi._execCommand(cmd)
                   cmd = ("%s router-create externalRouter") % config.network_type
-                  output = osi._execCommand(cmd)
+                  output = osi._execTableCommand(cmd)
                   EXTERNAL_ROUTER_ID = osi._getValueByPropertyName(output, 'id')
                   cmd = ("%s router-gateway-set externalRouter " +  PUBLIC_NET_ID) % config.network_type
                   output = osi._execCommand(cmd)
@@ -0,0 +1,561 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# In-process client for the OpenStack REST APIs (keystone v2.0, nova v2,
+# neutron v2.0).
+#
+# The CLI backend in open_stack_interface forks a python interpreter per
+# call and each of those fetches a fresh keystone token.  This client
+# instead keeps a cache of tokens (and the service catalogs that come with
+# them) per set of credentials, and a pool of keep-alive HTTP connections
+# per service endpoint.  Calls return the decoded JSON bodies.
+#
+# The client is selected by setting config.openstack_api_backend to 'rest'.
+# All URLs come from config.os_auth_url/service_endpoint and the keystone
+# service catalog, so the client can be pointed at a local stub server.
+
+import base64
+import calendar
+import datetime
+import errno
+import httplib
+import json
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+import config
+
+
+class OpenStackAPIError(Exception):
+    """
+        Raised when an OpenStack service returns an error status or
+        cannot be reached.
+    """
+    def __init__(self, method, url, status, reason, body=None):
+        self.method = method
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.body = body
+        Exception.__init__(self, '%s %s returned %s %s' % \
+                               (method, url, status, reason))
+
+
+class HTTPConnectionPool:
+    """
+        Pool of persistent (keep-alive) HTTP connections, kept per
+        (scheme, host, port).  A connection is checked out for the
+        duration of one request/response exchange and then returned.
+    """
+    def __init__(self, max_idle_per_host=8, timeout=60):
+        self._lock = threading.Lock()
+        self._idle = {} # (scheme, host, port) => list of idle connections
+        self._max_idle_per_host = max_idle_per_host
+        self._timeout = timeout
+
+    def _newConnection(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port, timeout=self._timeout)
+        return httplib.HTTPConnection(host, port, timeout=self._timeout)
+
+    def _checkout(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._newConnection(key), False
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self._max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None):
+        """
+            Issue a request and return (status, reason, response_body).
+            A pooled connection that turns out to have been closed by the
+            server (no response came back at all) is discarded and the 
+            request is retried on a fresh connection.  Other failures,
+            timeouts included, are not retried since the server may 
+            have acted on the request.
+        """
+        parsed = urlparse.urlsplit(url)
+        scheme = parsed.scheme or 'http'
+        port = parsed.port
+        if port is None:
+            port = scheme == 'https' and 443 or 80
+        key = (scheme, parsed.hostname, port)
+        path = parsed.path or '/'
+        if parsed.query:
+            path = path + '?' + parsed.query
+
+        while True:
+            conn, reused = self._checkout(key)
+            try:
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                if reused and _isStaleConnectionError(e):
+                    # Stale keep-alive connection; try again on a new one
+                    continue
+                raise OpenStackAPIError(method, url, None, str(e))
+            if response.getheader('connection', '').lower() == 'close':
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return response.status, response.reason, data
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+
+
+# Errors of a request on a keep-alive connection that the server had
+# already closed: it never saw the request
+STALE_CONNECTION_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+def _isStaleConnectionError(e):
+    if isinstance(e, httplib.BadStatusLine): return True
+    return isinstance(e, socket.error) and \
+        not isinstance(e, socket.timeout) and \
+        e.errno in STALE_CONNECTION_ERRNOS
+
+
+class _Token:
+    """
+        A keystone token and the service catalog issued with it.
+    """
+    # Tokens are refreshed this many seconds before keystone expires them
+    REFRESH_MARGIN = 60
+
+    def __init__(self, token_id, expires, catalog):
+        self.token_id = token_id
+        self.expires = expires # time.time() at which the token expires
+        self.catalog = catalog # service type => endpoint dictionary
+
+    def isValid(self):
+        return self.expires is None or \
+            time.time() < self.expires - _Token.REFRESH_MARGIN
+
+
+class OpenStackClient:
+    """
+        Client for the OpenStack REST services used by GRAM.
+
+        Most calls are made with the GRAM (cloud admin) credentials from
+        config.  Calls that must be made on behalf of a slice tenant
+        (security groups, booting VMs) take a credentials tuple of
+        (user_name, password, tenant_name).
+    """
+
+    def __init__(self, auth_url, username, password, tenant_name,
+                 region_name=None, pool=None):
+        self._auth_url = auth_url.rstrip('/')
+        self._admin_credentials = (username, password, tenant_name)
+        self._region_name = region_name
+        self._pool = pool or HTTPConnectionPool()
+        self._tokens = {} # credentials tuple => _Token
+        self._tokens_lock = threading.Lock()
+
+    ### Tokens and endpoints
+
+    def _parseExpiration(self, expires):
+        if not expires: return None
+        expires = expires.rstrip('Z')
+        if '.' in expires: expires = expires[:expires.index('.')]
+        dt = datetime.datetime.strptime(expires, "%Y-%m-%dT%H:%M:%S")
+        return calendar.timegm(dt.timetuple())
+
+    def _authenticate(self, credentials):
+        username, password, tenant_name = credentials
+        body = {'auth' : {'tenantName' : tenant_name,
+                          'passwordCredentials' : {'username' : username,
+                                                   'password' : password}}}
+        url = self._auth_url + '/tokens'
+        status, reason, data = \
+            self._pool.request('POST', url, json.dumps(body),
+                               {'Content-Type' : 'application/json',
+                                'Accept' : 'application/json'})
+        if status != 200:
+            raise OpenStackAPIError('POST', url, status, reason, data)
+
+        access = json.loads(data)['access']
+        catalog = {}
+        for service in access.get('serviceCatalog', []):
+            endpoints = service.get('endpoints', [])
+            if self._region_name:
+                in_region = [ep for ep in endpoints \
+                                 if ep.get('region') == self._region_name]
+                if in_region: endpoints = in_region
+            if endpoints:
+                catalog[service['type']] = endpoints[0]
+        token = access['token']
+        return _Token(token['id'], self._parseExpiration(token.get('expires')),
+                      catalog)
+
+    def _getToken(self, credentials):
+        with self._tokens_lock:
+            token = self._tokens.get(credentials)
+            if token and token.isValid():
+                return token
+        token = self._authenticate(credentials)
+        with self._tokens_lock:
+            self._tokens[credentials] = token
+        return token
+
+    def _invalidateToken(self, credentials):
+        with self._tokens_lock:
+            if credentials in self._tokens:
+                del self._tokens[credentials]
+
+    def _endpoint(self, token, service_type):
+        if service_type == 'identity':
+            # Tenant and user management goes to the keystone admin API
+            if 'identity' in token.catalog and \
+                    'adminURL' in token.catalog['identity']:
+                return token.catalog['identity']['adminURL']
+            return config.service_endpoint
+        if service_type not in token.catalog:
+            raise OpenStackAPIError(None, service_type, None,
+                                    'No endpoint in service catalog')
+        endpoint = token.catalog[service_type]
+        return endpoint.get('adminURL') or endpoint.get('publicURL')
+
+    def _request(self, service_type, method, path, body=None,
+                 credentials=None, query=None):
+        """
+            Issue a request against the given service and return the
+            decoded JSON response (None for an empty body).  On a 401 the
+            cached token is dropped and the request is retried once.
+        """
+        credentials = credentials or self._admin_credentials
+        if body is not None:
+            body = json.dumps(body)
+        for attempt in range(2):
+            token = self._getToken(credentials)
+            url = self._endpoint(token, service_type).rstrip('/') + path
+            if query:
+                url = url + '?' + urllib.urlencode(query, True)
+            headers = {'X-Auth-Token' : token.token_id,
+                       'Accept' : 'application/json'}
+            if body is not None:
+                headers['Content-Type'] = 'application/json'
+            status, reason, data = \
+                self._pool.request(method, url, body, headers)
+            if status == 401 and attempt == 0:
+                self._invalidateToken(credentials)
+                continue
+            if status >= 400:
+                raise OpenStackAPIError(method, url, status, reason, data)
+            if not data:
+                return None
+            return json.loads(data)
+
+    def close(self):
+        self._pool.close()
+
+    ### Identity (keystone v2.0 admin API)
+
+    def create_tenant(self, tenant_name):
+        body = {'tenant' : {'name' : tenant_name, 'enabled' : True}}
+        return self._request('identity', 'POST', '/tenants', body)['tenant']
+
+    def delete_tenant(self, tenant_uuid):
+        self._request('identity', 'DELETE', '/tenants/%s' % tenant_uuid)
+
+    def list_tenants(self):
+        return self._request('identity', 'GET', '/tenants')['tenants']
+
+    def create_user(self, user_name, password, tenant_uuid):
+        body = {'user' : {'name' : user_name, 'password' : password,
+                          'tenantId' : tenant_uuid, 'enabled' : True}}
+        return self._request('identity', 'POST', '/users', body)['user']
+
+    def delete_user(self, user_uuid):
+        self._request('identity', 'DELETE', '/users/%s' % user_uuid)
+
+    def list_users(self):
+        return self._request('identity', 'GET', '/users')['users']
+
+    def list_roles(self):
+        return self._request('identity', 'GET', '/OS-KSADM/roles')['roles']
+
+    def add_user_role(self, user_uuid, role_uuid, tenant_uuid):
+        path = '/tenants/%s/users/%s/roles/OS-KSADM/%s' % \
+            (tenant_uuid, user_uuid, role_uuid)
+        self._request('identity', 'PUT', path)
+
+    ### Compute (nova v2)
+
+    def create_security_group(self, name, description, credentials):
+        body = {'security_group' : {'name' : name,
+                                    'description' : description}}
+        return self._request('compute', 'POST', '/os-security-groups', body,
+                             credentials)['security_group']
+
+    def add_security_group_rule(self, group_id, protocol, from_port, to_port,
+                                cidr, credentials):
+        body = {'security_group_rule' : {'parent_group_id' : group_id,
+                                         'ip_protocol' : protocol,
+                                         'from_port' : from_port,
+                                         'to_port' : to_port,
+                                         'cidr' : cidr}}
+        return self._request('compute', 'POST', '/os-security-group-rules',
+                             body, credentials)['security_group_rule']
+
+    def list_security_groups(self, credentials):
+        return self._request('compute', 'GET', '/os-security-groups',
+                             credentials=credentials)['security_groups']
+
+    def delete_security_group(self, group_id, credentials):
+        self._request('compute', 'DELETE', '/os-security-groups/%s' % group_id,
+                      credentials=credentials)
+
+    def boot_server(self, name, image_id, flavor_id, networks,
+                    security_groups, credentials, user_data=None,
+                    availability_zone=None, different_host=None,
+                    config_drive=True):
+        """
+            Boot a server.  networks is a list of {'uuid' : net_uuid} or
+            {'port' : port_uuid} dictionaries.  Returns the server
+            dictionary (with 'id') without waiting for the boot to finish.
+        """
+        server = {'name' : name, 'imageRef' : image_id,
+                  'flavorRef' : flavor_id, 'networks' : networks,
+                  'config_drive' : config_drive,
+                  'security_groups' : \
+                      [{'name' : group} for group in security_groups]}
+        if user_data is not None:
+            server['user_data'] = base64.b64encode(user_data)
+        if availability_zone:
+            server['availability_zone'] = availability_zone
+        body = {'server' : server}
+        if different_host:
+            body['os:scheduler_hints'] = {'different_host' : different_host}
+        return self._request('compute', 'POST', '/servers', body,
+                             credentials)['server']
+
+    def show_server(self, server_uuid):
+        return self._request('compute', 'GET',
+                             '/servers/%s' % server_uuid)['server']
+
+    def list_servers(self, tenant_uuid=None):
+        query = {'all_tenants' : 1}
+        if tenant_uuid: query['tenant_id'] = tenant_uuid
+        return self._request('compute', 'GET', '/servers/detail',
+                             query=query)['servers']
+
+    def delete_server(self, server_uuid):
+        self._request('compute', 'DELETE', '/servers/%s' % server_uuid)
+
+    def server_action(self, server_uuid, action, args=None):
+        return self._request('compute', 'POST',
+                             '/servers/%s/action' % server_uuid,
+                             {action : args})
+
+    def get_console_output(self, server_uuid, length=None):
+        args = {}
+        if length is not None: args['length'] = length
+        return self.server_action(server_uuid, 'os-getConsoleOutput',
+                                  args)['output']
+
+    def list_hypervisors(self):
+        return self._request('compute', 'GET', '/os-hypervisors')['hypervisors']
+
+    def list_hosts(self):
+        return self._request('compute', 'GET', '/os-hosts')['hosts']
+
+    ### Networking (neutron/quantum v2.0)
+
+    def _networkRequest(self, method, path, body=None, query=None):
+        return self._request('network', method, '/v2.0' + path, body,
+                             query=query)
+
+    def create_network(self, name, tenant_uuid, vlan_tag,
+                       physical_network='physnet1'):
+        body = {'network' : {'name' : name, 'tenant_id' : tenant_uuid,
+                             'provider:network_type' : 'vlan',
+                             'provider:physical_network' : physical_network,
+                             'provider:segmentation_id' : vlan_tag}}
+        return self._networkRequest('POST', '/networks', body)['network']
+
+    def list_networks(self, **filters):
+        return self._networkRequest('GET', '/networks',
+                                    query=filters)['networks']
+
+    def delete_network(self, network_uuid):
+        self._networkRequest('DELETE', '/networks/%s' % network_uuid)
+
+    def create_subnet(self, network_uuid, tenant_uuid, cidr, gateway_ip,
+                      start_ip, end_ip):
+        body = {'subnet' : {'network_id' : network_uuid,
+                            'tenant_id' : tenant_uuid,
+                            'ip_version' : 4, 'cidr' : cidr,
+                            'gateway_ip' : gateway_ip,
+                            'allocation_pools' : [{'start' : start_ip,
+                                                   'end' : end_ip}]}}
+        return self._networkRequest('POST', '/subnets', body)['subnet']
+
+    def list_subnets(self, **filters):
+        return self._networkRequest('GET', '/subnets',
+                                    query=filters)['subnets']
+
+    def create_router(self, name, tenant_uuid):
+        body = {'router' : {'name' : name, 'tenant_id' : tenant_uuid}}
+        return self._networkRequest('POST', '/routers', body)['router']
+
+    def list_routers(self, **filters):
+        return self._networkRequest('GET', '/routers',
+                                    query=filters)['routers']
+
+    def delete_router(self, router_uuid):
+        self._networkRequest('DELETE', '/routers/%s' % router_uuid)
+
+    def add_router_interface(self, router_uuid, subnet_uuid):
+        return self._networkRequest('PUT',
+                                    '/routers/%s/add_router_interface' % \
+                                        router_uuid,
+                                    {'subnet_id' : subnet_uuid})
+
+    def remove_router_interface(self, router_uuid, subnet_uuid):
+        return self._networkRequest('PUT',
+                                    '/routers/%s/remove_router_interface' % \
+                                        router_uuid,
+                                    {'subnet_id' : subnet_uuid})
+
+    def create_port(self, network_uuid, tenant_uuid, subnet_uuid,
+                    ip_address=None):
+        fixed_ip = {'subnet_id' : subnet_uuid}
+        if ip_address: fixed_ip['ip_address'] = ip_address
+        body = {'port' : {'network_id' : network_uuid,
+                          'tenant_id' : tenant_uuid,
+                          'fixed_ips' : [fixed_ip]}}
+        return self._networkRequest('POST', '/ports', body)['port']
+
+    def list_ports(self, **filters):
+        return self._networkRequest('GET', '/ports', query=filters)['ports']
+
+    def delete_port(self, port_uuid):
+        self._networkRequest('DELETE', '/ports/%s' % port_uuid)
+
+    def create_floatingip(self, external_network_uuid, tenant_uuid,
+                          port_uuid=None):
+        floatingip = {'floating_network_id' : external_network_uuid,
+                      'tenant_id' : tenant_uuid}
+        if port_uuid: floatingip['port_id'] = port_uuid
+        return self._networkRequest('POST', '/floatingips',
+                                    {'floatingip' : floatingip})['floatingip']
+
+    def list_floatingips(self, **filters):
+        return self._networkRequest('GET', '/floatingips',
+                                    query=filters)['floatingips']
+
+    def delete_floatingip(self, floatingip_uuid):
+        self._networkRequest('DELETE', '/floatingips/%s' % floatingip_uuid)
+
+
+# The shared client instance, created on first use
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """
+        Return the shared OpenStackClient built from the os_* parameters
+        in config.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenStackClient(config.os_auth_url, config.os_username,
+                                      config.os_password,
+                                      config.os_tenant_name,
+                                      config.os_region_name)
+        return _client
+
+
+if __name__ == "__main__":
+    # Exercise the client against a local stub of the keystone and
+    # neutron APIs:  python open_stack_client.py
+    import BaseHTTPServer
+    import logging
+    logging.basicConfig()
+
+    class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # Keep connections alive
+        connections = set()
+        def log_message(self, format, *args): pass
+        def _reply(self, status, body):
+            data = json.dumps(body)
+            StubHandler.connections.add(self.client_address)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        def do_POST(self):
+            length = int(self.headers.getheader('content-length', 0))
+            body = json.loads(self.rfile.read(length))
+            base = 'http://127.0.0.1:%d' % self.server.server_port
+            if self.path == '/v2.0/tokens':
+                self._reply(200, {'access' : {
+                            'token' : {'id' : 'TOKEN',
+                                       'expires' : '2099-01-01T00:00:00Z'},
+                            'serviceCatalog' : [
+                                {'type' : 'identity', 'endpoints' : \
+                                     [{'adminURL' : base + '/v2.0'}]},
+                                {'type' : 'network', 'endpoints' : \
+                                     [{'adminURL' : base}]}]}})
+            elif self.path == '/v2.0/tenants':
+                self._reply(200, {'tenant' : {'id' : 'T1',
+                                              'name' : body['tenant']['name']}})
+            else:
+                self._reply(404, {})
+        def do_GET(self):
+            self._reply(200, {'networks' : [{'id' : 'N1', 'name' : 'net1'}]})
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StubHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.setDaemon(True)
+    server_thread.start()
+
+    client = OpenStackClient('http://127.0.0.1:%d/v2.0' % server.server_port,
+                             'admin', 'pwd', 'admin')
+    print "TENANT = %s" % client.create_tenant('slice1')
+    for i in range(10):
+        networks = client.list_networks(tenant_id='T1')
+    print "NETWORKS = %s" % networks
+    print "CONNECTIONS USED = %d" % len(StubHandler.connections)
+    client.close()
+    server.shutdown()
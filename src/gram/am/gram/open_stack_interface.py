@@ -23,7 +23,6 @@
 
 import subprocess
 import pdb
-import re
 import time
 import tempfile
 import os
@@ -39,8 +38,16 @@ import resources
 import config
 import constants
 import utils
+import cli_output
 import gen_metadata
 import manage_ssh_proxy
+import open_stack_client
+import boot_tracker
+import status_cache
+import boot_watcher
+import provisioning
+import deletion
+from open_stack_client import OpenStackAPIError
 
 from xml.dom.minidom import *
 
@@ -56,14 +63,24 @@ def init() :
     """
     # Get the UUID of the GRAM management network
     mgmt_net_name = config.management_network_name 
-    cmd_string = '%s net-list' % config.network_type
-    try :
-        output = _execCommand(cmd_string)
-    except :
-        config.logger.error('GRAM AM failed at init.  Failed to do a quantum/neutron net-list')
-        sys.exit(1)
-        
-    mgmt_net_uuid = _getUUIDByName(output, mgmt_net_name)
+    client = _apiClient()
+    if client :
+        try :
+            nets = client.list_networks(name=mgmt_net_name)
+        except OpenStackAPIError :
+            config.logger.error('GRAM AM failed at init.  Failed to list networks')
+            sys.exit(1)
+        mgmt_net_uuid = None
+        if len(nets) > 0 : mgmt_net_uuid = nets[0]['id']
+    else :
+        cmd_string = '%s net-list' % config.network_type
+        try :
+            nets = _execTableCommand(cmd_string)
+        except :
+            config.logger.error('GRAM AM failed at init.  Failed to do a quantum/neutron net-list')
+            sys.exit(1)
+        mgmt_net_uuid = nets.getUUIDByName(mgmt_net_name)
+
     if mgmt_net_uuid == None :
         config.logger.error('GRAM AM failed at init.  Failed to find the GRAM management network %s' % mgmt_net_name)
         sys.exit(1)
@@ -76,6 +93,17 @@ def init() :
     #print output2
 
     
+def _apiClient() :
+    """
+        Returns the shared OpenStack REST client if GRAM is configured to
+        talk to OpenStack through its REST APIs (openstack_api_backend is
+        'rest').  Returns None if the command line clients are to be used.
+    """
+    if config.openstack_api_backend == 'rest' :
+        return open_stack_client.get_client()
+    return None
+
+
 def cleanup(signal, frame) :
     """
         Perform OpenStack related cleanup.  Called when the aggregate 
@@ -94,14 +122,19 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
            users is a list of dictionaries [keys=>list_of_ssh_keys,
                                             urn=>user_urn]
 
+        The OpenStack operations are run as steps of a ProvisioningEngine:
+        a step starts as soon as the steps it depends on have completed,
+        so independent networks, ports and VMs are created concurrently.
+
         Returns None on success
         Returns an error message string on failure.  Failure to provision 
         any sliver results in the entire provision call being rolled back.
     """
+    engine = provisioning.ProvisioningEngine(config.provisioning_max_workers)
+
     # Create a new tenant for this slice if we don't already have one.  We
     # will not have a tenant_id associated with this slice if this is the
     # first time allocate is called for this slice.
-    #import pdb; pdb.set_trace()
     if geni_slice.getTenantUUID() == None :
         # Create a tenant_name out of the slice_urn.  Slice urn is of the form
         # urn:publicid:IDN+geni:gpo:gcf+slice+sliceName.  Tenant_name is 
@@ -112,85 +145,14 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
         slice_urn = geni_slice.getSliceURN()
         tenant_name = slice_urn[slice_urn.rfind('IDN+') + 4 : ]
         geni_slice.setTenantName(tenant_name)
-
-        # Create a new tenant and set the tenant UUID in the Slice object
-        tenant_uuid = _createTenant(tenant_name)
-        if tenant_uuid == None :
-            # Failed to create a tenant.  Cleanup actions before
-            # we return:
-            #    - nothing to cleanup
-            return 'GRAM internal error: OpenStack failed to create a tenant for slice %s' % geni_slice.getSliceURN()
-        else :
-            geni_slice.setTenantUUID(tenant_uuid)
-
-        # Create a admin user account for this tenant
-        admin_user_info = _createTenantAdmin(tenant_name, tenant_uuid)
-        if ('admin_name' in admin_user_info) and  \
-                ('admin_pwd' in admin_user_info) and \
-                ('admin_uuid' in admin_user_info) :
-            geni_slice.setTenantAdminInfo(admin_user_info['admin_name'], 
-                                          admin_user_info['admin_pwd'],
-                                          admin_user_info['admin_uuid'])
-        else :
-            # Failed to create tenant admin.  Cleanup actions before 
-            # we return:
-            #    - delete the tenant
-            #_deleteTenantByUUID(tenant_uuid)
-            return 'GRAM internal error: OpenStack failed to create a tenant admin for slice %s' % geni_slice.getSliceURN()
-
-        
-        # Create a security group for this tenant
-        # NOTE: This tenant specific security group support is necessary 
-        # to implement the GRAM SSH proxy
-        secgroup_name = \
-            _createTenantSecurityGroup(tenant_name,
-                                       admin_user_info['admin_name'],
-                                       admin_user_info['admin_pwd'])
-            
-        if (secgroup_name != None) :
-            geni_slice.setSecurityGroup(secgroup_name)
-        else :
-            # Failed to create security group.  Cleanup actions before 
-            # we return:
-            #    - delete tenant admin
-            #    - delete tenant
-            #_deleteUserByUUID(admin_user_info['admin_uuid'])
-            #_deleteTenantByUUID(tenant_uuid)
-            return 'GRAM internal error: OpenStack failed to create a security group for slice %s' % geni_slice.getSliceURN()
-        
-
-        ### This section of code is being commented out until we
-        ### have namespaces working and can do per slice/tenant routers
-        # Create a router for this tenant.  The name of this router is 
-        # R-tenant_name.
-        router_name = 'R-%s' % tenant_name
-        geni_slice.setTenantRouterName(router_name)
-        router_uuid = _createRouter(tenant_uuid, router_name)
-        if router_uuid != None :
-            geni_slice.setTenantRouterUUID(router_uuid)
-            config.logger.info('Created tenant router %s with uuid = %s' %
-                            (router_name, router_uuid))
-        else:
-            print "Not your lucky day!"
-            #INSERT ERROR HANDLING CODE
-
+        _addTenantSteps(engine, geni_slice, tenant_name)
 
         ### This section of code should be commented out when we have
         ### namespaces working.
         #router_name = config.external_router_name
         #geni_slice.setTenantRouterName(router_name)
         #geni_slice.setTenantRouterUUID(_getRouterUUID(router_name))
-    else :
-        # Tenant, tenant admin, tenant_router already exist.  Set variables
-        # that are used be code below
-        tenant_name = geni_slice.getTenantName()
-        tenant_uuid = geni_slice.getTenantUUID()
-        admin_name, admin_pwd, admin_uuid = geni_slice.getTenantAdminInfo()
-        admin_user_info = { 'admin_name' : admin_name,
-                            'admin_pwd' : admin_pwd,
-                            'admin_uuid' : admin_uuid }
 
-    # We provision all the links before we provision the VMs
     # Walk through the list of sliver_objects in slivers and create two list:
     # links_to_be_provisioned and vms_to_be_provisioned
     links_to_be_provisioned = list()
@@ -206,10 +168,12 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
                            (len(links_to_be_provisioned), 
                             len(vms_to_be_provisioned))) 
 
+    # Subnet and IP address assignment is done here, before any OpenStack
+    # operations are started, so the steps never race for addresses
     subnets_used = []
     for link in links_to_be_provisioned:
         if link.getSubnet() != None:
-            subnets_used.append(link.getSubnet)
+            subnets_used.append(link.getSubnet())
 
     used_ips = []
     for vm in vms_to_be_provisioned :
@@ -225,12 +189,7 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
                    # NIC is not connected to a link.  Go to next NIC
                     break
 
-                subnet = link.getSubnet()
-                if not subnet:
-                    subnet = geni_slice.generateSubnetAddress()
-                    while subnet in subnets_used:
-                        subnet = geni_slice.generateSubnetAddress()
-                    link.setSubnet(subnet)
+                subnet = _assignSubnet(geni_slice, link, subnets_used)
                 subnet_addr = netaddr.IPNetwork(subnet)
                 for i in range(1,len(subnet_addr)):
                     if not subnet_addr[i] in used_ips:
@@ -238,95 +197,43 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
                         nic.setNetmask('255.255.255.0')
                         used_ips.append(subnet_addr[i])
                         break
-                
-    # For each VirtualMachine object in the slice, create an  
-            
-    # For each link to be provisioned, set up a quantum/neutron network and subnet if
-    # it does not already have one.  (It will have a quantum/neutron network and 
-    # subnet if it was provisioned by a previous call to provision.)
-    links_created_this_call = list()  # Links created by this call to provision
+
+    # For each link to be provisioned, set up a quantum/neutron network and
+    # subnet if it does not already have one.  (It will have a quantum/neutron
+    # network and subnet if it was provisioned by a previous call to 
+    # provision.)  Networks are attached to the tenant router.
+    link_steps = []
     for link in links_to_be_provisioned :
         if link.getUUID() == None :
-            # This network link has not been set up
-            uuids = _createNetworkForLink(link,used_ips)
-            if uuids == None :
-                # Failed to create this network link.  Cleanup actions before
-                # we return:
-                #    - delete the network links created so far in this
-                #      call to provisionResources
-                #    - delete tenant admin
-                #    - delete tenant
-                #for i in range(0, len(links_created_this_call)) :
-                #    _deleteNetworkLink(geni_slice, links_created_this_call)
-                #_deleteUserByUUID(admin_user_info['admin_uuid'])
-                #_deleteTenantByUUID(tenant_uuid)
-                return 'GRAM internal error: Failed to create a network for link %s' % link.getName()
-
-            link.setNetworkUUID(uuids['network_uuid'])
-            link.setSubnetUUID(uuids['subnet_uuid'])
-            link.setUUID(uuids['network_uuid'])
-            link.setAllocationState(constants.provisioned)
-            links_created_this_call.append(uuids['network_uuid'])
-            link.setAllocationState(constants.provisioned)
-            link.setOperationalState(constants.ready)
-
-    # Find the VLANs used by this slice
-    nets_info = _getNetsForTenant(tenant_uuid)
-    if nets_info == None :
-        # Failed to get information on networks  Cleanup actions before 
-        # we return:
-        #    - delete the network links created so far in this
-        #      call to provisionResources
-        #    - delete tenant admin
-        #    - delete tenant
-        #for i in range(0, len(links_created_this_call)) :
-        #    _deleteNetworkLink(geni_slice, links_created_this_call)
-        #_deleteUserByUUID(admin_user_info['admin_uuid'])
-        #_deleteTenantByUUID(tenant_uuid)
-        return 'GRAM internal error: Failed to get vlan ids for networks created for slice  %s' % geni_slice.getSliceURN()
+            _assignSubnet(geni_slice, link, subnets_used)
+            link_steps.append(_addLinkStep(engine, link, used_ips))
 
-    for net_uuid in nets_info.keys():
-        net_info = nets_info[net_uuid]
-        vlan = net_info['vlan']
-#        if net_uuid == control_net_info['control_net_uuid']:
-#            config.logger.info("Setting control net vlan to " + str(vlan))
-#            control_net_info['control_net_vlan'] = vlan
-#        else:
-        for link in geni_slice.getNetworkLinks():
-            if link.getNetworkUUID() == net_uuid:
-                name = net_info['name']
-                config.logger.info("Setting data net " + name + " VLAN to " + vlan)
-                link.setVLANTag(vlan)
+    # Find the VLANs used by this slice once all its networks exist
+    engine.addStep('vlans', lambda: _setVLANTagsForSlice(geni_slice), 
+                   link_steps)
 
-    # For each VM, assign IP addresses to all its interfaces that are
-    # connected to a network link
-    for vm in vms_to_be_provisioned :
-        for nic in vm.getNetworkInterfaces() :
-            nic.enable()
-            #if nic.getIPAddress() == None :
-                # NIC needs an IP, if it is connected to a link
-            #    link = nic.getLink()
-            #    if link == None :
-                    # NIC is not connected to a link.  Go to next NIC
-            #        break
-                
-                # NIC is connected to a link.  We assign an IP address to the
-                # NIC only if the link it is connected to has been created
-           #     if link.getUUID() == None :
-                    # NIC is not connected to a link that not been 
-                    # provisioned.  Go to next NIC
-           #         break
-
-                # NIC is connected to a link that has been provisioned. Give
-                # it an IP address.  If IP addresses are from the 
-                # 10.0.x.0/24 subnet, this interface gets the
-                # ip address 10.0.x.nnn where nnn is the last octet for this vm
-          #      subnet_addr = link.getSubnet()
-          #      subnet_prefix = subnet_addr[0 : subnet_addr.rfind('0/24')]
-          #      nic.setIPAddress(str(netaddr.IPNetwork(subnet_addr)[vm.getLastOctet()]))
+    # Find out the number of compute nodes we have
+    compute_nodes = {}
+    def countComputeNodes() :
+        compute_nodes['count'] = _getComputeNodeCount()
+        config.logger.info('Number of compute nodes = %s' % \
+                               compute_nodes['count'])
+    engine.addStep('compute_nodes', countComputeNodes)
+
+    # Before we create the VMs, we get a list of usernames that get accounts
+    # on the VMs when they are created
+    user_names = list() 
+    for user in users :
+        for key in user.keys() :
+            # Found a user, there should only be one of these per key in 'user'
+            if key == "urn" :
+                # We have a urn for the user.  The username is the part of the
+                # urn that follows the last +
+                user_names.append(user[key].split('+')[-1])
 
     # For each VirtualMachine object in the slice, create an OpenStack
-    # VM if such a VM has not already been created.
+    # VM if such a VM has not already been created.  A VM is created once
+    # the ports for its experiment NICs exist.
     # We try to put the VMs on different compute nodes.  The algorithm for
     # doing this on a rack with N compute nodes is:
     #    1. Let openstack (nova) pick a location for the 1st VM i.e. we don't
@@ -339,86 +246,271 @@ def provisionResources(geni_slice, slivers, users, gram_manager) :
     #    3. For the remaining VMs, we don't provide nova with any placements
     #       hints.  We'll let the nova scheduler pick compute nodes for 
     #       these VMs.
-
-    # Find out the number of compute nodes we have
-    num_compute_nodes = _getComputeNodeCount()
-    config.logger.info('Number of compute nodes = %s' % num_compute_nodes)
-    
-    create_return = _createAllVMs(vms_to_be_provisioned, num_compute_nodes, 
-                                  users, gram_manager, geni_slice)
-    return create_return
-
-def _createAllVMs(vms_to_be_provisioned, num_compute_nodes, users, gram_manager, slice_object):
-    num_vms_created = 0    # number of VMs created in this provision call
+    # As VMs are booted concurrently, the hints for a VM are the VMs of
+    # this call that nova has accepted when its creation starts.
     vm_uuids = []  # List of uuids of VMs created in this provision call
-
-    # Before we create the VMs, we get a list of usernames that get accounts
-    # on the VMs when they are created
-    user_names = list() 
-    for user in users :
-        for key in user.keys() :
-            # Found a user, there should only be one of these per key in 'user'
-            if key == "urn" :
-                # We have a urn for the user.  The username is the part of the
-                # urn that follows the last +
-                user_names.append(user[key].split('+')[-1])
-          
-
-    # For efficiency, create all VM's in parallel and then wait for them
-    # these threads to finish before returning
-    creation_threads = {}
+    vm_uuids_lock = threading.Lock()
+    vm_position = 0
     for vm in vms_to_be_provisioned  :
         if vm.getUUID() == None :
             # This VM object does not have an openstack VM associated with it.
             # We need to create one.
-            if num_vms_created == 0 or num_vms_created >= num_compute_nodes :
-                # We are in Step 1 or Step 3 of the VM placement algorithm
-                # described above.  We don't give openstack any hints on
-                # where this VM should go
-                creation_thread = \
-                    threading.Thread(target=_createVM, args=(vm, users, None))
-                creation_threads[vm] = creation_thread
-                creation_thread.start()
-            else :
-                creation_thread = \
-                    threading.Thread(target=_createVM, args=(vm, users, vm_uuids))
-                creation_threads[vm] = creation_thread
-                creation_thread.start()
+            port_steps = []
+            for nic in vm.getNetworkInterfaces() :
+                if nic.isEnabled() and nic.getLink() != None and \
+                        nic.getUUID() == None :
+                    port_steps.append(_addPortStep(engine, vm, nic))
+            dependencies = port_steps + ['secgroup', 'compute_nodes']
+            _addVMStep(engine, vm, users, user_names, vm_position, 
+                       compute_nodes, vm_uuids, vm_uuids_lock, dependencies,
+                       gram_manager)
+            vm_position += 1
+
+    error = engine.run()
+    if error != None :
+        return error
+
+    gram_manager.persist_state(geni_slice) # Save updated state after the VM's are set up
+    return None
+
+
+def _addTenantSteps(engine, geni_slice, tenant_name) :
+    """
+        Add the steps that create the tenant, tenant admin, security group
+        and router of a new slice.  If provisioning fails, the rollbacks
+        of these steps delete what they created.
+    """
+    def createTenant() :
+        # Create a new tenant and set the tenant UUID in the Slice object
+        tenant_uuid = _createTenant(tenant_name)
+        if tenant_uuid == None :
+            return 'GRAM internal error: OpenStack failed to create a tenant for slice %s' % geni_slice.getSliceURN()
+        geni_slice.setTenantUUID(tenant_uuid)
+
+    def deleteTenant() :
+        tenant_uuid = geni_slice.getTenantUUID()
+        if tenant_uuid == None : return
+        error = _runTeardownDelete('tenant %s (%s)' % \
+                                       (tenant_name, tenant_uuid),
+            lambda client: client.delete_tenant(tenant_uuid),
+            'keystone tenant-delete %s' % tenant_uuid)
+        if error :
+            config.logger.error(error)
+            return
+        geni_slice.setTenantUUID(None)
+
+    def createTenantAdmin() :
+        # Create a admin user account for this tenant
+        admin_user_info = _createTenantAdmin(tenant_name, 
+                                             geni_slice.getTenantUUID())
+        if ('admin_name' in admin_user_info) and  \
+                ('admin_pwd' in admin_user_info) and \
+                ('admin_uuid' in admin_user_info) :
+            geni_slice.setTenantAdminInfo(admin_user_info['admin_name'], 
+                                          admin_user_info['admin_pwd'],
+                                          admin_user_info['admin_uuid'])
+        else :
+            return 'GRAM internal error: OpenStack failed to create a tenant admin for slice %s' % geni_slice.getSliceURN()
+
+    def deleteTenantAdmin() :
+        admin_name, admin_pwd, admin_uuid = geni_slice.getTenantAdminInfo()
+        if admin_uuid == None : return
+        error = _runTeardownDelete('user account %s' % admin_uuid,
+            lambda client: client.delete_user(admin_uuid),
+            'keystone user-delete %s' % admin_uuid)
+        if error :
+            config.logger.error(error)
+            return
+        geni_slice.setTenantAdminInfo(None, None, None)
+
+    def createSecurityGroup() :
+        # Create a security group for this tenant
+        # NOTE: This tenant specific security group support is necessary 
+        # to implement the GRAM SSH proxy
+        admin_name, admin_pwd, admin_uuid = geni_slice.getTenantAdminInfo()
+        secgroup_name = \
+            _createTenantSecurityGroup(tenant_name, admin_name, admin_pwd)
+        if (secgroup_name != None) :
+            geni_slice.setSecurityGroup(secgroup_name)
+        else :
+            return 'GRAM internal error: OpenStack failed to create a security group for slice %s' % geni_slice.getSliceURN()
 
-    for vm, creation_thread in creation_threads.items():
-        creation_thread.join()
+    def deleteSecurityGroup() :
+        # The VMs using the group have been rolled back already
+        admin_name, admin_pwd, admin_uuid = geni_slice.getTenantAdminInfo()
+        secgroup_name = geni_slice.getSecurityGroup()
+        if secgroup_name == None : return
+        if _deleteTenantSecurityGroup(admin_name, admin_pwd, tenant_name,
+                                      secgroup_name) :
+            geni_slice.setSecurityGroup(None)
+
+    def createRouter() :
+        # Create a router for this tenant.  The name of this router is 
+        # R-tenant_name.
+        router_name = 'R-%s' % tenant_name
+        geni_slice.setTenantRouterName(router_name)
+        router_uuid = _createRouter(geni_slice.getTenantUUID(), router_name)
+        if router_uuid == None :
+            raise Exception('Failed to create tenant router %s' % \
+                                router_name)
+        geni_slice.setTenantRouterUUID(router_uuid)
+        config.logger.info('Created tenant router %s with uuid = %s' %
+                           (router_name, router_uuid))
+
+    def deleteRouter() :
+        # The interfaces of the links have been rolled back already
+        router_uuid = geni_slice.getTenantRouterUUID()
+        if router_uuid == None : return
+        error = _runTeardownDelete('router %s' % router_uuid,
+            lambda client: client.delete_router(router_uuid),
+            '%s router-delete %s' % (config.network_type, router_uuid))
+        if error :
+            config.logger.error(error)
+            return
+        geni_slice.setTenantRouterUUID(None)
+
+    engine.addStep('tenant', createTenant, [], deleteTenant)
+    engine.addStep('admin', createTenantAdmin, ['tenant'], deleteTenantAdmin)
+    engine.addStep('secgroup', createSecurityGroup, ['admin'], 
+                   deleteSecurityGroup)
+    engine.addStep('router', createRouter, ['tenant'], deleteRouter)
+
+
+def _assignSubnet(geni_slice, link, subnets_used) :
+    """
+        Give the link a subnet address if it does not have one yet.
+        Returns the subnet of the link.
+    """
+    subnet = link.getSubnet()
+    if not subnet:
+        subnet = geni_slice.generateSubnetAddress()
+        while subnet in subnets_used:
+            subnet = geni_slice.generateSubnetAddress()
+        link.setSubnet(subnet)
+        subnets_used.append(subnet)
+    return subnet
+
+
+def _addLinkStep(engine, link, used_ips) :
+    """
+        Add the step that creates the network of a link.
+        Returns the name of the step.
+    """
+    def createLink() :
+        uuids = _createNetworkForLink(link, used_ips)
+        if uuids == None :
+            return 'GRAM internal error: Failed to create a network for link %s' % link.getName()
+
+        link.setNetworkUUID(uuids['network_uuid'])
+        link.setSubnetUUID(uuids['subnet_uuid'])
+        link.setUUID(uuids['network_uuid'])
+        link.setAllocationState(constants.provisioned)
+        link.setOperationalState(constants.ready)
+
+    def deleteLink() :
+        if link.getUUID() == None : return
+        # The tenant router may be in use by other links of the slice
+        _deleteNetworkLink(link.getSlice(), link.getUUID(), 
+                           delete_router=False)
+        link.setNetworkUUID(None)
+        link.setSubnetUUID(None)
+        link.setUUID(None)
+        link.setAllocationState(constants.allocated)
+
+    return engine.addStep('link_%s' % link.getName(), createLink, ['router'],
+                          deleteLink)
+
+
+def _setVLANTagsForSlice(geni_slice) :
+    """
+        Set the VLAN tags of the links of the slice from the VLANs of
+        the tenant's networks.
+    """
+    nets_info = _getNetsForTenant(geni_slice.getTenantUUID())
+    if nets_info == None :
+        return 'GRAM internal error: Failed to get vlan ids for networks created for slice  %s' % geni_slice.getSliceURN()
+
+    for net_uuid in nets_info.keys():
+        net_info = nets_info[net_uuid]
+        vlan = net_info['vlan']
+        for link in geni_slice.getNetworkLinks():
+            if link.getNetworkUUID() == net_uuid:
+                name = net_info['name']
+                config.logger.info("Setting data net " + name + " VLAN to " + vlan)
+                link.setVLANTag(vlan)
+
+
+def _addPortStep(engine, vm, nic) :
+    """
+        Add the step that creates the port of an experiment NIC of a VM.
+        Returns the name of the step.
+    """
+    link = nic.getLink()
+
+    def createPort() :
+        if _createPortForNIC(nic, vm.getSlice().getTenantUUID()) == None :
+            return 'GRAM internal error: Failed to create a port for interface %s of node %s' % (nic.getName(), vm.getName())
+
+    def deletePort() :
+        if nic.getUUID() == None : return
+        _deletePort(nic.getUUID(), vm.getName())
+        nic.setUUID(None)
+
+    return engine.addStep('port_%s_%s' % (vm.getName(), nic.getName()), 
+                          createPort, ['link_%s' % link.getName()], 
+                          deletePort)
+
+
+def _addVMStep(engine, vm, users, user_names, position, compute_nodes,
+               vm_uuids, vm_uuids_lock, dependencies, gram_manager) :
+    """
+        Add the step that boots a VM.  position is the index of the VM
+        among the VMs created by this provision call; it determines
+        whether the VM gets placement hints.
+
+        If config.async_vm_boot is set, the step completes as soon as
+        nova has accepted the boot request and the VM is left in the
+        configuring state; the state of the slice is saved again once 
+        the boot has finished.  Otherwise the step waits for the boot
+        (at most config.vm_boot_timeout seconds).
+    """
+    def createVM() :
+        placement_hint = None
+        if position > 0 and position < compute_nodes['count'] :
+            # Step 2 of the VM placement algorithm: avoid the nodes of
+            # the VMs created so far
+            with vm_uuids_lock :
+                placement_hint = list(vm_uuids)
+        boot = _createVM(vm, users, placement_hint)
         vm_uuid = vm.getUUID()
-        if vm_uuid == None :
-            # Failed to create this vm.  Cleanup actions before
-            # we return:
-            #    - delete all the VMs created in this call to provision
-            #    - delete the network links created so far in this
-            #      call to provisionResources
-            #    - delete tenant admin
-            #    - delete tenant
-            #    for i in range (0, len(vms_created_this_call)) :
-            #    _deleteVM(vms_created_this_call[i])
-            #    for i in range(0, len(links_created_this_call)) :
-            #        _deleteNetworkLink(geni_slice, links_created_this_call)
-            #    _deleteUserByUUID(admin_user_info['admin_uuid'])
-            #    _deleteTenantByUUID(tenant_uuid)
-            #    config.logger.error('Failed to create vm for node %s' % \
-            #                        vm.getName())
+        if boot == None or vm_uuid == None :
             return 'GRAM internal error: Failed to create a VM for node %s' % vm.getName()
-        else :
-            vm.setUUID(vm_uuid)
-            vm.setAllocationState(constants.provisioned)
-            num_vms_created += 1
+        with vm_uuids_lock :
             vm_uuids.append(vm_uuid)
-            vm.setAuthorizedUsers(user_names)
-            vm.setAllocationState(constants.provisioned)
+        vm.setAuthorizedUsers(user_names)
+        vm.setAllocationState(constants.provisioned)
+
+        if config.async_vm_boot :
+            boot.addCallback(lambda boot : \
+                                 gram_manager.persist_state(vm.getSlice()))
+            return None
+        boot.wait(config.vm_boot_timeout)
+        if not boot.succeeded() or \
+                vm.getOperationalState() == constants.failed :
+            return 'GRAM internal error: Failed to create a VM for node %s' % vm.getName()
+        if vm.getOperationalState() == constants.configuring :
             vm.setOperationalState(constants.notready)
-#                print "VM = %s" % vm
 
-    gram_manager.persist_state() # Save updated state after the VM's are set up
-    config.logger.info("Exiting createAllVMs thread...")
+    def deleteVM() :
+        if vm.getUUID() == None : return
+        # Deleting the VM also deletes the ports of its NICs
+        _deleteVM(vm)
+        for nic in vm.getNetworkInterfaces() :
+            nic.setUUID(None)
+        vm.setUUID(None)
+        vm.setAllocationState(constants.allocated)
 
-    return None
+    engine.addStep('vm_%s' % vm.getName(), createVM, dependencies, deleteVM)
 
 # Delete all ports associated with given slice/tenant
 # Allow some failures: there will be some that can't be deleted
@@ -454,11 +546,56 @@ def deleteSlivers(geni_slice, slivers) :
         Returns True if all slivers were successfully deleted.
         Returns False if one or more slivers did not get deleted.
     """
-    return_val = True  # Value returned by this method.  Be optimistic!
+    plans = teardownSlices([(geni_slice, slivers, False)])
+    return plans[0].succeeded()
+
+
+def expireSlice(geni_slice) :
+    """
+        Called when a slice is past its expiration time.
+    """
+    # Delete all slivers that belong to this slice and the slice tenant
+    teardownSlices([(geni_slice, geni_slice.getSlivers().values(), True)])
+    
 
-    # We delete all the VMs before we delete the links.
-    # Walk through the list of sliver_objects and create two list:
-    # links_to_be_deleted and vms_to_be_deleted
+def teardownSlices(teardowns) :
+    """
+        Delete the OpenStack resources of slivers of several slices
+        concurrently.  teardowns is a list of (geni_slice, slivers, expire)
+        tuples: the given slivers of the slice are deleted and, if expire
+        is True, the slice tenant (security group, admin user and tenant)
+        is deleted too.
+
+        The deletions are run by a DeletionEngine with at most 
+        config.deletion_max_workers operations at a time.
+        Returns the list of TeardownPlans (with the outcome of deleting
+        each resource) in the order of teardowns.
+    """
+    engine = deletion.DeletionEngine(config.deletion_max_workers)
+    plans = []
+    for geni_slice, slivers, expire in teardowns :
+        plan = engine.addPlan(geni_slice.getSliceURN())
+        _addSliverTeardownSteps(plan, geni_slice, slivers)
+        if expire :
+            _addTenantTeardownSteps(plan, geni_slice)
+        plans.append(plan)
+    engine.run()
+
+    for geni_slice, slivers, expire in teardowns :
+        if expire :
+            # Indicates tenant info is no longer valid
+            geni_slice.setTenantUUID(None)
+    return plans
+
+
+def _addSliverTeardownSteps(plan, geni_slice, slivers) :
+    """
+        Add the steps that delete the VMs and links among the slivers:
+        the ports and floating IPs of a VM are deleted before the VM, and
+        a network is deleted once its router interface and the VMs
+        (with their ports) have been deleted.  The tenant router is 
+        deleted once all the links of the slice are.
+    """
     links_to_be_deleted = list()
     vms_to_be_deleted = list()
     for sliver in slivers :
@@ -472,72 +609,193 @@ def deleteSlivers(geni_slice, slivers) :
                            (len(links_to_be_deleted), 
                             len(vms_to_be_deleted))) 
 
-    # For each VM to be deleted, delete the VM and its associated network ports
-    for vm in vms_to_be_deleted  :
-        success = _deleteVM(vm)
-        if success :
-            vm.setAllocationState(constants.unallocated)
-            vm.setOperationalState(constants.stopping)
-        else :
-            return_val = False
-
-    if len(links_to_be_deleted) == 0 and geni_slice.getTenantRouterUUID():
-        # Delete the router
-        router_uuid = geni_slice.getTenantRouterUUID()
-        cmd_string = '%s router-delete %s' % (config.network_type, router_uuid)
-        try:
-            _execCommand(cmd_string)
-            geni_slice.setTenantRouterUUID(None)
-        except:
-            config.logger.error("Failed to delete router %s" % router_uuid)
+    vm_steps = []
+    fip_steps = []
+    for vm in vms_to_be_deleted :
+        vm_steps.append(_addVMTeardownSteps(plan, vm, fip_steps))
 
-    # Delete the networks and subnets associated with the links to be deleted 
+    interface_steps = []
     for link in links_to_be_deleted :
-        success = _deleteNetworkLink(geni_slice,  link.getNetworkUUID())
-        if success :
-            link.setAllocationState(constants.unallocated)
-            link.setOperationalState(constants.stopping)
-        else :
-            return_val = False
-
-    ### Delete tenant router.  This section is empty right now as we don't
-    ### do per-tenant routers as yet.
-
-    return return_val
+        interface_steps.append(_addLinkTeardownSteps(plan, geni_slice, link,
+                                                     vm_steps))
+
+    # Delete the tenant router if no provisioned link remains
+    router_uuid = geni_slice.getTenantRouterUUID()
+    remaining_links = [link for link in geni_slice.getNetworkLinks() \
+                           if link.getNetworkUUID() and \
+                           link not in links_to_be_deleted]
+    if router_uuid and len(remaining_links) == 0 :
+        def deleteRouter() :
+            error = _runTeardownDelete('router %s' % router_uuid,
+                lambda client: client.delete_router(router_uuid),
+                '%s router-delete %s' % (config.network_type, router_uuid))
+            if error : return error
+            geni_slice.setTenantRouterUUID(None)
+        plan.addStep('router', 'router %s' % router_uuid, deleteRouter,
+                     interface_steps + fip_steps)
 
 
-def expireSlice(geni_slice) :
+def _addVMTeardownSteps(plan, vm, fip_steps) :
     """
-        Called when a slice is past its expiration time.
+        Add the steps that delete a VM and its ports and floating IPs.
+        Returns the name of the step that deletes the VM.
+    """
+    vm_name = vm.getName()
+    dependencies = []
+    for nic in vm.getNetworkInterfaces() :
+        port_uuid = nic.getUUID()
+        if port_uuid :
+            def deletePort(port_uuid=port_uuid) :
+                return _runTeardownDelete('port %s of VM %s' % \
+                                              (port_uuid, vm_name),
+                    lambda client: client.delete_port(port_uuid),
+                    '%s port-delete %s' % (config.network_type, port_uuid))
+            dependencies.append(plan.addStep('port_%s_%s' % \
+                                                 (vm_name, nic.getName()),
+                                             'port %s of VM %s' % \
+                                                 (port_uuid, vm_name),
+                                             deletePort))
+
+    def deleteFloatingIPs() :
+        errors = []
+        for fip_id in _getFloatingIpByVM(vm.getUUID()) :
+            error = _runTeardownDelete('floating IP %s of VM %s' % \
+                                           (fip_id, vm_name),
+                lambda client: client.delete_floatingip(fip_id),
+                '%s floatingip-delete %s' % (config.network_type, fip_id))
+            if error : errors.append(error)
+        if len(errors) > 0 : return '; '.join(errors)
+    fip_step = plan.addStep('fips_%s' % vm_name, 
+                            'floating IPs of VM %s' % vm_name,
+                            deleteFloatingIPs)
+    fip_steps.append(fip_step)
+    dependencies.append(fip_step)
+
+    def deleteVM() :
+        vm_uuid = vm.getUUID()
+        if vm_uuid != None :
+            _forgetServer(vm_uuid)
+            error = _runTeardownDelete('VM %s' % vm_name,
+                lambda client: client.delete_server(vm_uuid),
+                'nova delete %s' % vm_uuid)
+            if error : return error
+            manage_ssh_proxy._removeProxy(vm.getMgmtNetAddr())
+        vm.setAllocationState(constants.unallocated)
+        vm.setOperationalState(constants.stopping)
+    return plan.addStep('vm_%s' % vm_name, 'VM %s' % vm_name, deleteVM,
+                        dependencies)
+
+
+def _addLinkTeardownSteps(plan, geni_slice, link, vm_steps) :
     """
-    # Delete all slivers that belong to this slice
-    slivers = geni_slice.getSlivers().values()
-    deleteSlivers(geni_slice, slivers)
+        Add the steps that delete the router interface and network of a 
+        link.  Returns the name of the step that deletes the router
+        interface.
+    """
+    link_name = link.getName()
+    net_uuid = link.getNetworkUUID()
+    subnet_uuid = link.getSubnetUUID()
+
+    def deleteRouterInterface() :
+        if not net_uuid : return None
+        return _runTeardownDelete('router interface %s' % subnet_uuid,
+            lambda client: client.remove_router_interface(\
+                geni_slice.getTenantRouterUUID(), subnet_uuid),
+            '%s router-interface-delete %s %s' % \
+                (config.network_type, geni_slice.getTenantRouterName(),
+                 subnet_uuid))
+    interface_step = plan.addStep('interface_%s' % link_name,
+                                  'router interface of link %s' % link_name,
+                                  deleteRouterInterface)
+
+    def deleteNetwork() :
+        if net_uuid :
+            error = _runTeardownDelete('network %s' % net_uuid,
+                lambda client: client.delete_network(net_uuid),
+                '%s net-delete %s' % (config.network_type, net_uuid))
+            if error : return error
+        link.setAllocationState(constants.unallocated)
+        link.setOperationalState(constants.stopping)
+    plan.addStep('network_%s' % link_name, 'network of link %s' % link_name,
+                 deleteNetwork, vm_steps + [interface_step])
+    return interface_step
+
+
+def _addTenantTeardownSteps(plan, geni_slice) :
+    """
+        Add the steps that delete the security group, admin user and 
+        tenant of a slice, after all its other resources.
+    """
+    dependencies = plan.getStepNames()
 
     # Get information about the slice tenant admin
     admin_name, admin_pwd, admin_uuid = geni_slice.getTenantAdminInfo()
+    tenant_name = geni_slice.getTenantName()
 
-    # Delete the security group for this tenant
     if admin_name and admin_pwd and admin_uuid:
-        _deleteTenantSecurityGroup(admin_name, admin_pwd,
-                                   geni_slice.getTenantName(),
-                                   geni_slice.getSecurityGroup())
+        # Delete the security group for this tenant (as its admin)
+        # _deleteTenantSecurityGroup retries while the group is in use
+        secgroup_name = geni_slice.getSecurityGroup()
+        def deleteSecurityGroup() :
+            if not _deleteTenantSecurityGroup(admin_name, admin_pwd,
+                                              tenant_name, secgroup_name) :
+                return 'Failed to delete security group %s' % secgroup_name
+        plan.addStep('secgroup', 'security group %s' % secgroup_name,
+                     deleteSecurityGroup, dependencies, 0)
 
         # Delete the slice (tenant) admin user account
-        _deleteUserByUUID(admin_uuid)
+        def deleteAdmin() :
+            return _runTeardownDelete('user account %s' % admin_uuid,
+                lambda client: client.delete_user(admin_uuid),
+                'keystone user-delete %s' % admin_uuid)
+        plan.addStep('admin', 'admin user %s' % admin_name, deleteAdmin,
+                     ['secgroup'])
 
     # Delete the tenant
     tenant_uuid = geni_slice.getTenantUUID()
     if tenant_uuid:
-        if _deleteTenantByUUID(geni_slice.getTenantUUID()) == None :
-            # Failed to delete this tenant.  We just log the failure.
-            config.logger.error('Failed to delete tenant name = %s, uuid = %s'\
-                                    % (geni_slice.getTenantName, 
-                                       geni_slice.getTenantUUID()))
-        geni_slice.setTenantUUID(None) # Indicates tenant info is no longer valid
-
-    return 
-    
+        def deleteTenant() :
+            return _runTeardownDelete('tenant %s (%s)' % \
+                                          (tenant_name, tenant_uuid),
+                lambda client: client.delete_tenant(tenant_uuid),
+                'keystone tenant-delete %s' % tenant_uuid)
+        plan.addStep('tenant', 'tenant %s' % tenant_name, deleteTenant,
+                     plan.getStepNames())
+
+
+def _runTeardownDelete(resource, api_call, cmd_string) :
+    """
+        Delete a resource for a teardown step, with api_call(client) if 
+        there is an API client and otherwise with the CLI command.
+        Returns None if the resource was deleted or was not found (already
+        gone) and an error message if it can't be deleted.  Raises
+        deletion.TransientError if the failure may go away on retry.
+    """
+    client = _apiClient()
+    try :
+        if client :
+            api_call(client)
+        else :
+            _execDeleteCommand(cmd_string)
+        return None
+    except OpenStackAPIError, e :
+        error = str(e)
+        if e.status is None :
+            # No response from the service
+            kind = deletion.TRANSIENT
+        else :
+            kind = deletion.classifyError('%s %s' % (e, e.body or ''),
+                                          e.status)
+    except subprocess.CalledProcessError, e :
+        error = e.output.strip()
+        kind = deletion.classifyError(e.output)
+    if kind == deletion.NOT_FOUND :
+        config.logger.info('%s was already deleted' % resource)
+        return None
+    error = 'Failed to delete %s: %s' % (resource, error)
+    if kind == deletion.TRANSIENT :
+        raise deletion.TransientError(error)
+    return error
 
 
 ######## Module Private Functions.  All OpenStack commands are issued
@@ -547,10 +805,17 @@ def _createTenant(tenant_name) :
     """
         Create an OpenStack tenant and return the uuid of this new tenant.
     """
+    client = _apiClient()
+    if client :
+        try :
+            return client.create_tenant(tenant_name)['id']
+        except OpenStackAPIError :
+            return None
+
     # Create a tenant
     cmd_string = 'keystone tenant-create --name %s' % tenant_name
     try :
-        output = _execCommand(cmd_string) 
+        output = _execTableCommand(cmd_string) 
     except :
         return None
     else :
@@ -558,19 +823,6 @@ def _createTenant(tenant_name) :
         return _getValueByPropertyName(output, 'id')
 
 
-def _deleteTenantByUUID(tenant_uuid) :
-    """
-        Delete the tenant with the given uuid.
-    """
-    cmd_string = 'keystone tenant-delete %s' % tenant_uuid
-    try :
-        _execCommand(cmd_string)
-    except :
-        return None          # failure
-    else :
-        return tenant_uuid   # success
-        
-
 def _createTenantAdmin(tenant_name, tenant_uuid) :
     """
         Create an admin user account for this tenant.
@@ -578,10 +830,15 @@ def _createTenantAdmin(tenant_name, tenant_uuid) :
     admin_name = 'admin-' + tenant_name
     if len(admin_name) > 63:
         admin_name = str(uuid.uuid4())
+
+    client = _apiClient()
+    if client :
+        return _createTenantAdminViaAPI(client, admin_name, tenant_uuid)
+
     cmd_string = 'keystone user-create --name %s --pass %s --enabled true --tenant-id %s' % (admin_name, config.tenant_admin_pwd, tenant_uuid)
                                 
     try :
-        output = _execCommand(cmd_string) 
+        output = _execTableCommand(cmd_string) 
     except :
         # Failed to create admin account
         config.logger.error('Exception during keystone user-create')
@@ -598,7 +855,7 @@ def _createTenantAdmin(tenant_name, tenant_uuid) :
     # First, get a list of roles configured for this installation
     cmd_string = 'keystone role-list'
     try :
-        output = _execCommand(cmd_string) 
+        output = _execTableCommand(cmd_string) 
     except :
         # Failed to get a list of roles.  Undo what we've done until now:
         #      - delete the admin user
@@ -626,12 +883,65 @@ def _createTenantAdmin(tenant_name, tenant_uuid) :
                 'admin_uuid':admin_uuid }
 
 
+def _createTenantAdminViaAPI(client, admin_name, tenant_uuid) :
+    """
+        REST API version of _createTenantAdmin: create the admin user
+        account for the tenant and give it the tenant 'admin' role.
+    """
+    try :
+        admin_uuid = client.create_user(admin_name, config.tenant_admin_pwd,
+                                        tenant_uuid)['id']
+    except OpenStackAPIError :
+        config.logger.error('Failed to create admin user %s' % admin_name)
+        return {}
+
+    try :
+        admin_role_uuid = None
+        for role in client.list_roles() :
+            if role['name'] == 'admin' :
+                admin_role_uuid = role['id']
+        client.add_user_role(admin_uuid, admin_role_uuid, tenant_uuid)
+    except OpenStackAPIError :
+        config.logger.error('Failed to give user an admin role')
+        _deleteUserByUUID(admin_uuid)
+        return {}
+
+    return {'admin_name':admin_name, 'admin_pwd':config.tenant_admin_pwd, \
+                'admin_uuid':admin_uuid }
+
+
+# Rules added to every tenant security group: 
+#    SSH, ICMP (ping, etc.) and, for VMs with external control plane IP's,
+#    all TCP and UDP ports > 30000
+_TENANT_SECURITY_GROUP_RULES = [('tcp', 22, 22), ('icmp', -1, -1),
+                                ('tcp', 30000, 65535), ('udp', 30000, 65535)]
+
 def _createTenantSecurityGroup(tenant_name, admin_name, admin_pwd) :
     """
         Create a security group for this tenant.
     """
     secgroup_name = '%s_secgrp' % tenant_name
 
+    client = _apiClient()
+    if client :
+        credentials = (admin_name, admin_pwd, tenant_name)
+        try :
+            group = client.create_security_group(secgroup_name,
+                                                 'tenant-security-group',
+                                                 credentials)
+        except OpenStackAPIError :
+            return None
+        try :
+            for protocol, from_port, to_port in _TENANT_SECURITY_GROUP_RULES :
+                client.add_security_group_rule(group['id'], protocol,
+                                               from_port, to_port,
+                                               '0.0.0.0/0', credentials)
+        except OpenStackAPIError :
+            _deleteTenantSecurityGroup(admin_name, admin_pwd, tenant_name,
+                                       secgroup_name)
+            return None
+        return secgroup_name    # Success!
+
     cmd_string = 'nova --os-username=%s --os-password=%s --os-tenant-name=%s' \
         % (admin_name, admin_pwd, tenant_name)
     cmd_string += ' secgroup-create %s tenant-security-group' % secgroup_name
@@ -701,14 +1011,18 @@ def _deleteTenantSecurityGroup(admin_name, admin_pwd, tenant_name,
                                secgrp_name) :
     """
         Delete the security group created for this tenant
+        Returns True on success (or if there is no group), False on failure.
     """
     if secgrp_name == None:
-        return
+        return True
  
     cmd_string = 'nova --os-username=%s --os-password=%s --os-tenant-name=%s' \
         % (admin_name, admin_pwd, tenant_name)
     cmd_string += ' secgroup-delete %s' % secgrp_name
 
+    client = _apiClient()
+    credentials = (admin_name, admin_pwd, tenant_name)
+
     # We may need to make multiple attempts to delete a security group.  This
     # often happens when a VM using this security group has not yet been 
     # completely deleted.  We try a few times hoping all VMs using this security
@@ -718,7 +1032,13 @@ def _deleteTenantSecurityGroup(admin_name, admin_pwd, tenant_name,
     sec_grp_delete_attempts = 0
     while sec_grp_delete_attempts < 4 :
         try :
-            _execCommand(cmd_string)
+            if client :
+                for group in client.list_security_groups(credentials) :
+                    if group['name'] == secgrp_name :
+                        client.delete_security_group(group['id'],
+                                                     credentials)
+            else :
+                _execCommand(cmd_string)
             # Delete successful.  Break out of loop
             break
         except :
@@ -730,37 +1050,54 @@ def _deleteTenantSecurityGroup(admin_name, admin_pwd, tenant_name,
             time.sleep(15)
     if sec_grp_delete_attempts == 4 :
         config.logger.info('Failed to delete security group %s' % secgrp_name)
+        return False
+    return True
 
 
 def _deleteUserByUUID(user_uuid) :
     """
         Delete the user account for the user with the specified uuid.
+        Returns True on success, False on failure.
     """
     cmd_string = 'keystone user-delete %s' % user_uuid
     try :
-        _execCommand(cmd_string)
+        client = _apiClient()
+        if client :
+            client.delete_user(user_uuid)
+        else :
+            _execCommand(cmd_string)
     except :
         # Not much we can do other than log the failure
         config.logger.error('Failed to delete user account for uuid %s' % \
                                 user_uuid)
+        return False
+    return True
 
 
 def _createRouter(tenant_name, router_name) :
     """
         Create an OpenStack router and return the uuid of this new router.
     """
+    client = _apiClient()
+    if client :
+        try :
+            return client.create_router(router_name, tenant_name)['id']
+        except OpenStackAPIError :
+            config.logger.error('Failed to create router %s' % router_name)
+            return None
+
     cmd_string = '%s router-create --tenant-id %s %s' % \
         (config.network_type, tenant_name, router_name)
 
     try :
-        output = _execCommand(cmd_string) 
+        output = _execTableCommand(cmd_string) 
     except :
         # Failed to create router.
         config.logger.error('Failed to create router %s' % router_name)
         return None
     else :
         # Extract the uuid of the router from the output and return uuid
-        return _getValueByPropertyName(output, 'id')
+        return output.getValueByPropertyName('id')
 
 
 def _createNetworkForLink(link_object,used_ips=None) :
@@ -778,16 +1115,20 @@ def _createNetworkForLink(link_object,used_ips=None) :
     # Create a network with the exprimenter specified name for the link
     tenant_uuid = slice_object.getTenantUUID()
     network_name = link_object.getName()
+    client = _apiClient()
     cmd_string = '%s net-create %s --tenant-id %s --provider:network_type vlan --provider:physical_network physnet1 --provider:segmentation_id %s' % (config.network_type, network_name, tenant_uuid, link_object.getVLANTag())
                                                            
     try :
-        output = _execCommand(cmd_string) 
+        if client :
+            network_uuid = client.create_network(network_name, tenant_uuid,
+                                                 link_object.getVLANTag())['id']
+        else :
+            output = _execTableCommand(cmd_string) 
+            network_uuid = output.getValueByPropertyName('id')
     except :
         # Failed to create a network for this link.  Cleanup actions:
         #    - None
         return None
-    else :
-        network_uuid = _getValueByPropertyName(output, 'id')
 
     # Now create a subnet for this network.
     # First, get a subnet address of the form 10.0.x.0/24
@@ -831,14 +1172,19 @@ def _createNetworkForLink(link_object,used_ips=None) :
     cmd_string = '%s subnet-create --tenant-id %s --gateway %s  --allocation-pool start=%s,end=%s  %s %s' % \
         (config.network_type, tenant_uuid, gateway_addr, start_ip,end_ip,network_uuid, subnet_addr)
     try :
-        output = _execCommand(cmd_string) 
+        if client :
+            subnet_uuid = client.create_subnet(network_uuid, tenant_uuid,
+                                               subnet_addr, gateway_addr,
+                                               start_ip, end_ip)['id']
+        else :
+            output = _execTableCommand(cmd_string) 
+            subnet_uuid = output.getValueByPropertyName('id')
     except :
         # Failed to create a subnet.  Cleanup actions:
-        #    - Delete the network that was created
-        _deleteNetworkLink(slice_object, network_uuid)
+        #    - Delete the network that was created.  The tenant router
+        #      may be in use by other links of the slice
+        _deleteNetworkLink(slice_object, network_uuid, delete_router=False)
         return None
-    else :
-        subnet_uuid = _getValueByPropertyName(output, 'id')
 
     # create and delete a port on the subnet to create dhcp at a desired address
     #cmd_string = 'neutron port-create --tenant-id %s --fixed-ip subnet_id=%s,ip_address=%s %s' % (tenant_uuid, subnet_uuid,str(subnet_ip[-4]), network_uuid)
@@ -854,12 +1200,17 @@ def _createNetworkForLink(link_object,used_ips=None) :
                                                     router_name,
                                                     subnet_uuid)
     try :
-        _execCommand(cmd_string) 
+        if client :
+            client.add_router_interface(slice_object.getTenantRouterUUID(),
+                                        subnet_uuid)
+        else :
+            _execCommand(cmd_string) 
     except :
         # Failed to create interface.  Cleanup actions:
         #    - Delete the network created.  The subnet will be 
-        #      deleted automatically
-        _deleteNetworkLink(slice_object, network_uuid)
+        #      deleted automatically.  The tenant router may be in use
+        #      by other links of the slice
+        _deleteNetworkLink(slice_object, network_uuid, delete_router=False)
         return None
         
     # Set operational status
@@ -868,9 +1219,10 @@ def _createNetworkForLink(link_object,used_ips=None) :
     return {'network_uuid':network_uuid, 'subnet_uuid': subnet_uuid}
 
 
-def _deleteNetworkLink(slice_object, net_uuid) :
+def _deleteNetworkLink(slice_object, net_uuid, delete_router=True) :
     """
-       Delete network and subnet associated with specified network
+       Delete network and subnet associated with specified network.
+       The tenant router is deleted too unless delete_router is False.
     """
     if net_uuid :
 
@@ -879,68 +1231,113 @@ def _deleteNetworkLink(slice_object, net_uuid) :
         for link in slice_object.getNetworkLinks():
             if link.getNetworkUUID() == net_uuid:
                 subnet_uuid = link.getSubnetUUID()
-        router_name = slice_object.getTenantRouterName()
-        cmd_string = '%s router-interface-delete %s %s' % (config.network_type, router_name, subnet_uuid)
-        try:
-            _execCommand(cmd_string)
-        except:
-            config.logger.error("Failed to delete router interface %s %s" % (router_name, subnet_uuid))
+        _deleteRouterInterface(slice_object, subnet_uuid)
 
         # Delete the router before deleting the net/subnet
-        router_uuid = slice_object.getTenantRouterUUID()
-        cmd_string = '%s router-delete %s' % (config.network_type, router_uuid)
-        try:
+        if delete_router :
+            _deleteRouter(slice_object.getTenantRouterUUID())
+
+        return _deleteNetwork(net_uuid)
+
+
+def _deleteRouterInterface(slice_object, subnet_uuid) :
+    """
+        Remove the interface of the given subnet from the tenant router.
+        Returns True on success, False on failure.
+    """
+    client = _apiClient()
+    router_name = slice_object.getTenantRouterName()
+    cmd_string = '%s router-interface-delete %s %s' % (config.network_type, router_name, subnet_uuid)
+    try:
+        if client :
+            client.remove_router_interface(\
+                slice_object.getTenantRouterUUID(), subnet_uuid)
+        else :
             _execCommand(cmd_string)
-        except:
-            config.logger.error("Failed to delete router %s" % router_uuid)
-        
+    except:
+        config.logger.error("Failed to delete router interface %s %s" % (router_name, subnet_uuid))
+        return False
+    return True
 
 
-        cmd_string = '%s net-delete %s' % (config.network_type, net_uuid)
-        try :
+def _deleteNetwork(net_uuid) :
+    """
+        Delete the network (and its subnet) with the given uuid.
+        Returns True on success, False on failure.
+    """
+    client = _apiClient()
+    cmd_string = '%s net-delete %s' % (config.network_type, net_uuid)
+    try :
+        if client :
+            client.delete_network(net_uuid)
+        else :
             _execCommand(cmd_string)
-        except :
-            # Failed to delete network.  Not much we can do.
-            config.logger.error('Failed to delete network with uuid %s' % \
-                                    net_uuid)
-            return False # Failure
-        return True # Success
+    except :
+        # Failed to delete network.  Not much we can do.
+        config.logger.error('Failed to delete network with uuid %s' % \
+                                net_uuid)
+        return False # Failure
+    return True # Success
+
+
+def _deleteRouter(router_uuid) :
+    """
+        Delete the router with the given uuid.
+        Returns True on success, False on failure.
+    """
+    cmd_string = '%s router-delete %s' % (config.network_type, router_uuid)
+    try:
+        client = _apiClient()
+        if client :
+            client.delete_router(router_uuid)
+        else :
+            _execCommand(cmd_string)
+    except:
+        config.logger.error("Failed to delete router %s" % router_uuid)
+        return False
+    return True
 
 
 def _getNetsForTenant(tenant_uuid):
+    client = _apiClient()
+    if client :
+        try :
+            nets = client.list_networks(tenant_id=tenant_uuid)
+        except OpenStackAPIError :
+            config.logger.error('Failed to get list of networks for tenant %s' % \
+                                    tenant_uuid)
+            return None
+        nets_info = dict()
+        for net in nets :
+            nets_info[net['id']] = \
+                {'name' : net['name'],
+                 'vlan' : str(net.get('provider:segmentation_id'))}
+        return nets_info
+
     cmd_string = '%s net-list -- --tenant_id=%s' % (config.network_type, tenant_uuid)
     try :
-        output = _execCommand(cmd_string)
+        nets = _execTableCommand(cmd_string)
     except :
         # Command failed.  Return None.
         config.logger.error('Failed to get list of networks for tenant %s' % \
                                 tenant_uuid)
         return None
 
-    output_lines = output.split('\n')
     nets_info = dict()
-    for i in range(3, len(output_lines)-2):
-        line = output_lines[i]
-        line_parts = line.split('|')
-        net_id = line_parts[1].strip()
-        name = line_parts[2].strip()
-        subnets = line_parts[3].strip()
+    for net in nets.getDicts():
+        net_id = net['id']
+        name = net['name']
 
         cmd_string = '%s net-show %s' % (config.network_type, net_id)
         try :
-            net_output = _execCommand(cmd_string)
+            net_output = _execTableCommand(cmd_string)
         except :
             config.logger.error('Failed to get info on network %s' %  net_id)
             return None
             
-        net_output_lines = net_output.split('\n')
         belongs = True
         attributes = {'name' : name}
-        for j in range(3, len(net_output_lines)-2):
-            net_line = net_output_lines[j]
-            net_line_parts = net_line.split('|')
-            field = net_line_parts[1].strip()
-            value = net_line_parts[2].strip()
+        for field, value in net_output.getRows():
             if field == 'name' and value != name:
                 belongs = False
             elif field == 'tenant_id' and value != tenant_uuid:
@@ -954,29 +1351,89 @@ def _getNetsForTenant(tenant_uuid):
 # Return dictionary of 'id' => {'mac_address'=>mac_address, , 'fixed_ips'=>fixed_ips}
 #  for each port associated ith a given tenant
 def _getPortsForTenant(tenant_uuid,device_id=None):
+    client = _apiClient()
+    if client :
+        filters = {}
+        if tenant_uuid != None : filters['tenant_id'] = tenant_uuid
+        if device_id != None : filters['device_id'] = device_id
+        try :
+            ports = client.list_ports(**filters)
+        except OpenStackAPIError :
+            config.logger.error('Failed to get port list for tenant %s' % \
+                                    tenant_uuid)
+            return None
+        ports_info = dict()
+        for port in ports :
+            # Present fixed_ips the way the CLI table shows them
+            fixed_ips = ''
+            if len(port['fixed_ips']) > 0 :
+                fixed_ips = json.dumps(port['fixed_ips'][0])
+            ports_info[port['id']] = {'mac_address' : port['mac_address'],
+                                      'fixed_ips' : fixed_ips}
+        return ports_info
+
     if device_id != None:
         cmd_string = '%s port-list -- --tenant_id=%s --device_id=%s' % (config.network_type, tenant_uuid,device_id)
     else:
         cmd_string = '%s port-list -- --tenant_id=%s' % (config.network_type, tenant_uuid)
     try :
-        output = _execCommand(cmd_string)
+        ports = _execTableCommand(cmd_string)
     except :
         config.logger.error('Failed to get port list for tenant %s' % \
                                 tenant_uuid)
         return None
 
-    output_lines = output.split('\n')
     ports_info = dict()
-    for i in range(3, len(output_lines)-2):
-        port_info_columns = output_lines[i].split('|');
-        port_id = port_info_columns[1].strip()
-        port_mac_address = port_info_columns[3].strip()
-        port_fixed_ips = port_info_columns[4].strip()
-        port_info = {'mac_address' : port_mac_address, 'fixed_ips' : port_fixed_ips}
-        ports_info[port_id] = port_info
+    for port in ports.getDicts():
+        # Ports with several fixed IPs list one per line: keep the first
+        port_fixed_ips = port['fixed_ips'].split('\n')[0]
+        port_info = {'mac_address' : port['mac_address'],
+                     'fixed_ips' : port_fixed_ips}
+        ports_info[port['id']] = port_info
 
     return ports_info
 
+def _createPortForNIC(nic, tenant_uuid) :
+    """
+        Create a port for the NIC on the network of the link it is
+        connected to.  Returns the uuid of the port.
+    """
+    link_object = nic.getLink()
+    net_uuid = link_object.getNetworkUUID()
+    subnet_uuid = link_object.getSubnetUUID()
+    client = _apiClient()
+    if client :
+        port = client.create_port(net_uuid, tenant_uuid, subnet_uuid,
+                                  nic.getIPAddress())
+        nic.setUUID(port['id'])
+        return nic.getUUID()
+    if nic.getIPAddress():
+        cmd_string = '%s port-create --tenant-id %s --fixed-ip subnet_id=%s,ip_address=%s %s' % (config.network_type, tenant_uuid, subnet_uuid,nic.getIPAddress(), net_uuid)
+    else:
+        cmd_string = '%s port-create --tenant-id %s --fixed-ip subnet_id=%s %s' % (config.network_type, tenant_uuid, subnet_uuid, net_uuid)
+    output = _execTableCommand(cmd_string) 
+    nic.setUUID(output.getValueByPropertyName('id'))
+    return nic.getUUID()
+
+
+def _deletePort(port_uuid, vm_name) :
+    """
+        Delete a port of a VM.  Returns True on success, False on failure.
+    """
+    cmd_string = '%s port-delete %s' % (config.network_type, port_uuid)
+    try :
+        client = _apiClient()
+        if client :
+            client.delete_port(port_uuid)
+        else :
+            _execCommand(cmd_string)
+    except :
+        config.logger.error('Failed to delete port %s for VM %s' % \
+                                (port_uuid, vm_name))
+        return False
+    return True
+
+
 # users is a list of dictionaries [keys=>list_of_ssh_keys, urn=>user_urn]
 def _createVM(vm_object, users, placement_hint):
     """
@@ -994,21 +1451,15 @@ def _createVM(vm_object, users, placement_hint):
     mgmt_net_prefix = \
         config.management_network_cidr[0:config.management_network_cidr.rfind('0/24')]
 
-    # Create ports for the experiment data networks
+    client = _apiClient()
+
+    # Create ports for the experiment data networks (unless they were
+    # created by a provisioning step)
     vm_net_infs = vm_object.getNetworkInterfaces()
     for nic in vm_net_infs :
-        if nic.isEnabled() :
-            link_object = nic.getLink()
-            if link_object == None: continue
-            net_uuid = link_object.getNetworkUUID()
-            nic_ip_addr = nic.getIPAddress()
-            subnet_uuid = link_object.getSubnetUUID()
-            if nic.getIPAddress():
-                cmd_string = '%s port-create --tenant-id %s --fixed-ip subnet_id=%s,ip_address=%s %s' % (config.network_type, tenant_uuid, subnet_uuid,nic.getIPAddress(), net_uuid)
-            else:
-                cmd_string = '%s port-create --tenant-id %s --fixed-ip subnet_id=%s %s' % (config.network_type, tenant_uuid, subnet_uuid, net_uuid)
-            output = _execCommand(cmd_string) 
-            nic.setUUID(_getValueByPropertyName(output, 'id'))
+        if nic.isEnabled() and nic.getLink() != None and \
+                nic.getUUID() == None :
+            _createPortForNIC(nic, tenant_uuid)
 
     # Now grab and set the mac addresses from the port list
     ports_info = _getPortsForTenant(tenant_uuid)
@@ -1026,7 +1477,7 @@ def _createVM(vm_object, users, placement_hint):
     # Create the VM.  Form the command string in stages.
     cmd_string = 'nova --os-username=%s --os-password=%s --os-tenant-name=%s' \
         % (admin_name, admin_pwd, slice_object.getTenantName())
-    cmd_string += (' boot %s --config-drive=true --poll --image %s --flavor %s' % \
+    cmd_string += (' boot %s --config-drive=true --image %s --flavor %s' % \
                        (vm_name, os_image_id, vm_flavor_id))
 
     component_name = vm_object.getComponentName()
@@ -1075,21 +1526,63 @@ def _createVM(vm_object, users, placement_hint):
         for i in range (0, len(placement_hint)) :
             cmd_string += (' --hint different_host=%s' % placement_hint[i])
 
-    # Issue the command to create the VM
+    # Issue the command to create the VM.  This returns as soon as nova
+    # has accepted the request; the boot is tracked by the boot tracker.
     try :
-        output = _execCommand(cmd_string) 
+        if client :
+            vm_uuid = _bootVMViaAPI(client, vm_object, os_image_id,
+                                    vm_flavor_id, admin_name, admin_pwd,
+                                    metadata_cmd_count > 0 and \
+                                        zipped_userdata_filename or None,
+                                    placement_hint)
+        else :
+            output = _execTableCommand(cmd_string) 
+            # Get the UUID of the VM that was created 
+            vm_uuid = _getValueByPropertyName(output, 'id')
     except :
         config.logger.error('Failed to create VM %s' % vm_name)
         return None
 
-    # Get the UUID of the VM that was created 
-    vm_uuid = _getValueByPropertyName(output, 'id')
-
     # Delete the temp file
     os.unlink(zipped_userdata_filename)
 
+    if vm_uuid == None :
+        config.logger.error('Failed to create VM %s' % vm_name)
+        return None
+
     # Set the operational state of the VM to configuring
+    vm_object.setUUID(vm_uuid)
     vm_object.setOperationalState(constants.configuring)
+    _getStatusCache().update(vm_uuid, 'BUILD')
+
+    future = _getBootTracker().track(vm_uuid)
+    future.addCallback(lambda future : _completeVMBoot(vm_object, future))
+    return future
+
+
+def _completeVMBoot(vm_object, future) :
+    """
+        Called by the boot tracker when the boot of the VM has finished.
+        Sets up the floating IPs and SSH proxy of VMs that have become
+        ACTIVE.  VMs that failed to boot are marked failed.
+    """
+    vm_uuid = vm_object.getUUID()
+    vm_name = vm_object.getName()
+    if vm_uuid != future.getVMUUID() or \
+            future.getResult() == boot_tracker.CANCELLED :
+        # The VM has been deleted (or re-created) since the boot started
+        return
+    if not future.succeeded() :
+        config.logger.error('VM %s failed to boot: %s' % \
+                                (vm_name, future.getResult()))
+        vm_object.setOperationalState(constants.failed)
+        return
+
+    slice_object = vm_object.getSlice()
+    tenant_uuid = slice_object.getTenantUUID()
+    mgmt_net_prefix = \
+        config.management_network_cidr[0:config.management_network_cidr.rfind('0/24')]
+    client = _apiClient()
 
     # Create the floating IPs for the VM
     if vm_object.getExternalIp() == 'true':
@@ -1098,12 +1591,17 @@ def _createVM(vm_object, users, placement_hint):
         for port in ports_info.keys():
             mgmt_ip = eval(ports_info[port]['fixed_ips'])['ip_address']
             found = string.find(mgmt_ip,mgmt_net_prefix)
-            if found != -1:
+            if found != -1 and client:
+                public_nets = client.list_networks(name='public')
+                fip = client.create_floatingip(public_nets[0]['id'],
+                                               tenant_uuid, port)
+                vm_object.setExternalIp(fip['floating_ip_address'])
+            elif found != -1:
                 fip_cmd = "%s floatingip-create --tenant-id %s public" %\
                     (config.network_type, tenant_uuid)
-                output = _execCommand(fip_cmd)
-                fip_id = _getValueByPropertyName(output,'id')
-                fip = _getValueByPropertyName(output,'floating_ip_address')
+                output = _execTableCommand(fip_cmd)
+                fip_id = output.getValueByPropertyName('id')
+                fip = output.getValueByPropertyName('floating_ip_address')
                 vm_object.setExternalIp(fip)
                 fip_cmd = "%s floatingip-associate %s %s" %\
                     (config.network_type, fip_id, port)
@@ -1116,13 +1614,20 @@ def _createVM(vm_object, users, placement_hint):
     # look for the property with the name of the management network
     cmd_string = 'nova show %s' % vm_uuid
     try :
-        output = _execCommand(cmd_string)
+        if client :
+            server = client.show_server(vm_uuid)
+        else :
+            output = _execTableCommand(cmd_string)
     except :
         config.logger.error('Failed to get properties for vm %s' % vm_uuid)
-        return None
-    property_name = config.management_network_name + ' network'
-    mgmt_nic_ipaddr = _getValueByPropertyName(output, property_name)
-    compute_host = _getValueByPropertyName(output, 'OS-EXT-SRV-ATTR:host')
+        vm_object.setOperationalState(constants.failed)
+        return
+    if client :
+        mgmt_nic_ipaddr, compute_host = _getServerMgmtAddrAndHost(server)
+    else :
+        property_name = config.management_network_name + ' network'
+        mgmt_nic_ipaddr = _getValueByPropertyName(output, property_name)
+        compute_host = _getValueByPropertyName(output, 'OS-EXT-SRV-ATTR:host')
     if mgmt_nic_ipaddr != None :
         portNumber = manage_ssh_proxy._addNewProxy(mgmt_nic_ipaddr)
         vm_object.setSSHProxyLoginPort(portNumber)
@@ -1131,7 +1636,112 @@ def _createVM(vm_object, users, placement_hint):
         config.logger.info('SSH Proxy assigned port number %d to host %s' % \
                                (portNumber, vm_name))
 
-    vm_object.setUUID(vm_uuid)
+    # Watch the console log of images that report the end of their boot
+    _set_status_by_boot_complete_msg(vm_object)
+
+def _bootVMViaAPI(client, vm_object, os_image_id, vm_flavor_id,
+                  admin_name, admin_pwd, userdata_filename, placement_hint) :
+    """
+        REST API version of 'nova boot': boot the VM as the tenant admin.
+        Returns the VM UUID without waiting for the VM to become ACTIVE.
+        Raises an exception if nova does not accept the request.
+    """
+    slice_object = vm_object.getSlice()
+    credentials = (admin_name, admin_pwd, slice_object.getTenantName())
+
+    # The GRAM management network NIC, then the experiment data NICs
+    networks = [{'uuid' : resources.GramManagementNetwork.get_mgmt_net_uuid()}]
+    for nic in vm_object.getNetworkInterfaces() :
+        if nic.isEnabled() and nic.getUUID() != None :
+            networks.append({'port' : nic.getUUID()})
+
+    user_data = None
+    if userdata_filename :
+        userdata_file = open(userdata_filename, 'r')
+        user_data = userdata_file.read()
+        userdata_file.close()
+
+    availability_zone = None
+    component_name = vm_object.getComponentName()
+    if component_name :
+        availability_zone = 'nova:' + component_name
+
+    server = client.boot_server(vm_object.getName(), os_image_id,
+                                vm_flavor_id, networks,
+                                [slice_object.getSecurityGroup()],
+                                credentials, user_data=user_data,
+                                availability_zone=availability_zone,
+                                different_host=placement_hint)
+    return server['id']
+
+
+def _getBootTracker() :
+    """
+        Returns the boot tracker shared by all VM boots, creating it
+        (and its poller thread) on first use.
+    """
+    global _boot_tracker
+    with _boot_tracker_lock :
+        if _boot_tracker == None :
+            _boot_tracker = \
+                boot_tracker.BootTracker(_refreshServerStatuses,
+                                         config.vm_boot_poll_interval,
+                                         config.vm_boot_timeout,
+                                         config.vm_boot_completion_workers)
+        return _boot_tracker
+
+_boot_tracker = None
+_boot_tracker_lock = threading.Lock()
+
+
+def _getStatusCache() :
+    """
+        Returns the cache of the nova status of all VMs
+    """
+    global _status_cache
+    with _boot_tracker_lock :
+        if _status_cache == None :
+            _status_cache = \
+                status_cache.ServerStatusCache(_listServerStatuses,
+                                               config.server_status_cache_ttl)
+        return _status_cache
+
+_status_cache = None
+
+
+def _refreshServerStatuses() :
+    """
+        List the status of all VMs for the boot tracker, updating the
+        status cache with the listing.
+    """
+    return _getStatusCache().refresh()
+
+
+def _listServerStatuses() :
+    """
+        Returns {vm_uuid : nova status} for the VMs of all tenants,
+        in a single nova call.
+    """
+    client = _apiClient()
+    if client :
+        return dict((server['id'], server['status']) \
+                        for server in client.list_servers())
+    servers = _execTableCommand('nova list --all-tenants')
+    return dict(zip(servers.getColumn('ID'), servers.getColumn('Status')))
+
+
+def _getServerMgmtAddrAndHost(server) :
+    """
+        Given a nova server dictionary, return the address of the server
+        on the GRAM management network and the compute host it runs on.
+    """
+    mgmt_nic_ipaddr = None
+    addresses = server.get('addresses', {})
+    if config.management_network_name in addresses and \
+            len(addresses[config.management_network_name]) > 0 :
+        mgmt_nic_ipaddr = addresses[config.management_network_name][0]['addr']
+    return mgmt_nic_ipaddr, server.get('OS-EXT-SRV-ATTR:host')
+
 
 def _createImage(slivers,options):
     found  = False
@@ -1203,7 +1813,14 @@ def _performOperationalAction(vm_object, action, options):
     config.logger.info("Performing %s " % nova_cmd)
  
     try :
-        _execCommand(nova_cmd)
+        client = _apiClient()
+        if client :
+            if cmd == 'reboot' :
+                client.server_action(uuid, 'reboot', {'type' : 'SOFT'})
+            else :
+                client.server_action(uuid, cmd)
+        else :
+            _execCommand(nova_cmd)
     except:
         config.logger.error('Failed to perform operational action %s %s: %s' %
                             (action, vm_object.getUUID(), nova_cmd))
@@ -1217,37 +1834,69 @@ def _deleteVM(vm_object) :
 
         Returns True of VM was successfully deleted.  False otherwise.
     """
-    return_val = True
-
     # Delete ports associatd with the VM
     for nic in vm_object.getNetworkInterfaces() :
         port_uuid = nic.getUUID()
         if port_uuid:
-            cmd_string = '%s port-delete %s' % (config.network_type, port_uuid)
-            try :
-                _execCommand(cmd_string)
-            except :
-                config.logger.error('Failed to delete port %s for VM %s' % \
-                                        (port_uuid, vm_object.getName()))
+            _deletePort(port_uuid, vm_object.getName())
 
-    # Delete floating IPs
+    _deleteFloatingIPs(vm_object)
+
+    return _deleteServer(vm_object)
+
+
+def _deleteFloatingIPs(vm_object) :
+    """
+        Delete the floating IPs of the OpenStack VM of this vm_object.
+        Returns True on success, False if any could not be deleted.
+    """
+    return_val = True
+    client = _apiClient()
     vm_uuid = vm_object.getUUID()
     fip_ids = _getFloatingIpByVM(vm_uuid)
     for fip_id in fip_ids:
         cmd_string = '%s floatingip-delete %s' % (config.network_type, fip_id)
         try :
-            _execCommand(cmd_string)
+            if client :
+                client.delete_floatingip(fip_id)
+            else :
+                _execCommand(cmd_string)
         except :
             config.logger.error('Failed to delete floating ip %s for VN %s' % \
                                         (fip_id,vm_object.getName()))
+            return_val = False
+    return return_val
+
+
+def _forgetServer(vm_uuid) :
+    """
+        Stop tracking the boot and status of a VM that is being deleted
+    """
+    if _boot_tracker != None :
+        _boot_tracker.forget(vm_uuid)
+    _getStatusCache().remove(vm_uuid)
+    if _boot_watcher != None :
+        _boot_watcher.unwatch(vm_uuid)
+
 
+def _deleteServer(vm_object) :
+    """
+        Delete the OpenStack VM of this vm_object (but not its ports).
+        Returns True of VM was successfully deleted.  False otherwise.
+    """
+    return_val = True
+    client = _apiClient()
 
     # Delete the VM
     vm_uuid = vm_object.getUUID()
     if vm_uuid != None :
+        _forgetServer(vm_uuid)
         cmd_string = 'nova delete %s' % vm_uuid
         try :
-            _execCommand(cmd_string)
+            if client :
+                client.delete_server(vm_uuid)
+            else :
+                _execCommand(cmd_string)
         except :
             config.logger.error('Failed to delete VM %s with uuid %s' % \
                                     (vm_object.getName(), vm_uuid))
@@ -1268,7 +1917,7 @@ def _getRouterUUID(router_name) :
         working.
     """
     cmd_string = '%s router-list' % config.network_type
-    output = _execCommand(cmd_string) 
+    output = _execTableCommand(cmd_string) 
 
     return _getUUIDByName(output, router_name)
 
@@ -1278,7 +1927,7 @@ def _getUserUUID(user_name) :
         Return the UUID of the specified OpenStrack user.
     """
     cmd_string = 'keystone user-list'
-    output = _execCommand(cmd_string) 
+    output = _execTableCommand(cmd_string) 
 
     # Extract and return the uuid of the admin user 
     return _getUUIDByName(output, user_name)
@@ -1289,9 +1938,10 @@ def  _getImageUUID(image_name) :
         Given the name of an OS image (e.g. ubuntu-12.04), returns the 
         UUID of the image.  Returns None if the image cannot be found.
     """
-    output = resources.GramImageInfo.get_image_list()
+    output = resources.GramImageInfo.get_image_table()
     if not _getUUIDByName(output, image_name):
         resources.GramImageInfo.refresh()
+        output = resources.GramImageInfo.get_image_table()
 
 #    print output
     #cmd_string = 'nova image-list'
@@ -1313,7 +1963,7 @@ def _getFlavorID(flavor_name) :
     """
     # cmd_string = 'nova flavor-list'
     # output = _execCommand(cmd_string) 
-    output = resources.GramImageInfo.get_flavor_list()
+    output = resources.GramImageInfo.get_flavor_table()
     # Extract and return the uuid of the image
     return _getUUIDByName(output, flavor_name)
 
@@ -1326,26 +1976,14 @@ def _getUUIDByName(output_table, name) :
         column of the table has uuids of the objects listed and the other 
         columns have information on the objects such as name
 
+        output_table is the output parsed into a cli_output.CLITable (by
+        _execTableCommand or cli_output.parseOutput), so several values
+        can be looked up in one parse.
+
         This function finds the table row with the specified OpenStack 
         object (name) and returns column 1 of this table row.
     """
-    # Split the output table into lines (rows of the table)
-    output_lines = output_table.split('\n')
-
-    # Escape any non-alpanumerics in name
-    name = re.escape(name)
-
-    # Find the row in the output table that has an entry for object name
-    # Column 1 of this row will have the uuid for this object
-    for i in range(len(output_lines)) :
-        if re.search(r'\b' + name + r'\b', output_lines[i]) :
-            # Found the table row for router_name.  Split this row into 
-            # individual columns and pick out column 1
-            
-            columns = output_lines[i].split('|')
-            return columns[1].strip()
-
-    return None   # Failed to find the uuid
+    return output_table.getUUIDByName(name)
 
 
 def _getValueByPropertyName(output_table, property_name) :
@@ -1363,30 +2001,21 @@ def _getValueByPropertyName(output_table, property_name) :
         | id    |   uuid    |
         and returns the value of id (uuid).
 
+        output_table is the output parsed into a cli_output.CLITable.
         Returns None if a table row cannot be found for the specified 
         property_name.
     """
-    # Split the output into lines (rows of the table)
-    output_lines = output_table.split('\n')
-
-    # Escape any non-alpanumerics in property_name
-    property_name = re.escape(property_name)
-
-    # Look for the row with property_name
-    for i in range(len(output_lines)) :
-        if re.search(r'\b' + property_name + r'\b', output_lines[i]) :
-            # Found the table row with the id.  Split this row into individual
-            # columns and pick out column 2
-            columns = output_lines[i].split('|')
-            return columns[2].strip()
-
-    return None   # Failed to find the uuid
+    return output_table.getValueByPropertyName(property_name)
 
 
 def _getComputeNodeCount() :
     """
         Returns the number of compute nodes on the rack.
     """
+    client = _apiClient()
+    if client :
+        return len(client.list_hypervisors())
+
     cmd_string = 'nova hypervisor-list'
     output = _execCommand(cmd_string)
 
@@ -1399,22 +2028,27 @@ def _getComputeNodeCount() :
     #    | .. | ...                 |
     #    | N  | computeN            |
     #    +----+---------------------+
-    # The number of compute nodes is therefore the number of lines in
-    # the output - 5 (there is an extra newline)
-    output_lines = output.split('\n')
-    return len(output_lines) - 5
+    # The number of compute nodes is the number of rows of the table
+    return len(cli_output.parseTable(output))
 
 # Get dictionary of hostnames : hostname => list of services
 def _listHosts(onlyForService=None):
     hosts = {}
+    client = _apiClient()
+    if client :
+        for host in client.list_hosts() :
+            host_name = host['host_name']
+            service = host['service']
+            if onlyForService and onlyForService != service: continue
+            if not hosts.has_key(host_name): hosts[host_name] = []
+            hosts[host_name].append(service)
+        return hosts
+
     command_string = 'nova host-list'
     output = _execCommand(command_string)
-    output_lines = output.split('\n')
-    for i in range(3, len(output_lines)-2):
-        line = output_lines[i]
-        parts = line.split('|')
-        host_name = parts[1].strip()
-        service = parts[2].strip()
+    for row in cli_output.parseTable(output).getRows():
+        host_name = row[0]
+        service = row[1]
         if onlyForService and onlyForService != service: continue
         if not hosts.has_key(host_name): hosts[host_name] = []
         hosts[host_name].append(service)
@@ -1425,13 +2059,10 @@ def _listFlavors():
     flavors = {}
     #command_string = "nova flavor-list"
     #output = _execCommand(command_string)
-    output = resources.GramImageInfo.get_flavor_list()
-    output_lines = output.split('\n')
-    for i in range(3, len(output_lines)-2):
-        line = output_lines[i]
-        parts = line.split('|')
-        id = int(parts[1].strip())
-        name = parts[2].strip()
+    output = resources.GramImageInfo.get_flavor_table()
+    for row in output.getRows():
+        id = int(row[0])
+        name = row[1]
         flavors[id]=name
     return flavors
 
@@ -1440,14 +2071,10 @@ def _listImages():
     images ={}
     command_string = "nova image-list"
     #output = _execCommand(command_string)
-    output = resources.GramImageInfo.get_image_list()
-    #print output2
-    output_lines = output.split('\n')
-    for i in range(3, len(output_lines)-2):
-        line = output_lines[i]
-        parts = line.split('|')
-        image_id = parts[1].strip()
-        image_name = parts[2].strip()
+    output = resources.GramImageInfo.get_image_table()
+    for row in output.getRows():
+        image_id = row[0]
+        image_name = row[1]
         images[image_id] = image_name
 
     return images
@@ -1495,27 +2122,27 @@ def _getFloatingIpByVM(vm_uuid):
     """
 
     fip_ids = []
+    client = _apiClient()
+    if client :
+        for port in client.list_ports(device_id=vm_uuid) :
+            for fip in client.list_floatingips(port_id=port['id']) :
+                config.logger.info("getting floating ip: " + fip['id'])
+                fip_ids.append(fip['id'])
+        return fip_ids
+
     # Get a list of ports on the VM
-    cmd = '%s port-list --device_id=%s' % (config.network_type, vm_uuid)
-    output = _execCommand(cmd)
-    output_lines = output.split('\n')
-    name = 'subnet'
-    for line in output_lines:
-        if re.search(name, line) :
-            columns = line.split('|')
-            port_id = columns[1].strip()
-            # for each port get a list of associated floating IPs
-            output2 = _execCommand("%s floatingip-list -- --port_id=%s" % (config.network_type, port_id))
-            port = re.escape(port_id)
-            output_lines2 = output2.split('\n')
-            # Find the row in the output table that has the desired port
-            for i in range(len(output_lines2)) :
-                if re.search(r'\b' + port + r'\b', output_lines2[i]) :
-                    # Found the table row for router_name.  Split this row into 
-                    # individual columns and pick out column 1
-                    columns = output_lines2[i].split('|')
-                    config.logger.info("getting floating ip: " + columns[1].strip())
-                    fip_ids.append(columns[1].strip())
+    cmd = '%s port-list -- --device_id=%s' % (config.network_type, vm_uuid)
+    ports = _execTableCommand(cmd)
+    for port in ports.getDicts():
+        if 'subnet' not in port.get('fixed_ips', ''): continue
+        port_id = port['id']
+        # for each port get a list of associated floating IPs
+        fips = _execTableCommand("%s floatingip-list -- --port_id=%s" % \
+                                     (config.network_type, port_id))
+        for fip in fips.getDicts():
+            if fip.get('port_id') == port_id:
+                config.logger.info("getting floating ip: " + fip['id'])
+                fip_ids.append(fip['id'])
 
     return fip_ids
 
@@ -1556,48 +2183,98 @@ def _execCommand(cmd_string) :
         raise
 
 
-# Number of seconds must wait before actually updating sliver status
-# Calls to 'nova show' and 'nova console-log' are rate limited
-# and give errors if you call them too frequenty
-UPDATE_OPERATIONAL_STATUS_RATE_LIMIT = 2
+def _execDeleteCommand(cmd_string) :
+    """
+       Execute the specified command like _execCommand, but keep the
+       error output of a failed command in the CalledProcessError raised
+       (as its output) so the failure can be classified.
+    """
+    config.logger.info('Issuing command %s' % cmd_string)
+    process = subprocess.Popen(cmd_string.split(), stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    output, error_output = process.communicate()
+    if process.returncode != 0 :
+        config.logger.error('Error executing command %s' % cmd_string)
+        raise subprocess.CalledProcessError(process.returncode, cmd_string,
+                                            output + error_output)
+    return output
+
+
+# Command line clients that can print their results as JSON ('-f json')
+_JSON_OUTPUT_CLIS = ['quantum', 'neutron']
+
+# Subcommands that rejected the '-f json' option.  These are issued
+# without it from then on.
+_json_output_failed = set()
+
+def _execTableCommand(cmd_string) :
+    """
+       Execute the specified command and return its output parsed into
+       a cli_output.CLITable.  For clients that support it, the output is
+       requested as JSON; otherwise the ASCII table is parsed.
+       Raises an exception if the command execution fails.
+    """
+    command = cmd_string.split()
+    if not config.cli_structured_output or len(command) < 2 or \
+            command[0] not in _JSON_OUTPUT_CLIS or \
+            command[1] in _json_output_failed :
+        return cli_output.parseTable(_execCommand(cmd_string))
+
+    # Options for the subcommand go right after it (before any '--')
+    json_cmd_string = ' '.join(command[:2] + ['-f', 'json'] + command[2:])
+    try :
+        output = _execCommand(json_cmd_string)
+    except subprocess.CalledProcessError, e :
+        # Exit status 2 is a usage error: this client version doesn't
+        # know '-f json' for the subcommand.  Anything else is a real
+        # failure of the command.
+        if e.returncode != 2 : raise
+        config.logger.info('%s %s does not support JSON output' % \
+                               (command[0], command[1]))
+        _json_output_failed.add(command[1])
+        return cli_output.parseTable(_execCommand(cmd_string))
+    # The command has run, so never reissue it (it may have created
+    # something).  Parse whatever came back.
+    try :
+        return cli_output.parseJSON(output)
+    except ValueError :
+        return cli_output.parseTable(output)
+
+
+# The nova status of each VM comes from the server status cache, which
+# lists all servers at once, and the console logs of booting VMs are
+# polled by the BootWatcher, so no per-VM 'nova show' or 'nova
+# console-log' calls are made here
 def updateOperationalStatus(geni_slice) :
     """
         Update the operational status of all VM resources.
+        The nova status of the VMs is read from the server status cache.
     """
+    cache = _getStatusCache()
     vms = geni_slice.getVMs()
     for i in range(0, len(vms)) :
         vm_object = vms[i]
         vm_uuid = vm_object.getUUID()
-        last_status_update = vm_object.getLastStatusUpdate()
-        now = time.time()
-        if last_status_update is not None and \
-                (now - last_status_update) < UPDATE_OPERATIONAL_STATUS_RATE_LIMIT:
-            config.logger.info("Not updating operational status until %f" % \
-                                    last_status_update)
-            continue;
-        vm_object.setLastStatusUpdate(now)
-        if vm_uuid != None :
-            # If this is an image for which we can look in log
-            # to determine successful completion of boot, use that instead
-            # of nova show status
-            setting_status_by_boot_complete_msg = \
-                _set_status_by_boot_complete_msg(vm_object)
-            if setting_status_by_boot_complete_msg: continue
-
-            cmd_string = 'nova show %s' % vm_uuid
-            try :
-                output = _execCommand(cmd_string) 
-            except :
-                # Failed to update operational status of this VM.   Set the
-                # state to failed
+        if vm_uuid == None : continue
+
+        vm_state = cache.getStatus(vm_uuid)
+
+        # If this is an image for which we can look in log
+        # to determine successful completion of boot, use that instead
+        # of nova status
+        if vm_state == 'ACTIVE' and \
+                _set_status_by_boot_complete_msg(vm_object) :
+            continue
+
+        if vm_state == None :
+            if cache.hasListing() :
+                # The VM does not exist any more
                 config.logger.error('Failed to find the status of VM for node %s' % vm_object.getName())
                 vm_object.setOperationalState(constants.failed)
-            else :
-                vm_state = _getValueByPropertyName(output, 'status')
-                if vm_state == 'ACTIVE' :
-                    vm_object.setOperationalState(constants.ready)
-                elif vm_state == 'ERROR' :
-                    vm_object.setOperationalState(constants.failed)
+        elif vm_state == 'ACTIVE' :
+            vm_object.setOperationalState(constants.ready)
+        elif vm_state == 'ERROR' :
+            vm_object.setOperationalState(constants.failed)
 
     links = geni_slice.getNetworkLinks()
     for i in range(0, len(links)) :
@@ -1606,58 +2283,67 @@ def updateOperationalStatus(geni_slice) :
         if network_uuid != None :
             link_object.setOperationalState(constants.ready)
 
+def getStatusCacheMetrics() :
+    """
+        Returns the hit/miss/refresh counters of the server status cache.
+    """
+    return _getStatusCache().getMetrics()
+
+
+def _hasBootCompleteMsg(vm_object) :
+    image_name = vm_object.getOSImageName()
+    return image_name in config.disk_image_metadata and \
+        'boot_complete_msg' in config.disk_image_metadata[image_name]
+
+
 # If the VM is booted with an image for which a 'boot_complete_msg' is
 # registered in the config.disk_image_metadata, use the console-log
-# rather than the nova show to determine the operational status
+# rather than the nova status to determine the operational status.
+# The boot watcher sets the state of the VM once the message appears
+# in the log.  Returns False if the image has no boot_complete_msg.
 def _set_status_by_boot_complete_msg(vm_object):
-    vm_uuid = vm_object.getUUID()
-    image_name = vm_object.getOSImageName()
-    if not image_name in config.disk_image_metadata or not \
-            'boot_complete_msg' in config.disk_image_metadata[image_name]:
+    if not _hasBootCompleteMsg(vm_object):
         return False
 
-    cmd_string = 'nova console-log --length 2 %s' % vm_uuid
-    try :
-        output = _execCommand(cmd_string)
-    except Exception, e:
-        config.logger.error("Failed to get console log %s" % vm_uuid)
-        vm_object.setOperationalState(constants.failed)
-    else:
-#        config.logger.info("VM IMAGE %s TYPE %s VERSION %s" % \
-#                               (image_name, vm_object.getOSType(), 
-#                                vm_object.getOSVersion()))
+    if vm_object.getOperationalState() not in \
+            [constants.ready, constants.failed] :
+        image_name = vm_object.getOSImageName()
         boot_complete_msg = \
             config.disk_image_metadata[image_name]['boot_complete_msg']
-        
-        boot_done = output.find(boot_complete_msg) >= 0
-        config.logger.info("BOOT DONE MATCH = %s %s %s" % (boot_complete_msg, output, boot_done))
-        if boot_done:
-            vm_object.setOperationalState(constants.ready)
-        else:
-            vm_object.setOperationalState(constants.notready)
-
+        _getBootWatcher().watch(vm_object, boot_complete_msg)
     return True
 
+
+def _getBootWatcher() :
+    """
+        Returns the watcher of the console logs of booting VMs
+    """
+    global _boot_watcher
+    with _boot_tracker_lock :
+        if _boot_watcher == None :
+            _boot_watcher = \
+                boot_watcher.BootWatcher(_getConsoleLog,
+                                         config.boot_watch_poll_interval,
+                                         config.boot_watch_timeout,
+                                         config.boot_watch_tail_lines)
+        return _boot_watcher
+
+_boot_watcher = None
+
+
+def _getConsoleLog(vm_uuid, length) :
+    """
+        Returns the last length lines of the console log of the VM
+    """
+    client = _apiClient()
+    if client :
+        return client.get_console_output(vm_uuid, length)
+    return _execCommand('nova console-log --length %d %s' % (length, vm_uuid))
+
 # Parse return from an OpenStack call and return table 
 #   {key: values, key : values}
 def _parseTableOutput(output):
-    lines = output.split('\n')
-    header_line = lines[1]
-    data_lines = lines[3:len(lines)-2]
-    header_parts = header_line.split('|')
-    headers = [header_part.strip() for header_part in header_parts \
-                   if header_part.strip() != '']
-    data = [[data_part.strip() for data_part in data_line.split('|')] \
-                 for data_line in data_lines]
-    for i in range(len(data)):
-        data[i] = data[i][1:len(headers)+1]
-    output = {}
-    for i in range(len(headers)):
-        header = headers[i]
-        data_for_header = [data_for_line[i] for data_for_line in data]
-        output[header] = data_for_header
-        
-    return output
+    return cli_output.parseOutput(output).getColumns()
 
 def listImages():
     cmd_string = "glance image-list"
@@ -1683,85 +2369,176 @@ def listImages():
 
 
 def get_all_tenant_info():
+    """
+        Returns {tenant_uuid : {'vm_uuids' : [...], 'net_uuids' : [...],
+        'subnet_uuids' : [...], 'router_uuids' : [...], 'user_uuids' :
+        [...]}} for the tenants of slices (all tenants but admin and
+        service).  There are user_uuids only for tenants with users.
+
+        Each type of resource is listed once for all tenants and the
+        listings run concurrently, at most config.reconcile_max_workers at
+        a time.  (With the command line clients, VMs are listed per tenant
+        as nova doesn't report the tenants of VMs, and the tenant of each
+        user is looked up per user.)
+    """
+    listings = {}
+    def listing(name, function) :
+        def run() :
+            listings[name] = function()
+        return run
+
+    client = _apiClient()
+    functions = [listing('tenants', _listSliceTenantUUIDs),
+                 listing('users', _listUserUUIDsByTenant),
+                 listing('router_uuids', lambda : _listUUIDsByTenant('router')),
+                 listing('net_uuids', lambda : _listUUIDsByTenant('net')),
+                 listing('subnet_uuids', lambda : _listUUIDsByTenant('subnet'))]
+    if client :
+        functions.append(listing('vm_uuids', _listVMUUIDsByTenant))
+    _runConcurrently(functions, config.reconcile_max_workers)
+
+    tenant_ids = listings['tenants']
+    if not client :
+        listings['vm_uuids'] = _listVMUUIDsByTenant(tenant_ids)
+
+    result = {}
+    for tenant_id in tenant_ids :
+        result[tenant_id] = {}
+        for key in ['vm_uuids', 'router_uuids', 'net_uuids', 'subnet_uuids']:
+            result[tenant_id][key] = listings[key].get(tenant_id, [])
+        if tenant_id in listings['users'] :
+            result[tenant_id]['user_uuids'] = listings['users'][tenant_id]
+    return result
 
-    # Dictionary of 'vm_uuids', 'net_uuids', 'subnet_uuids', 'router_uuids'
-    #   'user_uuids', 'secgrp_uuids'
-    #  indexed by tenant_uuid
-    result = {} 
 
-    # Get all tenants
-    cmd_string = "keystone tenant-list"
-    output = _execCommand(cmd_string)
-    tenant_info = _parseTableOutput(output)
+def _runConcurrently(functions, max_workers) :
+    """
+        Call the given functions on at most max_workers threads and
+        return their results, in order.  If any function raises an
+        exception, the first one is raised again once all have finished.
+    """
+    results = [None] * len(functions)
+    errors = []
+    next_index = [0]
+    lock = threading.Lock()
+
+    def work() :
+        while True :
+            with lock :
+                if next_index[0] == len(functions) : return
+                index = next_index[0]
+                next_index[0] = index + 1
+            try :
+                results[index] = functions[index]()
+            except Exception, e :
+                with lock :
+                    errors.append(e)
 
-    # Tenant ID's correspond to slices
-    tenant_ids = []
-    for i in range(len(tenant_info['name'])):
-        tenant_name = tenant_info['name'][i]
-        if tenant_name not in ['admin', 'service']:
-            tenant_ids.append(tenant_info['id'][i])
+    workers = [threading.Thread(target=work) \
+                   for i in range(min(max(1, max_workers), len(functions)))]
+    for worker in workers : worker.start()
+    for worker in workers : worker.join()
+    if len(errors) > 0 :
+        raise errors[0]
+    return results
 
-    # Users are admins on slices
-    cmd_string = "keystone user-list"
-    output = _execCommand(cmd_string)
-#    print "USER-LIST %s" % output
-    users_info = _parseTableOutput(output)
-#    print "USERS_INFO = %s" % users_info
+
+def _listSliceTenantUUIDs() :
+    """
+        Returns the uuids of all tenants but admin and service.
+        Tenant ID's correspond to slices.
+    """
+    client = _apiClient()
+    if client :
+        tenants = [(tenant['name'], tenant['id']) \
+                       for tenant in client.list_tenants()]
+    else :
+        tenant_info = _execTableCommand("keystone tenant-list")
+        tenants = zip(tenant_info.getColumn('name'), 
+                      tenant_info.getColumn('id'))
+    return [tenant_id for tenant_name, tenant_id in tenants \
+                if tenant_name not in ['admin', 'service']]
+
+
+def _listUserUUIDsByTenant() :
+    """
+        Returns {tenant_uuid : [user_uuid]} for the users other than the 
+        OpenStack service users.  Users are admins on slices.
+    """
+    service_users = ['admin', 'cinder', 'glance', 'nova', config.network_type]
     user_uuids_by_tenant_id = {}
-    for i in range(len(users_info['id'])):
-        if users_info['name'][i] not in \
-                ['admin', 'cinder', 'glance', 'nova', config.network_type]:
-            user_uuid = users_info['id'][i]
-            user_cmd_string = 'keystone user-get %s' % user_uuid
-            user_output = _execCommand(user_cmd_string)
-            user_info = _parseTableOutput(user_output)
-            for j in range(len(user_info['Property'])):
-                if user_info['Property'][j] == 'tenantId':
-                    user_tenant_uuid = user_info['Value'][j]
-                    user_uuids_by_tenant_id[user_tenant_uuid] = [user_uuid]
-
-    # Nova instance ID's correspond to VM UUIDs
-    for tenant_id in tenant_ids:
+    client = _apiClient()
+    if client :
+        for user in client.list_users() :
+            if user['name'] not in service_users and user.get('tenantId') :
+                user_uuids_by_tenant_id[user['tenantId']] = [user['id']]
+        return user_uuids_by_tenant_id
+
+    users_info = _execTableCommand("keystone user-list")
+    user_uuids = [user['id'] for user in users_info.getDicts() \
+                      if user['name'] not in service_users]
+    # keystone user-list doesn't show tenants: get each user
+    def getUserTenant(user_uuid) :
+        user_info = _execTableCommand('keystone user-get %s' % user_uuid)
+        return user_info.getValueByPropertyName('tenantId')
+    user_tenant_uuids = \
+        _runConcurrently([lambda user_uuid=user_uuid : \
+                              getUserTenant(user_uuid) \
+                              for user_uuid in user_uuids],
+                         config.reconcile_max_workers)
+    for user_uuid, user_tenant_uuid in zip(user_uuids, user_tenant_uuids) :
+        if user_tenant_uuid :
+            user_uuids_by_tenant_id[user_tenant_uuid] = [user_uuid]
+    return user_uuids_by_tenant_id
+
+
+def _listUUIDsByTenant(resource_type) :
+    """
+        Returns {tenant_uuid : list of uuids} of all resources of the
+        given type ('net', 'subnet' or 'router') in quantum/neutron.
+    """
+    uuids_by_tenant_id = {}
+    client = _apiClient()
+    if client :
+        list_function = {'net' : client.list_networks,
+                         'subnet' : client.list_subnets,
+                         'router' : client.list_routers}[resource_type]
+        tenant_resources = [(item['tenant_id'], item['id']) \
+                                for item in list_function()]
+    else :
+        cmd_string = '%s %s-list -F id -F tenant_id' % \
+            (config.network_type, resource_type)
+        resource_info = _execTableCommand(cmd_string)
+        tenant_resources = zip(resource_info.getColumn('tenant_id'),
+                               resource_info.getColumn('id'))
+    for tenant_id, object_uuid in tenant_resources :
+        uuids_by_tenant_id.setdefault(tenant_id, []).append(object_uuid)
+    return uuids_by_tenant_id
 
-        result[tenant_id] = {}
 
+def _listVMUUIDsByTenant(tenant_ids=None) :
+    """
+        Returns {tenant_uuid : list of VM uuids}.  With the REST client
+        all VMs are listed in one call.  Otherwise (nova list doesn't
+        show tenants) the VMs of the given tenants are listed concurrently.
+        Nova instance ID's correspond to VM UUIDs.
+    """
+    client = _apiClient()
+    if client :
+        vm_uuids_by_tenant_id = {}
+        for server in client.list_servers() :
+            vm_uuids_by_tenant_id.setdefault(server['tenant_id'], 
+                                             []).append(server['id'])
+        return vm_uuids_by_tenant_id
+
+    def listTenantVMs(tenant_id) :
         cmd_string = 'nova list --tenant %s --all-tenants' % tenant_id
-        output = _execCommand(cmd_string)
-        vms_info = _parseTableOutput(output)
-        vm_uuids = []
-        if 'ID' in vms_info:
-            vm_uuids = vms_info['ID']
-        result[tenant_id]['vm_uuids'] = vm_uuids
-
-        cmd_string = '%s router-list -F id --tenant_id=%s' % (config.network_type, tenant_id)
-        output = _execCommand(cmd_string)
-        router_info = _parseTableOutput(output)
-        router_uuids = []
-        if 'id' in router_info:
-            router_uuids = router_info['id']
-        result[tenant_id]['router_uuids'] = router_uuids
-
-        cmd_string = '%s net-list -F id --tenant_id=%s' % (config.network_type, tenant_id)
-        output = _execCommand(cmd_string)
-        net_info = _parseTableOutput(output)
-        net_uuids = []
-        if 'id' in net_info:
-            net_uuids = net_info['id']
-        result[tenant_id]['net_uuids'] = net_uuids
-
-        cmd_string = '%s subnet-list -F id --tenant_id=%s' % (config.network_type, tenant_id)
-        output = _execCommand(cmd_string)
-        subnet_info = _parseTableOutput(output)
-        subnet_uuids = []
-        if 'id' in subnet_info:
-            subnet_uuids = subnet_info['id']
-        result[tenant_id]['subnet_uuids'] = subnet_uuids
-
-        if tenant_id in user_uuids_by_tenant_id:
-            result[tenant_id]['user_uuids'] = \
-                user_uuids_by_tenant_id[tenant_id]
-
-    return result
+        return _execTableCommand(cmd_string).getColumn('ID')
+    vm_uuids = _runConcurrently([lambda tenant_id=tenant_id : \
+                                     listTenantVMs(tenant_id) \
+                                     for tenant_id in tenant_ids],
+                                config.reconcile_max_workers)
+    return dict(zip(tenant_ids, vm_uuids))
 
 if __name__ == "__main__":
     import sys
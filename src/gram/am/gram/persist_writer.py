@@ -0,0 +1,254 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Background writer of the aggregate state.
+#
+# Request threads call markDirty when they change the state of a slice
+# (or of the aggregate as a whole).  A single worker thread waits
+# config.persist_coalesce_window seconds after the first notification
+# so that a burst of changes is persisted in one write, then calls the
+# write function with the slices that changed.
+#
+# flush is a barrier: it returns once every change notified before the
+# call has been written.
+#
+# If a write fails, the slices it was writing are marked dirty again
+# and the write is retried after a backoff (doubling up to
+# config.persist_max_retry_backoff seconds).
+
+import thread
+import threading
+import time
+
+import config
+
+
+class PersistWriter:
+    """
+        Coalesces "state dirty" notifications and persists them from a
+        worker thread.
+
+        write_function(slice_objects) persists the state of the given
+        slices, or of all slices if slice_objects is None.
+    """
+    def __init__(self, write_function, coalesce_window):
+        self._write_function = write_function
+        self._coalesce_window = coalesce_window
+        self._condition = threading.Condition()
+
+        # Slices changed since the last write, by slice_urn
+        self._dirty_slices = {}
+        # Whether the state as a whole is dirty
+        self._dirty_all = False
+
+        # Sequence number of the latest notification and of the
+        # latest notification that has been written
+        self._notified = 0
+        self._written = 0
+        self._flush_requested = False
+        # Consecutive failed writes (for the retry backoff)
+        self._consecutive_failures = 0
+
+        # Metrics
+        self._num_notifications = 0
+        self._num_writes = 0
+        self._num_failures = 0
+        self._max_queue_depth = 0
+        self._total_write_latency = 0.0
+        self._max_write_latency = 0.0
+        self._last_write_latency = 0.0
+
+        thread.start_new_thread(self._run, ())
+
+    def markDirty(self, slice_object=None):
+        """
+            Note that the state of the given slice (or of all slices 
+            if None) needs to be persisted
+        """
+        with self._condition:
+            if slice_object is None:
+                self._dirty_all = True
+            else:
+                self._dirty_slices[slice_object.getSliceURN()] = slice_object
+            self._notified = self._notified + 1
+            self._num_notifications = self._num_notifications + 1
+            self._max_queue_depth = max(self._max_queue_depth, 
+                                        self._queueDepth())
+            self._condition.notifyAll()
+
+    def flush(self, timeout=None):
+        """
+            Wait until all changes notified so far have been written.
+            Returns False if a write failed or the timeout (in seconds) 
+            expired first.
+        """
+        deadline = None
+        if timeout is not None: deadline = time.time() + timeout
+        with self._condition:
+            target = self._notified
+            num_failures = self._num_failures
+            self._flush_requested = True
+            self._condition.notifyAll()
+            while self._written < target:
+                if self._num_failures > num_failures: return False
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0: return False
+                    self._condition.wait(remaining)
+        return True
+
+    def getMetrics(self):
+        """
+            Return dictionary of writer metrics: current and maximum queue 
+            depth (slices waiting to be written), notification, write
+            and failure counts and write latencies in seconds
+        """
+        with self._condition:
+            mean_write_latency = 0.0
+            if self._num_writes > 0:
+                mean_write_latency = \
+                    self._total_write_latency / self._num_writes
+            return {'queue_depth' : self._queueDepth(),
+                    'max_queue_depth' : self._max_queue_depth,
+                    'notifications' : self._num_notifications,
+                    'writes' : self._num_writes,
+                    'failures' : self._num_failures,
+                    'last_write_latency' : self._last_write_latency,
+                    'mean_write_latency' : mean_write_latency,
+                    'max_write_latency' : self._max_write_latency}
+
+    # Called with self._condition held
+    def _queueDepth(self):
+        if self._dirty_all: return len(self._dirty_slices) + 1
+        return len(self._dirty_slices)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._written == self._notified:
+                    self._condition.wait()
+
+                # Let a burst of notifications accumulate
+                if not self._flush_requested:
+                    deadline = time.time() + self._coalesce_window
+                    while not self._flush_requested:
+                        remaining = deadline - time.time()
+                        if remaining <= 0: break
+                        self._condition.wait(remaining)
+                self._flush_requested = False
+
+                target = self._notified
+                queue_depth = self._queueDepth()
+                if self._dirty_all:
+                    slice_objects = None
+                else:
+                    slice_objects = self._dirty_slices.values()
+                self._dirty_slices = {}
+                self._dirty_all = False
+
+            start_time = time.time()
+            failed = False
+            try:
+                self._write_function(slice_objects)
+            except Exception, e:
+                config.logger.error("Failed to persist state: %s" % e)
+                failed = True
+            latency = time.time() - start_time
+
+            with self._condition:
+                self._num_writes = self._num_writes + 1
+                if failed:
+                    # Mark the slices dirty again so the retry writes them
+                    if slice_objects is None:
+                        self._dirty_all = True
+                    else:
+                        for slice_object in slice_objects:
+                            self._dirty_slices.setdefault( \
+                                slice_object.getSliceURN(), slice_object)
+                    self._num_failures = self._num_failures + 1
+                    self._consecutive_failures = \
+                        self._consecutive_failures + 1
+                else:
+                    self._written = target
+                    self._consecutive_failures = 0
+                self._last_write_latency = latency
+                self._total_write_latency = \
+                    self._total_write_latency + latency
+                self._max_write_latency = max(self._max_write_latency, 
+                                              latency)
+                backlog = self._queueDepth()
+                consecutive_failures = self._consecutive_failures
+                self._condition.notifyAll()
+
+            if failed:
+                backoff = min(config.persist_max_retry_backoff,
+                              config.persist_retry_backoff * \
+                                  2 ** (consecutive_failures - 1))
+                config.logger.error("Retrying persist in %.1f sec" % backoff)
+                time.sleep(backoff)
+            else:
+                config.logger.info( \
+                    "Persisted %d slices in %.3f sec (%d waiting)" \
+                        % (queue_depth, latency, backlog))
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig()
+    config.logger.setLevel(logging.WARNING)
+
+    class FakeSlice:
+        def __init__(self, urn): self._urn = urn
+        def getSliceURN(self): return self._urn
+
+    writes = []
+    def write(slice_objects):
+        time.sleep(0.01) # Disk I/O
+        writes.append(slice_objects)
+
+    writer = PersistWriter(write, 0.05)
+    slices = [FakeSlice('urn:slice+%d' % i) for i in range(20)]
+    start = time.time()
+    for i in range(1000):
+        writer.markDirty(slices[i % len(slices)])
+    notify_time = time.time() - start
+    writer.flush()
+    print "1000 notifications in %.4f sec, %d writes after flush" % \
+        (notify_time, len(writes))
+    print "METRICS = %s" % writer.getMetrics()
+
+    # A failed write is reported by flush and retried
+    config.persist_retry_backoff = 0.05
+    failures = [1]
+    def write_failing_once(slice_objects):
+        if failures:
+            failures.pop()
+            raise IOError("Disk full")
+        writes.append(slice_objects)
+    writes = []
+    writer = PersistWriter(write_failing_once, 0.01)
+    writer.markDirty(slices[0])
+    print "flush after failed write = %s" % writer.flush()
+    print "flush after retry = %s, %d writes" % (writer.flush(), len(writes))
@@ -0,0 +1,228 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Dependency-ordered execution of the OpenStack operations that
+# provision a slice.
+#
+# Each operation is a step with a name, an action, the names of the
+# steps it depends on and an optional rollback.  Steps whose dependencies
+# have completed run concurrently on a bounded pool of worker threads.
+# If a step fails, no further steps are started and, once the running
+# steps have finished, the rollbacks of the steps that ran are called
+# in the reverse of the order in which the steps finished.
+
+import Queue
+import threading
+import time
+
+import config
+
+
+class ProvisioningStep:
+    """
+        An action returns None on success or an error message on failure.
+        A rollback undoes whatever its action did (even partially).
+    """
+    def __init__(self, name, action, dependencies, rollback):
+        self._name = name
+        self._action = action
+        self._dependencies = dependencies
+        self._rollback = rollback
+        self._start_time = None
+        self._end_time = None
+        self._error = None
+
+    def getName(self): return self._name
+    def getDependencies(self): return self._dependencies
+
+    def run(self):
+        self._start_time = time.time()
+        try:
+            self._error = self._action()
+        except Exception, e:
+            config.logger.error("Provisioning step %s failed: %s" % \
+                                    (self._name, e))
+            self._error = 'GRAM internal error: %s failed: %s' % \
+                (self._name, e)
+        self._end_time = time.time()
+        return self._error
+
+    def rollback(self):
+        if not self._rollback: return
+        try:
+            self._rollback()
+        except Exception, e:
+            config.logger.error("Failed to roll back provisioning step %s: %s"\
+                                    % (self._name, e))
+
+
+class ProvisioningEngine:
+
+    def __init__(self, max_workers):
+        self._max_workers = max(1, max_workers)
+        self._steps = {}
+        self._step_order = [] # Names in order added
+        self._start_time = None
+        self._end_time = None
+
+    def addStep(self, name, action, dependencies=[], rollback=None):
+        """
+            Add a step.  Dependencies on steps that are never added
+            are considered satisfied.
+        """
+        self._steps[name] = ProvisioningStep(name, action, dependencies, 
+                                             rollback)
+        self._step_order.append(name)
+        return name
+
+    def hasStep(self, name): return name in self._steps
+
+    def run(self):
+        """
+            Run all steps.  Returns None if all succeeded or the error
+            message of the first step that failed (after rolling back).
+        """
+        self._start_time = time.time()
+
+        # Count unfinished dependencies of each step and find dependents
+        waiting_on = {}
+        dependents = {}
+        for name in self._step_order:
+            dependencies = [dependency \
+                                for dependency in self._steps[name].getDependencies() \
+                                if dependency in self._steps]
+            waiting_on[name] = len(dependencies)
+            for dependency in dependencies:
+                dependents.setdefault(dependency, []).append(name)
+
+        ready = Queue.Queue()
+        finished = Queue.Queue()
+        num_workers = min(self._max_workers, len(self._steps))
+        workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._work, 
+                                      args=(ready, finished))
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+
+        for name in self._step_order:
+            if waiting_on[name] == 0: ready.put(name)
+        num_running = len([name for name in self._step_order \
+                               if waiting_on[name] == 0])
+
+        error = None
+        ran = [] # Steps that ran, in the order they finished
+        while num_running > 0:
+            name, step_error = finished.get()
+            num_running = num_running - 1
+            ran.append(name)
+            if step_error and not error:
+                error = step_error
+            if error: continue # Don't start any more steps
+            for dependent in dependents.get(name, []):
+                waiting_on[dependent] = waiting_on[dependent] - 1
+                if waiting_on[dependent] == 0:
+                    ready.put(dependent)
+                    num_running = num_running + 1
+
+        for i in range(num_workers):
+            ready.put(None)
+        for worker in workers:
+            worker.join()
+
+        if error:
+            config.logger.error("Provisioning failed: %s. Rolling back %d steps"\
+                                    % (error, len(ran)))
+            for name in reversed(ran):
+                self._steps[name].rollback()
+
+        self._end_time = time.time()
+        self.logTimings()
+        return error
+
+    def _work(self, ready, finished):
+        while True:
+            name = ready.get()
+            if name is None: return
+            finished.put((name, self._steps[name].run()))
+
+    def getTimings(self):
+        """
+            Return list of (step name, start offset, duration, error)
+            for the steps that ran, in order of starting.
+            Times are in seconds from the start of the run.
+        """
+        timings = []
+        for name in self._step_order:
+            step = self._steps[name]
+            if step._start_time is None: continue
+            timings.append((name, step._start_time - self._start_time,
+                            step._end_time - step._start_time, step._error))
+        timings.sort(key = lambda timing: timing[1])
+        return timings
+
+    def logTimings(self):
+        timings = self.getTimings()
+        for name, start, duration, error in timings:
+            status = 'OK'
+            if error: status = 'FAILED'
+            config.logger.info("Provisioning step %s: start %.2f sec, took %.2f sec %s" % (name, start, duration, status))
+        total_step_time = sum(timing[2] for timing in timings)
+        config.logger.info("Provisioned %d steps in %.2f sec (%.2f sec of step time)" % \
+                               (len(timings), self._end_time - self._start_time,
+                                total_step_time))
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig()
+    config.logger.setLevel(logging.WARNING)
+
+    # A 20 node, 10 link slice: links take 1 unit, VMs 3 units
+    UNIT = 0.05
+    def delay(units, error=None):
+        def action():
+            time.sleep(units * UNIT)
+            return error
+        return action
+
+    for max_workers in [1, 8, 32]:
+        engine = ProvisioningEngine(max_workers)
+        engine.addStep('tenant', delay(1))
+        engine.addStep('router', delay(1), ['tenant'])
+        for i in range(10):
+            engine.addStep('link-%d' % i, delay(1), ['router'])
+        for i in range(20):
+            engine.addStep('vm-%d' % i, delay(3), ['link-%d' % (i % 10)])
+        start = time.time()
+        engine.run()
+        print "%2d workers: %.2f sec" % (max_workers, time.time() - start)
+
+    rolled_back = []
+    engine = ProvisioningEngine(4)
+    engine.addStep('tenant', delay(1), [], lambda: rolled_back.append('tenant'))
+    engine.addStep('link', delay(1, 'link failed'), ['tenant'],
+                   lambda: rolled_back.append('link'))
+    engine.addStep('vm', delay(1), ['link'], lambda: rolled_back.append('vm'))
+    print "ERROR = %s ROLLED BACK = %s" % (engine.run(), rolled_back)
@@ -0,0 +1,148 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+
+# Reconciliation of the state restored from a snapshot with the
+# resources actually present in OpenStack.
+#
+# Both sides are described by tenant-keyed indexes
+#
+#    {tenant_uuid : {'vm_uuids' : [...], 'net_uuids' : [...], 
+#                    'subnet_uuids' : [...], 'router_uuids' : [...],
+#                    'user_uuids' : [...]}}
+#
+# built from the restored slices (GramManager.get_all_slice_info) and
+# from one listing of each type of OpenStack resource for all tenants
+# (open_stack_interface.get_all_tenant_info).  findInconsistentTenants
+# compares them in a single pass over the GRAM tenants.
+#
+# Reconciliation may run in the background after startup.  A Reconciler
+# keeps the set of restored slices that have not been reconciled yet:
+# requests that change one of these slices wait for it, while other
+# requests are served right away.
+
+import threading
+import time
+
+import config
+
+
+def findInconsistentTenants(gram_info, os_info):
+    """
+        Return the list of GRAM tenants whose resources differ from
+        those in OpenStack: tenants that are not in OpenStack, or for which
+        GRAM has a type of resource OpenStack doesn't or different uuids
+        of a type of resource.
+    """
+    tenants_to_delete = []
+    for tenant_id, tenant_data in gram_info.items():
+        # Is this a slice in GRAM but not in OpenStack
+        if not tenant_id in os_info:
+            tenants_to_delete.append(tenant_id)
+            continue
+        os_tenant_data = os_info[tenant_id]
+        for key, gram_data in tenant_data.items():
+            # Is this a slice with some key in GRAM not in OS or
+            # with the same uuid type but not same entries
+            if key not in os_tenant_data or \
+                    sorted(gram_data) != sorted(os_tenant_data[key]):
+                tenants_to_delete.append(tenant_id)
+                break
+    return tenants_to_delete
+
+
+class Reconciler:
+    """
+        Tracks which restored slices are still to be reconciled and
+        lets request threads wait for them.
+    """
+    def __init__(self, slice_urns):
+        self._condition = threading.Condition()
+        self._pending = set(slice_urns)
+        self._finished = False
+        self._start_time = time.time()
+        self._end_time = None
+        self._num_slices = len(self._pending)
+        self._num_deleted = 0
+
+    def release(self, slice_urns, deleted=False):
+        """
+            Note that the given slices have been reconciled (and deleted,
+            if deleted is True)
+        """
+        with self._condition:
+            for slice_urn in slice_urns:
+                if slice_urn in self._pending:
+                    self._pending.remove(slice_urn)
+                    if deleted: self._num_deleted = self._num_deleted + 1
+            self._condition.notifyAll()
+
+    def finish(self):
+        """
+            Note that reconciliation is over (whether or not it succeeded)
+        """
+        with self._condition:
+            self._pending = set()
+            self._finished = True
+            self._end_time = time.time()
+            self._condition.notifyAll()
+        config.logger.info("Reconciled %d slices with OpenStack in %.2f sec (%d deleted)" % \
+                               (self._num_slices, 
+                                self._end_time - self._start_time,
+                                self._num_deleted))
+
+    def isFinished(self):
+        with self._condition:
+            return self._finished
+
+    def waitForSlice(self, slice_urn, timeout=None):
+        """
+            Wait until the given slice has been reconciled.
+            Returns False if the timeout (in seconds) expired first.
+        """
+        deadline = None
+        if timeout is not None: deadline = time.time() + timeout
+        with self._condition:
+            while slice_urn in self._pending:
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0: return False
+                    self._condition.wait(remaining)
+        return True
+
+    def getMetrics(self):
+        """
+            Return dictionary of the number of restored slices, of those 
+            still pending and deleted, whether reconciliation has finished 
+            and how long it has taken (so far) in seconds
+        """
+        with self._condition:
+            end_time = self._end_time
+            if end_time is None: end_time = time.time()
+            return {'slices' : self._num_slices,
+                    'pending' : len(self._pending),
+                    'deleted' : self._num_deleted,
+                    'finished' : self._finished,
+                    'duration' : end_time - self._start_time}
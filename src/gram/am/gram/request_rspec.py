@@ -0,0 +1,249 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# A request RSpec parsed once and shared by the code that reads it.
+#
+# Allocate used to parse the same request several times: once to create
+# the slivers, once more per network link to allocate stitching VLANs
+# (plus the stitching analysis each time) and once to generate the
+# manifest.  A ParsedRequest holds the DOM of the request with an index
+# of its top-level elements by client_id and of its stitching paths by
+# path id, so each of these lookups is done without reparsing or
+# scanning the document.
+#
+# The DOM is shared: code that needs to modify the request (e.g. to
+# build a manifest) must work on a copy.  The document is held by the
+# RSpec backend selected in the configuration (see rspec_backend.py).
+
+import rspec_backend
+
+
+class ParsedRequest:
+
+    def __init__(self, rspec, backend=None):
+        """
+            rspec is the request text, or its document (of the backend)
+        """
+        if backend is None: backend = rspec_backend.getBackend()
+        self._backend = backend
+        if isinstance(rspec, basestring):
+            self._text = rspec
+            self._dom = backend.parse(rspec)
+        else:
+            self._text = None
+            self._dom = rspec
+        self._rspec = backend.findAll(self._dom, 'rspec')[0]
+
+        # client_id => element for the node and link elements
+        self._nodes = []
+        self._links = []
+        self._elements_by_client_id = {}
+        for child in backend.children(self._rspec):
+            tag = backend.tag(child)
+            if tag == 'node':
+                self._nodes.append(child)
+            elif tag == 'link':
+                self._links.append(child)
+            else:
+                continue
+            client_id = backend.get(child, 'client_id')
+            if client_id is not None and \
+                    client_id not in self._elements_by_client_id:
+                self._elements_by_client_id[client_id] = child
+
+        self._stitching = None
+        stitching_elts = backend.findAll(self._rspec, 'stitching')
+        if len(stitching_elts) > 0:
+            self._stitching = stitching_elts[0]
+        self._paths_by_id = indexStitchingPaths(self._rspec, backend)
+
+        # Results of the stitching analysis of the request, 
+        # by aggregate id
+        self._stitching_details = {}
+
+    def getText(self):
+        if self._text is None:
+            self._text = self._backend.toPrettyXML(self._rspec)
+        return self._text
+
+    def getBackend(self): return self._backend
+
+    def getDOM(self): return self._dom
+
+    def getRSpecElement(self): return self._rspec
+
+    def getNodes(self): return self._nodes
+
+    def getLinks(self): return self._links
+
+    def getElement(self, client_id):
+        """
+            Returns the node or link element with the given client_id,
+            or None.
+        """
+        return self._elements_by_client_id.get(client_id)
+
+    def getStitching(self): return self._stitching
+
+    def getStitchingPath(self, path_id):
+        """
+            Returns the stitching path element with the given id, or None.
+        """
+        return self._paths_by_id.get(path_id)
+
+    def getStitchingDetails(self, aggregate_id):
+        return self._stitching_details.get(aggregate_id)
+
+    def setStitchingDetails(self, aggregate_id, details):
+        self._stitching_details[aggregate_id] = details
+
+    def hasStitchingDetails(self, aggregate_id):
+        return aggregate_id in self._stitching_details
+
+
+def asParsedRequest(request):
+    """
+        Return the ParsedRequest for a request given as RSpec text, a
+        document of the configured backend or a ParsedRequest.
+    """
+    if isinstance(request, ParsedRequest): return request
+    return ParsedRequest(request)
+
+
+def indexStitchingPaths(rspec_element, backend=None):
+    """
+        Returns {path id : path element} for the paths of the stitching
+        element of the given rspec element (first path for each id).
+    """
+    if backend is None: backend = rspec_backend.getBackend()
+    paths_by_id = {}
+    stitching_elts = backend.findAll(rspec_element, 'stitching')
+    if len(stitching_elts) == 0: return paths_by_id
+    for path in backend.findAll(stitching_elts[0], 'path'):
+        path_id = backend.get(path, 'id')
+        if path_id not in paths_by_id:
+            paths_by_id[path_id] = path
+    return paths_by_id
+
+
+def _generateRequest(num_nodes, num_links, aggregate_id, other_id):
+    """
+        A synthetic request for benchmarks: num_nodes nodes of the 
+        given aggregate, paired by num_links links stitched to the other
+        aggregate (one 4 hop stitching path per link).
+    """
+    parts = ['<rspec type="request" xmlns="http://www.geni.net/resources/rspec/3">']
+    for i in range(num_nodes):
+        parts.append('<node client_id="node-%d" component_manager_id="%s">' \
+                         '<sliver_type name="m1.small"/>' \
+                         '<interface client_id="node-%d:if0"/></node>' % \
+                         (i, aggregate_id, i))
+    for i in range(num_links):
+        parts.append('<link client_id="link-%d">' \
+                         '<component_manager name="%s"/>' \
+                         '<component_manager name="%s"/>' \
+                         '<interface_ref client_id="node-%d:if0"/>' \
+                         '<interface_ref client_id="node-%d:if0"/></link>' % \
+                         (i, aggregate_id, other_id, 2 * i, 2 * i + 1))
+    parts.append('<stitching lastUpdateTime="20130101:00:00:00">')
+    for i in range(num_links):
+        parts.append('<path id="link-%d">' % i)
+        for hop in range(4):
+            parts.append('<hop id="%d"><link id="urn:hop-%d-%d">' \
+                             '<switchingCapabilityDescriptor><switchingCapabilitySpecificInfo><switchingCapabilitySpecificInfo_L2sc>' \
+                             '<suggestedVLANRange>any</suggestedVLANRange>' \
+                             '<vlanRangeAvailability>100-200</vlanRangeAvailability>' \
+                             '</switchingCapabilitySpecificInfo_L2sc></switchingCapabilitySpecificInfo></switchingCapabilityDescriptor>' \
+                             '</link></hop>' % (hop, i, hop))
+        parts.append('</path>')
+    parts.append('</stitching></rspec>')
+    return ''.join(parts)
+
+
+if __name__ == "__main__":
+    # Benchmark Allocate's use of the request on a 200 node, 100 link
+    # stitched request: the stitching VLAN allocation for each link and the
+    # manifest, with the request given as text (parsed by each user, as
+    # before) and as one ParsedRequest.
+    import logging
+    import time
+    import config
+    import request_rspec
+    import resources
+    import rspec_handler
+    import stitching
+    from resources import NetworkLink, VirtualMachine
+
+    logging.basicConfig()
+    config.logger.setLevel(logging.CRITICAL)
+
+    AGG = 'urn:publicid:IDN+gram.example.net+authority+am'
+    OTHER = 'urn:publicid:IDN+other.example.net+authority+am'
+
+    class BenchmarkStitching(stitching.Stitching):
+        def __init__(self):
+            self._edge_points = {}
+            self._aggregate_id = AGG
+            self._reservations = {}
+
+    num_nodes = 200
+    num_links = 100
+    rspec = _generateRequest(num_nodes, num_links, AGG, OTHER)
+
+    geni_slice = resources.Slice('urn:publicid:IDN+geni:gpo:gcf+slice+bench')
+    slivers = []
+    for i in range(num_nodes):
+        vm = VirtualMachine(geni_slice)
+        vm.setName('node-%d' % i)
+        vm.setVMFlavor('m1.small')
+        vm.setOSImageName('ubuntu')
+        vm.setOSType('Linux')
+        vm.setOSVersion('12')
+        slivers.append(vm)
+    links = []
+    for i in range(num_links):
+        link = NetworkLink(geni_slice)
+        link.setName('link-%d' % i)
+        links.append(link)
+    slivers = slivers + links
+    geni_slice.setRequestRspec(rspec)
+    stitching_handler = BenchmarkStitching()
+
+    def allocate(request):
+        for link in links:
+            stitching_handler.allocate_external_vlan_tags(link, request, False)
+        rspec_handler.generateManifestForSlivers(geni_slice, slivers, True, 
+                                                 False, AGG, stitching_handler,
+                                                 request)
+
+    start = time.time()
+    allocate(rspec)
+    text_time = time.time() - start
+
+    start = time.time()
+    # Use the class of the request_rspec module (not of __main__)
+    allocate(request_rspec.ParsedRequest(rspec))
+    parsed_time = time.time() - start
+
+    print "%d nodes, %d links (%d bytes): text %.2f sec, parsed once %.2f sec" % \
+        (num_nodes, num_links, len(rspec), text_time, parsed_time)
@@ -32,6 +32,7 @@ import threading
 import os
 import subprocess
 
+import cli_output
 import config
 import constants
 import open_stack_interface
@@ -66,9 +67,13 @@ def resource_image(obj, label):
 
 
 # Holds information about GRAM images, based on nova calls
+# The lists are kept both as the command output and parsed (tables)
 class GramImageInfo :
   _image_list = None
   _flavor_list = None
+  _image_table = cli_output.CLITable([], [])
+  _flavor_table = cli_output.CLITable([], [])
+  _refresh_listeners = [] # Called after every refresh
   _last_update = None
   _compute_hosts = None
 
@@ -80,14 +85,24 @@ class GramImageInfo :
       cmd = 'nova image-list'
       try :
           GramImageInfo._image_list = _execCommand(cmd)
+          GramImageInfo._image_table = \
+              cli_output.parseTable(GramImageInfo._image_list)
           GramImageInfo._last_update = datetime.datetime.utcnow()
       except :
           config.logger.error('Failed to execute "nova image-list"')
       cmd = 'nova flavor-list'
       try:
           GramImageInfo._flavor_list = _execCommand(cmd)
+          GramImageInfo._flavor_table = \
+              cli_output.parseTable(GramImageInfo._flavor_list)
       except:
           config.logger.error('Failed to execute "nova flavor-list"')
+      for listener in GramImageInfo._refresh_listeners:
+          listener()
+
+  @staticmethod
+  def add_refresh_listener(listener):
+      GramImageInfo._refresh_listeners.append(listener)
 
   @staticmethod
   def get_image_list():
@@ -103,6 +118,16 @@ class GramImageInfo :
         GramImageInfo.refresh()
       return GramImageInfo._flavor_list
 
+  @staticmethod
+  def get_image_table():
+      GramImageInfo.get_image_list()
+      return GramImageInfo._image_table
+
+  @staticmethod
+  def get_flavor_table():
+      GramImageInfo.get_flavor_list()
+      return GramImageInfo._flavor_table
+
     
 # Holds information about the GRAM management network (used for aggregate
 # control plane traffic).  E.g. ssh connections to the VMs
@@ -149,6 +174,10 @@ class Slice:
                               #  starting with 100.  This number is used as the
                               #  last octet for all IP addresses assigned to 
                               #  that VM.
+      self._version = 0 # Bumped whenever the slice or its slivers change
+      self._manifest_cache = None # Manifests of the slice (see
+                                  # rspec_handler.ManifestCache)
+      self._registry = None # SliceRegistry the slice is registered with
 
    def __str__(self):
       return resource_image(self, "Slice");
@@ -156,13 +185,42 @@ class Slice:
    def getLock(self) :
       return self._slice_lock
 
+   # The version of the slice: it changes whenever slivers are added or
+   # removed or change in a way that shows in the manifest or status
+   def getVersion(self) :
+      return self._version
+
+   def bumpVersion(self) :
+      self._version = self._version + 1
+
+   # Called by slivers of the slice when they change
+   def sliverChanged(self, sliver) :
+      self.bumpVersion()
+      if self._registry is not None :
+         self._registry.sliverChanged(self, sliver)
+
+   def getRegistry(self) :
+      return self._registry
+
+   def setRegistry(self, registry) :
+      self._registry = registry
+
+   def getManifestCache(self) :
+      return self._manifest_cache
+
+   def setManifestCache(self, manifest_cache) :
+      self._manifest_cache = manifest_cache
+
    # Called by slivers to add themselves to the slice
    def addSliver(self, sliver) :
+      self.bumpVersion()
       sliver_urn = sliver.getSliverURN()
       if sliver_urn != None :
          self._slivers[sliver_urn] = sliver
       else :
          config.logger.error('Adding sliver to slice; sliver does not have a URN')
+      if self._registry is not None :
+         self._registry.sliverAdded(self, sliver)
 
       if sliver.__class__.__name__ == 'VirtualMachine' :
          self._VMs.append(sliver)
@@ -178,11 +236,14 @@ class Slice:
          return False
 
    def removeSliver(self, sliver) :
+      self.bumpVersion()
       sliver_urn = sliver.getSliverURN()
       config.logger.info("Deleting sliver: " + sliver_urn) 
       # Remove sliver from list of slivers
       if sliver_urn in self._slivers :
          del self._slivers[sliver_urn]
+      if self._registry is not None :
+         self._registry.sliverRemoved(self, sliver)
 
       # Remove sliver from appropriate list based on sliver type
       if sliver.__class__.__name__ == 'VirtualMachine' :
@@ -197,6 +258,8 @@ class Slice:
          
    def setTenantUUID(self, tenant_id ): 
       self._tenant_uuid = tenant_id
+      if self._registry is not None :
+         self._registry.sliceChanged(self)
 
    def getTenantUUID(self): 
       return self._tenant_uuid
@@ -326,6 +389,7 @@ class Slice:
       self._expiration = expiration;
 
    def setRequestRspec(self, rspec) :
+      self.bumpVersion()
       self._request_rspec = rspec
       
    def getRequestRspec(self) :
@@ -351,6 +415,7 @@ class Sliver():
       self._operational_state = constants.notready  # Operational state
       self._user_urn = None
       self._component_name = None
+      self._version = 0 # Bumped whenever the sliver changes (see _changed)
       my_slice.addSliver(self)  # Add this sliver to the list of slivers owned
                                 # by the slice.  sliver_urn must be set.
 
@@ -374,7 +439,9 @@ class Sliver():
       return self._component_name
 
    def setName(self, name) :
-      self._name = name
+      if name != self._name :
+         self._name = name
+         self._changed()
 
    def getName(self) :
       return self._name
@@ -388,6 +455,16 @@ class Sliver():
    def getSliverURN(self): 
       return self._sliver_urn
 
+   def getVersion(self) :
+      return self._version
+
+   # Called when the sliver changes in a way that shows in the
+   # manifest or status or in the indexes of the slice registry: bumps 
+   # the versions of the sliver and its slice
+   def _changed(self) :
+      self._version = self._version + 1
+      self._slice.sliverChanged(self)
+
    def getSlice(self): 
       return self._slice;
 
@@ -395,7 +472,9 @@ class Sliver():
       return self._expiration;
 
    def setExpiration(self, expiration):
-      self._expiration = expiration
+      if expiration != self._expiration :
+         self._expiration = expiration
+         self._changed()
 
    def getCreation(self):
       return self._creation;
@@ -404,13 +483,17 @@ class Sliver():
       self._creation = creation
 
    def setAllocationState(self, state) :
-      self._allocation_state = state
+      if state != self._allocation_state :
+         self._allocation_state = state
+         self._changed()
 
    def getAllocationState(self) :
       return self._allocation_state 
 
    def setOperationalState(self, state) :
-      self._operational_state = state
+      if state != self._operational_state :
+         self._operational_state = state
+         self._changed()
       
    def getOperationalState(self) :
       return self._operational_state 
@@ -487,7 +570,6 @@ class VirtualMachine(Sliver): #
       self._authorized_users =  None # List of User names with accts on the VM
       self._ssh_proxy_login_port = None # Port number assigned for remote 
                                         # SSH proxy login
-      self._last_status_update = None # Time of last status update
       self._external_ip = None  # floating ip assigned to the VM
       Sliver.__init__(self, my_slice, uuid=uuid, urn=urn)
 
@@ -498,13 +580,18 @@ class VirtualMachine(Sliver): #
       return self._external_ip
 
    def setExternalIp(self,ip):
-      self._external_ip = ip
+      if ip != self._external_ip :
+         self._external_ip = ip
+         self._changed()
 
    def addNetworkInterface(self, netInterface) :
       self._network_interfaces.append(netInterface)
+      self._changed()
 
    def setMgmtNetAddr(self, ip_addr) : 
-      self._mgmt_net_addr = ip_addr
+      if ip_addr != self._mgmt_net_addr :
+         self._mgmt_net_addr = ip_addr
+         self._changed()
 
    def getMgmtNetAddr(self): 
       return self._mgmt_net_addr 
@@ -525,25 +612,33 @@ class VirtualMachine(Sliver): #
       return self._os_image
 
    def setOSImageName(self, os_image) :
-      self._os_image = os_image
+      if os_image != self._os_image :
+         self._os_image = os_image
+         self._changed()
 
    def getOSType(self) :
       return self._os_type
 
    def setOSType(self, os_type) :
-      self._os_type = os_type
+      if os_type != self._os_type :
+         self._os_type = os_type
+         self._changed()
 
    def getOSVersion(self) :
       return self._os_version
 
    def setOSVersion(self, os_version) :
-      self._os_version = os_version
+      if os_version != self._os_version :
+         self._os_version = os_version
+         self._changed()
 
    def getVMFlavor(self) :
       return self._flavor
 
    def setVMFlavor(self, flavour) : # Set VirtualMachine flavor
-      self._flavor = flavour
+      if flavour != self._flavor :
+         self._flavor = flavour
+         self._changed()
 
    def addInstallItem(self, source, destination, file_type) :
       self._installs.append(_InstallItem(source, destination, file_type))
@@ -555,25 +650,25 @@ class VirtualMachine(Sliver): #
       return self._host
 
    def setHost(self, host): # Name of compute node on which VM resides
-      self._host = host;
+      if host != self._host :
+         self._host = host
+         self._changed()
 
    def setAuthorizedUsers(self, user_list) :
       self._authorized_users = user_list
+      self._changed()
 
    def getAuthorizedUsers(self) :
       return self._authorized_users 
 
    def setSSHProxyLoginPort(self, port_number) :
-      self._ssh_proxy_login_port = port_number
+      if port_number != self._ssh_proxy_login_port :
+         self._ssh_proxy_login_port = port_number
+         self._changed()
 
    def getSSHProxyLoginPort(self) :
       return self._ssh_proxy_login_port
 
-   def getLastStatusUpdate(self):
-      return self._last_status_update
-
-   def setLastStatusUpdate(self, update_time):
-      self._last_status_update = update_time
  
 # A NIC (Network Interface Card) resource
 class NetworkInterface(Sliver):  
@@ -595,19 +690,25 @@ class NetworkInterface(Sliver):
         return self._device_number
 
      def setMACAddress(self, mac_addr): 
-        self._mac_address = mac_addr
+        if mac_addr != self._mac_address :
+           self._mac_address = mac_addr
+           self._changed()
 
      def getMACAddress(self): 
         return self._mac_address
 
      def setIPAddress(self, ip_addr): 
-        self._ip_address = ip_addr
+        if ip_addr != self._ip_address :
+           self._ip_address = ip_addr
+           self._changed()
 
      def getIPAddress(self): 
         return self._ip_address
 
      def setNetmask(self,netmask):
-        self._netmask = netmask
+        if netmask != self._netmask :
+           self._netmask = netmask
+           self._changed()
 
      def getNetmask(self):
         return self._netmask
@@ -615,6 +716,11 @@ class NetworkInterface(Sliver):
      def getVM(self): 
         return self._vm
 
+     # The addresses of a NIC show in the manifest of its VM
+     def _changed(self) :
+        Sliver._changed(self)
+        if self._vm is not None: self._vm._changed()
+
      def setVM(self, vm):
         self._vm = vm
 
@@ -635,7 +741,9 @@ class NetworkInterface(Sliver):
 
      def setVLANTag(self, vlan_tag): # Set VLAN tag of traffic on this interface
         if vlan_tag: vlan_tag = int(vlan_tag)
-        self._vlan_tag = vlan_tag
+        if vlan_tag != self._vlan_tag :
+           self._vlan_tag = vlan_tag
+           self._changed()
 
 
 # A Network Link resource
@@ -678,7 +786,9 @@ class NetworkLink(Sliver): # was Link
 
      def setVLANTag(self, vlan_tag) :
         if vlan_tag: vlan_tag = int(vlan_tag)
-        self._vlan_tag = vlan_tag
+        if vlan_tag != self._vlan_tag :
+           self._vlan_tag = vlan_tag
+           self._changed()
 
      def getVLANTag(self) :
         return self._vlan_tag
@@ -0,0 +1,448 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# XML backends for reading and writing RSpecs.
+#
+# The request and manifest code works on RSpec documents through a
+# backend, which hides the tree library used:
+#
+#    'minidom' : xml.dom.minidom, as GRAM always did
+#    'etree'   : a tree of (C) ElementTree elements built directly from
+#                expat events.  Parsing, lookups and copies are several
+#                times faster and the tree uses much less memory.
+#
+# Both backends keep element and attribute names as they appear in the
+# document ('sharedvlan:link_shared_vlan'), so lookups by qualified
+# name behave the same.  findAllNS looks elements up by namespace URI
+# and local name.  Both produce identical pretty-printed XML: the etree
+# backend serializes (iteratively) exactly as minidom's toprettyxml.
+# (CDATA sections, which RSpecs don't use, are read as text by the etree
+# backend.)
+#
+# The backend is chosen by config.rspec_backend.
+
+import copy
+from xml.dom.minidom import parseString, Node
+from xml.etree import cElementTree as ElementTree
+from xml.parsers import expat
+
+import config
+
+PRETTY_INDENT = '    '
+
+
+class MinidomBackend:
+
+    name = 'minidom'
+
+    def parse(self, text):
+        return parseString(text)
+
+    def clone(self, node):
+        """
+            A deep copy of a document or element
+        """
+        return node.cloneNode(True)
+
+    def findAll(self, node, tag):
+        """
+            The descendant elements of a document or element with the
+            given (qualified) tag name, in document order
+        """
+        return node.getElementsByTagName(tag)
+
+    def findAllNS(self, document, namespace, local_name):
+        """
+            The elements of a document with the given namespace URI
+            and local name, in document order
+        """
+        return document.getElementsByTagNameNS(namespace, local_name)
+
+    def children(self, element):
+        return [child for child in element.childNodes \
+                    if child.nodeType == Node.ELEMENT_NODE]
+
+    def tag(self, element): return element.nodeName
+
+    def has(self, element, name):
+        return element.attributes.has_key(name)
+
+    def get(self, element, name, default=None):
+        if not element.attributes.has_key(name): return default
+        return element.attributes[name].value
+
+    def set(self, element, name, value):
+        element.setAttribute(name, value)
+
+    def addChild(self, parent, tag):
+        child = parent.ownerDocument.createElement(tag)
+        parent.appendChild(child)
+        return child
+
+    def replace(self, parent, old_child, new_child):
+        parent.replaceChild(new_child, old_child)
+
+    def getText(self, element):
+        return element.childNodes[0].nodeValue
+
+    def setText(self, element, text):
+        element.childNodes[0].nodeValue = text
+
+    def toPrettyXML(self, element):
+        return element.toprettyxml(indent = PRETTY_INDENT)
+
+
+# Tags of ElementTree comment and processing instruction nodes
+_COMMENT = ElementTree.Comment('').tag
+_PI = ElementTree.PI('pi').tag
+
+
+class ElementTreeDocument:
+    """
+        A document of the etree backend: the root element with any
+        comments and processing instructions around it.
+    """
+    def __init__(self, nodes):
+        self._nodes = nodes
+        self._root = None
+        for node in nodes:
+            if node.tag is not _COMMENT and node.tag is not _PI:
+                self._root = node
+        self._ns_index = None # (namespace, local name) => elements
+
+    def getRoot(self): return self._root
+
+
+class _TreeBuilder:
+    """
+        Builds ElementTree elements from expat events.  Character data
+        goes to the text of the current element or the tail of the 
+        previous child.  Names are kept unprocessed, as minidom shows them.
+    """
+    def __init__(self):
+        self._nodes = []
+        self._stack = []
+        self._last = None
+        self._data = []
+
+    def start(self, tag, attributes):
+        self._flush()
+        self._append(ElementTree.Element(tag, attributes))
+        self._stack.append(self._last)
+        self._last = None
+
+    def end(self, tag):
+        self._flush()
+        self._last = self._stack.pop()
+
+    def data(self, text):
+        self._data.append(text)
+
+    def comment(self, text):
+        self._flush()
+        self._append(ElementTree.Comment(text))
+
+    def pi(self, target, data):
+        self._flush()
+        node = ElementTree.PI(target)
+        node.text = "%s %s" % (target, data)
+        self._append(node)
+
+    def close(self):
+        self._flush()
+        return ElementTreeDocument(self._nodes)
+
+    def _append(self, node):
+        if self._stack: self._stack[-1].append(node)
+        else: self._nodes.append(node)
+        self._last = node
+
+    def _flush(self):
+        if not self._data: return
+        text = ''.join(self._data)
+        self._data = []
+        if self._last is not None:
+            self._last.tail = (self._last.tail or '') + text
+        elif self._stack:
+            element = self._stack[-1]
+            element.text = (element.text or '') + text
+
+
+def _escape(data):
+    return data.replace("&", "&amp;").replace("<", "&lt;"). \
+        replace("\"", "&quot;").replace(">", "&gt;")
+
+
+class ElementTreeBackend:
+
+    name = 'etree'
+
+    def parse(self, text):
+        builder = _TreeBuilder()
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = builder.start
+        parser.EndElementHandler = builder.end
+        parser.CharacterDataHandler = builder.data
+        parser.CommentHandler = builder.comment
+        parser.ProcessingInstructionHandler = builder.pi
+        parser.Parse(text, True)
+        return builder.close()
+
+    def clone(self, node):
+        if isinstance(node, ElementTreeDocument):
+            return ElementTreeDocument([copy.deepcopy(child) \
+                                            for child in node._nodes])
+        return copy.deepcopy(node)
+
+    def findAll(self, node, tag):
+        if isinstance(node, ElementTreeDocument):
+            root = node.getRoot()
+            if root is None: return []
+            return list(root.iter(tag))
+        return [element for element in node.iter(tag) \
+                    if element is not node]
+
+    def findAllNS(self, document, namespace, local_name):
+        # Resolve the names of all elements (by their xmlns attributes)
+        # the first time the document is searched
+        if document._ns_index is None:
+            document._ns_index = {}
+            root = document.getRoot()
+            stack = []
+            if root is not None: stack.append((root, {}))
+            while stack:
+                element, namespaces = stack.pop()
+                declarations = [(name, value) \
+                                    for name, value in element.attrib.items() \
+                                    if name == 'xmlns' or \
+                                    name.startswith('xmlns:')]
+                if declarations:
+                    namespaces = dict(namespaces)
+                    for name, value in declarations:
+                        namespaces[name[6:]] = value
+                prefix, sep, local = element.tag.rpartition(':')
+                key = (namespaces.get(prefix), local)
+                document._ns_index.setdefault(key, []).append(element)
+                for child in reversed(element):
+                    if child.tag is not _COMMENT and child.tag is not _PI:
+                        stack.append((child, namespaces))
+        return document._ns_index.get((namespace, local_name), [])
+
+    def children(self, element):
+        return [child for child in element \
+                    if child.tag is not _COMMENT and child.tag is not _PI]
+
+    def tag(self, element): return element.tag
+
+    def has(self, element, name):
+        return name in element.attrib
+
+    def get(self, element, name, default=None):
+        return element.attrib.get(name, default)
+
+    def set(self, element, name, value):
+        element.set(name, value)
+
+    def addChild(self, parent, tag):
+        return ElementTree.SubElement(parent, tag)
+
+    def replace(self, parent, old_child, new_child):
+        index = list(parent).index(old_child)
+        new_child.tail = old_child.tail
+        parent[index] = new_child
+
+    def getText(self, element):
+        return element.text
+
+    def setText(self, element, text):
+        # minidom writes any value as text (VLAN tags are ints)
+        element.text = '%s' % text
+
+    def toPrettyXML(self, element):
+        """
+            Serialize the element as minidom's toprettyxml does
+        """
+        newl = '\n'
+        out = []
+        # Stack of (element, indent) to write and strings to output
+        stack = [(element, '')]
+        while stack:
+            item = stack.pop()
+            if not isinstance(item, tuple):
+                out.append(item)
+                continue
+            node, indent = item
+            if node.tag is _COMMENT:
+                if "--" in node.text:
+                    raise ValueError("'--' is not allowed in a comment node")
+                out.append("%s<!--%s-->%s" % (indent, node.text, newl))
+                continue
+            if node.tag is _PI:
+                out.append("%s<?%s?>%s" % (indent, node.text, newl))
+                continue
+
+            out.append(indent + "<" + node.tag)
+            for name in sorted(node.attrib.keys()):
+                out.append(" %s=\"" % name)
+                out.append(_escape(node.attrib[name]))
+                out.append("\"")
+
+            # The child nodes as minidom has them: text and elements
+            child_nodes = []
+            if node.text: child_nodes.append(node.text)
+            for child in node:
+                child_nodes.append(child)
+                if child.tail: child_nodes.append(child.tail)
+
+            if not child_nodes:
+                out.append("/>%s" % newl)
+            elif len(child_nodes) == 1 and \
+                    isinstance(child_nodes[0], basestring):
+                out.append(">")
+                out.append(_escape(child_nodes[0]))
+                out.append("</%s>%s" % (node.tag, newl))
+            else:
+                out.append(">" + newl)
+                stack.append(indent + "</%s>%s" % (node.tag, newl))
+                child_indent = indent + PRETTY_INDENT
+                for child_node in reversed(child_nodes):
+                    if isinstance(child_node, basestring):
+                        stack.append(_escape(child_indent + child_node + newl))
+                    else:
+                        stack.append((child_node, child_indent))
+        return ''.join(out)
+
+
+_backends = {MinidomBackend.name : MinidomBackend(),
+             ElementTreeBackend.name : ElementTreeBackend()}
+
+def getBackend(name=None):
+    """
+        Returns the backend with the given name, by default the one
+        selected by config.rspec_backend.
+    """
+    if name is None: name = config.rspec_backend
+    if name not in _backends:
+        config.logger.error("Unknown RSpec backend %s: using minidom" % name)
+        name = MinidomBackend.name
+    return _backends[name]
+
+
+if __name__ == "__main__":
+    # Compare the backends on the sample RSpecs of the source tree and on
+    # a large synthetic stitched request: time to parse the request and
+    # generate its manifest, memory held by the parsed documents (measured
+    # in a child process), and check that both produce the same manifest.
+    import glob
+    import logging
+    import os
+    import resource
+    import time
+    import request_rspec
+    import resources
+    import rspec_backend
+    import rspec_handler
+    from resources import NetworkLink, VirtualMachine
+
+    logging.basicConfig()
+    config.logger.setLevel(logging.CRITICAL)
+
+    AGG = 'urn:publicid:IDN+gram.example.net+authority+am'
+    OTHER = 'urn:publicid:IDN+other.example.net+authority+am'
+
+    top = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                       '..', '..', '..', '..')
+    requests = []
+    for pattern in ['rspecs/*.rspec', 'test/*/*.rspec']:
+        for filename in sorted(glob.glob(os.path.join(top, pattern))):
+            f = open(filename)
+            requests.append((os.path.basename(filename), f.read(), []))
+            f.close()
+
+    num_nodes = 200
+    num_links = 100
+    geni_slice = resources.Slice('urn:publicid:IDN+geni:gpo:gcf+slice+bench')
+    slivers = []
+    for i in range(num_nodes):
+        vm = VirtualMachine(geni_slice)
+        vm.setName('node-%d' % i)
+        vm.setVMFlavor('m1.small')
+        vm.setOSImageName('ubuntu')
+        vm.setOSType('Linux')
+        vm.setOSVersion('12')
+        slivers.append(vm)
+    for i in range(num_links):
+        link = NetworkLink(geni_slice)
+        link.setName('link-%d' % i)
+        slivers.append(link)
+    requests.append(('synthetic-%d-nodes' % num_nodes, 
+                     request_rspec._generateRequest(num_nodes, num_links, 
+                                                    AGG, OTHER),
+                     slivers))
+
+    def manifest(backend, rspec, slivers):
+        # Use the classes of the modules (not of __main__)
+        parsed = request_rspec.ParsedRequest(rspec, backend)
+        return rspec_handler.generateManifestForSlivers(geni_slice, slivers,
+                                                        True, False, AGG,
+                                                        None, parsed)[0]
+
+    def memory(backend, rspec, copies):
+        # KB held by copies of the parsed request, in a child process
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is the peak, so the copies need not be kept
+            [backend.parse(rspec) for i in range(copies)]
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write_fd, str(after - before))
+            os._exit(0)
+        os.close(write_fd)
+        used = int(os.read(read_fd, 64))
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        return used
+
+    backends = [rspec_backend.getBackend('minidom'), 
+                rspec_backend.getBackend('etree')]
+    print "%-40s %8s %8s %8s %8s %s" % ('RSpec', 'dom ms', 'etree ms', 
+                                        'dom KB', 'etree KB', 'same')
+    for name, rspec, slivers in requests:
+        repeat = max(1, 200000 / len(rspec))
+        copies = max(1, 2000000 / len(rspec))
+        times = []
+        sizes = []
+        manifests = []
+        for backend in backends:
+            start = time.time()
+            for i in range(repeat):
+                result = manifest(backend, rspec, slivers)
+            times.append((time.time() - start) * 1000 / repeat)
+            sizes.append(memory(backend, rspec, copies) / float(copies))
+            manifests.append(result)
+        print "%-40s %8.2f %8.2f %8.1f %8.1f %s" % \
+            (name, times[0], times[1], sizes[0], sizes[1], 
+             manifests[0] == manifests[1])
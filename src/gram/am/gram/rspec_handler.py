@@ -21,9 +21,12 @@
 # IN THE WORK.
 #----------------------------------------------------------------------
 
-from xml.dom.minidom import *
+import base64
+import hashlib
 import socket
 import re
+import threading
+import zlib
 
 import config
 import constants
@@ -33,11 +36,13 @@ import uuid
 import utils
 import netaddr
 import stitching
+from request_rspec import asParsedRequest, indexStitchingPaths
+import rspec_backend
 
 def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
     """ This function parses a request rspec and creates the sliver objects for
         the resources requested by this rspec.  The resources are not actually
-        created.
+        created.  rspec is the request text or a ParsedRequest.
 
         Returns a tuple (error string, sliver list, controller) :
             error string: String describing any error encountered during parsing
@@ -53,31 +58,33 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
     controller_link_info = {}
         
     # Parse the xml rspec
-    rspec_dom = parseString(rspec)
+    parsed_request = asParsedRequest(rspec)
+    rspec_dom = parsed_request.getDOM()
+    xml = parsed_request.getBackend()
+
+    # Names of the VMs and links of the slice, to check for duplicates
+    vm_names = set([vm.getName() for vm in geni_slice.getVMs()])
+    link_names = set([link.getName() for link in geni_slice.getNetworkLinks()])
 
     # Look for DOM elements tagged 'node'.  These are the VMs requested by the
     # experimenter.
     # For each node in the rspec, extract experimenter specified information
-    node_list = rspec_dom.getElementsByTagName('node')
+    node_list = xml.findAll(rspec_dom, 'node')
     for node in node_list :
         # Get information about the node from the rspec
-        node_attributes = node.attributes
-
 
         # Find the name of the node.  We need to make sure we don't already
         # have a node with this name before we do anything else.
-        if node_attributes.has_key('client_id') :
-            node_name = node_attributes['client_id'].value
-            list_of_existing_vms = geni_slice.getVMs()
-            for i in range(0, len(list_of_existing_vms)) :
-                if node_name == list_of_existing_vms[i].getName() :
-                    # Duplicate name.  Fail this allocate
-                    error_string = \
-                        'Rspec error: VM with name %s already exists' % \
-                        node_name
-                    error_code = constants.REQUEST_PARSE_FAILED
-                    config.logger.error(error_string)
-                    return error_string, error_code, sliver_list, None
+        if xml.has(node, 'client_id') :
+            node_name = xml.get(node, 'client_id')
+            if node_name in vm_names :
+                # Duplicate name.  Fail this allocate
+                error_string = \
+                    'Rspec error: VM with name %s already exists' % \
+                    node_name
+                error_code = constants.REQUEST_PARSE_FAILED
+                config.logger.error(error_string)
+                return error_string, error_code, sliver_list, None
         else :
             error_string = 'Malformed rspec: Node name not specified' 
             error_code = constants.REQUEST_PARSE_FAILED
@@ -86,8 +93,8 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
 
         # If the node is already bound (component_manager_id is set)
         # Ignore the node if it isn't bound to my component_manager_id
-        if node_attributes.has_key('component_manager_id'):
-            cmi = node_attributes['component_manager_id'].value
+        if xml.has(node, 'component_manager_id'):
+            cmi = xml.get(node, 'component_manager_id')
             if cmi  != agg_urn:
                 print "Ignoring remote node : %s" % cmi
                 continue
@@ -96,12 +103,13 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
         # of virtual machines that belong to this slice at this aggregate
         vm_object = VirtualMachine(geni_slice)
         vm_object.setName(node_name)
+        vm_names.add(node_name)
         sliver_list.append(vm_object)
 
         # Check for component_id
         compute_hosts = GramImageInfo._compute_hosts.keys()
-        if node_attributes.has_key('component_id'):
-          ci = getHostFromUrn(node_attributes['component_id'].value)
+        if xml.has(node, 'component_id'):
+          ci = getHostFromUrn(xml.get(node, 'component_id'))
           if ci:
             if ci.lower() not in compute_hosts:
                 error_string = "Invalid value for component_id"
@@ -111,8 +119,8 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
             vm_object.setComponentName(ci)
 
         # Check for component_name
-        if node_attributes.has_key('component_name'):
-            cn = node_attributes['component_id'].value
+        if xml.has(node, 'component_name'):
+            cn = xml.get(node, 'component_id')
             if cn.lower() not in compute_hosts:
                 error_string = "Invalid value for component_name"
                 error_code = constants.UNSUPPORTED
@@ -121,30 +129,30 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
             vm_object.setComponentName(cn)
 
         # Make sure there isn't an exclusive="true" clause in the node 
-        if node_attributes.has_key("exclusive"):
-            value = node_attributes["exclusive"].value
+        if xml.has(node, "exclusive"):
+            value = xml.get(node, "exclusive")
             if value.lower() == 'true':
                 error_string = "GRAM instance can't allocate exclusive compute resources"
                 error_code = constants.UNSUPPORTED
                 config.logger.error(error_string)
                 return error_string, error_code, sliver_list, None
 
-        if node_attributes.has_key("external_ip"):
-            value = node_attributes["external_ip"].value
+        if xml.has(node, "external_ip"):
+            value = xml.get(node, "external_ip")
             if value.lower() == 'true':
                 vm_object.setExternalIp('true')
     
-        found = node.getElementsByTagName('emulab:routable_control_ip') +\
-            node.getElementsByTagName('routable_control_ip')
+        found = xml.findAll(node, 'emulab:routable_control_ip') +\
+            xml.findAll(node, 'routable_control_ip')
         if found:
             vm_object.setExternalIp('true')
 
 
         # Get flavor from the sliver_type
-        sliver_type_list = node.getElementsByTagName('sliver_type')
+        sliver_type_list = xml.findAll(node, 'sliver_type')
         for sliver_type in sliver_type_list:
-            if sliver_type.attributes.has_key('name') :
-                sliver_type_name = sliver_type.attributes['name'].value
+            if xml.has(sliver_type, 'name') :
+                sliver_type_name = xml.get(sliver_type, 'name')
             else :
                 sliver_type_name = config.default_VM_flavor
             if open_stack_interface._getFlavorID(sliver_type_name):
@@ -159,18 +167,18 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
                 return error_string, error_code, sliver_list, None
 
             # Get disk image by name from node
-            disk_image_list = sliver_type.getElementsByTagName('disk_image')
+            disk_image_list = xml.findAll(sliver_type, 'disk_image')
             for disk_image in disk_image_list:
-                if disk_image.attributes.has_key('name') :
-                    disk_image_name = disk_image.attributes['name'].value
+                if xml.has(disk_image, 'name') :
+                    disk_image_name = xml.get(disk_image, 'name')
                 else :
                     disk_image_name = config.default_OS_image
-                if disk_image.attributes.has_key('os'):
-                    os_type = disk_image.attributes['os'].value
+                if xml.has(disk_image, 'os'):
+                    os_type = xml.get(disk_image, 'os')
                 else:
                     os_type = config.default_OS_type
-                if disk_image.attributes.has_key('version'):
-                    os_version = disk_image.attributes['version'].value
+                if xml.has(disk_image, 'version'):
+                    os_version = xml.get(disk_image, 'version')
                 else:
                     os_version = config.default_OS_version
                 disk_image_uuid = \
@@ -190,7 +198,7 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
 
         
         # Get interfaces associated with the node
-        interface_list = node.getElementsByTagName('interface')
+        interface_list = xml.findAll(node, 'interface')
         for interface in interface_list :
             # Create a NetworkInterface object this interface and associate
             # it with the VirtualMachine object for the node
@@ -198,45 +206,43 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
             vm_object.addNetworkInterface(interface_object)
             
             # Get information about this network interface from rspec
-            interface_attributes = interface.attributes
-            if interface_attributes.has_key('client_id') :
-                interface_object.setName(interface_attributes['client_id'].value)
+            if xml.has(interface, 'client_id') :
+                interface_object.setName(xml.get(interface, 'client_id'))
             else :
                 error_string = 'Malformed rspec: Interface name not specified'
                 error_code = constants.REQUEST_PARSE_FAILED
                 config.logger.error(error_string)
                 return error_string, error_code, sliver_list, None
-            ip_list = interface.getElementsByTagName('ip')
+            ip_list = xml.findAll(interface, 'ip')
             if len(ip_list) > 1:
                 error_string = 'Malformed rspec: Interface can have only one ip'
                 error_code = constants.REQUEST_PARSE_FAILED
                 config.logger.error(error_string)
                 return error_string, error_code, sliver_list, None
             for ip in ip_list:
-                if ip.attributes.has_key('address'):
-                    interface_object.setIPAddress(ip.attributes['address'].value)
-                if ip.attributes.has_key('netmask'):
-                    interface_object.setNetmask(ip.attributes['netmask'].value)
+                if xml.has(ip, 'address'):
+                    interface_object.setIPAddress(xml.get(ip, 'address'))
+                if xml.has(ip, 'netmask'):
+                    interface_object.setNetmask(xml.get(ip, 'netmask'))
                 
 
         # Get the list of services for this node (install and execute services)
-        service_list = node.getElementsByTagName('services')
+        service_list = xml.findAll(node, 'services')
         # First handle all the install items in the list of services requested
         for service in service_list :
-            install_list = service.getElementsByTagName('install')
+            install_list = xml.findAll(service, 'install')
             for install in install_list :
-                install_attributes = install.attributes
-                if not (install_attributes.has_key('url') and 
-                        install_attributes.has_key('install_path')) :
+                if not (xml.has(install, 'url') and 
+                        xml.has(install, 'install_path')) :
                     error_string = 'Source URL or destination path missing for install element in request rspec'
                     error_code = constants.REQUEST_PARSE_FAILED
                     config.logger.error(error_string)
                     return error_string, error_code, sliver_list, None
 
-                source_url = install_attributes['url'].value
-                destination = install_attributes['install_path'].value
-                if install_attributes.has_key('file_type') :
-                    file_type = install_attributes['file_type'].value
+                source_url = xml.get(install, 'url')
+                destination = xml.get(install, 'install_path')
+                if xml.has(install, 'file_type') :
+                    file_type = xml.get(install, 'file_type')
                 else :
                     file_type = None
                 vm_object.addInstallItem(source_url, destination, file_type)
@@ -245,18 +251,17 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
         
         # Next take care of the execute services requested
         for service in service_list :
-            execute_list = service.getElementsByTagName('execute')
+            execute_list = xml.findAll(service, 'execute')
             for execute in execute_list :
-                execute_attributes = execute.attributes
-                if not execute_attributes.has_key('command') :
+                if not xml.has(execute, 'command') :
                     error_string = 'Command missing for execute element in request rspec'
                     error_code = constants.REQUEST_PARSE_FAILED
                     config.logger.error(error_string)
                     return error_string, error_code, sliver_list, None
 
-                exec_command = execute_attributes['command'].value
-                if execute_attributes.has_key('shell') :
-                    exec_shell = execute_attributes['shell'].value
+                exec_command = xml.get(execute, 'command')
+                if xml.has(execute, 'shell') :
+                    exec_shell = xml.get(execute, 'shell')
                 else :
                     exec_shell = config.default_execute_shell
                 vm_object.addExecuteItem(exec_command, exec_shell)
@@ -266,29 +271,25 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
 
     # Done getting information about nodes in the rspec.  Now get information
     # about links.
-    link_list = [link for link in rspec_dom.getElementsByTagName('rspec')[0].childNodes if
-                 link.nodeName == 'link']
+    link_list = parsed_request.getLinks()
 
 
     for link in link_list :
 #        print 'link: ' + link.toxml()
         # Get information about this link from the rspec
-        link_attributes = link.attributes
 
         # Find the name of the link.  We need to make sure we don't already
         # have a link with this name before we do anything else.
-        if link_attributes.has_key('client_id') :
-            link_name = link_attributes['client_id'].value
-            list_of_existing_links = geni_slice.getNetworkLinks()
-            for i in range(0, len(list_of_existing_links)) :
-                if link_name == list_of_existing_links[i].getName() :
-                    # Duplicate name.  Fail this allocate
-                    error_string = \
-                        'Rspec error: Link with name %s already exists' % \
-                        link_name
-                    error_code = constants.REQUEST_PARSE_FAILED
-                    config.logger.error(error_string)
-                    return error_string, error_code, sliver_list, None
+        if xml.has(link, 'client_id') :
+            link_name = xml.get(link, 'client_id')
+            if link_name in link_names :
+                # Duplicate name.  Fail this allocate
+                error_string = \
+                    'Rspec error: Link with name %s already exists' % \
+                    link_name
+                error_code = constants.REQUEST_PARSE_FAILED
+                config.logger.error(error_string)
+                return error_string, error_code, sliver_list, None
         else :
             error_string = 'Malformed rspec: Link name not specified'
             error_code = constants.REQUEST_PARSE_FAILED
@@ -298,32 +299,32 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
         # Create a NetworkLink object for this link 
         link_object = NetworkLink(geni_slice)
         link_object.setName(link_name)
+        link_names.add(link_name)
         sliver_list.append(link_object)
 
         # Check if a shared vlan is specified for the link
-        shared_vlan_tags = link.getElementsByTagName('sharedvlan:link_shared_vlan')
+        shared_vlan_tags = xml.findAll(link, 'sharedvlan:link_shared_vlan')
         if len(shared_vlan_tags) == 1:
-            vlan_tag = int(shared_vlan_tags[0].attributes['name'].value)
+            vlan_tag = int(xml.get(shared_vlan_tags[0], 'name'))
             link_object.setVLANTag(vlan_tag)
             config.logger.info("Using shared vlan: " + str(vlan_tag))
 
         # Gather OF Controller for this link (if any)
-        controllers = link.getElementsByTagName('openflow:controller')
+        controllers = xml.findAll(link, 'openflow:controller')
         if len(controllers) > 0:
             controller_node = controllers[0]
-            controller_url = controller_node.attributes['url'].value
+            controller_url = xml.get(controller_node, 'url')
             controller_link_info[link_name] = controller_url
 
         # Get the end-points for this link.  Each end_point is a network
         # interface
-        end_points = link.getElementsByTagName('interface_ref')
+        end_points = xml.findAll(link, 'interface_ref')
         subnet = None
         for i in range(len(end_points)) :
-            end_point_attributes = end_points[i].attributes
             
             # get the name of the interface at this end_point
-            if end_point_attributes.has_key('client_id') :
-                interface_name = end_point_attributes['client_id'].value
+            if xml.has(end_points[i], 'client_id') :
+                interface_name = xml.get(end_points[i], 'client_id')
 
             # Find the NetworkInterface with this interface_name
             interface_object =  \
@@ -355,199 +356,343 @@ def parseRequestRspec(agg_urn, geni_slice, rspec, stitching_handler=None) :
         if len(link_object.getEndpoints()) == 0:
             sliver_list.remove(link_object)
             geni_slice.removeSliver(link_object)
+            link_names.discard(link_name)
 
     if stitching_handler:
         error_string, error_code, request_details =  \
-            stitching_handler.parseRequestRSpec(rspec_dom)
+            stitching_handler.parseRequestRSpec(parsed_request)
 
     return error_string, error_code, sliver_list, controller_link_info
 
 
+# A manifest being generated: a copy of the request RSpec with its node and
+# link elements indexed by client_id
+class _Manifest :
+    def __init__(self, parsed_request) :
+        xml = parsed_request.getBackend()
+        self._xml = xml
+
+        # Clone the request and set the 'type' to 'manifest
+        self._doc = xml.clone(parsed_request.getDOM())
+        manifest = xml.findAll(self._doc, 'rspec')[0]
+        self._manifest = manifest
+        xml.set(manifest, 'type', 'manifest')
+
+        # Change schema location from request.xsd to manifest.xsd
+        schema_location_tag = 'xsi:schemaLocation'
+        if xml.has(manifest, schema_location_tag):
+            schema_location = xml.get(manifest, schema_location_tag)
+            revised_schema_location = \
+                schema_location.replace('request.xsd', 'manifest.xsd')
+            xml.set(manifest, schema_location_tag, revised_schema_location)
+
+        # Index the link and node elements of the manifest by client_id,
+        # with the request elements they are copied from
+        self._links_by_client_id = {}
+        self._nodes_by_client_id = {}
+        request_children = xml.children(parsed_request.getRSpecElement())
+        for request_child, child in zip(request_children, 
+                                        xml.children(manifest)):
+            tag = xml.tag(child)
+            if tag == 'link': elements = self._links_by_client_id
+            elif tag == 'node': elements = self._nodes_by_client_id
+            else: continue
+            if not xml.has(child, 'client_id'): continue
+            client_id = xml.get(child, 'client_id')
+            if client_id not in elements: 
+                elements[client_id] = [child, request_child]
+        self._paths_by_id = indexStitchingPaths(manifest, xml)
+
+    # Copy the information of the given slivers into their elements.
+    # If reset, the elements are first restored from the request (for
+    # slivers whose elements have already been updated)
+    # Return err_output, err_code
+    def update(self, geni_slivers, aggregate_urn, stitching_handler, 
+               allocate, reset = False) :
+        xml = self._xml
+        err_code = constants.SUCCESS
+        err_output = None
+
+        # For each sliver, find the corresponding manifest element
+        # and copy relevant information
+        for sliver in geni_slivers:
+            elements = None
+            client_id = sliver.getName()
+            if isinstance(sliver, NetworkLink):
+                elements = self._links_by_client_id.get(client_id)
+            elif isinstance(sliver, VirtualMachine):
+                elements = self._nodes_by_client_id.get(client_id)
+
+            if elements:
+                if reset:
+                    request_element = xml.clone(elements[1])
+                    xml.replace(self._manifest, elements[0], request_element)
+                    elements[0] = request_element
+                updateManifestForSliver(sliver, elements[0], xml, \
+                                        aggregate_urn)
+
+            if stitching_handler:
+                err_output, err_code = \
+                    stitching_handler.updateManifestForSliver(self._manifest,
+                                                              sliver,
+                                                              allocate,
+                                                              self._paths_by_id,
+                                                              xml)
+
+                if err_code != constants.SUCCESS:
+                    return err_output, err_code
+
+        return err_output, err_code
+
+    def toXML(self) :
+        return cleanXML(self._manifest, "MANIFEST", self._xml)
+
+
+# parsed_request is the request rspec of the slice (text or ParsedRequest),
+# if the caller has it
 def generateManifestForSlivers(geni_slice, geni_slivers, recompute, \
                                    allocate, 
                                    aggregate_urn,  \
-                                   stitching_handler = None):
+                                   stitching_handler = None,
+                                   parsed_request = None):
     
-    err_code = constants.SUCCESS
-    err_output = None
-
-    # Clone the request and set the 'type' to 'manifest
-    request = geni_slice.getRequestRspec()
+    request = parsed_request
     if request == None:
-        return None, constants.REQUEST_PARSE_FAILED, "Empty Request RSpec"
-
-    if isinstance(request, basestring): request = parseString(request)
-    manifest_doc = request.cloneNode(True)
-    config.logger.error("DOC = %s" % manifest_doc.toxml())
-    manifest = manifest_doc.getElementsByTagName('rspec')[0]
-    manifest.setAttribute('type', 'manifest')
-
-    # Change schema location from request.xsd to manifest.xsd
-    schema_location_tag = 'xsi:schemaLocation'
-    if manifest.attributes.has_key(schema_location_tag):
-        schema_location = manifest.attributes[schema_location_tag].value
-        revised_schema_location = \
-            schema_location.replace('request.xsd', 'manifest.xsd')
-        manifest.setAttribute(schema_location_tag, revised_schema_location)
-
-    root = Document()
-    
+        request = geni_slice.getRequestRspec()
+        if request == None:
+            return None, constants.REQUEST_PARSE_FAILED, "Empty Request RSpec"
+
+    manifest = _Manifest(asParsedRequest(request))
+    err_output, err_code = manifest.update(geni_slivers, aggregate_urn, 
+                                           stitching_handler, allocate)
+    if err_code != constants.SUCCESS:
+        return None, err_output, err_code
+
+    return manifest.toXML(), err_output, err_code
+
+
+# A manifest of a slice kept by the ManifestCache, with the versions 
+# of the slice and slivers it was generated from
+class _CachedManifest :
+    def __init__(self, version, sliver_versions, manifest, text) :
+        self.version = version
+        self.sliver_versions = sliver_versions # sliver URN => version
+        self.manifest = manifest
+        self.text = text
+
+
+# Cache of the manifests of a slice, by set of slivers described.
+# A cached manifest is returned as is while the version of the slice
+# is unchanged.  Otherwise only the elements of the slivers whose version
+# changed are generated again (from the request) and the manifest is 
+# serialized again.  Used for Describe and Provision, which don't 
+# allocate VLANs.
+class ManifestCache :
+    MAX_MANIFESTS = 8 # Manifests (sets of slivers) cached per slice
+
+    def __init__(self) :
+        self._lock = threading.Lock()
+        self._request = None # Request rspec text of the slice
+        self._parsed_request = None
+        self._manifests = {} # (sliver URNs, aggregate, stitching) => 
+                             #   _CachedManifest
+        self._hits = 0     # Manifests returned as cached
+        self._updates = 0  # Manifests updated for changed slivers
+        self._misses = 0   # Manifests generated
+
+    # Return manifest, err_output, err_code, as generateManifestForSlivers
+    def get(self, geni_slice, geni_slivers, aggregate_urn, 
+            stitching_handler = None) :
+        with self._lock:
+            # Read the versions first: changes made while the manifest 
+            # is generated make it out of date
+            version = geni_slice.getVersion()
+            request = geni_slice.getRequestRspec()
+            if request == None:
+                return None, constants.REQUEST_PARSE_FAILED, \
+                    "Empty Request RSpec"
+            if request != self._request:
+                self._request = request
+                self._parsed_request = asParsedRequest(request)
+                self._manifests = {}
+
+            sliver_versions = dict((sliver.getSliverURN(), sliver.getVersion())\
+                                       for sliver in geni_slivers)
+            key = (frozenset(sliver_versions.keys()), aggregate_urn, 
+                   stitching_handler)
+            cached = self._manifests.get(key)
+            if cached is not None and cached.version == version:
+                self._hits = self._hits + 1
+                return cached.text, None, constants.SUCCESS
+
+            if cached is None:
+                self._misses = self._misses + 1
+                manifest = _Manifest(self._parsed_request)
+                changed_slivers = geni_slivers
+            else:
+                self._updates = self._updates + 1
+                manifest = cached.manifest
+                changed_slivers = \
+                    [sliver for sliver in geni_slivers \
+                         if cached.sliver_versions[sliver.getSliverURN()] != \
+                         sliver_versions[sliver.getSliverURN()]]
+
+            if len(changed_slivers) > 0 or cached is None:
+                err_output, err_code = \
+                    manifest.update(changed_slivers, aggregate_urn, 
+                                    stitching_handler, False, 
+                                    cached is not None)
+                if err_code != constants.SUCCESS:
+                    if key in self._manifests: del self._manifests[key]
+                    return None, err_output, err_code
+                text = manifest.toXML()
+            else:
+                text = cached.text
 
-    # For each sliver, find the corresponding manifest element
-    # and copy relevant information
-    for sliver in geni_slivers:
-        sliver_element  = None
-        client_id = sliver.getName()
-        sliver_id = sliver.getSliverURN()
-        for child in manifest.childNodes:
-            if (isinstance(sliver, NetworkLink) and child.nodeName == 'link')\
-                    or \
-                    (isinstance(sliver, VirtualMachine) and child.nodeName =='node'):
-                if child.attributes['client_id'].value == client_id:
-                    sliver_element = child
-                    break
+            if key not in self._manifests and \
+                    len(self._manifests) >= ManifestCache.MAX_MANIFESTS:
+                self._manifests = {}
+            self._manifests[key] = \
+                _CachedManifest(version, sliver_versions, manifest, text)
+            return text, None, constants.SUCCESS
 
-        if sliver_element:
-            
-            updateManifestForSliver(sliver, sliver_element, root, \
-                                    aggregate_urn)
+    def getMetrics(self) :
+        with self._lock:
+            return {'hits' : self._hits, 'updates' : self._updates,
+                    'misses' : self._misses}
 
-        if stitching_handler:
-            err_output, err_code = \
-                stitching_handler.updateManifestForSliver(manifest, sliver,
-                                                          allocate)
 
-            if err_code != constants.SUCCESS:
-                return None, err_output, err_code
+_manifest_cache_lock = threading.Lock()
 
-    return cleanXML(manifest, "MANIFEST"), err_output, err_code
+# Return the manifest for the given slivers of a slice (manifest, 
+# err_output, err_code) from the manifest cache of the slice
+def getManifestForSlivers(geni_slice, geni_slivers, aggregate_urn, 
+                          stitching_handler = None) :
+    with _manifest_cache_lock:
+        manifest_cache = geni_slice.getManifestCache()
+        if manifest_cache is None:
+            manifest_cache = ManifestCache()
+            geni_slice.setManifestCache(manifest_cache)
+    return manifest_cache.get(geni_slice, geni_slivers, aggregate_urn, 
+                              stitching_handler)
 
 
-def getRequestElementForSliver(sliver):
-    full_request_rspec = parseString(sliver.getRequestRspec()).getElementsByTagName('rspec')[0]
-    for child in full_request_rspec.childNodes:
-        if child.attributes is None or not child.attributes.has_key('client_id'):
-            continue
-        client_id = child.attributes['client_id'].value;
-        if sliver.getName() == client_id:
-            return child
-    return None
+# parsed_request is the ParsedRequest of the request rspec of the sliver,
+# if the caller has one
+def getRequestElementForSliver(sliver, parsed_request=None):
+    if parsed_request == None:
+        parsed_request = asParsedRequest(sliver.getRequestRspec())
+    return parsed_request.getElement(sliver.getName())
 
 
 # Update XML element in manifest with information from given sliver
-def updateManifestForSliver(sliver_object, sliver_elt, root, \
+# (xml is the RSpec backend of the manifest)
+def updateManifestForSliver(sliver_object, sliver_elt, xml, \
                                 component_manager_id):
     client_id = sliver_object.getName()
     sliver_id = sliver_object.getSliverURN()
 
-    sliver_elt.setAttribute('component_manager_id', component_manager_id)
-    sliver_elt.setAttribute('sliver_id', sliver_id)
+    xml.set(sliver_elt, 'component_manager_id', component_manager_id)
+    xml.set(sliver_elt, 'sliver_id', sliver_id)
 
     if isinstance(sliver_object, NetworkLink):
 
-        sliver_elt.setAttribute('vlantag', str(sliver_object.getVLANTag()))
+        xml.set(sliver_elt, 'vlantag', str(sliver_object.getVLANTag()))
 
     elif isinstance(sliver_object, VirtualMachine):
 
         hostname = sliver_object.getHost()
         if hostname is not None:
             component_id = config.urn_prefix + 'node+' + hostname
-            sliver_elt.setAttribute('component_id', component_id)
+            xml.set(sliver_elt, 'component_id', component_id)
 
         # Add addresses to interfaces on VM
         for interface in sliver_object.getNetworkInterfaces():
             interface_id = interface.getName()
             interface_node = None
-            for iface_node in sliver_elt.getElementsByTagName('interface'):
-                if iface_node.attributes['client_id'].value == interface_id:
+            for iface_node in xml.findAll(sliver_elt, 'interface'):
+                if xml.get(iface_node, 'client_id') == interface_id:
                     interface_node = iface_node
                     break
             if interface_node is not None:
                 # Set the MAC address
                 mac_address = interface.getMACAddress()
                 if mac_address is not None and mac_address != '':
-                    interface_node.setAttribute('mac_address', mac_address)
+                    xml.set(interface_node, 'mac_address', mac_address)
 
                 # Set the IP address
                 ip_address = interface.getIPAddress()
                 ip_netmask = interface.getNetmask()
                 if ip_address is not None and ip_address != '':
-                    ip_nodes = interface_node.getElementsByTagName('ip')
+                    ip_nodes = xml.findAll(interface_node, 'ip')
                     if len(ip_nodes) == 0:
-                        ip_node = root.createElement('ip')
-                        interface_node.appendChild(ip_node)
+                        ip_node = xml.addChild(interface_node, 'ip')
                     else:
                         ip_node = ip_nodes[0]
                     
-                    ip_node.setAttribute('address', ip_address)
+                    xml.set(ip_node, 'address', ip_address)
                     if ip_netmask is not None:
-                        ip_node.setAttribute('netmask', ip_netmask) 
-                    ip_node.setAttribute('type', 'ip')
+                        xml.set(ip_node, 'netmask', ip_netmask) 
+                    xml.set(ip_node, 'type', 'ip')
 
         # Add sliver type (if not already there)
-        sliver_types = sliver_elt.getElementsByTagName('sliver_type')
+        sliver_types = xml.findAll(sliver_elt, 'sliver_type')
         if len(sliver_types) == 0:
-            sliver_type = root.createElement('sliver_type')
-            sliver_elt.appendChild(sliver_type)
+            sliver_type = xml.addChild(sliver_elt, 'sliver_type')
         else:
             sliver_type = sliver_types[0]
 
         # Set VM flavor in sliver type node
-        sliver_type.setAttribute('name', sliver_object.getVMFlavor())
+        xml.set(sliver_type, 'name', sliver_object.getVMFlavor())
 
         # Add disk image info to sliver type
-        disk_image = root.createElement('disk_image')
+        disk_image = xml.addChild(sliver_type, 'disk_image')
         disk_image_name = config.image_urn_prefix + \
             sliver_object.getOSImageName()
-        disk_image.setAttribute("name", disk_image_name)
+        xml.set(disk_image, "name", disk_image_name)
 
         disk_image_os = sliver_object.getOSType()
-        disk_image.setAttribute("os", disk_image_os)
+        xml.set(disk_image, "os", disk_image_os)
 
         disk_image_version = sliver_object.getOSVersion()
-        disk_image.setAttribute("version", disk_image_version)
-
-        sliver_type.appendChild(disk_image)
+        xml.set(disk_image, "version", disk_image_version)
 
         # Add the 'host' tag
-        hosts = sliver_elt.getElementsByTagName('host')
+        hosts = xml.findAll(sliver_elt, 'host')
         if len(hosts) == 0:
-            host = root.createElement("host")
-            sliver_elt.appendChild(host)
+            host = xml.addChild(sliver_elt, "host")
         else:
             host = hosts[0]
                 
         host_name = sliver_object.getName()
-        host.setAttribute('name', host_name)
+        xml.set(host, 'name', host_name)
 
         # Add user services if there are any
         users = sliver_object.getAuthorizedUsers()
         if users is not None and len(users) > 0:
-            services = root.createElement("services")
+            services = xml.addChild(sliver_elt, "services")
             for user in users:
-                login = root.createElement("login")
-                login.setAttribute("authentication", "ssh-keys")
+                login = xml.addChild(services, "login")
+                xml.set(login, "authentication", "ssh-keys")
                 my_host_name = \
                     socket.gethostbyaddr(socket.gethostname())[0]
                 #login.setAttribute("externally-routable-ip", sliver_object.getExternalIp())
                 if sliver_object.getExternalIp():
-                    login.setAttribute("hostname", sliver_object.getExternalIp())
-                    login.setAttribute("port", "22")
+                    xml.set(login, "hostname", sliver_object.getExternalIp())
+                    xml.set(login, "port", "22")
                 else:    
-                    login.setAttribute("hostname", config.public_ip)
-                    login.setAttribute("port", str(sliver_object.getSSHProxyLoginPort()))
-                login.setAttribute("username", user)
-                services.appendChild(login)
-            sliver_elt.appendChild(services)
+                    xml.set(login, "hostname", config.public_ip)
+                    xml.set(login, "port", str(sliver_object.getSSHProxyLoginPort()))
+                xml.set(login, "username", user)
         
 
-def cleanXML(doc, label):
-    xml = doc.toprettyxml(indent = '    ')
+# backend is the RSpec backend holding doc (minidom by default)
+def cleanXML(doc, label, backend=None):
+    if backend is None: backend = rspec_backend.getBackend('minidom')
+    xml = backend.toPrettyXML(doc)
 #    config.logger.info("%s = %s" % (label, xml))
-    clean_xml = ""
-    for line in xml.split('\n'):
-        if line.strip():
-            clean_xml += line + '\n'
+    clean_xml = ''.join([line + '\n' for line in xml.split('\n') \
+                             if line.strip()])
     config.logger.info("Clean %s = %s" % (label, clean_xml))
     return clean_xml
 
@@ -815,6 +960,69 @@ def generateAdvertisement(am_urn, stitching_handler = None):
 #                     sliver_type, image_types,  stitching_advertisement, POA_block)) 
     return result
 
+
+# Cache of the advertisement RSpec (plain and geni_compressed forms).
+# The cached advertisement is reused while the inputs it is generated 
+# from (flavors, images, compute hosts and stitching VLAN availability)
+# are unchanged and it hasn't been invalidated by an allocate, delete,
+# expiry or a refresh of the flavor and image lists of GramImageInfo.
+class AdvertisementCache :
+    _lock = threading.RLock()
+    _key = None
+    _generation = 0 # Bumped on every invalidation
+    _advertisement = None
+    _compressed_advertisement = None
+    _version = None
+
+    @staticmethod
+    def invalidate():
+        with AdvertisementCache._lock:
+            AdvertisementCache._generation = AdvertisementCache._generation + 1
+
+    # Return the (cheaply computed) values the advertisement depends on
+    @staticmethod
+    def _getKey(am_urn, stitching_handler):
+        flavors = GramImageInfo.get_flavor_list()
+        compute_hosts = GramImageInfo._compute_hosts
+        if compute_hosts is not None:
+            compute_hosts = sorted((host, tuple(services)) \
+                                       for host, services in compute_hosts.items())
+        vlans = None
+        if stitching_handler:
+            vlans = stitching_handler.getVLANAvailability()
+        return (AdvertisementCache._generation, am_urn, flavors, 
+                compute_hosts, repr(config.disk_image_metadata), 
+                repr(config.location), vlans)
+
+    @staticmethod
+    def get(am_urn, stitching_handler = None, compressed = False):
+        """
+            Return the advertisement RSpec (base64 encoded and zlib 
+            compressed if compressed is True) and its version, a digest 
+            which changes whenever the advertisement does.
+        """
+        with AdvertisementCache._lock:
+            key = AdvertisementCache._getKey(am_urn, stitching_handler)
+            if key != AdvertisementCache._key:
+                advertisement = generateAdvertisement(am_urn, stitching_handler)
+                AdvertisementCache._advertisement = advertisement
+                AdvertisementCache._compressed_advertisement = None
+                AdvertisementCache._version = \
+                    hashlib.sha1(advertisement).hexdigest()
+                AdvertisementCache._key = key
+            if not compressed:
+                return AdvertisementCache._advertisement, \
+                    AdvertisementCache._version
+            if AdvertisementCache._compressed_advertisement is None:
+                AdvertisementCache._compressed_advertisement = \
+                    base64.b64encode(zlib.compress( \
+                        AdvertisementCache._advertisement))
+            return AdvertisementCache._compressed_advertisement, \
+                AdvertisementCache._version
+
+# The advertisement lists the flavors and images of GramImageInfo
+GramImageInfo.add_refresh_listener(AdvertisementCache.invalidate)
+
 def getURNprefix(am_urn):
         host = socket.gethostname().split('.')[0]
         m = re.search(r'(.*)' + host + '(.*)',am_urn)
@@ -827,3 +1035,75 @@ def getHostFromUrn(urn):
             return m.group(1)
 
 
+
+
+if __name__ == "__main__":
+    # Benchmark Describe's manifest on a 200 node, 100 link slice: 
+    # generated on every call (as before), from the manifest cache of 
+    # the slice, and from the cache after one VM changed.  Checks that
+    # the cached manifests are those generated.
+    import logging
+    import time
+    import request_rspec
+    import rspec_handler
+
+    logging.basicConfig()
+    config.logger.setLevel(logging.CRITICAL)
+
+    AGG = 'urn:publicid:IDN+gram.example.net+authority+am'
+    OTHER = 'urn:publicid:IDN+other.example.net+authority+am'
+
+    num_nodes = 200
+    num_links = 100
+    geni_slice = Slice('urn:publicid:IDN+geni:gpo:gcf+slice+bench')
+    geni_slice.setRequestRspec( \
+        request_rspec._generateRequest(num_nodes, num_links, AGG, OTHER))
+    vms = []
+    for i in range(num_nodes):
+        vm = VirtualMachine(geni_slice)
+        vm.setName('node-%d' % i)
+        vm.setVMFlavor('m1.small')
+        vm.setOSImageName('ubuntu')
+        vm.setOSType('Linux')
+        vm.setOSVersion('12')
+        vm.setHost('compute%d' % (i % 4))
+        nic = NetworkInterface(geni_slice, vm)
+        nic.setName('node-%d:if0' % i)
+        vm.addNetworkInterface(nic)
+        vms.append(vm)
+    slivers = list(vms)
+    for i in range(num_links):
+        link = NetworkLink(geni_slice)
+        link.setName('link-%d' % i)
+        link.setVLANTag(1000 + i)
+        slivers.append(link)
+
+    def describe(generate):
+        if generate:
+            return rspec_handler.generateManifestForSlivers(geni_slice, 
+                                                            slivers, False,
+                                                            False, AGG)[0]
+        return rspec_handler.getManifestForSlivers(geni_slice, slivers, 
+                                                   AGG)[0]
+
+    calls = 20
+    results = []
+    for generate in [True, False]:
+        describe(generate)
+        start = time.time()
+        for i in range(calls):
+            manifest = describe(generate)
+        results.append((time.time() - start) * 1000 / calls)
+    same = describe(True) == describe(False)
+
+    start = time.time()
+    for i in range(calls):
+        vms[i].getNetworkInterfaces()[0].setIPAddress('10.0.%d.100' % i)
+        manifest = describe(False)
+    results.append((time.time() - start) * 1000 / calls)
+    same = same and manifest == describe(True)
+
+    print "%d nodes, %d links: generated %.1f ms, cached %.3f ms, " \
+        "one VM changed %.1f ms, same manifests %s" % \
+        (num_nodes, num_links, results[0], results[1], results[2], same)
+    print "Cache: %s" % geni_slice.getManifestCache().getMetrics()
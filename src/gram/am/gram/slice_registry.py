@@ -0,0 +1,340 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Registry of the slices of the aggregate and their slivers.
+#
+# Besides the slices by URN, the registry keeps indexes of
+#
+#    slices by OpenStack tenant UUID (None for slices without a tenant)
+#    slivers by sliver URN
+#    links and NICs by VLAN tag
+#    NICs by MAC address
+#    NICs and VMs by IP address (NIC, management and external addresses)
+#    VMs by compute host
+#    slivers by expiration time
+#
+# so the AM, monitoring and cleanup code can find slices and slivers
+# without scanning all of them.  The indexes are kept up to date as
+# slivers are added to or removed from registered slices and as the
+# indexed attributes of slivers change: slices report these changes to
+# the registry they belong to (see Slice.sliverChanged).
+
+import bisect
+import threading
+
+import config
+from resources import VirtualMachine, NetworkInterface, NetworkLink
+
+
+def _getSliverKeys(sliver):
+    """
+        Return {index name : list of keys} for the values of the
+        sliver indexed by the registry.
+    """
+    keys = {'vlan' : [], 'mac' : [], 'ip' : [], 'host' : [], 
+            'expiration' : []}
+    if sliver.getExpiration() is not None:
+        keys['expiration'].append(sliver.getExpiration())
+    if isinstance(sliver, NetworkLink):
+        if sliver.getVLANTag() is not None:
+            keys['vlan'].append(int(sliver.getVLANTag()))
+    elif isinstance(sliver, NetworkInterface):
+        if sliver.getVLANTag() is not None:
+            keys['vlan'].append(int(sliver.getVLANTag()))
+        if sliver.getMACAddress():
+            keys['mac'].append(sliver.getMACAddress().lower())
+        if sliver.getIPAddress():
+            keys['ip'].append(sliver.getIPAddress())
+    elif isinstance(sliver, VirtualMachine):
+        if sliver.getHost():
+            keys['host'].append(sliver.getHost())
+        if sliver.getMgmtNetAddr():
+            keys['ip'].append(sliver.getMgmtNetAddr())
+        # The external IP is 'true' until a floating IP is assigned
+        external_ip = sliver.getExternalIp()
+        if external_ip and external_ip != 'true':
+            keys['ip'].append(external_ip)
+    return keys
+
+
+class SliceRegistry:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._slices = {} # slice URN => Slice
+        self._slices_by_tenant = {} # tenant UUID => {slice URN : Slice}
+        self._tenants = {} # slice URN => tenant UUID indexed
+        self._slivers = {} # sliver URN => (sliver, slice, keys indexed)
+        # index name => {key : {sliver URN : sliver}}
+        self._indexes = {'vlan' : {}, 'mac' : {}, 'ip' : {}, 'host' : {},
+                         'expiration' : {}}
+        self._expirations = [] # Sorted keys of the expiration index
+
+    # Slices
+
+    def addSlice(self, slice_object):
+        """
+            Register a slice (replacing any slice with the same URN)
+            and index its slivers.
+        """
+        with self._lock:
+            slice_urn = slice_object.getSliceURN()
+            if slice_urn in self._slices:
+                self.removeSlice(slice_urn)
+            self._slices[slice_urn] = slice_object
+            slice_object.setRegistry(self)
+            self.sliceChanged(slice_object)
+            for sliver in slice_object.getAllSlivers().values():
+                self.sliverAdded(slice_object, sliver)
+
+    def removeSlice(self, slice_urn):
+        """
+            Unregister the slice with the given URN (if any) and its 
+            slivers.  Returns the slice, or None.
+        """
+        with self._lock:
+            slice_object = self._slices.get(slice_urn)
+            if slice_object is None: return None
+            for sliver in slice_object.getAllSlivers().values():
+                self.sliverRemoved(slice_object, sliver)
+            self._unindexTenant(slice_urn)
+            del self._slices[slice_urn]
+            slice_object.setRegistry(None)
+            return slice_object
+
+    def clear(self):
+        with self._lock:
+            for slice_urn in self._slices.keys():
+                self.removeSlice(slice_urn)
+
+    def getSlice(self, slice_urn):
+        with self._lock:
+            return self._slices.get(slice_urn)
+
+    def getSlices(self):
+        with self._lock:
+            return self._slices.values()
+
+    def getSlicesByURN(self):
+        """
+            Returns a copy of the {slice URN : Slice} map
+        """
+        with self._lock:
+            return dict(self._slices)
+
+    def __len__(self):
+        return len(self._slices)
+
+    def getSlicesByTenant(self, tenant_uuid):
+        """
+            Returns the slices with the given tenant UUID (normally one),
+            or the slices without a tenant if tenant_uuid is None.
+        """
+        with self._lock:
+            slices = self._slices_by_tenant.get(tenant_uuid)
+            if slices is None: return []
+            return slices.values()
+
+    # Slivers
+
+    def getSliver(self, sliver_urn):
+        with self._lock:
+            entry = self._slivers.get(sliver_urn)
+            if entry is None: return None
+            return entry[0]
+
+    def getSliceOfSliver(self, sliver_urn):
+        with self._lock:
+            entry = self._slivers.get(sliver_urn)
+            if entry is None: return None
+            return entry[1]
+
+    def getSliversByVLAN(self, vlan_tag):
+        """
+            Returns the links and NICs with the given VLAN tag
+        """
+        return self._lookup('vlan', int(vlan_tag))
+
+    def getSliversByMAC(self, mac_address):
+        return self._lookup('mac', mac_address.lower())
+
+    def getSliversByIP(self, ip_address):
+        """
+            Returns the NICs with the given address and the VMs with it
+            as management or external address
+        """
+        return self._lookup('ip', ip_address)
+
+    def getVMsByHost(self, host):
+        return self._lookup('host', host)
+
+    def getSliversExpiringBefore(self, time):
+        """
+            Returns the slivers whose expiration time is before the 
+            given time, by increasing expiration time.
+        """
+        with self._lock:
+            index = self._indexes['expiration']
+            slivers = []
+            for i in range(bisect.bisect_left(self._expirations, time)):
+                slivers.extend(index[self._expirations[i]].values())
+            return slivers
+
+    def _lookup(self, index_name, key):
+        with self._lock:
+            slivers = self._indexes[index_name].get(key)
+            if slivers is None: return []
+            return slivers.values()
+
+    # Updates (called by the registered slices)
+
+    def sliceChanged(self, slice_object):
+        """
+            Reindex the tenant of a registered slice
+        """
+        with self._lock:
+            slice_urn = slice_object.getSliceURN()
+            if self._slices.get(slice_urn) is not slice_object: return
+            self._unindexTenant(slice_urn)
+            tenant_uuid = slice_object.getTenantUUID()
+            self._tenants[slice_urn] = tenant_uuid
+            if tenant_uuid not in self._slices_by_tenant:
+                self._slices_by_tenant[tenant_uuid] = {}
+            self._slices_by_tenant[tenant_uuid][slice_urn] = slice_object
+
+    def _unindexTenant(self, slice_urn):
+        if slice_urn not in self._tenants: return
+        tenant_uuid = self._tenants.pop(slice_urn)
+        slices = self._slices_by_tenant[tenant_uuid]
+        del slices[slice_urn]
+        if len(slices) == 0: del self._slices_by_tenant[tenant_uuid]
+
+    def sliverAdded(self, slice_object, sliver):
+        with self._lock:
+            sliver_urn = sliver.getSliverURN()
+            if sliver_urn is None: return
+            if sliver_urn in self._slivers:
+                self._unindex(sliver_urn)
+            keys = _getSliverKeys(sliver)
+            self._slivers[sliver_urn] = (sliver, slice_object, keys)
+            for index_name, index_keys in keys.items():
+                for key in index_keys:
+                    self._addKey(index_name, key, sliver_urn, sliver)
+
+    def sliverChanged(self, slice_object, sliver):
+        with self._lock:
+            entry = self._slivers.get(sliver.getSliverURN())
+            if entry is None or entry[0] is not sliver: return
+            keys = _getSliverKeys(sliver)
+            if keys != entry[2]:
+                self.sliverAdded(slice_object, sliver)
+
+    def sliverRemoved(self, slice_object, sliver):
+        with self._lock:
+            entry = self._slivers.get(sliver.getSliverURN())
+            if entry is None or entry[0] is not sliver: return
+            self._unindex(sliver.getSliverURN())
+
+    def _unindex(self, sliver_urn):
+        sliver, slice_object, keys = self._slivers.pop(sliver_urn)
+        for index_name, index_keys in keys.items():
+            for key in index_keys:
+                self._removeKey(index_name, key, sliver_urn)
+
+    def _addKey(self, index_name, key, sliver_urn, sliver):
+        index = self._indexes[index_name]
+        if key not in index:
+            index[key] = {}
+            if index_name == 'expiration':
+                bisect.insort(self._expirations, key)
+        index[key][sliver_urn] = sliver
+
+    def _removeKey(self, index_name, key, sliver_urn):
+        index = self._indexes[index_name]
+        slivers = index.get(key)
+        if slivers is None: return
+        if sliver_urn in slivers: del slivers[sliver_urn]
+        if len(slivers) == 0:
+            del index[key]
+            if index_name == 'expiration':
+                position = bisect.bisect_left(self._expirations, key)
+                if position < len(self._expirations) and \
+                        self._expirations[position] == key:
+                    del self._expirations[position]
+
+
+if __name__ == "__main__":
+    # Find the slivers of an IP address, MAC address and VLAN among 500 
+    # slices of 10 VMs by scanning the slivers (as gram-mon did) and 
+    # from the registry
+    import logging
+    import re
+    import time
+    from resources import Slice
+
+    logging.basicConfig()
+    config.logger.setLevel(logging.CRITICAL)
+
+    registry = SliceRegistry()
+    num_slices = 500
+    for i in range(num_slices):
+        slice_object = Slice('urn:publicid:IDN+geni:gpo:gcf+slice+s%d' % i)
+        registry.addSlice(slice_object)
+        slice_object.setTenantUUID('tenant-%d' % i)
+        link = NetworkLink(slice_object)
+        link.setVLANTag(1000 + i)
+        for j in range(10):
+            vm = VirtualMachine(slice_object)
+            vm.setName('node-%d' % j)
+            vm.setUUID('vm-%d-%d' % (i, j))
+            vm.setHost('compute%d' % (j % 8))
+            nic = NetworkInterface(slice_object, vm)
+            nic.setUUID('nic-%d-%d' % (i, j))
+            vm.addNetworkInterface(nic)
+            nic.setIPAddress('10.%d.%d.%d' % (i / 256, i % 256, 100 + j))
+            nic.setMACAddress('fa:16:3e:%02x:%02x:%02x' % (i / 256, i % 256, j))
+            nic.setVLANTag(1000 + i)
+
+    def scan(ip, mac, vlan):
+        found = []
+        for slice_object in registry.getSlices():
+            for sliver in slice_object.getAllSlivers().values():
+                if isinstance(sliver, NetworkInterface):
+                    if re.search(ip, str(sliver)) or \
+                            sliver.getMACAddress() == mac or \
+                            sliver.getVLANTag() == vlan:
+                        found.append(sliver)
+        return found
+
+    def lookup(ip, mac, vlan):
+        found = registry.getSliversByIP(ip) + registry.getSliversByMAC(mac) + \
+            registry.getSliversByVLAN(vlan)
+        return set([sliver for sliver in found \
+                        if isinstance(sliver, NetworkInterface)])
+
+    for name, function in [('scan', scan), ('registry', lookup)]:
+        start = time.time()
+        for i in range(10):
+            found = function('10.1.200.105', 'fa:16:3e:01:c8:05', 1456)
+        print "%-8s %d slivers: %.3f ms per lookup (%d found)" % \
+            (name, num_slices * 21, (time.time() - start) * 100, len(found))
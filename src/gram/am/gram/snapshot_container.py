@@ -0,0 +1,299 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+
+# Compressed, indexed container for snapshots of the aggregate state.
+#
+# A container snapshot is
+#
+#    GRAMSNAP <version>\n
+#    <length of the header>\n
+#    <header>
+#    <records>
+#
+# The records are the JSON texts (as encoded by Archiving.GramJSONEncoder)
+# of the list of objects of each slice, that is the slice and its
+# slivers, followed by one record of the other objects (the 
+# GRAM_MANAGER_STATE and SSH_PROXY entries).  Each record is compressed
+# separately with zlib.  The header is an uncompressed JSON index
+#
+#    {"version" : 1, "compression" : "zlib",
+#     "slices" : [{"urn" : <slice_urn>, "tenant_uuid" : <tenant_uuid>,
+#                  "slivers" : [<sliver_urn>, ...],
+#                  "offset" : <offset>, "length" : <length>}, ...],
+#     "other" : {"offset" : <offset>, "length" : <length>}}
+#
+# giving the position of each record relative to the end of the header.
+# A reader can thus find and decode the objects of one slice without
+# reading the rest of the snapshot.  load_objects reads snapshots in
+# this format or in the plain JSON list format written by earlier
+# versions of GRAM.
+#
+# This module depends only on the standard library so that monitoring
+# tools can read snapshots without the rest of GRAM.
+
+import json
+import zlib
+
+MAGIC = 'GRAMSNAP'
+VERSION = 1
+CONTAINER_SUFFIX = '.snap'
+
+
+def encode_snapshot(slice_records, other_text, compression_level=6):
+    """
+        Return the contents of a container snapshot.
+
+        slice_records is a list of (slice_urn, tenant_uuid, sliver_urns, 
+        objects_text) with the JSON text of the list of objects of 
+        each slice.  other_text is the JSON text of the list of other
+        objects.
+    """
+    slices = []
+    records = []
+    offset = 0
+    for slice_urn, tenant_uuid, sliver_urns, objects_text in slice_records:
+        record = zlib.compress(objects_text, compression_level)
+        slices.append({'urn' : slice_urn, 'tenant_uuid' : tenant_uuid,
+                       'slivers' : sliver_urns, 'offset' : offset,
+                       'length' : len(record)})
+        records.append(record)
+        offset = offset + len(record)
+    record = zlib.compress(other_text, compression_level)
+    records.append(record)
+    header = json.dumps({'version' : VERSION, 'compression' : 'zlib',
+                         'slices' : slices, 
+                         'other' : {'offset' : offset, 
+                                    'length' : len(record)}})
+    return '%s %d\n%d\n%s%s' % (MAGIC, VERSION, len(header), header,
+                                ''.join(records))
+
+
+def is_container(filename):
+    """
+        Is the given file a container snapshot (rather than a JSON one)?
+    """
+    file = open(filename, 'rb')
+    try:
+        return file.read(len(MAGIC)) == MAGIC
+    finally:
+        file.close()
+
+
+class SnapshotReader:
+    """
+        Reads the index of a container snapshot and the records of 
+        individual slices on demand.
+    """
+    def __init__(self, filename):
+        self._filename = filename
+        file = open(filename, 'rb')
+        try:
+            magic, version = file.readline().split()
+            if magic != MAGIC:
+                raise ValueError("%s is not a GRAM snapshot container" % \
+                                     filename)
+            if int(version) > VERSION:
+                raise ValueError("%s has unsupported snapshot version %s" % \
+                                     (filename, version))
+            header_length = int(file.readline())
+            self._header = json.loads(file.read(header_length))
+            self._records_offset = file.tell()
+        finally:
+            file.close()
+
+        self._slices_by_urn = {}
+        self._slice_urns_by_tenant_uuid = {}
+        self._slice_urns_by_sliver_urn = {}
+        for entry in self._header['slices']:
+            slice_urn = entry['urn']
+            self._slices_by_urn[slice_urn] = entry
+            self._slice_urns_by_tenant_uuid[entry['tenant_uuid']] = slice_urn
+            for sliver_urn in entry['slivers']:
+                self._slice_urns_by_sliver_urn[sliver_urn] = slice_urn
+
+    def getVersion(self): return self._header['version']
+
+    def getSliceURNs(self):
+        """
+            Return the URNs of the slices in the snapshot, in order
+        """
+        return [entry['urn'] for entry in self._header['slices']]
+
+    def getTenantUUID(self, slice_urn):
+        return self._slices_by_urn[slice_urn]['tenant_uuid']
+
+    def getSliceURNByTenant(self, tenant_uuid):
+        return self._slice_urns_by_tenant_uuid.get(tenant_uuid)
+
+    def getSliceURNOfSliver(self, sliver_urn):
+        return self._slice_urns_by_sliver_urn.get(sliver_urn)
+
+    def getSliceObjects(self, slice_urn):
+        """
+            Return the list of JSON objects (the slice and its slivers) of
+            the given slice, or None if there is no such slice
+        """
+        if slice_urn not in self._slices_by_urn: return None
+        entry = self._slices_by_urn[slice_urn]
+        return json.loads(self._readRecord(entry['offset'], entry['length']))
+
+    def getOtherObjects(self):
+        """
+            Return the list of GRAM_MANAGER_STATE and SSH_PROXY objects
+        """
+        entry = self._header['other']
+        return json.loads(self._readRecord(entry['offset'], entry['length']))
+
+    def getObjects(self):
+        """
+            Return the list of all objects in the snapshot, as written
+            by Archiving.write_state: the objects of each slice followed
+            by the other objects
+        """
+        objects = []
+        file = open(self._filename, 'rb')
+        try:
+            file.seek(self._records_offset)
+            for entry in self._header['slices']:
+                objects = objects + \
+                    json.loads(zlib.decompress(file.read(entry['length'])))
+            objects = objects + \
+                json.loads(zlib.decompress(file.read( \
+                        self._header['other']['length'])))
+        finally:
+            file.close()
+        return objects
+
+    def _readRecord(self, offset, length):
+        file = open(self._filename, 'rb')
+        try:
+            file.seek(self._records_offset + offset)
+            return zlib.decompress(file.read(length))
+        finally:
+            file.close()
+
+
+def load_objects(filename):
+    """
+        Return the list of objects of a snapshot, either a container
+        or a JSON snapshot
+    """
+    if is_container(filename):
+        return SnapshotReader(filename).getObjects()
+    file = open(filename, 'r')
+    try:
+        return json.load(file)
+    finally:
+        file.close()
+
+
+# Return (slice_records, other_text) for encode_snapshot from a list
+# of objects in the form written by Archiving.write_state
+def _recordsFromObjects(json_data):
+    slice_records = []
+    objects_by_tenant_uuid = {}
+    other_objects = []
+    for json_object in json_data:
+        if json_object.get("__type__") == "Slice":
+            objects = [json_object]
+            objects_by_tenant_uuid[json_object['tenant_uuid']] = objects
+            slice_records.append((json_object['slice_urn'], 
+                                  json_object['tenant_uuid'], objects))
+    for json_object in json_data:
+        object_type = json_object.get("__type__")
+        if object_type is None:
+            other_objects.append(json_object)
+        elif object_type != "Slice" and \
+                json_object['slice'] in objects_by_tenant_uuid:
+            objects_by_tenant_uuid[json_object['slice']].append(json_object)
+    slice_records = [(slice_urn, tenant_uuid, 
+                      [obj['sliver_urn'] for obj in slice_objects[1:]],
+                      json.dumps(slice_objects)) \
+                         for slice_urn, tenant_uuid, slice_objects \
+                         in slice_records]
+    return slice_records, json.dumps(other_objects)
+
+
+if __name__ == "__main__":
+    # Convert a snapshot (with the changes in its journal applied) to
+    # a container snapshot, or a container snapshot back to JSON
+    import optparse
+    import os
+    import sys
+    import time
+    import snapshot_journal
+    import snapshot_store
+
+    parser = optparse.OptionParser( \
+        usage="%prog [options] snapshot [output]")
+    parser.add_option("--json", action="store_true", default=False,
+                      help="write a JSON snapshot rather than a container")
+    parser.add_option("--level", type="int", default=6,
+                      help="zlib compression level of container records")
+    parser.add_option("--benchmark", action="store_true", default=False,
+                      help="time loading the snapshot and one slice of it")
+    options, args = parser.parse_args()
+    if len(args) < 1 or len(args) > 2:
+        parser.print_help()
+        sys.exit(1)
+    snapshot_filename = args[0]
+
+    if options.benchmark:
+        start = time.time()
+        json_data = load_objects(snapshot_filename)
+        print "Loaded %d objects in %.3f sec" % \
+            (len(json_data), time.time() - start)
+        if is_container(snapshot_filename):
+            start = time.time()
+            reader = SnapshotReader(snapshot_filename)
+            slice_urns = reader.getSliceURNs()
+            if len(slice_urns) > 0:
+                objects = reader.getSliceObjects(slice_urns[-1])
+                print "Loaded %d objects of slice %s in %.3f sec" % \
+                    (len(objects), slice_urns[-1], time.time() - start)
+        sys.exit(0)
+
+    # Journal records are idempotent, so the output may share the
+    # journal of the input (by having the same base name)
+    json_data = snapshot_journal.replay(snapshot_filename)
+    if options.json:
+        suffix = snapshot_store.SNAPSHOT_SUFFIX
+        text = json.dumps(json_data)
+    else:
+        suffix = CONTAINER_SUFFIX
+        slice_records, other_text = _recordsFromObjects(json_data)
+        text = encode_snapshot(slice_records, other_text, options.level)
+    if len(args) > 1:
+        output_filename = args[1]
+    else:
+        output_filename = os.path.splitext(snapshot_filename)[0] + suffix
+    if output_filename == snapshot_filename:
+        print "Output would overwrite %s" % snapshot_filename
+        sys.exit(1)
+    file = open(output_filename + '.tmp', 'wb')
+    file.write(text)
+    file.close()
+    os.rename(output_filename + '.tmp', output_filename)
+    print "Wrote %s (%d bytes, %d bytes before conversion)" % \
+        (output_filename, len(text), os.path.getsize(snapshot_filename))
@@ -0,0 +1,416 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Append-only journal of per-slice changes to the aggregate state.
+#
+# A snapshot directory (see snapshot_store.py) holds base snapshots 
+# (<name>.snap or <name>.json, in the forms written by 
+# Archiving.write_state) and next to the most recent one a journal 
+# (<name>.journal) of the changes made since it was written.
+# Each line of a journal is a JSON record:
+#
+#    {"op": "slice", "urn": <slice_urn>, "objects": [<slice>, <sliver>, ...]}
+#         The slice and all its slivers as of the change.  Replaces
+#         any earlier state of the slice.
+#    {"op": "delete_slice", "urn": <slice_urn>}
+#    {"op": "manager", "state": <manager state>, "ssh_proxy": <SSH proxy table>}
+#
+# Persisting a change thus costs the encoding of one slice rather than
+# of the whole aggregate.  Journal writes are flushed immediately but
+# fsync'ed in batches every config.snapshot_journal_fsync_interval seconds.
+# After config.snapshot_journal_compact_records records, a new base
+# snapshot is written in the background and a new journal started.
+#
+# The rename of the new base snapshot into place is the commit point of
+# a compaction: until then the previous base and journal hold every
+# change, afterwards the new base and journal do.
+
+import json
+import os
+import thread
+import threading
+import time
+
+import config
+import snapshot_container
+from Archiving import GramJSONEncoder
+from manage_ssh_proxy import SSHProxyTable
+from snapshot_store import SNAPSHOT_SUFFIX, journal_filename
+
+TEMP_SUFFIX = '.tmp'
+
+# Return the suffix of new base snapshots in config.snapshot_format
+def snapshot_suffix():
+    if config.snapshot_format == 'container':
+        return snapshot_container.CONTAINER_SUFFIX
+    return SNAPSHOT_SUFFIX
+
+
+# Split a list of snapshot objects into the objects of each slice
+# Returns a list of slice URNs (in snapshot order), a dictionary
+# of slice_urn => list of objects of the slice and the
+# GRAM_MANAGER_STATE and SSH_PROXY objects (or None)
+def _group_objects(json_data):
+    slice_urns = []
+    objects_by_slice_urn = {}
+    slice_urn_by_tenant_uuid = {}
+    manager_state = None
+    ssh_proxy = None
+    for json_object in json_data:
+        if json_object.get("__type__") == "Slice":
+            slice_urn = json_object['slice_urn']
+            slice_urn_by_tenant_uuid[json_object['tenant_uuid']] = slice_urn
+            slice_urns.append(slice_urn)
+            objects_by_slice_urn[slice_urn] = [json_object]
+    for json_object in json_data:
+        if "GRAM_MANAGER_STATE" in json_object:
+            manager_state = json_object
+        elif "SSH_PROXY" in json_object:
+            ssh_proxy = json_object
+        elif json_object.get("__type__") not in [None, "Slice"]:
+            slice_urn = slice_urn_by_tenant_uuid.get(json_object['slice'])
+            if slice_urn is not None:
+                objects_by_slice_urn[slice_urn].append(json_object)
+    return slice_urns, objects_by_slice_urn, manager_state, ssh_proxy
+
+
+def replay(snapshot_filename):
+    """
+        Return the list of objects (in the form written by 
+        Archiving.write_state) of the given base snapshot with the 
+        changes in its journal (if any) applied.
+    """
+    json_data = snapshot_container.load_objects(snapshot_filename)
+
+    slice_urns, objects_by_slice_urn, manager_state, ssh_proxy = \
+        _group_objects(json_data)
+
+    filename = journal_filename(snapshot_filename)
+    num_records = 0
+    if os.path.exists(filename):
+        file = open(filename, "r")
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Last record only partly written before a crash
+                config.logger.info("Ignoring incomplete journal record in %s"\
+                                       % filename)
+                break
+            num_records = num_records + 1
+            op = record['op']
+            if op == 'slice':
+                slice_urn = record['urn']
+                if slice_urn not in objects_by_slice_urn:
+                    slice_urns.append(slice_urn)
+                objects_by_slice_urn[slice_urn] = record['objects']
+            elif op == 'delete_slice':
+                slice_urn = record['urn']
+                if slice_urn in objects_by_slice_urn:
+                    slice_urns.remove(slice_urn)
+                    del objects_by_slice_urn[slice_urn]
+            elif op == 'manager':
+                manager_state = {"GRAM_MANAGER_STATE" : record['state']}
+                ssh_proxy = {"SSH_PROXY" : record['ssh_proxy']}
+        file.close()
+    config.logger.info("Replayed %d journal records onto %s" % \
+                           (num_records, snapshot_filename))
+
+    objects = []
+    for slice_urn in slice_urns:
+        objects = objects + objects_by_slice_urn[slice_urn]
+    if manager_state: objects.append(manager_state)
+    if ssh_proxy: objects.append(ssh_proxy)
+    return objects
+
+
+def replay_slice(snapshot_filename, slice_urn=None, sliver_urn=None):
+    """
+        Return the list of objects (the slice and its slivers) of the
+        slice with the given URN, or of the slice holding the sliver with
+        the given URN, as of the last change in the journal.  Returns
+        None if there is no such slice.
+
+        Only the record of that slice is read from a container snapshot.
+    """
+    objects = None
+    if snapshot_container.is_container(snapshot_filename):
+        reader = snapshot_container.SnapshotReader(snapshot_filename)
+        if slice_urn is None:
+            slice_urn = reader.getSliceURNOfSliver(sliver_urn)
+        if slice_urn is not None:
+            objects = reader.getSliceObjects(slice_urn)
+    else:
+        slice_urns, objects_by_slice_urn, manager_state, ssh_proxy = \
+            _group_objects(snapshot_container.load_objects(snapshot_filename))
+        if slice_urn is None:
+            for urn in slice_urns:
+                if sliver_urn in [json_object.get('sliver_urn') \
+                                      for json_object in objects_by_slice_urn[urn]]:
+                    slice_urn = urn
+        if slice_urn is not None:
+            objects = objects_by_slice_urn.get(slice_urn)
+
+    filename = journal_filename(snapshot_filename)
+    if os.path.exists(filename):
+        file = open(filename, "r")
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Last record only partly written before a crash
+                break
+            if record['op'] == 'slice':
+                if record['urn'] == slice_urn or \
+                        (slice_urn is None and sliver_urn in \
+                             [json_object.get('sliver_urn') \
+                                  for json_object in record['objects']]):
+                    slice_urn = record['urn']
+                    objects = record['objects']
+            elif record['op'] == 'delete_slice' and record['urn'] == slice_urn:
+                objects = None
+        file.close()
+    return objects
+
+
+class SnapshotJournal:
+    """
+        Writes the journal of changes to slices and periodically compacts
+        it into a new base snapshot.
+
+        new_filename is a function returning the name of the next
+        base snapshot to write.  Each base snapshot written is added to
+        the given snapshot_store.SnapshotStore (if any).
+    """
+    def __init__(self, new_filename, stitching_handler, snapshot_store=None):
+        self._new_filename = new_filename
+        self._stitching_handler = stitching_handler
+        self._snapshot_store = snapshot_store
+        self._lock = threading.RLock()
+
+        # JSON text of the list of objects of each slice by slice_urn
+        self._slice_texts = {}
+        # (tenant_uuid, sliver urns) of each slice by slice_urn
+        self._slice_index = {}
+        self._manager_text = None
+        self._ssh_proxy_text = None
+
+        self._snapshot_filename = None
+        self._journal_file = None
+        self._num_records = 0 # Records in the current journal
+        self._unsynced = False # Records not yet fsync'ed
+
+        # Records written while a compaction is writing a new base
+        self._compacting = False
+        self._records_during_compaction = None
+
+    def getSnapshotFilename(self): return self._snapshot_filename
+
+    def start(self, json_data):
+        """
+            Write a base snapshot of the given objects (as returned by 
+            replay) and start journaling changes against it.
+        """
+        slice_urns, objects_by_slice_urn, manager_state, ssh_proxy = \
+            _group_objects(json_data)
+        with self._lock:
+            self._slice_texts = {}
+            self._slice_index = {}
+            for slice_urn in slice_urns:
+                objects = objects_by_slice_urn[slice_urn]
+                self._slice_texts[slice_urn] = json.dumps(objects)
+                self._slice_index[slice_urn] = \
+                    (objects[0]['tenant_uuid'], 
+                     [json_object['sliver_urn'] for json_object in objects[1:]])
+            self._manager_text = None
+            if manager_state: 
+                self._manager_text = \
+                    json.dumps(manager_state['GRAM_MANAGER_STATE'])
+            self._ssh_proxy_text = None
+            if ssh_proxy:
+                self._ssh_proxy_text = json.dumps(ssh_proxy['SSH_PROXY'])
+
+            filename = self._new_filename()
+            self._writeFile(filename + TEMP_SUFFIX, self._snapshotText())
+            self._commit(filename, [])
+
+        thread.start_new_thread(self._syncLoop, ())
+
+    def recordSlice(self, slice_object, gram_manager):
+        """
+            Record the current state of a slice and its slivers
+        """
+        objects = [slice_object] + slice_object.getAllSlivers().values()
+        objects_text = GramJSONEncoder(self._stitching_handler).encode(objects)
+        slice_urn = slice_object.getSliceURN()
+        record = '{"op": "slice", "urn": %s, "objects": %s}' % \
+            (json.dumps(slice_urn), objects_text)
+        slice_index = (slice_object.getTenantUUID(),
+                       [sliver.getSliverURN() for sliver in objects[1:]])
+        with self._lock:
+            self._slice_texts[slice_urn] = objects_text
+            self._slice_index[slice_urn] = slice_index
+            self._append(record)
+            self._recordManager(gram_manager)
+
+    def recordSliceDeleted(self, slice_urn, gram_manager):
+        """
+            Record that a slice no longer exists
+        """
+        with self._lock:
+            if slice_urn in self._slice_texts:
+                del self._slice_texts[slice_urn]
+                del self._slice_index[slice_urn]
+                self._append(json.dumps({'op' : 'delete_slice', 
+                                         'urn' : slice_urn}))
+            self._recordManager(gram_manager)
+
+    def recordSlicesDeletedExcept(self, slice_urns, gram_manager):
+        """
+            Record that all slices other than the given ones no longer exist
+        """
+        with self._lock:
+            for slice_urn in self._slice_texts.keys():
+                if slice_urn not in slice_urns:
+                    self.recordSliceDeleted(slice_urn, gram_manager)
+
+    def sync(self):
+        """
+            Force journal records written so far to disk
+        """
+        with self._lock:
+            if self._unsynced and self._journal_file:
+                self._journal_file.flush()
+                os.fsync(self._journal_file.fileno())
+                self._unsynced = False
+
+    def compact(self):
+        """
+            Write a new base snapshot holding the current state
+            and start a new (empty) journal against it.
+        """
+        with self._lock:
+            if self._compacting: return
+            self._compacting = True
+            self._records_during_compaction = []
+            snapshot_text = self._snapshotText()
+            filename = self._new_filename()
+        start_time = time.time()
+        try:
+            self._writeFile(filename + TEMP_SUFFIX, snapshot_text)
+            with self._lock:
+                self._commit(filename, self._records_during_compaction)
+            config.logger.info("Compacted snapshot journal into %s in %.2f sec"\
+                                   % (filename, time.time() - start_time))
+        except Exception, e:
+            config.logger.error("Failed to compact snapshot journal: %s" % e)
+            if os.path.exists(filename + TEMP_SUFFIX):
+                os.unlink(filename + TEMP_SUFFIX)
+        with self._lock:
+            self._compacting = False
+            self._records_during_compaction = None
+
+    # Record GRAM manager state and the SSH proxy table if they changed
+    def _recordManager(self, gram_manager):
+        manager_text = json.dumps(gram_manager.getPersistentState())
+        ssh_proxy_text = json.dumps(SSHProxyTable._get())
+        if manager_text == self._manager_text and \
+                ssh_proxy_text == self._ssh_proxy_text:
+            return
+        self._manager_text = manager_text
+        self._ssh_proxy_text = ssh_proxy_text
+        self._append('{"op": "manager", "state": %s, "ssh_proxy": %s}' % \
+                         (manager_text, ssh_proxy_text))
+
+    # Append a record to the journal.  Called with self._lock held.
+    def _append(self, record):
+        self._journal_file.write(record + '\n')
+        self._journal_file.flush()
+        self._num_records = self._num_records + 1
+        self._unsynced = True
+        if self._compacting:
+            self._records_during_compaction.append(record)
+        elif self._num_records >= config.snapshot_journal_compact_records:
+            thread.start_new_thread(self.compact, ())
+
+    # Contents of a base snapshot of the current state
+    # The slice texts are JSON lists: strip their brackets and join them
+    # into one list, or make each a record of a container snapshot.
+    # Called with self._lock held.
+    def _snapshotText(self):
+        other_parts = []
+        if self._manager_text is not None:
+            other_parts.append('{"GRAM_MANAGER_STATE": %s}' % \
+                                   self._manager_text)
+        if self._ssh_proxy_text is not None:
+            other_parts.append('{"SSH_PROXY": %s}' % self._ssh_proxy_text)
+
+        if config.snapshot_format == 'container':
+            slice_records = []
+            for slice_urn, text in self._slice_texts.items():
+                tenant_uuid, sliver_urns = self._slice_index[slice_urn]
+                slice_records.append((slice_urn, tenant_uuid, sliver_urns,
+                                      text))
+            return snapshot_container.encode_snapshot(slice_records,
+                                  '[' + ', '.join(other_parts) + ']',
+                                  config.snapshot_compression_level)
+
+        parts = [text[1:-1] for text in self._slice_texts.values() \
+                     if text != '[]']
+        return '[' + ', '.join(parts + other_parts) + ']'
+
+    def _writeFile(self, filename, text):
+        file = open(filename, 'wb')
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+
+    # Make filename (written to filename + TEMP_SUFFIX) the current base
+    # snapshot, with a journal holding the given records.
+    # Called with self._lock held.
+    def _commit(self, filename, records):
+        journal_file = open(journal_filename(filename), 'w')
+        for record in records:
+            journal_file.write(record + '\n')
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+        os.rename(filename + TEMP_SUFFIX, filename)
+
+        if self._journal_file:
+            self._journal_file.close()
+        self._journal_file = journal_file
+        self._snapshot_filename = filename
+        self._num_records = len(records)
+        self._unsynced = False
+
+        if self._snapshot_store:
+            self._snapshot_store.addSnapshot(filename)
+
+    def _syncLoop(self):
+        while True:
+            time.sleep(config.snapshot_journal_fsync_interval)
+            try:
+                self.sync()
+            except Exception, e:
+                config.logger.error("Failed to sync snapshot journal: %s" % e)
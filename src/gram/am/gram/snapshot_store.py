@@ -0,0 +1,288 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Directory of base snapshots of the aggregate state.
+#
+# Besides the snapshots (and their journals, see snapshot_journal.py)
+# the directory holds
+#
+#    latest      The name of the most recent snapshot
+#    MANIFEST    JSON {"latest" : <name>,
+#                      "snapshots" : [{"name" : <name>, "time" : <time>,
+#                                      "size" : <bytes>}, ...]}
+#                of the retained snapshots, oldest first
+#
+# both replaced atomically (written to a temporary file and renamed)
+# whenever a snapshot is added.  Readers thus find the newest snapshot
+# by reading one small file instead of listing and stat'ing the
+# directory, and the aggregate manager prunes snapshots (by count, age
+# and total size) from the manifest as it writes new ones.
+#
+# This module depends only on the standard library (and
+# snapshot_container) so that monitoring tools can use it.
+
+import json
+import os
+import threading
+import time
+
+import snapshot_container
+
+SNAPSHOT_SUFFIX = '.json'
+JOURNAL_SUFFIX = '.journal'
+LATEST_FILENAME = 'latest'
+MANIFEST_FILENAME = 'MANIFEST'
+
+
+# Return the name of the journal kept with the given base snapshot
+def journal_filename(snapshot_filename):
+    return os.path.splitext(snapshot_filename)[0] + JOURNAL_SUFFIX
+
+# Is the given file a base snapshot (rather than a journal or temp file)?
+def is_snapshot_file(filename):
+    return filename.endswith(SNAPSHOT_SUFFIX) or \
+        filename.endswith(snapshot_container.CONTAINER_SUFFIX)
+
+
+def find_latest_snapshot(directory):
+    """
+        Return the path of the most recent snapshot in the given
+        directory, or None if there is none.  Uses the latest pointer,
+        falling back to a scan of directories not (yet) managed by a
+        SnapshotStore.
+    """
+    try:
+        file = open(os.path.join(directory, LATEST_FILENAME), 'r')
+        try:
+            name = file.read().strip()
+        finally:
+            file.close()
+        filename = os.path.join(directory, name)
+        if name and os.path.isfile(filename):
+            return filename
+    except IOError:
+        pass
+    snapshots = _scan(directory)
+    if len(snapshots) == 0: return None
+    return os.path.join(directory, snapshots[-1]['name'])
+
+
+# Return manifest entries for all snapshots in the given directory,
+# oldest first
+def _scan(directory):
+    entries = []
+    if not os.path.isdir(directory): return entries
+    for name in os.listdir(directory):
+        filename = os.path.join(directory, name)
+        if is_snapshot_file(name) and os.path.isfile(filename):
+            entries.append({'name' : name, 
+                            'time' : os.path.getmtime(filename),
+                            'size' : _size(filename)})
+    entries.sort(key = lambda entry: entry['time'])
+    return entries
+
+# Size of a snapshot including its journal
+def _size(filename):
+    size = 0
+    for name in [filename, journal_filename(filename)]:
+        if os.path.exists(name):
+            size = size + os.path.getsize(name)
+    return size
+
+
+class SnapshotStore:
+    """
+        Keeps the manifest and latest pointer of a snapshot directory
+        and prunes its snapshots.
+
+        Snapshots beyond the newest max_count, older than max_age seconds
+        or beyond a total of max_size bytes (oldest first) are removed
+        as new snapshots are added.  A limit of 0 or None is no limit.
+        The most recent snapshot is never removed.
+    """
+    def __init__(self, directory, max_count=None, max_age=None, 
+                 max_size=None):
+        self._directory = directory
+        self._max_count = max_count
+        self._max_age = max_age
+        self._max_size = max_size
+        self._lock = threading.RLock()
+        self._entries = [] # Manifest entries, oldest first
+        self._load()
+
+    def getDirectory(self): return self._directory
+
+    def getLatest(self):
+        """
+            Return the path of the most recent snapshot, or None
+        """
+        with self._lock:
+            if len(self._entries) == 0: return None
+            return self._path(self._entries[-1]['name'])
+
+    def getSnapshots(self):
+        """
+            Return the paths of the retained snapshots, oldest first
+        """
+        with self._lock:
+            return [self._path(entry['name']) for entry in self._entries]
+
+    def getTotalSize(self):
+        with self._lock:
+            return sum([entry['size'] for entry in self._entries])
+
+    def addSnapshot(self, filename):
+        """
+            Record the given (completely written) snapshot as the most
+            recent one and prune older snapshots.  Returns the list of
+            snapshots removed.
+        """
+        name = os.path.basename(filename)
+        with self._lock:
+            self._entries = [entry for entry in self._entries \
+                                 if entry['name'] != name]
+            # The journal of the previous snapshot is now complete
+            if len(self._entries) > 0:
+                previous = self._entries[-1]
+                previous['size'] = _size(self._path(previous['name']))
+            self._entries.append({'name' : name, 'time' : time.time(),
+                                  'size' : _size(filename)})
+            removed = self._prune()
+            self._save()
+            return removed
+
+    def prune(self):
+        """
+            Remove snapshots beyond the limits.  Returns the list of 
+            snapshots removed.
+        """
+        with self._lock:
+            removed = self._prune()
+            if len(removed) > 0: self._save()
+            return removed
+
+    # Read the manifest, adding any snapshots written since it was
+    # last saved (or, without a manifest, all snapshots in the directory)
+    def _load(self):
+        manifest = None
+        try:
+            file = open(self._path(MANIFEST_FILENAME), 'r')
+            try:
+                manifest = json.load(file)
+            finally:
+                file.close()
+        except (IOError, ValueError):
+            pass
+
+        if manifest is None:
+            self._entries = _scan(self._directory)
+        else:
+            self._entries = [entry for entry in manifest['snapshots'] \
+                                 if os.path.isfile(self._path(entry['name']))]
+            # Snapshots renamed into place but not yet recorded 
+            # when the process stopped
+            names = set([entry['name'] for entry in self._entries])
+            latest_time = 0
+            if len(self._entries) > 0:
+                latest_time = self._entries[-1]['time']
+            for entry in _scan(self._directory):
+                if entry['name'] not in names and entry['time'] >= latest_time:
+                    self._entries.append(entry)
+        self._save()
+
+    # Remove the oldest snapshots (and their journals) beyond the limits
+    # Called with self._lock held.
+    def _prune(self):
+        now = time.time()
+        total_size = sum([entry['size'] for entry in self._entries])
+        removed = []
+        while len(self._entries) > 1:
+            oldest = self._entries[0]
+            if not ((self._max_count and \
+                         len(self._entries) > self._max_count) or \
+                        (self._max_age and \
+                             now - oldest['time'] > self._max_age) or \
+                        (self._max_size and total_size > self._max_size)):
+                break
+            filename = self._path(oldest['name'])
+            for name in [filename, journal_filename(filename)]:
+                if os.path.exists(name):
+                    os.unlink(name)
+            del self._entries[0]
+            total_size = total_size - oldest['size']
+            removed.append(filename)
+        return removed
+
+    # Write the manifest and latest pointer.
+    # Called with self._lock held.
+    def _save(self):
+        latest = None
+        if len(self._entries) > 0: latest = self._entries[-1]['name']
+        self._writeFile(MANIFEST_FILENAME, 
+                        json.dumps({'latest' : latest, 
+                                    'snapshots' : self._entries}))
+        if latest is not None:
+            self._writeFile(LATEST_FILENAME, latest + '\n')
+        elif os.path.exists(self._path(LATEST_FILENAME)):
+            os.unlink(self._path(LATEST_FILENAME))
+
+    def _writeFile(self, name, text):
+        temp_filename = self._path(name + '.tmp')
+        file = open(temp_filename, 'w')
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+        os.rename(temp_filename, self._path(name))
+
+    def _path(self, name):
+        return os.path.join(self._directory, name)
+
+
+if __name__ == "__main__":
+    # Compare finding the newest of many snapshots by scanning the
+    # directory with reading the latest pointer
+    import shutil
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    try:
+        for i in range(5000):
+            file = open(os.path.join(directory, 'snap_%05d.json' % i), 'w')
+            file.write('[]')
+            file.close()
+        start = time.time()
+        entries = _scan(directory)
+        print "Scan: %s of %d snapshots in %.1f ms" % \
+            (entries[-1]['name'], len(entries), (time.time() - start) * 1000)
+
+        store = SnapshotStore(directory, max_count=10)
+        store.prune()
+        print "Pruned to %d snapshots, %d files left" % \
+            (len(store.getSnapshots()), len(os.listdir(directory)))
+        start = time.time()
+        latest = find_latest_snapshot(directory)
+        print "Pointer: %s in %.1f ms" % \
+            (os.path.basename(latest), (time.time() - start) * 1000)
+    finally:
+        shutil.rmtree(directory)
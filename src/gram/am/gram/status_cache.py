@@ -0,0 +1,173 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+# Cache of the nova status of all VMs.
+#
+# Status and Describe used to run a 'nova show' per VM.  The cache is
+# instead filled by one listing of the instances of all tenants, which
+# is repeated when the listing is older than the TTL.  The listings done
+# by the boot tracker and the VM creations and deletions done by GRAM
+# are pushed into the cache as they happen.
+
+import threading
+import time
+
+import config
+
+
+class ServerStatusCache:
+    """
+        {vm_uuid : nova status} of all VMs.  list_function() returns that
+        dictionary from one call to nova; it may raise an exception.
+    """
+    def __init__(self, list_function, ttl):
+        self._list_function = list_function
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock() # Held while listing
+        self._statuses = {}
+        self._pushed = {} # vm_uuid => time of the push, since last listing
+        self._listing_time = None
+
+        # Metrics
+        self._num_hits = 0
+        self._num_misses = 0
+        self._num_refreshes = 0
+        self._num_refresh_failures = 0
+        self._num_pushes = 0
+
+    def getStatus(self, vm_uuid):
+        """
+            Returns the nova status of the VM, refreshing the cache first
+            if it is older than the TTL.  Returns None if the VM is not
+            in the cache.
+        """
+        with self._lock:
+            fresh = self._isFresh()
+            if fresh: self._num_hits = self._num_hits + 1
+            else: self._num_misses = self._num_misses + 1
+        if not fresh:
+            try:
+                self._refreshIfStale()
+            except Exception, e:
+                config.logger.error("Failed to list VM status: %s" % e)
+        with self._lock:
+            return self._statuses.get(vm_uuid)
+
+    def hasListing(self):
+        """
+            Whether the cache holds a listing of all VMs (so a VM missing
+            from the cache does not exist).
+        """
+        with self._lock:
+            return self._listing_time is not None
+
+    def refresh(self):
+        """
+            List the status of all VMs and replace the cache contents.
+            Returns a copy of the new contents.  Raises an exception if
+            the listing fails.
+        """
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refreshIfStale(self):
+        # Threads that miss at the same time share one listing
+        with self._refresh_lock:
+            with self._lock:
+                if self._isFresh(): return
+            self._refresh()
+
+    def _refresh(self):
+        start = time.time()
+        try:
+            statuses = self._list_function()
+        except:
+            with self._lock:
+                self._num_refresh_failures = self._num_refresh_failures + 1
+            raise
+        with self._lock:
+            # Keep what was pushed while the listing was in progress
+            for vm_uuid, push_time in self._pushed.items():
+                if push_time < start: continue
+                if self._statuses.has_key(vm_uuid):
+                    statuses[vm_uuid] = self._statuses[vm_uuid]
+                elif statuses.has_key(vm_uuid):
+                    del statuses[vm_uuid]
+            self._statuses = statuses
+            self._pushed = {}
+            self._listing_time = start
+            self._num_refreshes = self._num_refreshes + 1
+            return dict(statuses)
+
+    def update(self, vm_uuid, status):
+        """
+            Push the status of a VM (e.g. one that was just created)
+        """
+        with self._lock:
+            self._statuses[vm_uuid] = status
+            self._pushed[vm_uuid] = time.time()
+            self._num_pushes = self._num_pushes + 1
+
+    def remove(self, vm_uuid):
+        """
+            Push the deletion of a VM
+        """
+        with self._lock:
+            if self._statuses.has_key(vm_uuid):
+                del self._statuses[vm_uuid]
+            self._pushed[vm_uuid] = time.time()
+            self._num_pushes = self._num_pushes + 1
+
+    def getMetrics(self):
+        with self._lock:
+            return {'hits' : self._num_hits,
+                    'misses' : self._num_misses,
+                    'refreshes' : self._num_refreshes,
+                    'refresh_failures' : self._num_refresh_failures,
+                    'pushes' : self._num_pushes,
+                    'size' : len(self._statuses)}
+
+    def _isFresh(self):
+        return self._listing_time is not None and \
+            time.time() - self._listing_time < self._ttl
+
+
+if __name__ == "__main__":
+    # Status of 50 VMs in each of 20 slices, looked up 10 times
+    num_listings = [0]
+    def list_statuses():
+        num_listings[0] = num_listings[0] + 1
+        time.sleep(0.05)
+        return dict(('vm-%d' % i, 'ACTIVE') for i in range(1000))
+
+    cache = ServerStatusCache(list_statuses, 2)
+    start = time.time()
+    for lookup in range(10):
+        for i in range(1000):
+            cache.getStatus('vm-%d' % i)
+    cache.update('vm-1000', 'BUILD')
+    print "vm-1000 = %s" % cache.getStatus('vm-1000')
+    print "10000 lookups in %.3f sec with %d listings" % \
+        (time.time() - start, num_listings[0])
+    print "METRICS = %s" % cache.getMetrics()
@@ -29,6 +29,8 @@ import json
 import logging
 import sys
 import resources
+from request_rspec import asParsedRequest, indexStitchingPaths
+import rspec_backend
 from vlan_pool import VLANPool
 
 logger = logging.getLogger('gram.stitching')
@@ -93,7 +95,6 @@ class StitchingEdgePoint:
     # tags from the request
     # Return tag and success (whether successfully allocated)
     def allocateTag(self, request_suggested, request_available, is_v2_allocation):
-        request_suggested_tags = VLANPool.parseVLANs(request_suggested)
         selected = None
 
         # If 'suggested' is any
@@ -104,18 +105,10 @@ class StitchingEdgePoint:
 
 
         # Find a tag that is both available and suggested
-        suggested_and_available_tags = \
-            self._vlans.intersectAvailable(request_suggested_tags)
-        if len(suggested_and_available_tags) > 0:
-            selected = suggested_and_available_tags[0]
+        selected = self._vlans.firstAvailable(request_suggested)
 
         if not selected and not is_v2_allocation:
-            request_available_tags = \
-                VLANPool.parseVLANs(request_available)
-            requested_and_available_tags = \
-                self._vlans.intersectAvailable(request_available_tags)
-            if len(requested_and_available_tags) > 0:
-                selected = requested_and_available_tags[0]
+            selected = self._vlans.firstAvailable(request_available)
 
         if selected:
             self._vlans.allocate(selected)
@@ -205,6 +198,12 @@ class Stitching:
     def isLinkOfEdgePoint(self, link):
         return link in self._edge_points
 
+    # Return the available VLANs of all edge points as a tuple of 
+    # (link, available VLAN mask) pairs
+    def getVLANAvailability(self):
+        return tuple((link, self._edge_points[link]._vlans.getAvailableMask()) \
+                         for link in sorted(self._edge_points.keys()))
+
     def getLastUpdateTime(self):
         return datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
 
@@ -323,9 +322,12 @@ class Stitching:
         return doc
 
     # Allocate VLAN's for stitching links
+    # request_rspec is the request text or a ParsedRequest (which is
+    # not modified)
     # Return success, message, error_code
     def allocate_external_vlan_tags(self, link_sliver_object, request_rspec, is_v2_allocation):
-        if isinstance(request_rspec, basestring): request_rspec = parseString(request_rspec)
+        request_rspec = asParsedRequest(request_rspec)
+        xml = request_rspec.getBackend()
         error_string, error_code, request_details = \
             self.parseRequestRSpec(request_rspec)
         if not request_details:
@@ -333,24 +335,16 @@ class Stitching:
 
         sliver_id = link_sliver_object.getSliverURN()
 
-        request = request_rspec.getElementsByTagName('rspec')[0]
-        stitching_request = request.getElementsByTagName('stitching')[0]
-        stitching_request_paths = stitching_request.getElementsByTagName('path')
-
-#        print "SRP = %s" % stitching_request_paths
-
-        for path in stitching_request_paths:
-#            print "PATH = %s" % path.toxml()
-            path_id = path.attributes['id'].value
-#            print "PATH_ID = %s LINK_ID = %s" % (path_id, link_sliver_object.getName())
-            if path_id != link_sliver_object.getName(): continue
-            stitching_request_hops = path.getElementsByTagName('hop')
+        # The path for this link
+        path = request_rspec.getStitchingPath(link_sliver_object.getName())
+        if path:
+            stitching_request_hops = xml.findAll(path, 'hop')
             for hop in stitching_request_hops:
 #                print "   HOP = %s" % hop.toxml()
-                links = hop.getElementsByTagName('link')
+                links = xml.findAll(hop, 'link')
                 for request_link in links:
 #                    print "      REQUEST_LINK = %s" % request_link.toxml()
-                    link_id = request_link.attributes['id'].value
+                    link_id = xml.get(request_link, 'id')
 
                     # Allocate a VLAN for manifest based on request
                     # and stick in appropriate field of manifest
@@ -364,11 +358,14 @@ class Stitching:
 #		    print "%s" % edge_point
 #                    print link_id
                     if link_id in self._edge_points: # One of my links
+                        # allocateVLAN updates the hop link: leave the
+                        # shared request as it is
                         success, tag = self.allocateVLAN(link_id, 
-                                                         request_link, 
+                                                         xml.clone(request_link), 
                                                          sliver_id, 
                                                          True,
-                                                         is_v2_allocation)
+                                                         is_v2_allocation,
+                                                         xml)
                         if not success:
                             return False, "Failure to allocate VLAN in requested range", constants.VLAN_UNAVAILABLE
                         else:
@@ -384,8 +381,13 @@ class Stitching:
     # in manifest. 
     # If allocate, allocate VLAN's based on suggested, available
     # If not (provision), use the VLAN's
+    # paths_by_id is the index of the stitching paths of the manifest
+    # (see request_rspec.indexStitchingPaths), computed if not given
+    # backend is the RSpec backend of the manifest (the configured one
+    # if not given)
     # Return err_value, error_code
-    def updateManifestForSliver(self, manifest, sliver_object, allocate):
+    def updateManifestForSliver(self, manifest, sliver_object, allocate,
+                                paths_by_id=None, backend=None):
 
        #/ We only update manifests on network links
         if not isinstance(sliver_object, resources.NetworkLink): 
@@ -394,24 +396,24 @@ class Stitching:
         sliver_id = sliver_object.getSliverURN()
         sliver_name = sliver_object.getName()
 
-        stitching_elts = manifest.getElementsByTagName('stitching')
-        if len(stitching_elts) == 0: return None, constants.SUCCESS
-        stitching = stitching_elts[0]
+        if backend is None: backend = rspec_backend.getBackend()
+        if paths_by_id is None:
+            paths_by_id = indexStitchingPaths(manifest, backend)
 
-        for path in stitching.getElementsByTagName('path'):
-            path_id = path.attributes['id'].value
-            # This path must match the link client_id
-            if sliver_name != path_id: continue
+        # The path must match the link client_id
+        path = paths_by_id.get(sliver_name)
+        if path:
             config.logger.info("Correct Path %s %s" % (sliver_id, sliver_name))
-            for hop in path.getElementsByTagName('hop'):
-                for link in hop.getElementsByTagName('link'):
-                    link_id = link.attributes['id'].value
+            for hop in backend.findAll(path, 'hop'):
+                for link in backend.findAll(hop, 'link'):
+                    link_id = backend.get(link, 'id')
                     # One of my links
                     if link_id in self._edge_points:
                         success, tag = self.allocateVLAN(link_id, link, 
                                                          sliver_id,
                                                          allocate, 
-                                                         False)
+                                                         False,
+                                                         backend)
                         if not success:
                             return "Failure to allocate VLAN", \
                                 constants.VLAN_UNAVAILABLE
@@ -425,19 +427,22 @@ class Stitching:
     # If not 'allocate', use the one that is already allocated
     # Return True if successfully allocated, False if failed to allocate
     # As well as the tag_id (or None) allocated
-    def allocateVLAN(self, link_id, hop_link, sliver_id, allocate, is_v2_allocation):
+    # backend is the RSpec backend holding hop_link
+    def allocateVLAN(self, link_id, hop_link, sliver_id, allocate, 
+                     is_v2_allocation, backend=None):
+        if backend is None: backend = rspec_backend.getBackend()
 
         config.logger.info("AllocateVLAN %s %s %s %s %s" % \
-            (link_id, sliver_id, allocate, is_v2_allocation, hop_link.toxml()))
+            (link_id, sliver_id, allocate, is_v2_allocation, 
+             backend.toPrettyXML(hop_link)))
 
-        request_suggested, request_available = self.parseVLANTagInfo(hop_link)
+        request_suggested, request_available = \
+            self.parseVLANTagInfo(hop_link, backend)
         edge_point = self._edge_points[link_id]
         if allocate:
             # Grab a new tag from available list
-            request_available_tags = VLANPool.parseVLANs(request_available)
-            available_intersection_tags = \
-                edge_point._vlans.intersectAvailable(request_available_tags)
-            available = VLANPool.dumpVLANs(available_intersection_tags)
+            available = VLANPool.dumpVLANMask( \
+                edge_point._vlans.intersectAvailableMask(request_available))
             selected_vlan, success = \
                 edge_point.allocateTag(request_suggested, request_available, \
                                            is_v2_allocation)
@@ -449,56 +454,67 @@ class Stitching:
             reservation = self._reservations[sliver_id]
             selected_vlan = reservation['vlan_tag']
             available = selected_vlan
-        self.setVLANTagInfo(hop_link, selected_vlan, available)
+        self.setVLANTagInfo(hop_link, selected_vlan, available, backend)
 
         return True, selected_vlan # Success
 
-    def setVLANTagInfo(self, hop_link, suggested, available):
-        availability_nodes = hop_link.getElementsByTagName('vlanRangeAvailability')
+    def setVLANTagInfo(self, hop_link, suggested, available, backend=None):
+        if backend is None: backend = rspec_backend.getBackend()
+        availability_nodes = backend.findAll(hop_link, 'vlanRangeAvailability')
         availability_node = availability_nodes[0]
-        suggested_nodes = hop_link.getElementsByTagName('suggestedVLANRange')
+        suggested_nodes = backend.findAll(hop_link, 'suggestedVLANRange')
         suggested_node = suggested_nodes[0]
-        suggested_node.childNodes[0].nodeValue = str(suggested)
-        availability_node.childNodes[0].nodeValue = available
+        backend.setText(suggested_node, str(suggested))
+        backend.setText(availability_node, available)
 
-    def parseVLANTagInfo(self, hop_link):
-        availability_nodes = hop_link.getElementsByTagName('vlanRangeAvailability')
+    def parseVLANTagInfo(self, hop_link, backend=None):
+        if backend is None: backend = rspec_backend.getBackend()
+        availability_nodes = backend.findAll(hop_link, 'vlanRangeAvailability')
         availability_node = availability_nodes[0]
-        availability = availability_node.childNodes[0].nodeValue
-        suggested_nodes = hop_link.getElementsByTagName('suggestedVLANRange')
+        availability = backend.getText(availability_node)
+        suggested_nodes = backend.findAll(hop_link, 'suggestedVLANRange')
         suggested_node = suggested_nodes[0]
-        suggested = suggested_node.childNodes[0].nodeValue
+        suggested = backend.getText(suggested_node)
         return suggested, availability
 
     # Is this a stitching rspec, from my perspective?
     # That is, are there multiple component_manager_id's on nodes, one of them me?
+    # request_rspec is the request text or a ParsedRequest
     def isStitchingRSpec(self, request_rspec):
         is_stitching = False
         has_my_cmi = False
         has_another_cmi = False
-        rspec = request_rspec.childNodes[0]
-        for i in range(len(rspec.childNodes)):
-            child = rspec.childNodes[i]
-            if child.nodeType == Node.ELEMENT_NODE:
-                if child.attributes.has_key('component_manager_id'):
-                    cmi = child.attributes['component_manager_id'].value
-                    is_me = cmi == self._aggregate_id
-                    has_my_cmi |= is_me
-                    has_another_cmi |= (not is_me)
+        request_rspec = asParsedRequest(request_rspec)
+        xml = request_rspec.getBackend()
+        for child in xml.children(request_rspec.getRSpecElement()):
+            if xml.has(child, 'component_manager_id'):
+                cmi = xml.get(child, 'component_manager_id')
+                is_me = cmi == self._aggregate_id
+                has_my_cmi |= is_me
+                has_another_cmi |= (not is_me)
 #        print "has_my_cmi %s has_another_cmi %s" % (has_my_cmi, has_another_cmi)
         return has_my_cmi and has_another_cmi
 
     # Find the hop that corresponds to an edge point
-    def findLocalHop(self, stitching, link_id):
+    # paths_by_id is the index of the stitching paths of the request
+    # backend is the RSpec backend holding the request
+    def findLocalHop(self, stitching, link_id, paths_by_id=None, 
+                     backend=None):
+        if backend is None: backend = rspec_backend.getBackend()
         local_hop = None
-        paths = stitching.getElementsByTagName('path')
+        if paths_by_id is None:
+            paths = [path for path in backend.findAll(stitching, 'path') \
+                         if backend.get(path, 'id') == link_id]
+        elif link_id in paths_by_id:
+            paths = [paths_by_id[link_id]]
+        else:
+            paths = []
         for path in paths:
-            if path.attributes['id'].value != link_id: continue
-            hops = path.getElementsByTagName('hop')
+            hops = backend.findAll(path, 'hop')
             for hop in hops:
-                hop_links = hop.getElementsByTagName('link')
+                hop_links = backend.findAll(hop, 'link')
                 for hop_link in hop_links:
-                    hop_link_id = hop_link.attributes['id'].value
+                    hop_link_id = backend.get(hop_link, 'id')
                     if self.isLinkOfEdgePoint(hop_link_id):
                         local_hop = hop
                         break
@@ -526,6 +542,8 @@ class Stitching:
     #                    'my_links', 
     #                    'my_hops_by_path_id'}
     # Return request_details = None if no stitching element in request
+    # request_rspec is the request text or a ParsedRequest; the details
+    # are computed once per ParsedRequest
     #
     def parseRequestRSpec(self, request_rspec):
 
@@ -533,46 +551,48 @@ class Stitching:
         error_code = constants.SUCCESS
         request_details = None
 
-        if isinstance(request_rspec, basestring):
-            request_rspec = parseString(request_rspec)
-        request = request_rspec.getElementsByTagName('rspec')[0]
+        request_rspec = asParsedRequest(request_rspec)
+        if request_rspec.hasStitchingDetails(self._aggregate_id):
+            request_details = \
+                request_rspec.getStitchingDetails(self._aggregate_id)
+            return error_string, error_code, request_details
+        xml = request_rspec.getBackend()
 
-        nodes = request.getElementsByTagName('node')
+        nodes = request_rspec.getNodes()
         
 
 #        print ' parsing stitching rspec'
         # Find nodes that is mine that has an interface in a stitching link
         my_nodes_by_interface = {}
         for node in nodes:
-            node_attributes = node.attributes
-            if not node_attributes.has_key('component_manager_id') :
+            if not xml.has(node, 'component_manager_id') :
                 continue
-            cmid = node.attributes['component_manager_id'].value
+            cmid = xml.get(node, 'component_manager_id')
             if cmid == self._aggregate_id:
-                node_id = node.attributes['client_id'].value
-                interfaces = node.getElementsByTagName('interface')
+                node_id = xml.get(node, 'client_id')
+                interfaces = xml.findAll(node, 'interface')
                 for interface in interfaces:
-                    interface_id= interface.attributes['client_id'].value
+                    interface_id= xml.get(interface, 'client_id')
                     my_nodes_by_interface[interface_id] = node_id
 
         # Find links that contain my CM
-        links = [child for child in request.childNodes if child.nodeName == 'link']
+        links = request_rspec.getLinks()
         my_links = []
         for link in links:
-            cms = link.getElementsByTagName('component_manager')
+            cms = xml.findAll(link, 'component_manager')
             for cm in cms:
-                if cm.attributes['name'].value == self._aggregate_id:
+                if xml.get(cm, 'name') == self._aggregate_id:
                     my_links.append(link)
                     break
 
         # Find hops that are mine ad involved in link-referenced stitching
-        stitching_elts = request.getElementsByTagName('stitching')
-        if len(stitching_elts) > 0:
-            stitching = stitching_elts[0]
+        stitching = request_rspec.getStitching()
+        if stitching:
             my_hops_by_path_id = {}
             for link in my_links:
-                link_id = link.attributes['client_id'].value
-                my_hop = self.findLocalHop(stitching, link_id)
+                link_id = xml.get(link, 'client_id')
+                my_hop = self.findLocalHop(stitching, link_id,
+                                           request_rspec._paths_by_id, xml)
                 my_hops_by_path_id[link_id] = my_hop
 
 #            print "MY NODES and IFS:" + str(my_nodes_by_interface)
@@ -583,6 +603,7 @@ class Stitching:
                                "my_links" : my_links,
                                "my_hops_by_path_id" : my_hops_by_path_id}
 
+        request_rspec.setStitchingDetails(self._aggregate_id, request_details)
         return error_string, error_code, request_details
 
     # Restore stitching state from archive
@@ -608,7 +629,7 @@ if __name__ == '__main__':
     except Exception,  e:
         print "Can't read request file " + request_filename + " " + str(e)
         sys.exit(0)
-    request = parseString(request_raw)
+    request = asParsedRequest(request_raw)
 
     is_stitching = stitching.isStitchingRSpec(request)
     print("IS STITCHING " + str(is_stitching))
@@ -24,10 +24,19 @@
 import threading
 import config
 
+# Range of valid 802.1Q VLAN tags
+MIN_TAG = 1
+MAX_TAG = 4094
+
 # Class to manage a set of VLAN's
 # Letting someone allocate and free one, 
 # Verifying if one is allocated, and getting a list of all allocated ones
 # There should be one of these on each stitching edge point
+#
+# The tags of the pool and the available tags are held as bitmasks 
+# (Python longs with bit N set for tag N).  Allocating, freeing and testing
+# a tag are single bit operations, and intersections with requested ranges 
+# are a bitwise AND of masks rather than per-tag list searches.
 
 class VLANPool:
 
@@ -35,8 +44,10 @@ class VLANPool:
 
     def __init__(self, vlan_spec, name):
         self._lock = threading.RLock()
-        self._all_vlans = VLANPool.parseVLANs(vlan_spec)
-        self._available_vlans = [v for v in self._all_vlans]
+        self._all_mask = VLANPool.parseVLANMask(vlan_spec)
+        if self._all_mask == VLANPool.ANY_TAG: 
+            self._all_mask = VLANPool._rangeMask(MIN_TAG, MAX_TAG)
+        self._available_mask = self._all_mask
         self._temporary_allocations = {} # tag => timestamp
         self._name = name
 
@@ -50,58 +61,121 @@ class VLANPool:
         ranges = (x.split("-") for x in vlan_spec.split(","))
         return [i for r in ranges for i in range(int(r[0]), int(r[-1]) + 1)]
 
+    # Parse a comma-separated set of tags or tag ranges into a bitmask
+    # if 'any' return 'any'
+    @staticmethod
+    def parseVLANMask(vlan_spec):
+        vlan_spec = vlan_spec.strip()
+        if vlan_spec == VLANPool.ANY_TAG:
+            return vlan_spec
+        mask = 0L
+        for r in vlan_spec.split(","):
+            r = r.split("-")
+            mask = mask | VLANPool._rangeMask(int(r[0]), int(r[-1]))
+        return mask
+
     # Turn a sorted list of tags into a string synposis of the tags
     # hyphen-separated between groups, comma-separated between gaps
     @staticmethod
     def dumpVLANs(tags):
-        segments = []
-        if len(tags) == 0: return ""
-        current_start = tags[0]
-        current_end = tags[0]
-        for i in range(len(tags)):
-            if tags[i] <= current_end+1: 
-                # Continue current segment
-                current_end = tags[i]
-            else:
-                # end current segment, start new one
-                segments.append((current_start, current_end))
-                current_start = tags[i]
-                current_end = tags[i]
-        segments.append((current_start, current_end))
-            
-        return ",".join("%d-%d" % (seg[0], seg[1]) for seg in segments)
+        return VLANPool.dumpVLANMask(VLANPool._tagsToMask(tags))
+
+    # Turn a bitmask of tags into a string synposis of the tags
+    # hyphen-separated between groups, comma-separated between gaps
+    @staticmethod
+    def dumpVLANMask(mask):
+        # Segments start at set bits whose lower neighbor is clear and
+        # end at set bits whose upper neighbor is clear
+        starts = VLANPool._maskToTags(mask & ~(mask << 1))
+        ends = VLANPool._maskToTags(mask & ~(mask >> 1))
+        return ",".join("%d-%d" % (start, end) \
+                            for start, end in zip(starts, ends))
+
+    # Bitmask of the tags from start to end inclusive
+    @staticmethod
+    def _rangeMask(start, end):
+        if end < start: return 0L
+        return ((1L << (end - start + 1)) - 1) << start
 
+    # Bitmask of a list of tags (or of all tags if 'any')
+    @staticmethod
+    def _tagsToMask(tags):
+        if tags == VLANPool.ANY_TAG:
+            return VLANPool._rangeMask(MIN_TAG, MAX_TAG)
+        mask = 0L
+        for tag in tags: mask = mask | (1L << tag)
+        return mask
 
+    # Sorted list of tags in a bitmask
+    @staticmethod
+    def _maskToTags(mask):
+        bits = bin(mask)[:1:-1] # Least significant bit first
+        tags = []
+        tag = bits.find('1')
+        while tag >= 0:
+            tags.append(tag)
+            tag = bits.find('1', tag + 1)
+        return tags
+
+    # Is the given tag a valid tag in the given mask?
+    @staticmethod
+    def _inMask(tag, mask):
+        if not isinstance(tag, (int, long)) or tag < 0: return False
+        return (mask >> tag) & 1 == 1
 
     # Produce list of tags intersecting the available vlans with given set
     # if given set is ANY, return available list. Otherwise compute intersection
     def intersectAvailable(self, tags):
         if tags == VLANPool.ANY_TAG:
-            return self._available_vlans
-        intersection = [tag for tag in tags if tag in self._available_vlans]
-        return intersection
+            return self.getAvailableVLANs()
+        return VLANPool._maskToTags(self._available_mask & \
+                                        VLANPool._tagsToMask(tags))
+
+    # Return bitmask of the available tags in the given comma-separated
+    # set of tags or tag ranges (or all available if 'any')
+    def intersectAvailableMask(self, vlan_spec):
+        mask = VLANPool.parseVLANMask(vlan_spec)
+        if mask == VLANPool.ANY_TAG:
+            return self._available_mask
+        return self._available_mask & mask
+
+    # Return the lowest available tag in the given comma-separated
+    # set of tags or tag ranges (or None if there isn't one)
+    def firstAvailable(self, vlan_spec):
+        mask = self.intersectAvailableMask(vlan_spec)
+        if mask == 0: return None
+        return (mask & -mask).bit_length() - 1
 
     def __str__(self): return self.dumpAvailableVLANs()
 
     # Return available VLAN's as a comma-separated string of sequences
     def dumpAvailableVLANs(self):
-        return VLANPool.dumpVLANs(self._available_vlans)
+        return VLANPool.dumpVLANMask(self._available_mask)
 
     # Return list of all VLAN tags for this pool (allocated and not)
     def getAllVLANs(self):
-        return self._all_vlans
+        return VLANPool._maskToTags(self._all_mask)
 
     # Return list of all available VLAN tags
     def getAvailableVLANs(self):
-        return self._available_vlans
+        return VLANPool._maskToTags(self._available_mask)
+
+    # Return bitmask of all available VLAN tags
+    def getAvailableMask(self):
+        return self._available_mask
+
+    # Return whether a given tag belongs to this pool (allocated or not)
+    def isInPool(self, tag):
+        return VLANPool._inMask(tag, self._all_mask)
 
     # Return whether a given tag belongs to this pool but is allocated
     def isAllocated(self, tag):
-        return tag in self._all_vlans and tag not in self._available_vlans
+        return VLANPool._inMask(tag, self._all_mask) and \
+            not VLANPool._inMask(tag, self._available_mask)
 
     # Return whether a given tag is available
     def isAvailable(self, tag):
-        return tag in self._available_vlans
+        return VLANPool._inMask(tag, self._available_mask)
 
     # Allocate a VLAN tag.
     # If the tag is specified, allocate it if available otherwise fail
@@ -109,18 +183,17 @@ class VLANPool:
     # Return boolean indicating success
     def allocate(self, tag):
         with self._lock:  # Thread-safe concurrent access to pool
-            # If tag not specified, pick the first from the list
+            # If tag not specified, pick the lowest available
             if not tag:
-                if len(self._available_vlans) > 0:
-                    tag = self._available_vlans[0]
+                if self._available_mask != 0:
+                    tag = (self._available_mask & -self._available_mask).bit_length() - 1
                 else:
                     return False, None
 
-            if tag not in self._all_vlans: return False, None
-
-            if tag not in self._available_vlans: return False, None
+            if not VLANPool._inMask(tag, self._available_mask): 
+                return False, None
             
-            self._available_vlans.remove(tag)
+            self._available_mask = self._available_mask & ~(1L << tag)
 
             config.logger.info( "Allocated %d from VLAN pool %s" % \
                                     (tag, self._name))
@@ -131,10 +204,8 @@ class VLANPool:
     # Return boolean indicating success
     def free(self, tag):
         with self._lock: # Thread-safe concurrent access to pool
-            if tag not in self._all_vlans: return False
-            if tag in self._available_vlans: return False
-            self._available_vlans.append(tag)
-            self._available_vlans.sort()
+            if not self.isAllocated(tag): return False
+            self._available_mask = self._available_mask | (1L << tag)
             config.logger.info("Freed %d to VLAN pool %s" % (tag, self._name))
             return True
 
@@ -182,6 +253,44 @@ if __name__ == "__main__":
 
     tags = pool.intersectAvailable(VLANPool.ANY_TAG)
     print "TAGS = %s" % tags
-    
-    
 
+    # Benchmark: allocate and free the whole 1-4094 tag space
+    import logging
+    import time
+    config.logger.setLevel(logging.WARNING)
+    pool = VLANPool('1-4094', 'BENCH')
+    start = time.time()
+    for i in range(MIN_TAG, MAX_TAG + 1):
+        success, tag = pool.allocate(None)
+    allocate_time = time.time() - start
+    start = time.time()
+    for tag in range(MAX_TAG, MIN_TAG - 1, -1):
+        pool.free(tag)
+    free_time = time.time() - start
+    print "Allocate %d tags: %.4f sec, free %d tags: %.4f sec" % \
+        (MAX_TAG, allocate_time, MAX_TAG, free_time)
+
+    # The same with the previous list-based pool
+    start = time.time()
+    available = range(MIN_TAG, MAX_TAG + 1)
+    for i in range(MIN_TAG, MAX_TAG + 1):
+        tag = available[0]
+        if tag in available: available.remove(tag)
+    for tag in range(MAX_TAG, MIN_TAG - 1, -1):
+        if tag not in available:
+            available.append(tag)
+            available.sort()
+    print "List-based allocate and free of %d tags: %.4f sec" % \
+        (MAX_TAG, time.time() - start)
+
+    for i in range(0, MAX_TAG, 2): pool.allocate(i + 1)
+    start = time.time()
+    for i in range(1000):
+        tag = pool.firstAvailable('1000-2000,3000-3100')
+        dump = VLANPool.dumpVLANMask(pool.intersectAvailableMask('1000-1100'))
+    print "1000 intersections: %.4f sec" % (time.time() - start)
+    start = time.time()
+    for i in range(1000):
+        dump = pool.dumpAvailableVLANs()
+    print "1000 dumps of %d available ranges: %.4f sec" % \
+        (len(pool.getAvailableVLANs()), time.time() - start)
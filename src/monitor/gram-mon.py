@@ -23,16 +23,17 @@
 
 from gram.am.gram import open_stack_interface
 from gram.am.gram import Archiving
+from gram.am.gram import snapshot_journal
+from gram.am.gram import snapshot_store
+from gram.am.gram import slice_registry
 from gram.am.gram import config
 from gram.am.gram import stitching
 import sys
 import getopt
 import gmoc
-import os
 import getpass
 import time
 import uuid
-import re
 
 # all these variables should be in config.json  +++++
 # submission staging server
@@ -60,6 +61,7 @@ def usage():
   print '\tgram-mon.py -i <ipaddress>'
   print '\tgram-mon.py -m <macaddr>'
   print '\tgram-mon.py -v <vlantag>'
+  print '\tgram-mon.py -u <sliver urn>'
 
 def printDiagInfo(curSlice, curSliver):
   print "\tSlice URN : " + curSlice.getSliceURN()
@@ -76,7 +78,7 @@ def printDiagInfo(curSlice, curSliver):
 def monitor(parms):
 
  try:
-   opts, args = getopt.getopt(parms,"hdv:m:i:", ["vlan=", "mac=", "ip="])
+   opts, args = getopt.getopt(parms,"hdv:m:i:u:", ["vlan=", "mac=", "ip=", "urn="])
 
  except getopt.GetoptError:
    print "gram_mon.py: Error parsing args"
@@ -86,6 +88,7 @@ def monitor(parms):
  sip = None
  smac = None
  svlan = None
+ surn = None
 
  for opt, arg in opts:
 #   print opt, arg
@@ -101,6 +104,9 @@ def monitor(parms):
    elif opt in ("-v", "--vlan"):
      svlan = arg
      print "Searching for Slice Information for vlan " + svlan
+   elif opt in ("-u", "--urn"):
+     surn = arg
+     print "Searching for Slice Information for sliver " + surn
 
 
  config.initialize("/etc/gram/config.json")
@@ -128,23 +134,50 @@ def monitor(parms):
 
  snapshot_dir = config.gram_snapshot_directory + "/" + getpass.getuser()
 
- allF = []
- files = os.listdir(snapshot_dir)
- for f in files:
-  filename = os.path.join(snapshot_dir, f)
-  if(os.path.isfile(filename)):
-#    print filename
-    allF.append(filename)
-
- if allF:
-  nfiles = sorted(allF, key=os.path.getctime)
-  oldest = nfiles[0]
-  newest = nfiles[-1]
-
+ newest = snapshot_store.find_latest_snapshot(snapshot_dir)
+ if newest:
   print "Latest snapshot file: " + newest + "\n"
-  myslices = Archiving.read_state(newest, None, stitching_handler)
+
+  # Only the objects of the slice holding the sliver need be read
+  # (and decoded) to look up a sliver by URN
+  if surn is not None:
+    slice_objects = snapshot_journal.replay_slice(newest, sliver_urn=surn)
+    if slice_objects:
+      slices = Archiving.restore_objects(slice_objects, None, stitching_handler)
+      for slice in slices.values():
+        slivers = slice.getAllSlivers()
+        if surn in slivers:
+          print "Diagnostic Information for sliver = " + surn + ":"
+          printDiagInfo(slice, slivers[surn])
+    return
+
+  myslices = Archiving.restore_objects(snapshot_journal.replay(newest), None, stitching_handler)
   sliver = {}
 
+  # Look up the sliver with the given address or tag in the indexes
+  # of a registry of the restored slices
+  if sip is not None or smac is not None or svlan is not None:
+    registry = slice_registry.SliceRegistry()
+    for slice in myslices.values():
+      registry.addSlice(slice)
+    if sip is not None:
+      label = "ip = " + sip
+      matches = registry.getSliversByIP(sip)
+    elif smac is not None:
+      label = "mac = " + smac
+      matches = registry.getSliversByMAC(smac)
+    else:
+      label = "vlan = " + svlan
+      matches = []
+      if svlan.isdigit():
+        matches = registry.getSliversByVLAN(int(svlan))
+    if matches:
+      v = matches[0]
+      print "Diagnostic Information for " + label + ":"
+      printDiagInfo(registry.getSliceOfSliver(v.getSliverURN()), v)
+      found = True
+      return
+
   for i, slice in myslices.iteritems():
    slice_obj = gmoc.Slice(str(slice.getSliceURN()))
    #print "Slice:  "+ str(slice.getSliceURN())
@@ -177,16 +210,6 @@ def monitor(parms):
       #why is ExternalIp not set - have to ask Stephen RRH
       #if v.getExternalIp() is not None:
       #  print "IP " + v.getExternalIp()
-      #  if sip == str(v.getExternalIp()):
-      if sip is not None:
-        match = re.search(sip, str(v))
-        if match:
-          #print "FOUND IP " + match.group()
-          print "Diagnostic Information for ip = " + sip + ":"
-          printDiagInfo(slice, v)
-          found = True
-          sliver[v.getSliverURN()].extIP = match.group()
-          return
 
 
       #else:
@@ -201,12 +224,6 @@ def monitor(parms):
       #print "Link"
       if v.getVLANTag() is not None:
         #print "vlan " + str(v.getVLANTag())
-        if svlan == str(v.getVLANTag()):
-          print "Diagnostic Information for vlan = " + svlan + ":"
-          printDiagInfo(slice, v)
-          found = True
-          return
-
         sliver[v.getSliverURN()].vlan = str(v.getVLANTag())
       #else:
       #  print "No VLAN Tag"
@@ -215,21 +232,9 @@ def monitor(parms):
     elif isinstance(v, Archiving.NetworkInterface):
       #print "NIC"
       #print "mac " + v.getMACAddress()
-      if smac == str(v.getMACAddress()):
-        print "Diagnostic Information for mac = " + smac + ":"
-        printDiagInfo(slice, v)
-        found = True
-        return
-
       sliver[v.getSliverURN()].mac = str(v.getMACAddress())
       if v.getVLANTag() is not None:
         #print "vlan " + str(v.getVLANTag())
-        if svlan == str(v.getVLANTag()):
-          print "Diagnostic Information for vlan = " + svlan + ":"
-          printDiagInfo(slice, v)
-          found = True
-          return
-
         sliver[v.getSliverURN()].vlan = str(v.getVLANTag())
       #else:
       #  print "No VLAN Tag"
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+
+#----------------------------------------------------------------------
+# Copyright (c) 2013-2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+
+
+# Framing of the persistent channel between a VMOC client (e.g. GRAM)
+# and the VMOC management interface.
+#
+# A client opens the channel by sending the greeting line 
+#    channel <protocol version>\n
+# instead of a single command (ping, dump, register, ...).  From then on
+# both sides exchange frames
+#    <length>\n<JSON message of length bytes>
+#
+# Client -> VMOC
+#    {"op" : "hello", "client" : <client id>}
+#    {"op" : "batch", "version" : <version>, "clear" : <bool>,
+#     "changes" : [{"op" : "register" | "unregister", 
+#                   "config" : <slice configuration>}, ...]}
+# VMOC -> client
+#    {"op" : "hello", "pid" : <VMOC pid>, "version" : <version or null>}
+#    {"op" : "ack", "version" : <version>, "results" : [<response>, ...]}
+#
+# Every change made by a client is numbered by a version of its registry
+# of slice configurations.  A batch carries the version of its last 
+# change and is acknowledged with it.  In answer to a hello, VMOC gives the 
+# last version it applied for that client id (null if none, e.g. after 
+# VMOC restarted), so that on reconnection a client resends only the 
+# changes VMOC has not yet applied.  A batch with "clear" set first
+# removes all slices registered by any client.
+
+import json
+
+PROTOCOL_VERSION = 1
+GREETING = 'channel'
+
+
+def greeting():
+    return '%s %d\n' % (GREETING, PROTOCOL_VERSION)
+
+# Does the given data received on a new connection open a channel?
+def is_greeting(data):
+    return data.startswith(GREETING + ' ')
+
+def send_frame(sock, message):
+    payload = json.dumps(message)
+    sock.sendall('%d\n%s' % (len(payload), payload))
+
+
+class FrameReader:
+    """
+        Reads the greeting and frames of a channel from a socket, 
+        starting with any data already received from it.
+    """
+    def __init__(self, sock, data=''):
+        self._sock = sock
+        self._buffer = data
+
+    def readGreeting(self):
+        """
+            Return the protocol version of the greeting line, or None if
+            the connection was closed
+        """
+        line = self._readLine()
+        if line is None: return None
+        return int(line.split()[1])
+
+    def read(self):
+        """
+            Return the next message, or None if the connection was closed
+        """
+        length = self._readLine()
+        if length is None: return None
+        length = int(length)
+        while len(self._buffer) < length:
+            if not self._receive(): return None
+        payload = self._buffer[:length]
+        self._buffer = self._buffer[length:]
+        return json.loads(payload)
+
+    def _readLine(self):
+        while '\n' not in self._buffer:
+            if not self._receive(): return None
+        line, self._buffer = self._buffer.split('\n', 1)
+        return line
+
+    def _receive(self):
+        data = self._sock.recv(65536)
+        if not data: return False
+        self._buffer = self._buffer + data
+        return True
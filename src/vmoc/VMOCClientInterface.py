@@ -23,43 +23,62 @@
 # IN THE WORK.
 #----------------------------------------------------------------------
 
-# Thread from a VMOC client (e.g. GRAM) to queue up requests
-# For the VMOC managnement interface and send them
-# When VMOC is available
-# When VMOC goes down and comes back up, re-send all current requests
 
-import json
+# Thread from a VMOC client (e.g. GRAM) to send requests to the 
+# VMOC management interface over a persistent channel (see VMOCChannel.py)
+# Changes are queued, coalesced by slice and sent in batches as soon as
+# they are made, without waiting for earlier batches to be acknowledged.
+# When VMOC goes down and comes back up (or the channel is reset), 
+# re-send only the changes VMOC has not acknowledged (all current
+# slice configurations if VMOC has restarted)
+
 import logging
 import pdb
 import socket
+import thread
 import threading
 import time
+import uuid
 import gram.am.gram.config as config
 from VMOCConfig import VMOCSliceConfiguration, VMOCVLANConfiguration
+import VMOCChannel
 
 class VMOCClientInterface(threading.Thread):
 
-    # Lock on the queue of pending requests (class variable)
-    _lock = threading.RLock() 
-
-    # Queue of messages to send to VMOC Mgt I/F (class variable)
-    # Stored as {'slice_id':slice_id,'msg':msg}
-    _pending_queue = [] 
+    # Lock on the registry and pending changes (class variable)
+    _lock = threading.Condition(threading.RLock())
 
     # Per-slice current configuration (class variable)
     _configs_by_slice = {} 
 
+    # Changes not yet acknowledged by VMOC (class variable)
+    # Stored as {slice_id : (version, register, slice_config)}
+    # Only the latest change to each slice is kept
+    _changes_by_slice = {}
+
+    # Version of the registry of slice configurations: incremented
+    # by every change
+    _version = 0
+
+    # Latest version sent to and acknowledged by VMOC
+    _sent_version = 0
+    _acked_version = 0
+
+    # Should the next batch clear VMOC and send all configurations?
+    _full_sync = True
+
+    # Identifies this client (process) to VMOC
+    _client_id = uuid.uuid4().hex
+
     # Singleton instance of interface
     _instance = None
 
-    # How often to try to reconnect to VMOC?
-    _ping_interval = 5
-
     # What is the PID of the VMOC process we've been talking to?
     _vmoc_pid = None
 
-    # Has the VMOC restarted since last check (the PID is different)
-    _vmoc_restarted = False
+    # Counters reported by getMetrics
+    _metrics = {'batches' : 0, 'changes' : 0, 'connections' : 0,
+                'full_syncs' : 0, 'last_ack_latency' : None}
 
     def __init__(self):
 
@@ -74,90 +93,149 @@ class VMOCClientInterface(threading.Thread):
 
 
     # Thread loop
-    # Maintain a socket connection
-    # Every second, try to ping. 
-    # If you fail, try to reconnect
-    # And send every message out afresh when you reconnect
-    # If connection is open, send all pending messages
+    # Maintain a channel to VMOC, reconnecting every 
+    # config.vmoc_retry_interval seconds when it is down
     def run(self):
 
-      self._running = True
-
-      while self._running:
-
-          latest_vmoc_pid = None
-
-#          config.logger.info("VMOC_IS_UP : "+ str(self._vmoc_is_up));
-
-          # Is VMOC down? If so, flush queue and fill with all configs
-          try:
-              sock = self.connectToVMOC()
-#              config.logger.info("SOCK = " + str(sock));
-              if sock:
-                  sock.send('ping')
-                  latest_vmoc_pid = sock.recv(1024)
-#                  config.logger.info("VMOC_PID /" + latest_vmoc_pid + "/ " + str(len(latest_vmoc_pid)))
-                  if latest_vmoc_pid != self._vmoc_pid:
-                      config.logger.info("VMOC_PID changed from %s to %s" % \
-                                             (self._vmoc_pid, latest_vmoc_pid))
-                      self._vmoc_restarted = True
-                      self._vmoc_pid = latest_vmoc_pid
-                  sock.close()
-#                  config.logger.info("After close");
-                  self._vmoc_is_up =  True
-              else:
-                  if self._vmoc_is_up:
-                      config.logger.info("VMOC went down ")
-                      self._vmoc_is_up = False
-
-          except Exception as e:
-              config.logger.info("Exception (1) : " + str(e))
-              if self._vmoc_is_up:
-                  config.logger.info("VMOC went down " + str(e))
-                  self._vmoc_is_up  = False
-
-#          config.logger.info("UP = " + str(self._vmoc_is_up))
-#          config.logger.info("RESTARTED = " + str(self._vmoc_restarted))
-
-                  
-          # Connection is down or recently reset. 
-          # Put all configs into queue
-          if not self._vmoc_is_up or self._vmoc_restarted:
-              with VMOCClientInterface._lock:
-                  slice_configs = \
-                      VMOCClientInterface._configs_by_slice.values()
-                  VMOCClientInterface._pending_queue = []
-#                  config.logger.info("Disconnected from VMOC: " + 
-#                                     "restoring slice configs")
-                  for slice_config in slice_configs:
-                      VMOCClientInterface.register(slice_config)
-                  self._vmoc_restarted = False
-
-
-
-  # If connected, try to send all messages
-  # If we fail sending any message, connection is closed
-          with VMOCClientInterface._lock:
-              while len(VMOCClientInterface._pending_queue) > 0 and self._vmoc_is_up:
-                  entry = VMOCClientInterface._pending_queue[0]
-                  msg = entry['msg']
-                  try:
-                      sock = self.connectToVMOC()
-#                      print " Trying to send " + str(entry)
-                      if sock:
-                          sock.send(msg)
-                          sock.close()
-                          VMOCClientInterface._pending_queue = \
-                              VMOCClientInterface._pending_queue[1:]
-                          config.logger.info("Sent to VMOC: " + msg)
-                      else:
-                          self._vmoc_is_up = False
-                  except Exception as e:
-#                      print "Exception (2) "  + str(e)
-                      self._vmoc_is_up = False
-
-          # Wake up every N seconds
-          time.sleep(VMOCClientInterface._ping_interval)
+        self._running = True
+
+        while self._running:
+            sock = self.connectToVMOC()
+            if not sock:
+                retry_time = time.time() + config.vmoc_retry_interval
+                with VMOCClientInterface._lock:
+                    while self._running and time.time() < retry_time:
+                        VMOCClientInterface._lock.wait(retry_time - \
+                                                           time.time())
+                continue
+
+            try:
+                self.serveChannel(sock)
+            except Exception as e:
+                config.logger.info("VMOC channel closed: " + str(e))
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+            sock.close()
+            if self._vmoc_is_up:
+                config.logger.info("VMOC went down ")
+                self._vmoc_is_up = False
+
+    # Exchange the hello with VMOC, then send batches of changes as they
+    # are made while a reader thread receives the acknowledgements
+    def serveChannel(self, sock):
+        sock.sendall(VMOCChannel.greeting())
+        VMOCChannel.send_frame(sock, {'op' : 'hello', 
+                                      'client' : VMOCClientInterface._client_id})
+        reader = VMOCChannel.FrameReader(sock)
+        hello = reader.read()
+        if hello is None: return
+
+        # State of this connection shared with the reader thread
+        channel = {'closed' : False, 'sent_times' : {}}
+
+        with VMOCClientInterface._lock:
+            vmoc_pid = str(hello['pid'])
+            if vmoc_pid != VMOCClientInterface._vmoc_pid:
+                config.logger.info("VMOC_PID changed from %s to %s" % \
+                                       (VMOCClientInterface._vmoc_pid, 
+                                        vmoc_pid))
+                VMOCClientInterface._vmoc_pid = vmoc_pid
+            if hello['version'] is None:
+                # VMOC knows nothing of this client: start afresh
+                VMOCClientInterface._full_sync = True
+            else:
+                VMOCClientInterface.acknowledge(hello['version'])
+            VMOCClientInterface._sent_version = \
+                VMOCClientInterface._acked_version
+            VMOCClientInterface._metrics['connections'] += 1
+            self._vmoc_is_up = True
+
+        thread.start_new_thread(self.readAcknowledgements, (reader, channel))
+
+        while True:
+            with VMOCClientInterface._lock:
+                while self._running and not channel['closed'] and \
+                        not self.hasBatch(len(channel['sent_times'])):
+                    VMOCClientInterface._lock.wait()
+                if not self._running or channel['closed']: return
+                batch = VMOCClientInterface.nextBatch()
+                channel['sent_times'][batch['version']] = time.time()
+            VMOCChannel.send_frame(sock, batch)
+            config.logger.info("Sent to VMOC: %d changes (version %d)" % \
+                                   (len(batch['changes']), batch['version']))
+
+    # Receive acknowledgements until the channel is closed
+    def readAcknowledgements(self, reader, channel):
+        try:
+            while True:
+                message = reader.read()
+                if message is None: break
+                if message['op'] != 'ack': continue
+                with VMOCClientInterface._lock:
+                    version = message['version']
+                    sent_time = channel['sent_times'].pop(version, None)
+                    if sent_time is not None:
+                        VMOCClientInterface._metrics['last_ack_latency'] = \
+                            time.time() - sent_time
+                    VMOCClientInterface.acknowledge(version)
+                    VMOCClientInterface._lock.notifyAll()
+                for result in message['results']:
+                    config.logger.info("VMOC: " + result)
+        except Exception as e:
+            config.logger.info("Exception reading from VMOC: " + str(e))
+        with VMOCClientInterface._lock:
+            channel['closed'] = True
+            VMOCClientInterface._lock.notifyAll()
+
+    # Is there a batch to send with the given number of batches
+    # awaiting acknowledgement?  Called with the lock held.
+    def hasBatch(self, num_unacked):
+        if num_unacked >= config.vmoc_max_unacked_batches: return False
+        return VMOCClientInterface._full_sync or \
+            VMOCClientInterface._sent_version < VMOCClientInterface._version
+
+    # Return the next batch of changes to send and mark them sent
+    # Called with the lock held.
+    @staticmethod
+    def nextBatch():
+        if VMOCClientInterface._full_sync:
+            changes = [{'op' : 'register', 'config' : slice_config.__attr__()}\
+                           for slice_config in \
+                           VMOCClientInterface._configs_by_slice.values()]
+            version = VMOCClientInterface._version
+            VMOCClientInterface._full_sync = False
+            VMOCClientInterface._metrics['full_syncs'] += 1
+            clear = True
+        else:
+            entries = [entry for entry in \
+                           VMOCClientInterface._changes_by_slice.values() \
+                           if entry[0] > VMOCClientInterface._sent_version]
+            entries.sort(key = lambda entry: entry[0])
+            entries = entries[:config.vmoc_max_batch_size]
+            changes = []
+            for entry_version, register, slice_config in entries:
+                op = 'unregister'
+                if register: op = 'register'
+                changes.append({'op' : op, 'config' : slice_config.__attr__()})
+            version = entries[-1][0]
+            clear = False
+        VMOCClientInterface._sent_version = version
+        VMOCClientInterface._metrics['batches'] += 1
+        VMOCClientInterface._metrics['changes'] += len(changes)
+        return {'op' : 'batch', 'version' : version, 'clear' : clear,
+                'changes' : changes}
+
+    # VMOC has applied all changes up to the given version
+    # Called with the lock held.
+    @staticmethod
+    def acknowledge(version):
+        if version <= VMOCClientInterface._acked_version: return
+        VMOCClientInterface._acked_version = version
+        for slice_id, entry in VMOCClientInterface._changes_by_slice.items():
+            if entry[0] <= version:
+                del VMOCClientInterface._changes_by_slice[slice_id]
 
     # Establish a connection to VMOC Management interface
     def connectToVMOC(self):
@@ -165,6 +243,8 @@ class VMOCClientInterface(threading.Thread):
         addr = (self._vmoc_host, config.vmoc_interface_port)
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             sock.connect(addr)
         except Exception as e:
             sock = None
@@ -179,61 +259,67 @@ class VMOCClientInterface(threading.Thread):
     # Shutdown thread for VMOC Client I/F
     @staticmethod
     def shutdown():
-        VMOCClientInterface._instance._running = False
+        with VMOCClientInterface._lock:
+            VMOCClientInterface._instance._running = False
+            VMOCClientInterface._lock.notifyAll()
         VMOCClientInterface._instance.join()
 
+    # Record a change to the registry of slice configurations
+    # Called with the lock held.
     @staticmethod
-    def create_queue_entry(slice_id, slice_config, register):
-        if not slice_config:
-#            print "SLICE_ID = " + str(slice_id)
-#            print "CONFIGS_BY_SLICE = " + str(VMOCClientInterface._instance._configs_by_slice)
-            slice_config = VMOCClientInterface._instance._configs_by_slice[slice_id];
-        if slice_config: slice_id = slice_config.getSliceID()
-        if register:
-            msg = 'register %s' % json.dumps(slice_config.__attr__())
-        else:
-#            msg = 'unregister %s' % slice_id
-            msg = 'unregister %s' % json.dumps(slice_config.__attr__())
-        entry = {'slice_id': slice_id, 'msg':msg}
-        return entry
+    def recordChange(slice_config, register):
+        VMOCClientInterface._version = VMOCClientInterface._version + 1
+        slice_id = slice_config.getSliceID()
+        VMOCClientInterface._changes_by_slice[slice_id] = \
+            (VMOCClientInterface._version, register, slice_config)
+        VMOCClientInterface._lock.notifyAll()
 
     @staticmethod
     def register(slice_config):
         with VMOCClientInterface._lock:
             slice_id = slice_config.getSliceID()
-            queue_entry = \
-                VMOCClientInterface.create_queue_entry(slice_id, \
-                                                           slice_config, True)
-            VMOCClientInterface._pending_queue.append(queue_entry)
             VMOCClientInterface._configs_by_slice[slice_id] = slice_config
+            VMOCClientInterface.recordChange(slice_config, True)
 #        VMOCClientInterface.dumpQueue()
 
     @staticmethod
     def unregister(slice_config):
         with VMOCClientInterface._lock:
             slice_id = slice_config.getSliceID()
-            VMOCClientInterface._pending_queue = \
-                [msg for msg in VMOCClientInterface._pending_queue if msg['slice_id'] != slice_id]
-            queue_entry = \
-                VMOCClientInterface.create_queue_entry(slice_id, slice_config, False)
-            VMOCClientInterface._pending_queue.append(queue_entry)
             if VMOCClientInterface._configs_by_slice.has_key(slice_id):
                 del VMOCClientInterface._configs_by_slice[slice_id]
+            VMOCClientInterface.recordChange(slice_config, False)
 #        VMOCClientInterface.dumpQueue()
 
+    # Clear all slices registered with VMOC, then register all current
+    # slice configurations again
     @staticmethod
     def clear():
         with VMOCClientInterface._lock:
-            clear_entry = {'slice_id': None, 'msg': "clear"}
-            VMOCClientInterface._pending_queue.append(clear_entry)
+            VMOCClientInterface._full_sync = True
+            VMOCClientInterface._lock.notifyAll()
 #        VMOCClientInterface.dumpQueue()
 
+    # Return counters of the channel to VMOC
+    @staticmethod
+    def getMetrics():
+        with VMOCClientInterface._lock:
+            metrics = dict(VMOCClientInterface._metrics)
+            metrics['connected'] = VMOCClientInterface._instance is not None \
+                and VMOCClientInterface._instance._vmoc_is_up
+            metrics['vmoc_pid'] = VMOCClientInterface._vmoc_pid
+            metrics['version'] = VMOCClientInterface._version
+            metrics['acked_version'] = VMOCClientInterface._acked_version
+            metrics['pending'] = len(VMOCClientInterface._changes_by_slice)
+            return metrics
+
     @staticmethod
     def dumpQueue():
-        logger.info("Pending VMOC Request Queue:")
+        config.logger.info("Pending VMOC Changes:")
         with VMOCClientInterface._lock:
-            for entry in VMOCClientInterface._pending_queue:
-                logger.info("   " + str(entry))
+            for slice_id, entry in \
+                    VMOCClientInterface._changes_by_slice.items():
+                config.logger.info("   %s : %s" % (slice_id, str(entry)))
 
 
 if __name__ == "__main__":
@@ -252,9 +338,9 @@ if __name__ == "__main__":
     slice_config2 = \
         VMOCSliceConfiguration(slice_id='S2', vlan_configs=[vlan_config2])
     VMOCClientInterface.register(slice_config2)
-    VMOCClientInterface.unregister('S2')
-
-#    VMOCClientInterface.shutdown()
-
+    VMOCClientInterface.unregister(slice_config2)
 
+    time.sleep(2)
+    print VMOCClientInterface.getMetrics()
 
+#    VMOCClientInterface.shutdown()
@@ -40,9 +40,17 @@ from VMOCControllerConnection import VMOCControllerConnection
 from VMOCConfig import VMOCSliceConfiguration
 from VMOCGlobals import VMOCGlobals
 from VMOCSliceRegistry import *
+import VMOCChannel
 
 log = core.getLogger() # Use central logging service
 
+# Serializes changes to the slice registry made by concurrent handlers
+_registry_lock = threading.RLock()
+
+# Last registry version applied for each client of a channel 
+# (see VMOCChannel.py)
+_applied_versions = {}
+
 class VMOCManagementServerHandler(SocketServer.BaseRequestHandler):
 
 	# Commands:
@@ -50,6 +58,7 @@ class VMOCManagementServerHandler(SocketServer.BaseRequestHandler):
 	# unregister slice_id
 	# dump
 	# ping
+	# channel <version> : open a persistent channel (see VMOCChannel.py)
 	# Return command, controller_url, slice_config [last two could be None]
 	def parseCommand(self, command_line):
 		pieces=command_line.split(' ')
@@ -66,7 +75,11 @@ class VMOCManagementServerHandler(SocketServer.BaseRequestHandler):
 
 	# Handle the request, wrapping in an exception black
 	def handle(self):
-		data = self.request.recv(1024).strip()
+		data = self.request.recv(1024)
+		if VMOCChannel.is_greeting(data):
+			self.handleChannel(data)
+			return
+		data = data.strip()
 		if data != 'ping':
 			log.debug("Received " + data)
 		command, slice_id, slice_config = self.parseCommand(data)
@@ -80,11 +93,16 @@ class VMOCManagementServerHandler(SocketServer.BaseRequestHandler):
 				response = str(os.getpid())
 #				print "PING RESP = " + response
 			elif command == 'clear':
-				response = self.handleClear()
+				with _registry_lock:
+					response = self.handleClear()
+					# Channel clients must resend all their slices
+					_applied_versions.clear()
 			elif command == "register":
-				response = self.handleRegister(slice_config)
+				with _registry_lock:
+					response = self.handleRegister(slice_config)
 			elif command == "unregister":
-				response = self.handleUnregister(slice_config)
+				with _registry_lock:
+					response = self.handleUnregister(slice_config)
 			else:
 				response = "Illegal command " + command
 		except AssertionError, error:
@@ -92,6 +110,49 @@ class VMOCManagementServerHandler(SocketServer.BaseRequestHandler):
 #		log.debug("Sending " + response)
 		self.request.sendall(response)
 
+	# Serve a persistent channel: answer the hello with the last 
+	# version applied for the client, then apply and acknowledge 
+	# batches of changes until the client closes the channel
+	def handleChannel(self, data):
+		self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		reader = VMOCChannel.FrameReader(self.request, data)
+		reader.readGreeting()
+		hello = reader.read()
+		if hello is None: return
+		client_id = hello['client']
+		log.debug("Channel opened by client " + client_id)
+		with _registry_lock:
+			version = _applied_versions.get(client_id)
+		VMOCChannel.send_frame(self.request, \
+			{'op' : 'hello', 'pid' : os.getpid(), 'version' : version})
+		while True:
+			message = reader.read()
+			if message is None: break
+			if message['op'] != 'batch': continue
+			results = []
+			with _registry_lock:
+				if message['clear']:
+					results.append(self.handleClear())
+					# Slices of other clients are gone
+					_applied_versions.clear()
+				for change in message['changes']:
+					slice_config = VMOCSliceConfiguration(\
+						attribs=change['config'])
+					try:
+						if change['op'] == 'register':
+							results.append(\
+								self.handleRegister(slice_config))
+						else:
+							results.append(\
+								self.handleUnregister(slice_config))
+					except AssertionError, error:
+						results.append(str(error))
+				_applied_versions[client_id] = message['version']
+			VMOCChannel.send_frame(self.request, \
+				{'op' : 'ack', 'version' : message['version'], \
+					 'results' : results})
+		log.debug("Channel closed by client " + client_id)
+
 	# Handle the register request, returning response 
 	def handleRegister(self, slice_config):
 		slice_id = slice_config.getSliceID()
@@ -135,6 +196,12 @@ class VMOCManagementServerHandler(SocketServer.BaseRequestHandler):
 			slice_registry_unregister_slice(slice_id)
 		return response
 
+# Handle each connection (in particular each persistent channel) 
+# in its own thread
+class VMOCManagementServer(SocketServer.ThreadingTCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
 class VMOCManagementInterface(threading.Thread):
  	def __init__(self, port, default_controller_url):
  		threading.Thread.__init__(self)
@@ -149,8 +216,8 @@ class VMOCManagementInterface(threading.Thread):
 			print "Trying to start server"
 			try:
 				server = \
-				    SocketServer.TCPServer((self._host, self._port), \
-								   VMOCManagementServerHandler)
+				    VMOCManagementServer((self._host, self._port), \
+								 VMOCManagementServerHandler)
 				server.serve_forever()
 			except Exception, e:
 				print "Exception" + str(e)